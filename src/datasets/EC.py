@@ -16,11 +16,14 @@ from warnings import warn
 # internal imports
 from datasets.CRU import loadCRU_StnTS
 from datasets.common import days_per_month, getRootFolder, selectElements, translateVarNames
-from datasets.common import CRU_vars, stn_params, nullNaN
+from datasets.common import CRU_vars, stn_params, nullNaN, StationIndex, applyStationIndex, loadCachedRecord
+from datasets.common import checkStationHeader, parseStationRecord
+from datasets.common import monthLengths, monthlyMean, monthlyExtrema, consecutiveExtrema
 from geodata.misc import ParseError, DateError, VariableError, ArgumentError, DatasetError, AxisError
 from geodata.misc import RecordClass, StrictRecordClass, isNumber, isInt 
 from geodata.base import Axis, Variable, Dataset
 from utils.nctools import writeNetCDF
+from processing.multiprocess import imapPool
 from geodata.netcdf import DatasetNetCDF
 # import derived variables from the WRF Tools package wrfavg
 import imp, os
@@ -91,6 +94,8 @@ for threshold in precip_thresholds:
 
 # list of variables to load
 variable_list = varatts.keys() # also includes coordinate fields    
+# version of the station record parser (parsed records in the cache are only valid for the same version)
+parser_version = 1
 
 
 ## a class that handles access to station records in ASCII files
@@ -145,69 +150,76 @@ class DailyStationRecord(StrictRecordClass):
     self.validateHeader(f.readline()) # read first line as header
     f.close()
   
-  def parseRecord(self):
-    ''' open the station file and parse records; return a daiy time-series '''
-    # open file
+  def parseRecord(self, lflags=False):
+    ''' open the station file and parse records; return a daily time-series (and data flags, if lflags=True) '''
+    # read entire file at once
     f = codecs.open(self.filename, 'r', encoding=self.encoding)
     self.validateHeader(f.readline()) # read first line as header
+    lines = f.readlines()
+    f.close() # close again
     # allocate daily data array (31 days per month, filled with NaN for missing values)
-    tlen = ( (self.end_year - self.begin_year) * 12 + (self.end_mon - self.begin_mon +1) ) * 31
+    nmon = (self.end_year - self.begin_year) * 12 + (self.end_mon - self.begin_mon +1); tlen = nmon * 31
     data = np.empty((tlen,), dtype=self.dtype); data.fill(np.NaN) # use NaN as missing values
-    # some stuff to remember
-    lfloat = 'float' in self.dtype; lint = 'int' in self.dtype; lm = len(self.missing)
-    # iterate over line
-    oldyear = self.begin_year; oldmon = self.begin_mon -1; z = 0
-    for line in f:      
-      ll = line.replace('-9999.9', ' -9999.9').split() # without the replace, the split doesn't work      
-      if ll[0].isdigit() and ll[1].isdigit():
-        year = int(ll[0]); mon = int(ll[1])
-        # check continuity
-        if year == oldyear and mon == oldmon+1: pass
-        elif year == oldyear+1 and oldmon == 12 and mon ==1: pass 
-        else: raise DateError, line
-        oldyear = year; oldmon = mon
-#         # rigorous check of date bounds
-#         if year == self.begin_year and mon < self.begin_mon: raise DateError, line
-#         elif year < self.begin_year: raise DateError, line
-#         if year == self.end_year and mon > self.end_mon: raise DateError, line
-#         elif year > self.end_year: raise DateError, line
-        # skip dates outside the specified begin/end dates
-        if year < self.begin_year or year > self.end_year: pass # outside range 
-        elif year == self.begin_year and mon < self.begin_mon: pass # start later
-        elif year == self.end_year and mon > self.end_mon: pass # basically done
-        else: # else we can proceed
-          assert len(ll) < 34, line
-          zz = z 
-          # loop over daily values
-          for num in ll[2:]:
-            # evaluate daily value
-            assert zz < data.size, line              
-            if num[:lm] == self.missing: pass # missing value; already pre-filled NaN;  or num[-1] == 'M'
-            else:
-              if lfloat and '.' in num and 1 < len(num): # at least 1 digit plus decimal, i.e. ignore the flag
-                if num[-1].isdigit(): n = float(num)
-                elif num[-2].isdigit() and num[-1] in self.flags: n = float(num[:-1]) # remove data flag
-                else: raise ParseError, "Unable to process value '{:s}' in line:\n {:s}".format(num,line)
-              elif lint and 0 < len(num):# almost the same as for floats
-                if num[-1].isdigit(): n = int(num)
-                elif num[-2].isdigit() and num[-1] in self.flags: n = int(num[:-1]) # remove data flag
-                else: raise ParseError, "Unable to process value '{:s}' in line:\n {:s}".format(num,line)
-              else: raise ParseError, "Unable to process value '{:s}' in line:\n {:s}".format(num,line)
-              if n < self.varmin: warn("Encountered value '{:s}' below minimum in line (ignored):\n {:s}".format(num,line))
-              elif n > self.varmax: warn("Encountered value '{:s}' above maximum in line (ignored):\n {:s}".format(num,line))
-              else: data[zz] = n # only now, we can accept the value
-            # increment daily counter
-            zz += 1 # here each month has 31 days (padded with missing values)
-          if zz != z+31: raise ParseError, 'Line has {:d} values instead of 31:\n {:s}'.format(zz-z,line)  
-          # increment counter
-          z += 31
+    # split lines into fields; without the replace, the split doesn't work
+    records = []; reclines = []
+    for line in lines:
+      ll = line.replace('-9999.9', ' -9999.9').split()
+      if len(ll) == 0: pass # skip empty lines
+      elif ll[0].isdigit() and ll[1].isdigit():
+        records.append(ll); reclines.append(line)
       elif ll[0] != 'Year' or ll[1] != 'Mo':
         raise ParseError, "No valid title or data found at begining of file:\n {:s}".format(self.filename)
-    if z < tlen: raise ParseError, 'Reached end of file before specified end date: {:s}'.format(self.filename)    
-    f.close() # close again
+    # check continuity of all records (relative to begin date)
+    dates = np.array([(int(ll[0])-self.begin_year)*12 + int(ll[1]) - self.begin_mon for ll in records], dtype='int')
+    idx = np.flatnonzero(dates != np.arange(len(dates)))
+    if len(idx) > 0: raise DateError, reclines[idx[0]]
+    # skip dates outside the specified begin/end dates
+    if len(records) < nmon: raise ParseError, 'Reached end of file before specified end date: {:s}'.format(self.filename)
+    records = records[:nmon]; reclines = reclines[:nmon]
+    for ll,line in zip(records,reclines):
+      assert len(ll) < 34, line
+      if len(ll) != 33: raise ParseError, 'Line has {:d} values instead of 31:\n {:s}'.format(len(ll)-2,line)
+    # decode values and flags for all days at once, using a fixed-width byte array
+    nums = np.array([ll[2:] for ll in records], dtype=np.string_).reshape((nmon,31))
+    chars = nums.view(np.uint8).reshape(nums.shape+(-1,)) # N.B.: fields are left-aligned and zero-padded
+    numlen = np.count_nonzero(chars, axis=-1)
+    lm = len(self.missing); missing = np.frombuffer(str(self.missing), dtype=np.uint8)
+    lmiss = np.logical_and(numlen >= lm, np.all(chars[:,:,:lm] == missing, axis=-1)) # missing value; already pre-filled NaN
+    ii,jj = np.indices(nums.shape)
+    last = chars[ii,jj,np.maximum(numlen-1,0)]; secl = chars[ii,jj,np.maximum(numlen-2,0)]
+    ldigit = np.logical_and(last >= 48, last <= 57) # ASCII digits
+    lflag = np.in1d(last, np.frombuffer(str(self.flags), dtype=np.uint8)).reshape(nums.shape)
+    lflag = np.logical_and(lflag, np.logical_and(secl >= 48, secl <= 57)) # flag needs to follow a digit
+    lvalid = np.logical_or(ldigit, lflag)
+    if 'float' in self.dtype: # at least 1 digit plus decimal, i.e. ignore the flag
+      lvalid = np.logical_and(lvalid, np.logical_and(np.any(chars == 46, axis=-1), numlen > 1))
+    elif 'int' not in self.dtype: lvalid[:] = False
+    lerr = np.logical_and(~lmiss, ~lvalid)
+    if np.any(lerr):
+      i,j = np.argwhere(lerr)[0]
+      raise ParseError, "Unable to process value '{:s}' in line:\n {:s}".format(records[i][j+2],reclines[i])
+    lval = ~lmiss; lflag = np.logical_and(lval, lflag)
+    flags = np.where(lflag, last, 0).astype(np.uint8).view('S1') # before removing the flag
+    chars[ii[lflag],jj[lflag],numlen[lflag]-1] = 0 # remove data flag
+    values = np.empty(nums.shape, dtype=self.dtype); values.fill(np.NaN)
+    vals = nums[lval].astype(self.dtype); values[lval] = vals
+    # screen values outside of valid range (only now, we can accept the value)
+    lout = np.zeros_like(lval); lout[lval] = np.logical_or(vals < self.varmin, vals > self.varmax)
+    for i,j in np.argwhere(lout):
+      num = records[i][j+2]
+      if values[i,j] < self.varmin: warn("Encountered value '{:s}' below minimum in line (ignored):\n {:s}".format(num,reclines[i]))
+      else: warn("Encountered value '{:s}' above maximum in line (ignored):\n {:s}".format(num,reclines[i]))
+      values[i,j] = np.NaN
+    data[:] = values.ravel() # here each month has 31 days (padded with missing values)
     # return array
-    return data
+    if lflags: return data, flags.ravel()
+    else: return data
   
+  def loadRecord(self, cache_folder=None, lflags=False):
+    ''' load parsed record from cache, if the source file has not changed (see loadCachedRecord) '''
+    return loadCachedRecord(self, cache_folder=cache_folder, lflags=lflags, version=parser_version, 
+                            atts=('begin_year', 'begin_mon', 'end_year', 'end_mon', 'missing', 'flags', 'varmin', 'varmax', 'dtype'))
+
 
 ## class that defines variable properties (specifics are implemented in children)
 class VarDef(RecordClass):
@@ -364,12 +376,16 @@ class StationRecords(object):
   header_format  = '' # station format definition (for validation)
   station_format = '' # station format definition (for reading)
   constraints    = None # constraints to limit the number of stations that are loaded
+  NP             = 1 # number of processes used to parse station files
+  cache_folder   = None # folder for cached parsed station records (None: no caching)
+  xspecs         = None # definitions of extremes that are computed with vectorized functions
   # internal variables
   stationlists   = None # list of station objects
   dataset        = None # GeoPy Dataset (will hold results) 
   
   def __init__(self, folder='', stationfile='stations.txt', variables=None, extremes=None, interval='daily', 
-               encoding='', header_format=None, station_format=None, constraints=None, atts=None, varmap=None):
+               encoding='', header_format=None, station_format=None, constraints=None, atts=None, varmap=None, NP=1, 
+               lcache=False, cache_folder=None):
     ''' Parse station file and initialize station records. '''
     # some input checks
     if not isinstance(stationfile,basestring): raise TypeError
@@ -412,6 +428,8 @@ class StationRecords(object):
     self.header_format = header_format
     self.station_format = station_format
     self.constraints = constraints
+    self.NP = NP
+    if lcache: self.cache_folder = cache_folder or '{:s}/cache/'.format(folder) # next to source files
     ## initialize station objects from file
     # open and parse station file
     stationfile = '{:s}/{:s}'.format(folder,stationfile)
@@ -463,9 +481,11 @@ class StationRecords(object):
             kwargs = dict() # combine station and variable attributes
             kwargs.update(stdef); kwargs.update(vardef.getKWargs())
             station = DailyStationRecord(filename=filename, **kwargs)
-            station.checkHeader() 
             self.stationlists[varname].append(station)
     assert len(self.stationlists[varname]) == ns # make sure we got all (lists should have the same length)
+    # validate station file headers (fail early)
+    stationlist = [station for stnlst in self.stationlists.values() for station in stnlst]
+    for tmp in imapPool(checkStationHeader, stationlist, NP=NP): pass
     
   def prepareDataset(self, filename=None, folder=None):
     ''' prepare a GeoPy dataset for the station data (with all the meta data); 
@@ -527,10 +547,14 @@ class StationRecords(object):
     ncset = writeNetCDF(dataset, ncfile, feedback=False, overwrite=True, writeData=True, 
                         skipUnloaded=True, close=False, zlib=True)
     # add derived variables
-    extremes = []
+    extremes = []; self.xspecs = dict()
     for xvar in self.extremes:
+      xspec = None
       if isinstance(xvar,dict):
         var = xvar.pop('var'); mode = xvar.pop('mode'); Klass = xvar.pop('klass')
+        # simple extrema and consecutive events can be computed more efficiently in vectorized form
+        if Klass is dv.Extrema or Klass is dv.ConsecutiveExtrema:
+          xspec = dict(klass=Klass.__name__, var=var, mode=mode, threshold=xvar.get('threshold',0))
         xvar = Klass(ncset.variables[var], mode, ignoreNaN=True, **xvar)
         xvar.prerequisites = [self.ravmap.get(varname,varname) for varname in xvar.prerequisites]
       elif isinstance(xvar,dv.DerivedVariable):
@@ -548,17 +572,23 @@ class StationRecords(object):
 #       print xvar.name
       xvar.createVariable(ncset)
       extremes.append(xvar)
+      if xspec is not None: self.xspecs[xvar.name] = xspec
     self.extremes = extremes
     # reopen netcdf file with netcdf dataset
     self.dataset = DatasetNetCDF(dataset=ncset, mode='rw', load=True) # always need to specify mode manually
     
-  def readStationData(self):
-    ''' read station data from source files and store in dataset '''
+  def readStationData(self, NP=None, nreport=100, min_days=0):
+    ''' read station data from source files and store in dataset; station files are parsed in parallel 
+        (on NP processes), but results are written in station order; monthly values with less than 
+        min_days valid days are set to NaN (only applies to monthly means and vectorized extremes) '''
     assert self.dataset
+    if NP is None: NP = self.NP
+    xspecs = self.xspecs or dict()
+    lmons = monthLengths(self.dataset.time.coord, origin=1979) # days per month (including leap days)
     # determine record begin and end indices
     all_begin = self.dataset.time.coord[0] # coordinate value of first time step
-    begin_idx = ( self.dataset.stn_begin_date.getArray() - all_begin ) * 31.
-    end_idx = ( self.dataset.stn_end_date.getArray() - all_begin + 1 ) * 31.
+    begin_idx = np.asarray( self.dataset.stn_begin_date.getArray() - all_begin, dtype='int' ) * 31
+    end_idx = np.asarray( self.dataset.stn_end_date.getArray() - all_begin + 1, dtype='int' ) * 31
     # loop over variables
     dailydata = dict() # to store daily data for derived variables
     monlydata = dict() # monthly data, but transposed
@@ -571,27 +601,45 @@ class StationRecords(object):
       # allocate array
       shape = (varobj.shape[0], varobj.shape[1]*31) # daily data!
       dailytmp = np.empty(shape, dtype=varobj.dtype); dailytmp.fill(np.NaN) # initialize all with NaN
-      # loop over stations
+      # loop over stations (results are returned in order, as they become available)
+      stationlist = self.stationlists[var]
+      parser = functools.partial(parseStationRecord, vardef=vardef, cache_folder=self.cache_folder)
       s = 0 # station counter
-      for station in self.stationlists[var]:
+      for data in imapPool(parser, stationlist, NP=NP, nreport=nreport if NP != 1 else 0):
+        station = stationlist[s]
         print("   {:<15s} {:s}".format(station.name,station.filename))
-        # read station file
-        dailytmp[s,begin_idx[s]:end_idx[s]] = station.parseRecord()  
+        # insert station record
+        dailytmp[s,begin_idx[s]:end_idx[s]] = data  
         s += 1 # next station
       assert s == varobj.shape[0]
-      dailytmp = vardef.convert(dailytmp) # apply conversion function
       # compute monthly average
       dailytmp = dailytmp.reshape(varobj.shape+(31,))
-      monlytmp = np.nanmean(dailytmp,axis=-1) # squeezes automatically
+      monlytmp = monthlyMean(dailytmp, lmons, min_days=min_days) # squeezes automatically
       # store daily and monthly data for computation of derived variables
       dailydata[wrfvar] = dailytmp
       monlydata[wrfvar] = monlytmp
       # load data
       varobj.load(monlytmp) # varobj.sync()
       del dailytmp, monlytmp
-    # loop over derived nonlinear variables/extremes
-    if any(not var.linear for var in self.extremes): print('\n computing (nonlinear) daily variables:')
-    for var in self.extremes:      
+    # compute simple extrema and consecutive events for all stations and month at once
+    if len(xspecs) > 0: print('\n computing (nonlinear) monthly extremes:')
+    for var in self.extremes:
+      if var.name in xspecs:
+        print("   {:<15s} {:s}".format(var.name,str(tuple(self.varmap.get(varname,varname) for varname in var.prerequisites))))
+        if var.name not in ravmap: ravmap[var.name] = var.name # naming convention for tmp storage 
+        xspec = xspecs[var.name]
+        dailytmp = dailydata[ravmap.get(xspec['var'],xspec['var'])]
+        if xspec['klass'] == 'Extrema':
+          monlytmp = monthlyExtrema(dailytmp, lmons, mode=xspec['mode'], min_days=min_days)
+        elif xspec['klass'] == 'ConsecutiveExtrema':
+          monlytmp = consecutiveExtrema(dailytmp, lmons, mode=xspec['mode'], threshold=xspec['threshold'], 
+                                        min_days=min_days)
+        else: raise NotImplementedError, xspec['klass']
+        monlydata[ravmap[var.name]] = monlytmp
+    # loop over remaining derived nonlinear variables/extremes
+    nonlinear = [var for var in self.extremes if not var.linear and var.name not in xspecs]
+    if len(nonlinear) > 0: print('\n computing (nonlinear) daily variables:')
+    for var in nonlinear:      
       if not var.linear:
         print("   {:<15s} {:s}".format(var.name,str(tuple(self.varmap.get(varname,varname) for varname in var.prerequisites))))
         varobj = self.dataset[var.name] # get variable object
@@ -603,15 +651,10 @@ class StationRecords(object):
         monlydata[wrfvar] = tmp
     # loop over time steps to compute nonlinear variables from daily values    
     tmpvars = dict()
-    for m,mon in enumerate(varobj.axes[1].coord):
-      # figure out length of month
-      if mon%12 == 1: # February
-        if calendar.isleap(1979 + mon/12): lmon = 29
-        else: lmon = 28
-      else: lmon = days_per_month[mon%12]
+    for m,lmon in enumerate(lmons if len(nonlinear) > 0 else []):
       # construct arrays for this month
       tmpdata = {varname:data[:,m,0:lmon] for varname,data in dailydata.iteritems()}      
-      for var in self.extremes:      
+      for var in nonlinear:      
         if not var.linear:
           varobj = self.dataset[var.name] # get variable object
           wrfvar = ravmap[var.name]
@@ -716,67 +759,11 @@ def loadEC():
 loadEC_Stn = loadEC
 
 
-## some helper functions to test conditions
-# defined in module main to facilitate pickling
-def test_prov(val,index,dataset,axis):
-  ''' check if station province is in provided list ''' 
-  return dataset.stn_prov[index] in val
-def test_begin(val,index,dataset,axis):
-  ''' check if station record begins before given year ''' 
-  return dataset.stn_begin_date[index] <= val # converted to month beforehand 
-def test_end(val,index,dataset,axis):
-  ''' check if station record ends after given year ''' 
-  return dataset.stn_end_date[index] >= val # converted to month beforehand 
-def test_minlen(val,index,dataset,axis):
-  ''' check if station record is longer than a minimum period ''' 
-  return dataset.stn_rec_len[index] >= val 
-def test_maxzse(val,index,dataset,axis, lcheckVar=True):
-  ''' check that station elevation error does not exceed a threshold ''' 
-  if not dataset.hasVariable('zs_err'):
-    if lcheckVar: raise DatasetError
-    else: return True # EC datasets don't have this field...
-  else: return np.abs(dataset.zs_err[index]) <= val
-def test_maxz(val,index,dataset,axis, lcheckVar=True):
-  ''' check that station elevation does not exceed a threshold ''' 
-  if not dataset.hasVariable('stn_zs'):
-    if lcheckVar: raise DatasetError
-    else: return True # EC datasets don't have this field...
-  else: return np.abs(dataset.stn_zs[index]) <= val
-def test_lat(val,index,dataset,axis):
-  ''' check if station is located within selected latitude band '''
-  return val[0] <= dataset.stn_lat[index] <= val[1] 
-def test_lon(val,index,dataset,axis):
-  ''' check if station is located within selected longitude band ''' 
-  return val[0] <= dataset.stn_lon[index] <= val[1] 
-def test_cluster(val,index,dataset,axis, cluster_name='cluster_id', lcheckVar=True):
-  ''' check if station is member of a cluster '''
-  if not dataset.hasVariable(cluster_name):
-    if lcheckVar: raise DatasetError
-    else: return True # most datasets don't have this field...
-  elif isinstance(val, (int,np.integer)): 
-    return dataset[cluster_name][index] == val
-  elif isinstance(val, (tuple,list,np.ndarray)):
-    return dataset[cluster_name][index] in val
-  else: ValueError, val
-def test_name(val,index,dataset,axis):
-  ''' check if station name is in provided list (val) '''
-  if isinstance(val, basestring): 
-    return dataset['station_name'][index].strip() == val
-  elif isinstance(val, (tuple,list)):
-    return dataset['station_name'][index].strip() in val
-  else: ValueError, val
-# apply tests to list
-def apply_test_suite(tests, index, dataset, axis):
-  ''' apply an entire test suite to '''
-  # just call all individual tests for given index
-  results = [test(index,dataset,axis) for test in tests]
-  results = [np.all(res) if isinstance(res,np.ndarray) else res for res in results]  
-  return all(results)
-
 ## select a set of common stations for an ensemble, based on certain conditions
 def selectStations(datasets, stnaxis='station', master=None, linplace=False, lall=False, 
                   lcheckVar=False, cluster_name='cluster_id', **kwcond):
-  ''' A wrapper for selectCoords that selects stations based on common criteria '''
+  ''' A wrapper for selectCoords that selects stations based on common criteria; criteria are evaluated 
+      in vectorized form, using a (cached) StationIndex '''
   if linplace: raise NotImplementedError, "Option 'linplace' does not work currently."
   # pre-load NetCDF datasets
   for dataset in datasets: 
@@ -784,7 +771,7 @@ def selectStations(datasets, stnaxis='station', master=None, linplace=False, lal
     if dataset.station_name.ndim > 1 and not dataset.station_name.hasAxis(stnaxis):
       raise DatasetError, "Meta-data fields must only have a 'station' axis and no other!" 
   # list of possible constraints
-  tests = [] # a list of tests to run on each station
+  conditions = [] # a list of vectorized conditions to apply to the station index
   #loadlist =  (datasets[imaster],) if not lall and imaster is not None else datasets 
   # test definition
   varcheck = [True]*len(datasets)
@@ -795,47 +782,53 @@ def selectStations(datasets, stnaxis='station', master=None, linplace=False, lal
       if not isinstance(val,(tuple,list)): val = (val,)
       if not isinstance(val,tuple): val = tuple(val)
       if not all(isinstance(prov,basestring) for prov in val): raise TypeError
-      tests.append(functools.partial(test_prov, val))
+      conditions.append(functools.partial(StationIndex.isin, name=varname, values=val))
     elif key == 'min_len':
       varname = 'stn_rec_len'
       if not isNumber(val): raise TypeError
       val = val*12 # units in dataset are month  
-      tests.append(functools.partial(test_minlen, val))    
+      conditions.append(functools.partial(StationIndex.between, name=varname, lower=val))    
     elif key == 'begin_before':
       varname = 'stn_begin_date'
       if not isNumber(val): raise TypeError
       val = (val-1979.)*12. # units in dataset are month since Jan 1979  
-      tests.append(functools.partial(test_begin, val))    
+      conditions.append(functools.partial(StationIndex.between, name=varname, upper=val))    
     elif key == 'end_after':
       varname = 'stn_end_date'
       if not isNumber(val): raise TypeError
       val = (val-1979.)*12. # units in dataset are month since Jan 1979  
-      tests.append(functools.partial(test_end, val))    
+      conditions.append(functools.partial(StationIndex.between, name=varname, lower=val))    
     elif key == 'max_zerr':
       varname = 'zs_err'
       if not isNumber(val): raise TypeError  
-      tests.append(functools.partial(test_maxzse, val, lcheckVar=lcheckVar))
+      conditions.append(functools.partial(StationIndex.between, name=varname, upper=val, labs=True, 
+                                          lcheckVar=lcheckVar))
     elif key == 'max_z':
       varname = 'stn_zs'
       if not isNumber(val): raise TypeError  
-      tests.append(functools.partial(test_maxz, val, lcheckVar=lcheckVar))
+      conditions.append(functools.partial(StationIndex.between, name=varname, upper=val, labs=True, 
+                                          lcheckVar=lcheckVar))
     elif key == 'lat':
       varname = 'stn_lat'
       if not isinstance(val,(list,tuple)) or len(val) != 2 or not all(isNumber(l) for l in val): raise TypeError  
-      tests.append(functools.partial(test_lat, val))
+      conditions.append(functools.partial(StationIndex.box, lat=val))
     elif key == 'lon':
       varname = 'stn_lon'
       if not isinstance(val,(list,tuple)) or len(val) != 2 or not all(isNumber(l) for l in val): raise TypeError  
-      tests.append(functools.partial(test_lon, val))
+      conditions.append(functools.partial(StationIndex.box, lon=val))
+    elif key == 'radius':
+      varname = 'stn_lat'
+      if not isinstance(val,(list,tuple)) or len(val) != 3 or not all(isNumber(l) for l in val): raise TypeError  
+      conditions.append(functools.partial(StationIndex.radius, lat=val[0], lon=val[1], radius=val[2]))
     elif key == 'cluster':
       varname = cluster_name
       if ( not isinstance(val,(list,tuple,np.ndarray)) or not all(isInt(l) for l in val)) and not isInt(val): raise TypeError  
-      tests.append(functools.partial(test_cluster, val, cluster_name=cluster_name, lcheckVar=lcheckVar))
+      conditions.append(functools.partial(StationIndex.isin, name=varname, values=val, lcheckVar=lcheckVar))
     elif key == 'name':
       varname = 'station_name'
       if not ( ( isinstance(val,(list,tuple)) and all(isinstance(v,basestring) for v in val) ) or 
                isinstance(val,basestring) ): raise TypeError  
-      tests.append(functools.partial(test_name, val))
+      conditions.append(functools.partial(StationIndex.isin, name=varname, values=val))
     else:
       raise NotImplementedError, "Unknown condition/test: '{:s}'".format(key)
     # record, which datasets have all variables 
@@ -843,12 +836,12 @@ def selectStations(datasets, stnaxis='station', master=None, linplace=False, lal
   if not all(varcheck): 
     if lall and lcheckVar: raise DatasetError, varcheck
     else: warn("Some Datasets do not have all variables: {:s}".format(varcheck))
-  # define test function (all tests must pass)
-  if len(tests) > 0:
-    testFct = functools.partial(apply_test_suite, tests)
-  else: testFct = None
+  # define vectorized mask function based on station index (all conditions must be met)
+  if len(conditions) > 0:
+    maskFct = functools.partial(applyStationIndex, conditions)
+  else: maskFct = None
   # pass on call to generic function selectCoords
-  datasets = selectElements(datasets=datasets, axis=stnaxis, testFct=testFct, master=master, linplace=linplace, lall=lall)
+  datasets = selectElements(datasets=datasets, axis=stnaxis, maskFct=maskFct, master=master, linplace=linplace, lall=lall)
   # return sliced datasets
   return datasets
   
@@ -1055,7 +1048,7 @@ if __name__ == '__main__':
     for variables in (temp_vars,):
       
       # initialize station record container
-      stations = StationRecords(variables=variables, constraints=None)
+      stations = StationRecords(variables=variables, constraints=None, NP=4, lcache=True) # parse in parallel and cache
       # create netcdf file
       stations.prepareDataset(filename=None, folder=None) # default settings
       # read actual station data
@@ -16,11 +16,14 @@ from warnings import warn
 # internal imports
 from datasets.CRU import loadCRU_StnTS
 from datasets.common import days_per_month, getRootFolder, selectElements, translateVarNames
-from datasets.common import CRU_vars, stn_params, nullNaN
-from geodata.misc import ParseError, ArgumentError, DatasetError, AxisError
+from datasets.common import CRU_vars, stn_params, nullNaN, StationIndex, applyStationIndex, loadCachedRecord
+from datasets.common import checkStationHeader, parseStationRecord
+from datasets.common import monthLengths, monthlyMean, monthlyExtrema, consecutiveExtrema
+from geodata.misc import ParseError, DateError, ArgumentError, DatasetError, AxisError
 from geodata.misc import RecordClass, StrictRecordClass, isNumber, isInt 
 from geodata.base import Axis, Variable, Dataset
 from utils.nctools import writeNetCDF
+from processing.multiprocess import imapPool
 from geodata.netcdf import DatasetNetCDF
 # import derived variables from the WRF Tools package wrfavg
 import imp, os
@@ -89,6 +92,8 @@ for threshold in precip_thresholds:
 
 # list of variables to load
 variable_list = varatts.keys() # also includes coordinate fields    
+# version of the station record parser (parsed records in the cache are only valid for the same version)
+parser_version = 1
 
 class DailyStationRecord(StrictRecordClass):
   '''
@@ -130,80 +135,70 @@ class DailyStationRecord(StrictRecordClass):
     self.validateHeader(f.readline()) # read first line as header
     f.close()
   
-  def parseRecord(self):
-    ''' open the station file and parse records; return a daily time-series '''
-    # open file
+  def parseRecord(self, lflags=False):
+    ''' open the station file and parse records; return a daily time-series (and data flags, if lflags=True) '''
+    # read entire file at once
     f = codecs.open(self.filename, 'r', encoding=self.encoding)
-    infoline=f.readlines()
-    ll=infoline[0]
+    lines = f.readlines()
+    f.close() # close again
+    ll = lines[0]
     self.begin_year = int(ll[11:15])
     self.begin_mon = int(ll[15:17])
-    #existflag=False
-    off=-270 #number of characters in a line
-    f.seek(off, 2)#-270 from the end of file
-    infoline = f.readlines() 
-    if len(infoline)>=2: 
-      raise ParseError,'last line incomplete'
-    else:
-      ll=infoline[-1]
-      self.end_year = int(ll[11:15])
-      self.end_mon = int(ll[15:17])
-    oldyear = self.begin_year; oldmon = self.begin_mon -1;
+    ll = lines[-1]
+    if len(ll.rstrip('\r\n')) < 269: raise ParseError,'last line incomplete'
+    self.end_year = int(ll[11:15])
+    self.end_mon = int(ll[15:17])
     # allocate daily data array (31 days per month, filled with NaN for missing values)
     tlen = ( (self.end_year - self.begin_year) * 12 + (self.end_mon - self.begin_mon +1) ) * 31
     data = np.empty((tlen,), dtype=self.dtype); data.fill(np.NaN) # use NaN as missing values
-    # some stuff to remember
+    flags = np.zeros((tlen,), dtype='S3') # measurement, quality and source flag
+    # select lines with the variable we're looking for and convert to fixed-width byte array
+    reclines = [line for line in lines if line[17:21] == self.variable]
+    if len(reclines) == 0:
+      if lflags: return data, flags
+      else: return data
+    for line in reclines:
+      if len(line.rstrip('\r\n')) < 266: raise ParseError, 'Line has {:d} values instead of 31:\n {:s}'.format((len(line.rstrip('\r\n'))-21+3)//8,line)
+    records = np.array([line[:269].ljust(269) for line in reclines], dtype='S269')
+    chars = records.view(np.uint8).reshape((len(records),269))
+    # check continuity (missing month are skipped)
+    years = chars[:,11:15].copy().view('S4').ravel().astype('int')
+    mons = chars[:,15:17].copy().view('S2').ravel().astype('int')
+    dates = (years - self.begin_year)*12 + mons - self.begin_mon
+    if np.any(np.diff(dates) < 1): raise DateError, reclines[np.flatnonzero(np.diff(dates) < 1)[0]+1]
+    lout = np.logical_or(dates < 0, dates*31 >= tlen) # records outside of the begin/end dates of the file
+    if np.any(lout): raise DateError, reclines[np.flatnonzero(lout)[0]]
+    for i in np.flatnonzero(np.diff(np.concatenate(([-1],dates))) > 1):
+      print 'discontinuity', years[i-1] if i else self.begin_year, mons[i-1] if i else self.begin_mon-1
+    # decode daily values and flags from fixed-width columns (value: 5 characters, 3 flags)
+    cols = 21 + 8*np.arange(31).reshape((31,1)) # here each month has 31 days (padded with missing values)
+    nums = chars[:,cols+np.arange(5)].copy().view('S5').reshape((len(records),31))
     lm = len(self.missing)
-    # iterate over line
-    z = 0
-    f.seek(0,0)
-    for line in f:
-      ll=line
-      if self.variable==ll[17:21]:#check if it's the variable we're looking for
-        year = int(ll[11:15]); mon = int(ll[15:17])  
-        # check continuity
-        discontinuity_flag = False
-        if year == oldyear and mon == oldmon+1: pass
-        elif year == oldyear+1 and oldmon == 12 and mon ==1: pass 
-        else:
-          discontinuity_flag = True
-          print 'discontinuity', oldyear, oldmon
-          while (discontinuity_flag):
-            z+=31
-            if oldmon == 12:
-              oldmon=1;oldyear+=1
-            else:
-              oldmon+=1
-            if year == oldyear and mon == oldmon+1: discontinuity_flag=False
-            elif year == oldyear+1 and oldmon == 12 and mon ==1: discontinuity_flag=False 
-        oldyear=year;oldmon=mon
-          #assert len(ll) ==269, line
-        zz = z 
-          # loop over daily values
-        count=21
-        while(count < 266):
-            num=ll[count:count+5]
-            # evaluate daily value
-            assert zz < data.size, line              
-            if num[:lm] == self.missing: 
-                pass # missing value; already pre-filled NaN;  or num[-1] == 'M'
-            else:
-              n = int(num)
-              if n < self.varmin: warn("Encountered value '{:s}' below minimum in line (ignored):\n {:s}".format(num,line))
-              elif n > self.varmax: warn("Encountered value '{:s}' above maximum in line (ignored):\n {:s}".format(num,line))
-              else: data[zz] = n # only now, we can accept the value
-            # increment count in line
-            zz += 1 # here each month has 31 days (padded with missing values)
-            count += 8 # here each month has 31 days (padded with missing values)
-        if zz != z+31: raise ParseError, 'Line has {:d} values instead of 31:\n {:s}'.format(zz-z,line)  
-        # increment counter
-        z += 31
-    #if existflag==False:tlen=0
-    #if z < tlen: raise ParseError, 'Reached end of file before specified end date: {:s}'.format(self.filename)    
-    f.close() # close again
+    lval = np.any(chars[:,cols+np.arange(lm)] != np.frombuffer(str(self.missing), dtype=np.uint8), axis=-1)
+    values = np.empty(nums.shape, dtype=self.dtype); values.fill(np.NaN)
+    vals = nums[lval].astype('int'); values[lval] = vals
+    # screen values outside of valid range (only now, we can accept the value)
+    lout = np.zeros_like(lval); lout[lval] = np.logical_or(vals < self.varmin, vals > self.varmax)
+    for i,j in np.argwhere(lout):
+      num = nums[i,j]; line = reclines[i]
+      if values[i,j] < self.varmin: warn("Encountered value '{:s}' below minimum in line (ignored):\n {:s}".format(num,line))
+      else: warn("Encountered value '{:s}' above maximum in line (ignored):\n {:s}".format(num,line))
+      values[i,j] = np.NaN
+    # insert months into daily array
+    days = ( 31*dates.reshape((len(dates),1)) + np.arange(31) ).ravel()
+    data[days] = values.ravel()
+    flags[days] = chars[:,cols+np.arange(5,8)].copy().view('S3').ravel()
     # return array
-    return data
+    if lflags: return data, flags
+    else: return data
   
+  def loadRecord(self, cache_folder=None, lflags=False):
+    ''' load parsed record from cache, if the source file has not changed (see loadCachedRecord); the period 
+        of record is determined by the parser and also restored from the cache '''
+    return loadCachedRecord(self, cache_folder=cache_folder, lflags=lflags, version=parser_version, 
+                            atts=('missing', 'varmin', 'varmax', 'dtype'), 
+                            meta=('begin_year', 'begin_mon', 'end_year', 'end_mon'))
+
 
 ## class that defines variable properties (specifics are implemented in children)
 class VarDef(RecordClass):
@@ -355,12 +350,16 @@ class StationRecords(object):
   header_format  = '' # station format definition (for validation)
   station_format = '' # station format definition (for reading)
   constraints    = None # constraints to limit the number of stations that are loaded
+  NP             = 1 # number of processes used to parse station files
+  cache_folder   = None # folder for cached parsed station records (None: no caching)
+  xspecs         = None # definitions of extremes that are computed with vectorized functions
   # internal variables
   stationlists   = None # list of station objects
   dataset        = None # GeoPy Dataset (will hold results) 
   
   def __init__(self, folder=root_folder, stationfile='ghcnd-stations.txt', variables=None, extremes=None, interval='daily', 
-               encoding='', header_format=None, station_format=None, constraints=None, atts=None, varmap=None):
+               encoding='', header_format=None, station_format=None, constraints=None, atts=None, varmap=None, NP=1, 
+               lcache=False, cache_folder=None):
     ''' Parse station file and initialize station records. '''
     # some input checks
     if not isinstance(stationfile,basestring): raise TypeError
@@ -395,6 +394,8 @@ class StationRecords(object):
     self.header_format = header_format
     self.station_format = station_format
     self.constraints = constraints
+    self.NP = NP
+    if lcache: self.cache_folder = cache_folder or '{:s}/cache/'.format(folder) # next to source files
     ## initialize station objects from file
     # open and parse station file
     stationfile = '{:s}/{:s}'.format(folder,stationfile)
@@ -435,7 +436,6 @@ class StationRecords(object):
             kwargs = dict() # combine station and variable attributes
             kwargs.update(stdef); kwargs.update(vardef.getKWargs())
             station = DailyStationRecord(filename=filename, **kwargs)
-            station.checkHeader() 
             self.stationlists[varname].append(station)
             begin_end_dates=[station.begin_year,station.begin_mon,station.end_year,station.end_mon]
             count=0
@@ -445,6 +445,9 @@ class StationRecords(object):
 #XXX: we don't really need to use the station format to add these...
 
     assert len(self.stationlists[varname]) == ns # make sure we got all (lists should have the same length)
+    # validate station file headers (fail early)
+    stationlist = [station for stnlst in self.stationlists.values() for station in stnlst]
+    for tmp in imapPool(checkStationHeader, stationlist, NP=NP): pass
     
   def prepareDataset(self, filename=None, folder=None, station_folder=None):
     ''' prepare a GeoPy dataset for the station data (with all the meta data); 
@@ -529,10 +532,14 @@ class StationRecords(object):
     ncset = writeNetCDF(dataset, ncfile, feedback=False, overwrite=True, writeData=True, 
                         skipUnloaded=True, close=False, zlib=True)
     # add derived variables
-    extremes = []
+    extremes = []; self.xspecs = dict()
     for xvar in self.extremes:
+      xspec = None
       if isinstance(xvar,dict):
         var = xvar.pop('var'); mode = xvar.pop('mode'); Klass = xvar.pop('klass')
+        # simple extrema and consecutive events can be computed more efficiently in vectorized form
+        if Klass is dv.Extrema or Klass is dv.ConsecutiveExtrema:
+          xspec = dict(klass=Klass.__name__, var=var, mode=mode, threshold=xvar.get('threshold',0))
         xvar = Klass(ncset.variables[var], mode, ignoreNaN=True, **xvar)
         xvar.prerequisites = [self.ravmap.get(varname,varname) for varname in xvar.prerequisites]
       elif isinstance(xvar,dv.DerivedVariable):
@@ -548,17 +555,23 @@ class StationRecords(object):
       if xvar.name in self.varmap: xvar.name = self.varmap[xvar.name] # rename
       xvar.createVariable(ncset)
       extremes.append(xvar)
+      if xspec is not None: self.xspecs[xvar.name] = xspec
     self.extremes = extremes
     # reopen netcdf file with netcdf dataset
     self.dataset = DatasetNetCDF(dataset=ncset, mode='rw', load=True) # always need to specify mode manually
     
-  def readStationData(self):
-    ''' read station data from source files and store in dataset '''
+  def readStationData(self, NP=None, nreport=100, min_days=0):
+    ''' read station data from source files and store in dataset; station files are parsed in parallel 
+        (on NP processes), but results are written in station order; monthly values with less than 
+        min_days valid days are set to NaN (only applies to monthly means and vectorized extremes) '''
     assert self.dataset
+    if NP is None: NP = self.NP
+    xspecs = self.xspecs or dict()
+    lmons = monthLengths(self.dataset.time.coord, origin=1980) # days per month (including leap days)
     # determine record begin and end indices
     all_begin = self.dataset.time.coord[0] # coordinate value of first time step
-    begin_idx = ( self.dataset.stn_begin_date.getArray() - all_begin ) * 31.
-    end_idx = ( self.dataset.stn_end_date.getArray() - all_begin + 1 ) * 31.
+    begin_idx = np.asarray( self.dataset.stn_begin_date.getArray() - all_begin, dtype='int' ) * 31
+    end_idx = np.asarray( self.dataset.stn_end_date.getArray() - all_begin + 1, dtype='int' ) * 31
     # loop over variables
     dailydata = dict() # to store daily data for derived variables
     monlydata = dict() # monthly data, but transposed
@@ -571,27 +584,45 @@ class StationRecords(object):
       # allocate array
       shape = (varobj.shape[0], varobj.shape[1]*31) # daily data!
       dailytmp = np.empty(shape, dtype=varobj.dtype); dailytmp.fill(np.NaN) # initialize all with NaN
-      # loop over stations
+      # loop over stations (results are returned in order, as they become available)
+      stationlist = self.stationlists[var]
+      parser = functools.partial(parseStationRecord, vardef=vardef, cache_folder=self.cache_folder)
       s = 0 # station counter
-      for station in self.stationlists[var]:
+      for data in imapPool(parser, stationlist, NP=NP, nreport=nreport if NP != 1 else 0):
+        station = stationlist[s]
         print("   {:<15s} {:s}".format(station.name,station.filename))
-        # read station file
-        dailytmp[s,begin_idx[s]:end_idx[s]] = station.parseRecord()  
+        # insert station record
+        dailytmp[s,begin_idx[s]:end_idx[s]] = data  
         s += 1 # next station
       assert s == varobj.shape[0]
-      dailytmp = vardef.convert(dailytmp) # apply conversion function
       # compute monthly average
       dailytmp = dailytmp.reshape(varobj.shape+(31,))
-      monlytmp = np.nanmean(dailytmp,axis=-1) # squeezes automatically
+      monlytmp = monthlyMean(dailytmp, lmons, min_days=min_days) # squeezes automatically
       # store daily and monthly data for computation of derived variables
       dailydata[wrfvar] = dailytmp
       monlydata[wrfvar] = monlytmp
       # load data
       varobj.load(monlytmp) # varobj.sync()
       del dailytmp, monlytmp
-    # loop over derived nonlinear variables/extremes
-    if any(not var.linear for var in self.extremes): print('\n computing (nonlinear) daily variables:')
-    for var in self.extremes:      
+    # compute simple extrema and consecutive events for all stations and month at once
+    if len(xspecs) > 0: print('\n computing (nonlinear) monthly extremes:')
+    for var in self.extremes:
+      if var.name in xspecs:
+        print("   {:<15s} {:s}".format(var.name,str(tuple(self.varmap.get(varname,varname) for varname in var.prerequisites))))
+        if var.name not in ravmap: ravmap[var.name] = var.name # naming convention for tmp storage 
+        xspec = xspecs[var.name]
+        dailytmp = dailydata[ravmap.get(xspec['var'],xspec['var'])]
+        if xspec['klass'] == 'Extrema':
+          monlytmp = monthlyExtrema(dailytmp, lmons, mode=xspec['mode'], min_days=min_days)
+        elif xspec['klass'] == 'ConsecutiveExtrema':
+          monlytmp = consecutiveExtrema(dailytmp, lmons, mode=xspec['mode'], threshold=xspec['threshold'], 
+                                        min_days=min_days)
+        else: raise NotImplementedError, xspec['klass']
+        monlydata[ravmap[var.name]] = monlytmp
+    # loop over remaining derived nonlinear variables/extremes
+    nonlinear = [var for var in self.extremes if not var.linear and var.name not in xspecs]
+    if len(nonlinear) > 0: print('\n computing (nonlinear) daily variables:')
+    for var in nonlinear:      
       if not var.linear:
         print("   {:<15s} {:s}".format(var.name,str(tuple(self.varmap.get(varname,varname) for varname in var.prerequisites))))
         varobj = self.dataset[var.name] # get variable object
@@ -603,15 +634,10 @@ class StationRecords(object):
         monlydata[wrfvar] = tmp
     # loop over time steps      
     tmpvars = dict()
-    for m,mon in enumerate(varobj.axes[1].coord):
-      # figure out length of month
-      if mon%12 == 1: # February
-        if calendar.isleap(1980 + mon/12): lmon = 29
-        else: lmon = 28
-      else: lmon = days_per_month[mon%12]
+    for m,lmon in enumerate(lmons if len(nonlinear) > 0 else []):
       # construct arrays for this month
       tmpdata = {varname:data[:,m,0:lmon] for varname,data in dailydata.iteritems()}      
-      for var in self.extremes:      
+      for var in nonlinear:      
         if not var.linear:
           varobj = self.dataset[var.name] # get variable object
           wrfvar = ravmap[var.name]
@@ -708,60 +734,11 @@ def loadGHCN():
 loadGHCN_Stn = loadGHCN
 
 
-## some helper functions to test conditions
-# defined in module main to facilitate pickling
-#def test_prov(val,index,dataset,axis):
-#  ''' check if station province is in provided list ''' 
-#  return dataset.stn_prov[index] in val
-def test_begin(val,index,dataset,axis):
-  ''' check if station record begins before given year ''' 
-  return dataset.stn_begin_date[index] <= val # converted to month beforehand 
-def test_end(val,index,dataset,axis):
-  ''' check if station record ends after given year ''' 
-  return dataset.stn_end_date[index] >= val # converted to month beforehand 
-def test_minlen(val,index,dataset,axis):
-  ''' check if station record is longer than a minimum period ''' 
-  return dataset.stn_rec_len[index] >= val 
-def test_maxzse(val,index,dataset,axis, lcheckVar=True):
-  ''' check that station elevation error does not exceed a threshold ''' 
-  if not dataset.hasVariable('zs_err'):
-    if lcheckVar: raise DatasetError
-    else: return True # EC datasets don't have this field...
-  else: return np.abs(dataset.zs_err[index]) <= val
-def test_maxz(val,index,dataset,axis, lcheckVar=True):
-  ''' check that station elevation does not exceed a threshold ''' 
-  if not dataset.hasVariable('stn_zs'):
-    if lcheckVar: raise DatasetError
-    else: return True # EC datasets don't have this field...
-  else: return np.abs(dataset.stn_zs[index]) <= val
-def test_lat(val,index,dataset,axis):
-  ''' check if station is located within selected latitude band '''
-  return val[0] <= dataset.stn_lat[index] <= val[1] 
-def test_lon(val,index,dataset,axis):
-  ''' check if station is located within selected longitude band ''' 
-  return val[0] <= dataset.stn_lon[index] <= val[1] 
-def test_cluster(val,index,dataset,axis, cluster_name='cluster_id', lcheckVar=True):
-  ''' check if station is located within selected longitude band '''
-  if not dataset.hasVariable(cluster_name):
-    if lcheckVar: raise DatasetError
-    else: return True # most datasets don't have this field...
-  elif isinstance(val, (int,np.integer)): 
-    return dataset[cluster_name][index] == val
-  elif isinstance(val, (tuple,list,np.ndarray)):
-    return dataset[cluster_name][index] in val
-  else: ValueError, val
-# apply tests to list
-def apply_test_suite(tests, index, dataset, axis):
-  ''' apply an entire test suite to '''
-  # just call all individual tests for given index
-  results = [test(index,dataset,axis) for test in tests]
-  results = [np.all(res) if isinstance(res,np.ndarray) else res for res in results]  
-  return all(results)
-
 ## select a set of common stations for an ensemble, based on certain conditions
 def selectStations(datasets, stnaxis='station', master=None, linplace=False, lall=False, 
                   lcheckVar=False, cluster_name='cluster_id', **kwcond):
-  ''' A wrapper for selectCoords that selects stations based on common criteria '''
+  ''' A wrapper for selectCoords that selects stations based on common criteria; criteria are evaluated 
+      in vectorized form, using a (cached) StationIndex '''
   if linplace: raise NotImplementedError, "Option 'linplace' does not work currently."
   # pre-load NetCDF datasets
   for dataset in datasets: 
@@ -769,7 +746,7 @@ def selectStations(datasets, stnaxis='station', master=None, linplace=False, lal
     if dataset.station_name.ndim > 1 and not dataset.station_name.hasAxis(stnaxis):
       raise DatasetError, "Meta-data fields must only have a 'station' axis and no other!" 
   # list of possible constraints
-  tests = [] # a list of tests to run on each station
+  conditions = [] # a list of vectorized conditions to apply to the station index
   #loadlist =  (datasets[imaster],) if not lall and imaster is not None else datasets 
   # test definition
   varcheck = [True]*len(datasets)
@@ -779,37 +756,43 @@ def selectStations(datasets, stnaxis='station', master=None, linplace=False, lal
       varname = 'stn_rec_len'
       if not isNumber(val): raise TypeError
       val = val*12 # units in dataset are month  
-      tests.append(functools.partial(test_minlen, val))    
+      conditions.append(functools.partial(StationIndex.between, name=varname, lower=val))    
     elif key == 'begin_before':
       varname = 'stn_begin_date'
       if not isNumber(val): raise TypeError
       val = (val-1980.)*12. # units in dataset are month since Jan 1980  
-      tests.append(functools.partial(test_begin, val))    
+      conditions.append(functools.partial(StationIndex.between, name=varname, upper=val))    
     elif key == 'end_after':
       varname = 'stn_end_date'
       if not isNumber(val): raise TypeError
       val = (val-1980.)*12. # units in dataset are month since Jan 1980  
-      tests.append(functools.partial(test_end, val))    
+      conditions.append(functools.partial(StationIndex.between, name=varname, lower=val))    
     elif key == 'max_zerr':
       varname = 'zs_err'
       if not isNumber(val): raise TypeError  
-      tests.append(functools.partial(test_maxzse, val, lcheckVar=lcheckVar))
+      conditions.append(functools.partial(StationIndex.between, name=varname, upper=val, labs=True, 
+                                          lcheckVar=lcheckVar))
     elif key == 'max_z':
       varname = 'stn_zs'
       if not isNumber(val): raise TypeError  
-      tests.append(functools.partial(test_maxz, val, lcheckVar=lcheckVar))
+      conditions.append(functools.partial(StationIndex.between, name=varname, upper=val, labs=True, 
+                                          lcheckVar=lcheckVar))
     elif key == 'lat':
       varname = 'stn_lat'
       if not isinstance(val,(list,tuple)) or len(val) != 2 or not all(isNumber(l) for l in val): raise TypeError  
-      tests.append(functools.partial(test_lat, val))
+      conditions.append(functools.partial(StationIndex.box, lat=val))
     elif key == 'lon':
       varname = 'stn_lon'
       if not isinstance(val,(list,tuple)) or len(val) != 2 or not all(isNumber(l) for l in val): raise TypeError  
-      tests.append(functools.partial(test_lon, val))
+      conditions.append(functools.partial(StationIndex.box, lon=val))
+    elif key == 'radius':
+      varname = 'stn_lat'
+      if not isinstance(val,(list,tuple)) or len(val) != 3 or not all(isNumber(l) for l in val): raise TypeError  
+      conditions.append(functools.partial(StationIndex.radius, lat=val[0], lon=val[1], radius=val[2]))
     elif key == 'cluster':
       varname = cluster_name
       if ( not isinstance(val,(list,tuple,np.ndarray)) or not all(isInt(l) for l in val)) and not isInt(val): raise TypeError  
-      tests.append(functools.partial(test_cluster, val, cluster_name=cluster_name, lcheckVar=lcheckVar))
+      conditions.append(functools.partial(StationIndex.isin, name=varname, values=val, lcheckVar=lcheckVar))
     else:
       raise NotImplementedError, "Unknown condition/test: '{:s}'".format(key)
     # record, which datasets have all variables 
@@ -817,12 +800,12 @@ def selectStations(datasets, stnaxis='station', master=None, linplace=False, lal
   if not all(varcheck): 
     if lall and lcheckVar: raise DatasetError, varcheck
     else: warn("Some Datasets do not have all variables: {:s}".format(varcheck))
-  # define test function (all tests must pass)
-  if len(tests) > 0:
-    testFct = functools.partial(apply_test_suite, tests)
-  else: testFct = None
+  # define vectorized mask function based on station index (all conditions must be met)
+  if len(conditions) > 0:
+    maskFct = functools.partial(applyStationIndex, conditions)
+  else: maskFct = None
   # pass on call to generic function selectCoords
-  datasets = selectElements(datasets=datasets, axis=stnaxis, testFct=testFct, master=master, linplace=linplace, lall=lall)
+  datasets = selectElements(datasets=datasets, axis=stnaxis, maskFct=maskFct, master=master, linplace=linplace, lall=lall)
   # return sliced datasets
   return datasets
   
@@ -990,7 +973,7 @@ if __name__ == '__main__':
     for variables in (all_vars,):
       
       # initialize station record container
-      stations = StationRecords(variables=variables, constraints=None)
+      stations = StationRecords(variables=variables, constraints=None, NP=4, lcache=True) # parse in parallel and cache
       # create netcdf file
       stations.prepareDataset(filename=None, folder=None) # default settings
       # read actual station data
@@ -175,8 +175,9 @@ def loadNRCan_ShpTS(name=dataset_name, shape=None, resolution=None, varlist=None
 # a universal load function for normals and historical timeseries; also computes some derived variables, and combines NA and CA grids
 def loadASCII_TS(name=None, title=None, atts=None, derived_vars=None, varatts=None, NA_grid=None, CA_grid=None, 
                  merged_axis=None, time_axis='time', resolution=None, grid_defs=None, period=None, var_pattern=None, 
-                 snow_density='maritime',grid_pattern=None, vardefs=None, axdefs=None, lfeedback=True):
-    ''' load NRCan time-series data from ASCII files, merge CA and NA grids and compute some additional variables; return Dataset '''
+                 snow_density='maritime',grid_pattern=None, vardefs=None, axdefs=None, lfeedback=True, NP=1):
+    ''' load NRCan time-series data from ASCII files, merge CA and NA grids and compute some additional variables; return Dataset 
+        (ASCII raster files are read in parallel using NP processes) '''
     
     from utils.ascii import rasterDataset
 
@@ -202,12 +203,12 @@ def loadASCII_TS(name=None, title=None, atts=None, derived_vars=None, varatts=No
     # load NA grid
     dataset = rasterDataset(name=name, title=title, vardefs=NA_vardefs, axdefs=axdefs, atts=atts, projection=None, 
                             griddef=grid_defs[NA_grid], lgzip=None, lgdal=True, lmask=True, fillValue=None, 
-                            lskipMissing=True, lgeolocator=True, time_axis=time_axis, lfeedback=lfeedback,
+                            lskipMissing=True, lgeolocator=True, time_axis=time_axis, lfeedback=lfeedback, NP=NP,
                             file_pattern=grid_pattern.format(GRID=NA_grid,PRDSTR=prdstr)+var_pattern )    
     # load CA grid
     ca_ds = rasterDataset(name=name, title=title, vardefs=CA_vardefs, axdefs=axdefs, atts=atts, projection=None, 
                           griddef=grid_defs[CA_grid], lgzip=None, lgdal=True, lmask=True, fillValue=None, 
-                          lskipMissing=True, lgeolocator=False, time_axis=time_axis, lfeedback=lfeedback,
+                          lskipMissing=True, lgeolocator=False, time_axis=time_axis, lfeedback=lfeedback, NP=NP,
                           file_pattern=grid_pattern.format(GRID=CA_grid,PRDSTR=prdstr)+var_pattern )
     
     # merge grids
@@ -369,11 +370,11 @@ norm_title = 'NRCan Gridded Normals'
 
 def loadASCII_Normals(name=dataset_name, title=norm_title, atts=None, derived_vars=norm_derived, varatts=varatts, 
                       NA_grid=None, CA_grid=None, resolution=12, grid_defs=None, period=norm_period, snow_density='maritime',
-                      var_pattern=norm_var_pattern, grid_pattern=norm_grid_pattern, vardefs=norm_vardefs, axdefs=norm_axdefs):
+                      var_pattern=norm_var_pattern, grid_pattern=norm_grid_pattern, vardefs=norm_vardefs, axdefs=norm_axdefs, NP=1):
     ''' load NRCan normals from ASCII files, merge CA and NA grids and compute some additional variables; return Dataset '''
     return loadASCII_TS(name=name, title=title, atts=atts, derived_vars=derived_vars, varatts=varatts, snow_density=snow_density,
                         NA_grid=NA_grid, CA_grid=CA_grid, merged_axis=None, resolution=resolution, grid_defs=grid_defs, 
-                        period=period, var_pattern=var_pattern, grid_pattern=grid_pattern, vardefs=vardefs, axdefs=axdefs)
+                        period=period, var_pattern=var_pattern, grid_pattern=grid_pattern, vardefs=vardefs, axdefs=axdefs, NP=NP)
 
 
 # Historical time-series: ASCII data specifications
@@ -397,7 +398,7 @@ hist_title = 'NRCan Historical Gridded Time-series'
 
 def loadASCII_Hist(name=dataset_name, title=hist_title, atts=None, derived_vars=hist_derived, varatts=varatts, snow_density='maritime',
                    NA_grid=None, CA_grid=None, resolution=12, grid_defs=None, period=hist_period, merged_axis=merged_atts,
-                   var_pattern=hist_var_pattern, grid_pattern=hist_grid_pattern, vardefs=hist_vardefs, axdefs=hist_axdefs):
+                   var_pattern=hist_var_pattern, grid_pattern=hist_grid_pattern, vardefs=hist_vardefs, axdefs=hist_axdefs, NP=1):
     ''' load historical NRCan timeseries from ASCII files, merge CA and NA grids and compute some additional variables; return Dataset '''
     # figure out time period for merged time axis
     for axname,axdef in axdefs.items():
@@ -416,7 +417,7 @@ def loadASCII_Hist(name=dataset_name, title=hist_title, atts=None, derived_vars=
     return loadASCII_TS(name=name, title=title, atts=atts, derived_vars=derived_vars, varatts=varatts, time_axis='month', 
                         snow_density=snow_density,
                         NA_grid=NA_grid, CA_grid=CA_grid, merged_axis=merged_axis, resolution=resolution, grid_defs=grid_defs, 
-                        period=period, var_pattern=var_pattern, grid_pattern=grid_pattern, vardefs=vardefs, axdefs=axdefs)
+                        period=period, var_pattern=var_pattern, grid_pattern=grid_pattern, vardefs=vardefs, axdefs=axdefs, NP=NP)
 
 # Historical time-series
 CMC_period = (1998,2015)
@@ -434,7 +435,7 @@ CMC_title = 'CMC Historical Gridded Snow Time-series'
 def loadCMC_Hist(name='CMC', title=CMC_title, atts=None, derived_vars=CMC_derived, varatts=varatts, 
                  grid='NA12', resolution=12, grid_defs=None, period=CMC_period, lcheck=True, mask=None,
                  lmergeTime=False, # merge the year and month "axes" into a single monthly time axis 
-                 var_pattern=CMC_var_pattern, data_root=CMC_root, vardefs=CMC_vardefs, axdefs=CMC_axdefs):
+                 var_pattern=CMC_var_pattern, data_root=CMC_root, vardefs=CMC_vardefs, axdefs=CMC_axdefs, NP=1):
     ''' load CMC historical snow time-series from GeoTIFF files, merge with NRCan dataset and recompute snowmelt '''
 
     from utils.ascii import rasterDataset
@@ -452,7 +453,7 @@ def loadCMC_Hist(name='CMC', title=CMC_title, atts=None, derived_vars=CMC_derive
     # load NA grid
     dataset = rasterDataset(name=name, title=title, vardefs=vardefs, axdefs=axdefs, atts=atts, projection=None, 
                             griddef=grid_defs[grid], lgzip=None, lgdal=True, lmask=False, fillValue=0, lskipMissing=True, 
-                            lgeolocator=False, file_pattern=data_root+var_pattern )    
+                            lgeolocator=False, file_pattern=data_root+var_pattern, NP=NP )    
 
     # merge year and month axes
     dataset = dataset.mergeAxes(axes=axdefs.keys(), axatts=varatts['time'], linplace=True)
@@ -618,7 +619,7 @@ if __name__ == '__main__':
         ncfile = avgfolder + avgfile.format(grdstr,prdstr)
         if not os.path.exists(avgfolder): os.mkdir(avgfolder)
         # load ASCII dataset with default values
-        dataset = loadASCII_Normals(period=period, resolution=resolution, snow_density=snow_density, grid_defs=grid_def,)        
+        dataset = loadASCII_Normals(period=period, resolution=resolution, snow_density=snow_density, grid_defs=grid_def, NP=4)        
         # test 
         print(dataset)
         print('')
@@ -651,7 +652,7 @@ if __name__ == '__main__':
 #         derived_vars = ('T2',)
         # load ASCII dataset with default values
         dataset = loadASCII_Hist(period=period, vardefs=vardefs, derived_vars=derived_vars, 
-                                 resolution=resolution, snow_density=snow_density, grid_defs=grid_def,)        
+                                 resolution=resolution, snow_density=snow_density, grid_defs=grid_def, NP=4)        
         # test 
         print(dataset)
         print('')
@@ -131,7 +131,7 @@ loadShapeClimatology = loadPRISM_Shp
 def loadASCII(var, fileformat='BCY_%s.%02ia', arrayshape=(601,697)):
   # local imports
   from numpy.ma import zeros
-  from numpy import genfromtxt, flipud
+  from utils.ascii import readESRIgrid
   # definitions
   datadir = root_folder + 'Climatology/ASCII/' # data folder   
   ntime = len(days_per_month) # number of month
@@ -142,9 +142,8 @@ def loadASCII(var, fileformat='BCY_%s.%02ia', arrayshape=(601,697)):
   for m in xrange(ntime):
     # read data into array
     filename = fileformat%(var,m+1)
-    tmp = genfromtxt(datadir+filename, dtype=float, skip_header=5, 
-                     missing_values=-9999, filling_values=-9999, usemask=True)
-    data[m,:] = flipud(tmp)  
+    tmp = readESRIgrid(datadir+filename, lgzip=False, dtype=float, lmask=True, na=-9999, lflip=True)[0]
+    data[m,:] = tmp
     # N.B.: the data is loaded in a masked array (where missing values are omitted)   
   # return array
   return data
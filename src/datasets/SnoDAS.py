@@ -17,6 +17,7 @@ Changes in SnoDAS data:
 import datetime as dt
 import pandas as pd
 import os, gzip
+import multiprocessing as mp
 import os.path as osp
 import numpy as np
 import netCDF4 as nc # netCDF4-python module
@@ -116,12 +117,20 @@ def getFilenameFolder(varname=None, date=None, root_folder=root_folder, lgzip=Tr
     folder = '{:s}/data/{:04d}/{:s}/SNODAS_unmasked_{:s}/'.format(root_folder,date.year,mon,datestr)
     return folder,filename
 
-def readBinaryData(fobj=None, lstr=True):
-    ''' load binary data for variable from file (defiend by file handle) and return a 2D array '''
+def readBinaryData(fobj=None, lstr=True, out=None):
+    ''' load binary data for variable from file (defiend by file handle) and return a 2D array;
+        if a preallocated buffer is passed as out, the data are read directly into the buffer '''
     # read binary data (16-bit signed integers, big-endian)
-    if lstr:
+    if out is not None:
+        # read binary data directly into buffer (no intermediate copies; also works with gzip files)
+        if out.dtype != binary_dtype or out.shape != snodas_shape2d: raise ArgumentError(out.shape)
+        nbytes = fobj.readinto(out)
+        if nbytes != out.nbytes or len(fobj.read(1)) > 0:
+            raise DataError(nbytes)
+        data = out
+    elif lstr:
         # read binary data from file stream (basically as string; mainly for gzip files)
-        data = np.fromstring(fobj.read(), dtype=binary_dtype, count=-1) # read binary data
+        data = np.frombuffer(fobj.read(), dtype=binary_dtype, count=-1) # read binary data
     else:
         # read binary data from file system (does not work with gzip files)
         data = np.fromfile(fobj, dtype=binary_dtype, count=-1) # read binary data
@@ -130,22 +139,28 @@ def readBinaryData(fobj=None, lstr=True):
     data = data.reshape(snodas_shape2d) # assign shape
     return data
   
-def readBinaryFile(varname=None, date=None, root_folder=root_folder, lgzip=True, scalefactor=None, 
-                   lmask=True, lmissing=True):
-    ''' load SnoDAS binary data for one day into a numpy array with proper scaling and unites etc. '''
+def readBinaryFile(varname=None, date=None, root_folder=root_folder, lgzip=True, scalefactor=None,
+                   lmask=True, lmissing=True, buffer=None, out=None):
+    ''' load SnoDAS binary data for one day into a numpy array with proper scaling and unites etc.;
+        if out is given, the data are decoded directly into out (missing values are set to missing_value),
+        and buffer can be a preallocated array for the binary data '''
     # find file
     folder,filename = getFilenameFolder(varname=varname, date=date, root_folder=root_folder, lgzip=lgzip)
     filepath = folder+filename
     # check if present
     try:
         # open file (gzipped or not)
-        with gzip.open(filepath, mode='rb') if lgzip else open(filepath, mode='rb') as fobj:              
-            data = readBinaryData(fobj=fobj, lstr=lgzip,) # read data        
+        with gzip.open(filepath, mode='rb') if lgzip else open(filepath, mode='rb') as fobj:
+            data = readBinaryData(fobj=fobj, lstr=lgzip, out=buffer) # read data
         # flip y-axis (in file upper-left corner is origin, we want lower-left)
         data = np.flip(data, axis=0)
         # N.B.: the order of the axes is (y,x)
         # format such that we have actual variable values
-        if lmask:
+        if out is not None:
+            # convert directly into output array
+            out[:] = data; fdata = out
+            lmiss = data == missing_value # restore missing values after scaling
+        elif lmask:
             fdata = np.ma.masked_array(data, dtype=netcdf_dtype)
             fdata = np.ma.masked_where(data==-9999, fdata, copy=False)
         else:
@@ -155,12 +170,16 @@ def readBinaryFile(varname=None, date=None, root_folder=root_folder, lgzip=True,
         if scalefactor is None:
             scalefactor = binary_varatts[varname]['scalefactor']*netcdf_varatts[varname]['scalefactor']
         if scalefactor != 1:
-            fdata *= scalefactor
+            if out is not None: # in double precision, like masked arrays
+                np.multiply(out, scalefactor, out=out, dtype=np.float64, casting='same_kind')
+            else: fdata *= scalefactor
+        if out is not None: out[lmiss] = missing_value
     except IOError:
         if lmissing:
             print("Warning: data for '{}' missing - creating empty array!\n  ('{:s}')".format(date, folder))
             # create empty/masked array
-            if lmask: fdata = np.ma.masked_all(snodas_shape2d, dtype=netcdf_dtype)            
+            if out is not None: out[:] = missing_value; fdata = out
+            elif lmask: fdata = np.ma.masked_all(snodas_shape2d, dtype=netcdf_dtype)
             else: fdata = np.zeros(snodas_shape2d, dtype=netcdf_dtype)+missing_value
         else:
             print("Point of failure: {}/{}".format(varname,date))
@@ -169,7 +188,8 @@ def readBinaryFile(varname=None, date=None, root_folder=root_folder, lgzip=True,
         if lmissing:
             print("Warning: data for '{}' incomplete - creating empty array!\n  ('{:s}')".format(date, folder))
             # create empty/masked array
-            if lmask: fdata = np.ma.masked_all(snodas_shape2d, dtype=netcdf_dtype)            
+            if out is not None: out[:] = missing_value; fdata = out
+            elif lmask: fdata = np.ma.masked_all(snodas_shape2d, dtype=netcdf_dtype)
             else: fdata = np.zeros(snodas_shape2d, dtype=netcdf_dtype)+missing_value
         else:
             print("Point of failure: {}/{}".format(varname,date))
@@ -211,8 +231,74 @@ def creatNetCDF(varname, varatts=None, ncatts=None, data_folder=daily_folder, fi
             dtype=netcdf_dtype, zlib=True, fillValue=fillValue, lusestr=True, **ncatts)
     # return dataset object
     return ds
-  
-  
+
+
+## batch conversion of binary files with parallel decompression
+
+# shared time slab buffers and binary read buffer of worker processes
+_slab_buffers = None
+_binary_buffer = None
+
+def _initSlabBuffers(shared_array, shape):
+    ''' initialize worker process with shared time slab buffers and a binary read buffer '''
+    global _slab_buffers, _binary_buffer
+    _slab_buffers = np.frombuffer(shared_array, dtype=netcdf_dtype).reshape(shape)
+    _binary_buffer = np.empty(snodas_shape2d, dtype=binary_dtype)
+
+def _decodeBinaryDay(args):
+    ''' worker function that decompresses and decodes one daily binary file directly into a time slab '''
+    islab, iday, varname, date, root_folder, lgzip, lmissing = args
+    readBinaryFile(varname=varname, date=date, root_folder=root_folder, lgzip=lgzip, lmissing=lmissing,
+                   buffer=_binary_buffer, out=_slab_buffers[islab,iday,:,:])
+    return iday
+
+def convertBinaryBatch(varname, dates, ncds, time_offset=0, time_chunk=None, NP=4, root_folder=root_folder,
+                       lgzip=True, lmissing=True, flush_intervall=4, lfeedback=True):
+    ''' decompress and decode daily binary files in a process pool and write them to a NetCDF-4 dataset
+        in time slabs that are aligned with the chunking of the NetCDF variable; days are appended after
+        time_offset and the number of records in the dataset is returned '''
+    ncvar = ncds[varname]; ncts = ncds['time_stamp']; nctc = ncds['time']
+    if time_chunk is None:
+        chunking = ncvar.chunking()
+        time_chunk = 1 if chunking == 'contiguous' else chunking[0]
+    # time slabs are aligned with chunks in the file (first slab may be shorter when appending)
+    bounds = range(time_offset + time_chunk - time_offset%time_chunk, time_offset + len(dates), time_chunk)
+    bounds = [time_offset] + bounds + [time_offset + len(dates)]
+    slabs = [(ts,te) for ts,te in zip(bounds[:-1],bounds[1:]) if te > ts]
+    # allocate two shared time slab buffers: workers decode into one, while the other is written to disk
+    shape = (2,time_chunk)+snodas_shape2d
+    shared_array = mp.RawArray('f', int(np.prod(shape)))
+    slab_buffers = np.frombuffer(shared_array, dtype=netcdf_dtype).reshape(shape)
+    if NP > 1: pool = mp.Pool(processes=NP, initializer=_initSlabBuffers, initargs=(shared_array,shape))
+    else: _initSlabBuffers(shared_array, shape); pool = None
+    def decodeSlab(n):
+        ''' launch decoding of all days in slab n (asynchronously, if a pool is used) '''
+        ts,te = slabs[n]
+        args = [(n%2, i, varname, dates[t-time_offset], root_folder, lgzip, lmissing) for i,t in enumerate(xrange(ts,te))]
+        return pool.map_async(_decodeBinaryDay, args) if pool else map(_decodeBinaryDay, args)
+    try:
+        result = decodeSlab(0) if len(slabs) > 0 else None
+        for n,(ts,te) in enumerate(slabs):
+            if pool: result.get() # wait for current slab to finish
+            # start decoding the next slab, before writing the current one
+            if n+1 < len(slabs): result = decodeSlab(n+1)
+            # write time slab, time coordinate and time stamps
+            ncvar[ts:te,:,:] = slab_buffers[n%2,:te-ts,:,:]
+            nctc[ts:te] = np.arange(ts,te)
+            for t in xrange(ts,te):
+                ncts[t] = str(dates[t-time_offset] - 1) # SnoDAS uses end-of-day time-stamps
+            if lfeedback: print("  {} - {}".format(dates[ts-time_offset]-1, dates[te-time_offset-1]-1))
+            # periodic flushing to disk
+            if (n+1)%flush_intervall == 0: ncds.sync()
+    except:
+        if pool: pool.terminate()
+        raise
+    else:
+        if pool: pool.close(); pool.join()
+    ncds.sync()
+    return time_offset + len(dates)
+
+
 ## functions to load NetCDF datasets (using xarray)
 
 # valid geographic/projected coordinates
@@ -459,9 +545,9 @@ if __name__ == '__main__':
     
   elif test_mode == 'convert_binary':
     
-      import gc, time
+      import time
 
-      lappend = True
+      lappend = True; NP = 4 # number of processes for decompression
 #       netcdf_settings = dict(chunksizes=(1,snodas_shape2d[0]/4,snodas_shape2d[1]/8))
       nc_time_chunk = netcdf_settings['chunksizes'][0]
       start_date = '2009-12-14'; end_date = '2018-11-24'
@@ -521,53 +607,9 @@ if __name__ == '__main__':
                   ncds.close()
                   continue # skip ahead to next variable
           
-          flush_intervall = 64 if nc_time_chunk==1 else nc_time_chunk*4
-          
-          # loop over daily records and periodically write to disk
-          ii = 0; fi = 0; c = 0; var_chunks = []; tc_chunks = []; ts_chunks = []
+          # decompress and decode daily rasters in parallel and write time slabs (aligned with chunks)
           print("\nIterating over daily rasters:\n")
-          for i,day in enumerate(time_array):
-              
-              ii = time_offset + i + 1 # one-based day
-              actual_day = day -1
-              ## N.B.: look into validity of time-stamp, i.e. end of day or beginning?
-    
-              # load data and add to variable chunk list
-              var_chunks.append(readBinaryFile(varname=varname, date=day,))
-              # assign time stamp to time chunk list
-              tc_chunks.append(i) # zero-based
-              print("  {}".format(actual_day))
-              ts_chunks.append(str(actual_day))
-              
-              # now assign chunk to file
-              c += 1
-              if c == nc_time_chunk:
-                  ic = ii - nc_time_chunk # start of chunk
-                  # write data
-                  ncvar[ic:ii,:,:] = np.stack(var_chunks, axis=0)
-                  nctc[ic:ii] = np.stack(tc_chunks, axis=0)          
-                  ncts[ic:ii] = np.stack(ts_chunks, axis=0)
-                  # reset intervall counter and lists
-                  c = 0; var_chunks = []; tc_chunks = []; ts_chunks = []
-
-              # periodic flushing to disk
-              fi += 1
-              if fi == flush_intervall:
-                  print("Flushing data to disk ({:d}, {:s})".format(ii, actual_day))
-                  ncds.sync() # flush data
-                  fi = 0 # reset intervall counter
-                  gc.collect()
-                  
-          # write remaining data for incomplete chunk
-          if len(var_chunks) > 0:
-              ic = ii - c # start of chunk
-              # write data
-              ncvar[ic:ii,:,:] = np.stack(var_chunks, axis=0)
-              nctc[ic:ii] = np.stack(tc_chunks, axis=0)          
-              ncts[ic:ii] = np.stack(ts_chunks, axis=0)
-              # delete chunk lists lists
-              del var_chunks, tc_chunks, ts_chunks
-              gc.collect()
+          ii = convertBinaryBatch(varname, time_array, ncds, time_offset=time_offset, time_chunk=nc_time_chunk, NP=NP)
           
           print("\nCompleted iteration; read {:d} rasters and created NetCDF-4 variable:\n".format(ii))    
           print(ncvar)
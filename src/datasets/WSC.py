@@ -13,7 +13,7 @@ import os, functools
 from copy import deepcopy
 from collections import OrderedDict
 # internal imports
-from datasets.common import selectElements, data_root
+from datasets.common import selectElements, data_root, StationIndex, applyStationIndex
 from geodata.netcdf import DatasetNetCDF
 from geodata.misc import FileError, isNumber, ArgumentError
 from utils import nanfunctions as nf
@@ -57,6 +57,18 @@ for varname,varatts in variable_attributes_kgs.items():
 agg_varatts_mms = deepcopy(agg_varatts_kgs)
 for varatts in agg_varatts_mms.values():
     varatts['units'] = kgs_to_mms.get(varatts['units'],varatts['units'])
+# meta data variables and axes for datasets with many gage stations
+station_attributes = dict(station    = dict(name='station', units='#', atts=dict(long_name='Station Number')), # ordinal number of station
+                          name       = dict(name='station_name', units='', atts=dict(long_name='Station Name')), # the proper name of the station
+                          ID         = dict(name='stn_ID', units='', atts=dict(long_name='WSC Station Number')), # official station ID
+                          shape_name = dict(name='shape_name', units='', atts=dict(long_name='Basin Name')), # basin the gage belongs to
+                          shp_area   = dict(name='shp_area', units='m^2', atts=dict(long_name='Drainage Area')),) # drainage area of gage
+
+# version of the gage station CSV parser (parsed records in the cache are only valid for the same version)
+parser_version = 1
+# in-memory cache of parsed gage station records (indexed by cache file; validated with the cache key)
+gage_records = OrderedDict()
+max_gage_records = 256 # only the most recently used records are kept (0: no in-memory cache)
 
 
 # change scalefactor and update PlotAtts of Variables
@@ -241,16 +253,74 @@ class GageStation(object):
     if not os.path.isfile(self.monthly_file): 
       if lcheck: raise IOError(self.monthly_file)
       else: self.monthly_file = None # clear if not available
-    
-  def getMetaData(self, lcheck=False):
-    ''' parse meta data file and save and return as dictionary '''
+    self.cache_folder = '{:s}/cache/'.format(folder) # per-basin cache for parsed CSV files
+
+  def parseRecord(self):
+    ''' parse monthly CSV file and meta data file (once) and return values, flags and meta data in a dictionary '''
+    record = dict()
+    if self.monthly_file:
+      # read verification flags, years and monthly values in a single pass
+      # N.B.: every value is followed by a data symbol column, which is skipped
+      table = np.genfromtxt(self.monthly_file, dtype=np.float64, delimiter=',', skip_header=1, filling_values=np.nan,
+                            usecols=np.concatenate((np.arange(1,4,1),np.arange(4,28,2))), usemask=True, loose=True,
+                            invalid_raise=True)
+      table = table.reshape((-1,15)) # in case there is only one line
+      record['flags'] = np.where(table.mask[:,:3], -9999, table.data[:,:3]).astype(np.int) # verification flags and year
+      record['flagmask'] = table.mask[:,:3].copy()
+      record['data'] = table.data[:,3:].astype(np.float32) # missing values are NaN
+      record['mask'] = table.mask[:,3:].copy()
     if self.meta_file:
-      # parse file and load data into a dictionary
       with open(self.meta_file, mode='r') as filehandle:
-        lines = filehandle.readlines()
-        assert len(lines) == 2, lines
-        keys = lines[0].split(',')
-        values = lines[1].split(',')
+        record['meta'] = np.array(filehandle.readlines())
+    return record
+
+  def cacheKey(self):
+    ''' return a string that identifies the source files (path, size, and modification time) and parser version '''
+    key = [('version',parser_version)]
+    for filename in (self.monthly_file, self.meta_file):
+      if filename:
+        stat = os.stat(filename)
+        key.append((os.path.abspath(filename), stat.st_size, stat.st_mtime))
+      else: key.append(None)
+    return repr(key)
+
+  def loadRecord(self, lcache=False):
+    ''' load parsed record from memory or from the per-basin cache, if the source files have not changed;
+        otherwise parse the CSV files and keep the record (only saved to disk, if lcache=True) '''
+    key = self.cacheKey()
+    cachefile = os.path.abspath('{:s}/{:s}.npz'.format(self.cache_folder,self.name))
+    # N.B.: records are kept in memory, since the same gages are often loaded many times
+    record = None; lsave = lcache
+    if cachefile in gage_records and gage_records[cachefile][0] == key:
+      record = gage_records.pop(cachefile)[1] # re-inserted below (most recently used)
+      lsave = lcache and not os.path.exists(cachefile)
+    elif lcache and os.path.exists(cachefile):
+      try:
+        npz = np.load(cachefile)
+        if str(npz['key']) == key:
+          record = {name:npz[name] for name in npz.files if name != 'key'}; lsave = False
+        npz.close()
+      except (IOError, KeyError, ValueError): record = None # invalid cache file; just parse again
+    if record is None: record = self.parseRecord()
+    if lsave:
+      if not os.path.exists(self.cache_folder): os.makedirs(self.cache_folder)
+      # write to temporary file first and rename, so that cache files are always complete
+      tmpfile = '{:s}.{:d}.tmp.npz'.format(cachefile[:-4], os.getpid())
+      np.savez(tmpfile, key=np.array(key), **record)
+      os.rename(tmpfile, cachefile)
+    if max_gage_records > 0:
+      gage_records[cachefile] = (key,record)
+      while len(gage_records) > max_gage_records: gage_records.popitem(last=False) # least recently used
+    return record
+
+  def getMetaData(self, lcheck=False, lcache=False):
+    ''' parse meta data file and save and return as dictionary '''
+    if self.meta_file:
+      # load lines from parsed record and load data into a dictionary
+      lines = [str(line) for line in self.loadRecord(lcache=lcache)['meta']]
+      assert len(lines) == 2, lines
+      keys = lines[0].split(',')
+      values = lines[1].split(',')
       assert len(keys) == len(values)
       # add some additional attributes
       metadata = {key:value for key,value in zip(keys,values)}
@@ -266,13 +336,13 @@ class GageStation(object):
     self.atts = metadata
     return metadata
   
-  def getTimeseriesData(self, units='kg/s', lcheck=True, lexpand=True, lfill=True, period=None, lflatten=True):
+  def getTimeseriesData(self, units='kg/s', lcheck=True, lexpand=True, lfill=True, period=None, lflatten=True,
+                        lcache=False):
     ''' extract time series data and time coordinates from a WSC monthly CSV file '''
     if self.monthly_file:
-      # use numpy's CSV functionality
-      # get timeseries data
-      data = np.genfromtxt(self.monthly_file, dtype=np.float32, delimiter=',', skip_header=1, filling_values=np.nan,  
-                           usecols=np.arange(4,28,2), usemask=True, loose=True, invalid_raise=True)
+      # get timeseries data from parsed record (CSV file is only parsed once)
+      record = self.loadRecord(lcache=lcache)
+      data = np.ma.array(record['data'], mask=record['mask'], copy=True) # modified below
       assert data.shape[1] == 12, data.shape
       # for some reason every value is followed by an extra comma...
       #data = np.ma.masked_less(data, 10) # remove some invalid values
@@ -282,8 +352,7 @@ class GageStation(object):
       elif units.lower() == 'm^3/s': pass # original units
       else: raise ArgumentError("Unknown units: {}".format(units))
       # get time coordinates and verification flag
-      check = np.genfromtxt(self.monthly_file, dtype=np.int, delimiter=',', skip_header=1, filling_values=-9999,  
-                           usecols=np.arange(1,4,1), usemask=True, loose=True, invalid_raise=True)
+      check = np.ma.array(record['flags'], mask=record['flagmask'], copy=True)
       assert check.shape[0] == data.shape[0], check.shape
       assert np.all(check >= 0), np.sum(check < 0)
       time = check[:,2].astype(np.int) # this is the year (time coordinate)
@@ -380,7 +449,7 @@ def getGageStation(basin=None, station=None, name=None, folder=None, river=None,
 def loadGageStation(basin=None, station=None, varlist=None, varatts=None, mode='climatology', 
                     aggregation=None, filetype='monthly', folder=None, name=None, period=None,
                     basin_list=None, lcheck=True, lexpand=True, lfill=True, lflatten=True,
-                    lkgs=True, scalefactors=None, title=None):
+                    lkgs=True, scalefactors=None, title=None, lcache=False):
   ''' function to load hydrograph climatologies and timeseries for a given basin '''
   ## resolve input
   if mode == 'timeseries' and aggregation: 
@@ -401,10 +470,10 @@ def loadGageStation(basin=None, station=None, varlist=None, varatts=None, mode='
   # time series data and time coordinates
   lexpand = True; lfill = True
   if mode == 'climatology': lexpand = False; lfill = False; lflatten = False
-  data, time = station.getTimeseriesData(units='kg/s' if lkgs else 'm^3/s', lcheck=True, lexpand=lexpand, 
-                                         lfill=lfill, period=period, lflatten=lflatten)
+  data, time = station.getTimeseriesData(units='kg/s' if lkgs else 'm^3/s', lcheck=True, lexpand=lexpand,
+                                         lfill=lfill, period=period, lflatten=lflatten, lcache=lcache)
   # station meta data
-  metadata = station.getMetaData(lcheck=True)
+  metadata = station.getMetaData(lcheck=True, lcache=lcache)
   den = metadata['shp_area'] if lkgs else ( metadata['shp_area'] / 1000. )
   ## create dataset for station
   dataset = Dataset(name='WSC', title=title or metadata['Station Name'], varlist=[], atts=metadata,) 
@@ -476,17 +545,83 @@ def loadGageStation(basin=None, station=None, varlist=None, varatts=None, mode='
   else: 
     raise NotImplementedError, "Time axis mode '{}' is not supported.".format(mode)
   # adjust scalefactors, if necessary
-  if scalefactors:
-      if isinstance(scalefactors,dict):
-          dataset = updateScalefactor(dataset, varlist=scalefactors, scalefactor=None)
-      elif isNumber(scalefactors):
-          scalelist = ('discharge','StdDisc','SEMDisc','MaxDisc','MinDisc',)
-          dataset = updateScalefactor(dataset, varlist=scalelist, scalefactor=scalefactors)
-      else: 
-          raise TypeError(scalefactors) 
+  if scalefactors: dataset = _applyScalefactors(dataset, scalefactors)
   # return station dataset
   return dataset   
 
+# helper function to adjust scalefactors of discharge variables
+def _applyScalefactors(dataset, scalefactors):
+  ''' adjust the plotting scalefactors of discharge variables, using either a dict or a single number '''
+  if isinstance(scalefactors,dict):
+      dataset = updateScalefactor(dataset, varlist=scalefactors, scalefactor=None)
+  elif isNumber(scalefactors):
+      scalelist = ('discharge','StdDisc','SEMDisc','MaxDisc','MinDisc',)
+      dataset = updateScalefactor(dataset, varlist=scalelist, scalefactor=scalefactors)
+  else:
+      raise TypeError(scalefactors)
+  return dataset
+
+## load many gage stations at once
+def loadGageStations(stations=None, basin=None, basin_list=None, folder=None, varatts=None, period=None,
+                     lcheck=True, lkgs=True, lcache=False, scalefactors=None, name=dataset_name, title=None):
+  ''' load monthly time-series from many gage stations into a single dataset with a station dimension;
+      each CSV file is only parsed once and, if lcache=True, also cached in a per-basin folder '''
+  ## resolve input
+  if stations is None:
+    if isinstance(basin,basestring) and basin_list is not None: basin = basin_list[basin]
+    if isinstance(basin,BasinSet): stations = basin.stations.values()
+    elif basin is None and basin_list is not None:
+      stations = [station for basin_set in basin_list.values() for station in basin_set.stations.values()]
+    else: raise ArgumentError("Specify a list of gage stations or a BasinSet.")
+    basin = None # already resolved
+  elif not isinstance(stations,(list,tuple)): raise TypeError(stations)
+  stations = [getGageStation(basin=basin, station=station, folder=folder, basin_list=basin_list, lcheck=True)
+              for station in stations]
+  if len(stations) == 0: raise GageStationError("No gage stations selected.")
+  if varatts is None: varatts = variable_attributes_kgs if lkgs else variable_attributes_mms
+  elif not isinstance(varatts,dict): raise TypeError
+  units = 'kg/s' if lkgs else 'm^3/s'
+  # determine common period (all years with valid data in any station)
+  if period is None:
+    years = []
+    for station in stations:
+      time = station.getTimeseriesData(units=units, lcheck=lcheck, lexpand=False, lfill=False,
+                                       lflatten=False, lcache=lcache)[1]
+      if len(time) > 0: years += [time[0], time[-1]+1]
+    if len(years) == 0: raise GageStationError("No valid data found for selected gage stations.")
+    period = (min(years), max(years))
+  ## read csv data (from cache, if possible) and assemble arrays
+  nstn = len(stations); ntime = ( period[1] - period[0] )*12
+  discharge = np.ma.masked_all((nstn,ntime), dtype=np.float32)
+  metadata = []
+  for i,station in enumerate(stations):
+    data, time = station.getTimeseriesData(units=units, lcheck=lcheck, lexpand=True, lfill=True, period=period,
+                                           lflatten=True, lcache=lcache)
+    discharge[i,:] = data
+    metadata.append(station.getMetaData(lcheck=True, lcache=lcache))
+  shp_area = np.array([atts['shp_area'] for atts in metadata], dtype=np.float64)
+  den = ( shp_area if lkgs else ( shp_area / 1000. ) ).astype(np.float32).reshape((nstn,1))
+  ## create dataset for stations
+  dataset = Dataset(name=name, title=title or 'WSC Gage Stations', varlist=[], atts=dict(period=period))
+  stnAxis = Axis(coord=np.arange(1,nstn+1, dtype='int16'), **station_attributes['station']) # start at 1
+  timeAxis = Axis(name='time', units='month', coord=time, # time series centered at 1979-01
+                  atts=dict(long_name='Month since 1979-01'))
+  dataset += stnAxis; dataset += timeAxis
+  # station meta data
+  for key,att in (('name','long_name'),('ID','ID'),('shape_name','shape_name')):
+    strlist = [str(atts[att]) for atts in metadata]
+    strlen = max([len(string) for string in strlist])
+    strarray = np.array([string.ljust(strlen) for string in strlist], dtype='|S{:d}'.format(strlen))
+    dataset += Variable(axes=(stnAxis,), data=strarray, **station_attributes[key])
+  dataset += Variable(axes=(stnAxis,), data=shp_area, **station_attributes['shp_area'])
+  # mean discharge and runoff
+  dataset += Variable(axes=(stnAxis,timeAxis), data=discharge, atts=varatts['discharge'])
+  dataset += Variable(axes=(stnAxis,timeAxis), data=discharge / den, atts=varatts['runoff'])
+  # adjust scalefactors, if necessary
+  if scalefactors: dataset = _applyScalefactors(dataset, scalefactors)
+  # return multi-station dataset
+  return dataset
+
 # helper function to convert arguments
 def _sliceArgs(slices=None, basin=None, station=None, period=None, years=None):
     ''' a helper function to translate arguments from standard datasets to WSC specifics; the main difference is
@@ -549,67 +684,44 @@ def loadWSC_ShpTS(name=dataset_name, title=None, shape=None, basin=None, station
     # return formatted dataset
     return dataset
 
-## some helper functions to test conditions
-# defined in module main to facilitate pickling
-def test_encl(val, index,dataset,axis):
-  ''' check if shape is fully enclosed by grid ''' 
-  return dataset.shp_encl[index] == val  
-def test_full(val, index,dataset,axis):
-  ''' check if shape fully covers the grid ''' 
-  return dataset.shp_full[index] == val
-def test_empty(val, index,dataset,axis):
-  ''' check if shape is outside of grid ''' 
-  return dataset.shp_empty[index] == val 
-def test_mina(val,index,dataset,axis):
-  ''' check minimum area ''' 
-  return dataset.shp_area[index] >= val
-def test_maxa(val,index,dataset,axis):
-  ''' check maximum area ''' 
-  return dataset.shp_area[index] <= val
- 
-# apply tests to list
-def apply_test_suite(tests, index, dataset, axis):
-  ''' apply an entire test suite to '''
-  # just call all individual tests for given index 
-  return all(test(index,dataset,axis) for test in tests)
-
 ## select a set of common stations for an ensemble, based on certain conditions
-def selectStations(datasets, shpaxis='shape', imaster=None, linplace=True, lall=False, **kwcond):
-  ''' A wrapper for selectCoords that selects stations based on common criteria '''
+def selectStations(datasets, shpaxis='shape', imaster=None, linplace=False, lall=False, **kwcond):
+  ''' A wrapper for selectCoords that selects stations based on common criteria; criteria are evaluated 
+      in vectorized form, using a (cached) StationIndex '''
   # pre-load NetCDF datasets
   for dataset in datasets: 
     if isinstance(dataset,DatasetNetCDF): dataset.load() 
   # list of possible constraints
-  tests = [] # a list of tests to run on each station
+  conditions = [] # a list of vectorized conditions to apply to the station index
   #loadlist =  (datasets[imaster],) if not lall and imaster is not None else datasets 
   # test definition
   for key,val in kwcond.iteritems():
     key = key.lower()
     if key[:4] == 'encl' or key[:4] == 'cont':
       val = bool(val)
-      tests.append(functools.partial(test_encl, val))
+      conditions.append(functools.partial(StationIndex.isin, name='shp_encl', values=val))
     elif key == 'full':
       val = bool(val)
-      tests.append(functools.partial(test_full, val))
+      conditions.append(functools.partial(StationIndex.isin, name='shp_full', values=val))
     elif key[:4] == 'empt':
       val = bool(val)
-      tests.append(functools.partial(test_empty, val))
+      conditions.append(functools.partial(StationIndex.isin, name='shp_empty', values=val))
     elif key == 'min_area':
       if not isNumber(val): raise TypeError
       val = val*1e6 # units in km^2  
-      tests.append(functools.partial(test_mina, val))    
+      conditions.append(functools.partial(StationIndex.between, name='shp_area', lower=val))    
     elif key == 'max_area':
       if not isNumber(val): raise TypeError
       val = val*1e6 # units in km^2  
-      tests.append(functools.partial(test_maxa, val))
+      conditions.append(functools.partial(StationIndex.between, name='shp_area', upper=val))
     else:
       raise NotImplementedError, "Unknown condition/test: '{:s}'".format(key)
-  # define test function (all tests must pass)
-  if len(tests) > 0:
-    testFct = functools.partial(apply_test_suite, tests)
-  else: testFct = None
+  # define vectorized mask function based on station index (all conditions must be met)
+  if len(conditions) > 0:
+    maskFct = functools.partial(applyStationIndex, conditions)
+  else: maskFct = None
   # pass on call to generic function selectCoords
-  datasets = selectElements(datasets=datasets, axis=shpaxis, testFct=testFct, imaster=imaster, linplace=linplace, lall=lall)
+  datasets = selectElements(datasets=datasets, axis=shpaxis, maskFct=maskFct, master=imaster, linplace=linplace, lall=lall)
   # return sliced datasets
   return datasets
 
@@ -639,6 +751,10 @@ if __name__ == '__main__':
   stnds = loadGageStation(basin=basin_name, basin_list=basin_list, station=station,
                           scalefactors=1e-4, lkgs=True)
   print(stnds.discharge.plot)
+
+  # load all gage stations of the basin at once (parsed CSV files are cached)
+  stnsds = loadGageStations(basin=basin_name, basin_list=basin_list, lcache=True)
+  print stnsds
   
   # verify basin info
   basin_set = basin_list[basin_name]
@@ -10,8 +10,9 @@ Some tools and data that are used by many datasets, but not much beyond that.
 from importlib import import_module
 from warnings import warn
 import inspect
+from collections import OrderedDict
 import numpy as np
-import os
+import os, hashlib, errno
 import functools
 # internal imports
 from utils.misc import expandArgumentList
@@ -258,6 +259,66 @@ def transformDays(data=None, var=None, slc=None, l365=False, lvar=None, linplace
     return data      
       
       
+## vectorized aggregation of daily station data (months padded to 31 days)
+
+def monthLengths(months, origin=1979):
+  ''' return the number of days in each month (months are counted from January of the origin year) '''
+  months = np.asarray(months, dtype='int')
+  lengths = np.asarray(days_per_month_365, dtype='int')[months%12]
+  years = origin + months//12
+  lleap = np.logical_and(years%4 == 0, np.logical_or(years%100 != 0, years%400 == 0))
+  lengths[np.logical_and(months%12 == 1, lleap)] = 29 # leap days
+  return lengths
+
+def validDays(data, lengths, min_days=0):
+  ''' return a mask of valid days for daily data of shape (..., months, 31); months with less than 
+      min_days valid days are masked completely '''
+  if data.shape[-1] != 31 or data.shape[-2] != len(lengths): raise AxisError, data.shape
+  lvalid = np.logical_and(np.arange(31) < lengths.reshape((len(lengths),1)), ~np.isnan(data)) # (padding) days
+  if min_days > 0: 
+    lvalid = np.logical_and(lvalid, ( lvalid.sum(axis=-1) >= min_days )[...,np.newaxis])
+  return lvalid
+
+def monthlyMean(data, lengths, min_days=0):
+  ''' compute monthly means from daily data of shape (..., months, 31), ignoring missing days '''
+  lvalid = validDays(data, lengths, min_days=min_days)
+  return np.nanmean(np.where(lvalid, data, np.NaN), axis=-1) # N.B.: all-NaN months produce a warning
+
+def monthlyExtrema(data, lengths, mode='max', min_days=0):
+  ''' compute monthly extrema from daily data of shape (..., months, 31), ignoring missing days '''
+  lvalid = validDays(data, lengths, min_days=min_days)
+  if mode == 'max': xtrm = np.where(lvalid, data, -np.inf).max(axis=-1)
+  elif mode == 'min': xtrm = np.where(lvalid, data, np.inf).min(axis=-1)
+  else: raise ArgumentError, mode
+  xtrm[~lvalid.any(axis=-1)] = np.NaN
+  return np.asarray(xtrm, dtype=data.dtype)
+
+def consecutiveRuns(mask, axis=-1):
+  ''' return the length of the run of consecutive True values that ends at each element (run-length encoding) '''
+  mask = np.asarray(mask, dtype=np.bool)
+  if axis != -1 and axis != mask.ndim-1: mask = np.rollaxis(mask, axis=axis, start=mask.ndim)
+  idx = np.arange(mask.shape[-1])
+  # the run length is the distance to the last False element
+  runs = idx - np.maximum.accumulate(np.where(mask, -1, idx), axis=-1)
+  if axis != -1 and axis != mask.ndim-1: runs = np.rollaxis(runs, axis=mask.ndim-1, start=axis)
+  return runs
+
+def consecutiveExtrema(data, lengths, mode='above', threshold=0., min_days=0):
+  ''' compute the monthly maximum of consecutive days above/below a threshold from daily data of shape 
+      (..., months, 31); runs continue across month boundaries and missing days end a run '''
+  lvalid = validDays(data, lengths, min_days=0) # N.B.: run lengths have to be computed from all data
+  lmonth = np.arange(31) < lengths.reshape((len(lengths),1)) # days that exist, not padding
+  if mode == 'above': levent = np.logical_and(lvalid, np.where(lvalid, data, threshold) > threshold)
+  elif mode == 'below': levent = np.logical_and(lvalid, np.where(lvalid, data, threshold) < threshold)
+  else: raise ArgumentError, mode
+  # remove padding days, so that runs are continuous across months
+  runs = np.zeros(data.shape, dtype='int16')
+  runs[...,lmonth] = consecutiveRuns(levent[...,lmonth], axis=-1)
+  xtrm = np.asarray(runs.max(axis=-1), dtype=data.dtype)
+  if min_days > 0: xtrm[lvalid.sum(axis=-1) < min_days] = np.NaN
+  return xtrm
+
+
 ## functions to load a dataset
 
 # convenience function to invert variable name mappings
@@ -543,19 +604,22 @@ def loadDataset(name=None, station=None, shape=None, mode='climatology', basin_l
 loadDatasets = BatchLoad(loadDataset)
 
 # function to extract common points that meet a specific criterion from a list of datasets
-def selectElements(datasets, axis, testFct=None, master=None, linplace=False, lall=False):
+def selectElements(datasets, axis, testFct=None, maskFct=None, master=None, linplace=False, lall=False):
   ''' Extract common points that meet a specific criterion from a list of datasets. 
-      The test function has to accept the following input: index, dataset, axis'''
+      The test function has to accept the following input: index, dataset, axis; alternatively, a 
+      vectorized mask function can be used, which accepts dataset and axis and returns a boolean mask
+      along the axis (e.g. applyStationIndex). '''
   if linplace: raise NotImplementedError("Option 'linplace' does not work currently.")
   # check input
   if not isinstance(datasets, (list,tuple,Ensemble)): raise TypeError(datasets)
   if not all(isinstance(dataset,Dataset) for dataset in datasets): raise TypeError(dataset)
   if not callable(testFct) and testFct is not None: raise TypeError(testFct)
+  if not callable(maskFct) and maskFct is not None: raise TypeError(maskFct)
+  if testFct is not None and maskFct is not None: raise ArgumentError("The options 'testFct' and 'maskFct' are mutually exclusive!")
   if isinstance(axis, Axis): axis = axis.name
   if not isinstance(axis, basestring): raise TypeError(axis)
   if lall and master is not None: raise ArgumentError("The options 'lall' and 'imaster' are mutually exclusive!")
   # save some ensemble parameters for later  
-  lnotest = testFct is None
   lens = isinstance(datasets,Ensemble)
   if lens:
     enskwargs = dict(basetype=datasets.basetype, idkey=datasets.idkey, 
@@ -574,40 +638,31 @@ def selectElements(datasets, axis, testFct=None, master=None, linplace=False, la
   if not imaster is None and not isinstance(imaster,(int,np.integer)): raise TypeError(imaster)
   elif imaster >= len(datasets) or imaster < 0: raise ValueError 
   maxis = axes.pop(imaster) # extraxt shortest axis for loop
-  if lall: 
-    tmpds = tuple(datasets)
-    if imaster != 0: tmpds = (tmpds[imaster],)+tmpds[:imaster]+tmpds[imaster+1:]
-    test_fct = lambda i,ds: testFct(i, ds, axis) # prepare test function arguments
-  else: 
-    test_fct = lambda i: testFct(i, datasets[imaster], axis) 
-  # loop over coordinate axis
-  itpls = [] # list of valid index tuple
-  for i,x in enumerate(maxis.coord):
-    # check other axes
-    if all([x in ax.coord for ax in axes]): # only the other axes
-      # no condition
-      if lnotest:
-        # just find and add indices
-        itpls.append((i,)+tuple(ax.coord.searchsorted(x) for ax in axes))
-      # check condition using shortest dataset
-      elif lall: 
-        # check test condition on all datasets (slower)
-        tmpidx = (i,)+tuple(ax.coord.searchsorted(x) for ax in axes)
-        if all(test_fct(ii,ds) for ii,ds in zip(tmpidx,tmpds)):
-          # add corresponding indices in each dataset to list
-          itpls.append(tmpidx)
-      else:
-        # check test condition on only one dataset (faster, default)
-        if test_fct(i):
-          # add corresponding indices in each dataset to list
-          itpls.append((i,)+tuple(ax.coord.searchsorted(x) for ax in axes))
-          # N.B.: since we can expect exact matches, plain searchsorted is fastest (side='left') 
+  tmpds = tuple(datasets)
+  if imaster != 0: tmpds = (tmpds[imaster],)+tmpds[:imaster]+tmpds[imaster+1:] # master first
+  # find common coordinates and corresponding indices in each dataset (master first)
+  lcommon = np.ones(len(maxis), dtype=np.bool)
+  for ax in axes: lcommon &= np.in1d(maxis.coord, ax.coord)
+  idxs = [np.flatnonzero(lcommon)]
+  idxs += [ax.coord.searchsorted(maxis.coord[idxs[0]]) for ax in axes]
+  # N.B.: since we can expect exact matches, plain searchsorted is fastest (side='left') 
+  if maskFct is not None:
+    # apply vectorized test condition to all datasets (slower) or only the master (faster, default)
+    lmask = np.ones(len(idxs[0]), dtype=np.bool)
+    for ds,idx in zip(tmpds if lall else tmpds[:1],idxs): lmask &= np.asarray(maskFct(ds, axis))[idx]
+    idxs = [idx[lmask] for idx in idxs]
+  elif testFct is not None:
+    if lall: 
+      # check test condition on all datasets (slower)
+      lmask = [all(testFct(ii,ds,axis) for ii,ds in zip(tmpidx,tmpds)) for tmpidx in zip(*idxs)]
+    else: 
+      # check test condition on only one dataset (faster, default)
+      lmask = [testFct(i,tmpds[0],axis) for i in idxs[0]]
+    lmask = np.asarray(lmask, dtype=np.bool).reshape(idxs[0].shape)
+    idxs = [idx[lmask] for idx in idxs]
   # check if there is anything left...
-  if len(itpls) == 0: raise DatasetError("Aborting: no data points match all criteria!")
+  if len(idxs[0]) == 0: raise DatasetError("Aborting: no data points match all criteria!")
   # construct axis indices for each dataset (need to remember to move shortest axis back in line)
-  idxs = [[] for ds in datasets] # create unique empty lists
-  for itpl in itpls:
-    for i,idx in enumerate(itpl): idxs[i].append(idx)
   idxs.insert(imaster,idxs.pop(0)) # move first element back in line (where shortest axis was)
   idxs = [np.asarray(idxlst, dtype='int') for idxlst in idxs]      
   # slice datasets using only positive results  
@@ -617,6 +672,245 @@ def selectElements(datasets, axis, testFct=None, master=None, linplace=False, la
   return datasets
 
 
+## station meta data index for vectorized station selection
+
+class StationIndex(object):
+  ''' 
+    A class that holds columnar arrays of station meta data (all variables that only have a station axis) 
+    and provides vectorized predicates, which return boolean masks along the station axis; stations are 
+    also sorted by latitude, which serves as a simple spatial index for box and radius queries. 
+  '''
+  axis    = '' # name of station axis
+  coord   = None # station axis coordinates
+  columns = None # dictionary of station meta data arrays
+  latname = 'stn_lat' # name of latitude column
+  lonname = 'stn_lon' # name of longitude column
+  _latsort   = None # station order sorted by latitude (None, if there is no latitude column)
+  _latsorted = None # sorted latitudes
+  
+  def __init__(self, columns, coord, axis='station', latname='stn_lat', lonname='stn_lon'):
+    ''' initialize index from columns (dictionary of arrays) and station coordinates '''
+    if not isinstance(columns,dict): raise TypeError(columns)
+    coord = np.asarray(coord)
+    if not all(col.shape == coord.shape for col in columns.itervalues()): raise AxisError(axis)
+    self.axis = axis; self.coord = coord; self.columns = columns
+    self.latname = latname; self.lonname = lonname
+    # spatial index: station order sorted by latitude
+    if latname in columns:
+      self._latsort = np.argsort(columns[latname], kind='mergesort')
+      self._latsorted = columns[latname][self._latsort]
+    
+  @classmethod
+  def fromDataset(cls, dataset, axis='station', **kwargs):
+    ''' construct station index from all variables in dataset that only have a station axis '''
+    if not isinstance(dataset,Dataset): raise TypeError(dataset)
+    ax = dataset.getAxis(axis)
+    columns = dict()
+    for var in dataset.variables.itervalues():
+      if var.ndim == 1 and var.hasAxis(axis) and var.name != ax.name:
+        data = var.getArray(unmask=True, fillValue=np.NaN) if np.issubdtype(var.dtype,np.inexact) else var.getArray()
+        if data.dtype.kind == 'S': data = np.char.strip(data) # names are padded
+        columns[var.name] = np.asarray(data)
+    return cls(columns=columns, coord=ax.coord, axis=ax.name, **kwargs)
+  
+  def __len__(self): return len(self.coord)
+  
+  def __contains__(self, name): return name in self.columns
+  
+  def _missing(self, name, lcheckVar=True):
+    ''' handle missing columns: raise error or select everything '''
+    if lcheckVar: raise DatasetError("Station meta data '{:s}' not found in index.".format(name))
+    return np.ones(len(self), dtype=np.bool)
+  
+  def isin(self, name, values, lcheckVar=True):
+    ''' select stations where the meta data value is in values '''
+    if name not in self.columns: return self._missing(name, lcheckVar=lcheckVar)
+    if isinstance(values,basestring) or np.isscalar(values): values = (values,)
+    return np.in1d(self.columns[name], np.asarray(values))
+  
+  def between(self, name, lower=None, upper=None, labs=False, lcheckVar=True):
+    ''' select stations where lower <= value <= upper (bounds are optional; labs: use absolute value) '''
+    if name not in self.columns: return self._missing(name, lcheckVar=lcheckVar)
+    data = np.abs(self.columns[name]) if labs else self.columns[name]
+    mask = np.ones(len(self), dtype=np.bool)
+    with np.errstate(invalid='ignore'): # NaN never matches
+      if lower is not None: mask &= data >= lower
+      if upper is not None: mask &= data <= upper
+    return mask
+  
+  def _checkCoords(self, *names):
+    ''' spatial queries require station coordinates; raise AxisError, if a coordinate column is missing '''
+    for name in names:
+      if name not in self.columns: 
+        raise AxisError("Station coordinate '{:s}' not found in index (required for spatial queries).".format(name))
+  
+  def box(self, lat=None, lon=None):
+    ''' select stations in a lat/lon box (lat and lon are (min,max) tuples) '''
+    mask = np.zeros(len(self), dtype=np.bool)
+    if lat is None: mask[:] = True
+    else:
+      self._checkCoords(self.latname)
+      # use sorted latitudes to select band
+      i0 = np.searchsorted(self._latsorted, lat[0], side='left')
+      i1 = np.searchsorted(self._latsorted, lat[1], side='right')
+      mask[self._latsort[i0:i1]] = True
+    if lon is not None: 
+      self._checkCoords(self.lonname)
+      mask &= self.between(self.lonname, lower=lon[0], upper=lon[1])
+    return mask
+  
+  def radius(self, lat, lon, radius):
+    ''' select stations within a great-circle distance (radius in km) from a point (lat/lon in degrees) '''
+    self._checkCoords(self.latname, self.lonname)
+    dlat = np.degrees(radius/6371.) # radius of the earth (in km)
+    # pre-select latitude band using sorted latitudes
+    i0 = np.searchsorted(self._latsorted, lat-dlat, side='left')
+    i1 = np.searchsorted(self._latsorted, lat+dlat, side='right')
+    idx = self._latsort[i0:i1]
+    # compute great-circle distance (haversine formula) only for candidates
+    lat1 = np.radians(lat); lat2 = np.radians(self.columns[self.latname][idx])
+    dlon = np.radians(self.columns[self.lonname][idx] - lon)
+    a = np.sin((lat2-lat1)/2.)**2 + np.cos(lat1)*np.cos(lat2)*np.sin(dlon/2.)**2
+    dist = 2.*6371.*np.arcsin(np.sqrt(np.minimum(a,1.)))
+    mask = np.zeros(len(self), dtype=np.bool)
+    mask[idx[dist <= radius]] = True
+    return mask
+  
+  def where(self, mask):
+    ''' return station indices for a boolean mask '''
+    return np.flatnonzero(mask)
+  
+  def save(self, filename, **kwargs):
+    ''' save station index in a NumPy archive (additional keyword arguments are also stored) '''
+    columns = {'col_'+name:col for name,col in self.columns.iteritems()}
+    np.savez(filename, coord=self.coord, axis=np.array(self.axis), latname=np.array(self.latname), 
+             lonname=np.array(self.lonname), **dict(columns, **kwargs))
+    
+  @classmethod
+  def load(cls, filename):
+    ''' load station index from NumPy archive; returns index and additional keyword arguments '''
+    npz = np.load(filename)
+    columns = {key[4:]:npz[key] for key in npz.files if key[:4] == 'col_'}
+    kwargs = {key:npz[key] for key in npz.files if key[:4] != 'col_' and key not in ('coord','axis','latname','lonname')}
+    index = cls(columns=columns, coord=npz['coord'], axis=str(npz['axis']), latname=str(npz['latname']), 
+                lonname=str(npz['lonname']))
+    npz.close()
+    return index, kwargs
+
+# in-memory cache for station indices (only the most recently used indices are kept)
+station_indices = OrderedDict()
+max_station_indices = 32
+# folder for station index cache files (None: indices are only cached in memory)
+station_index_folder = None
+
+def getStationIndex(dataset, axis='station', lcache=True, cache_folder=None):
+  ''' return a StationIndex for dataset; indices of NetCDF datasets are cached in memory and, if a cache folder 
+      is given (or station_index_folder is set), in a file; cached indices are only used, if the size and 
+      modification time of the NetCDF file, the station axis and the meta data match '''
+  if not isinstance(dataset,Dataset): raise TypeError(dataset)
+  ax = dataset.getAxis(axis)
+  varnames = set(var.name for var in dataset.variables.itervalues() 
+                 if var.ndim == 1 and var.hasAxis(axis) and var.name != ax.name)
+  ncfile = None
+  if lcache and isinstance(dataset,DatasetNetCDF) and len(dataset.filelist) == 1: 
+    ncfile = os.path.abspath(dataset.filelist[0])
+    if os.path.exists(ncfile): 
+      stat = os.stat(ncfile); key = (ncfile, stat.st_size, stat.st_mtime, ax.name)
+    else: ncfile = None
+  def isValid(index):
+    return ( len(index) == len(ax) and np.array_equal(index.coord, ax.coord) and 
+             varnames.issubset(index.columns.iterkeys()) )
+  if ncfile is None: return StationIndex.fromDataset(dataset, axis=axis)
+  # check in-memory cache
+  index = station_indices.pop(key, None) # re-inserted below (most recently used)
+  if index is not None and not isValid(index): index = None
+  # check cache file
+  if cache_folder is None: cache_folder = station_index_folder
+  idxfile = None
+  if index is None and cache_folder:
+    idxfile = '{:s}/{:s}_{:s}_{:s}_index.npz'.format(cache_folder, os.path.splitext(os.path.basename(ncfile))[0], 
+                                                     ax.name, hashlib.md5(ncfile).hexdigest()[:12])
+    if os.path.exists(idxfile):
+      try:
+        index, kwargs = StationIndex.load(idxfile)
+        if str(kwargs.get('key',None)) != repr(key) or not isValid(index): index = None
+      except (IOError, KeyError, ValueError): index = None # just create new index
+  if index is None:
+    index = StationIndex.fromDataset(dataset, axis=axis)
+    if idxfile:
+      try: 
+        if not os.path.exists(cache_folder): os.makedirs(cache_folder)
+        index.save(idxfile, key=np.array(repr(key)))
+      except (IOError, OSError): pass # e.g. read-only file system
+  station_indices[key] = index
+  while len(station_indices) > max_station_indices: station_indices.popitem(last=False) # least recently used
+  return index
+
+def applyStationIndex(conditions, dataset, axis):
+  ''' apply a list of vectorized conditions (functions that take a StationIndex and return a boolean mask) 
+      to a dataset and return the combined mask (all conditions have to be met) '''
+  index = getStationIndex(dataset, axis=axis)
+  mask = np.ones(len(index), dtype=np.bool)
+  for condition in conditions: mask &= condition(index)
+  return mask
+
+
+## cache for parsed station records (from ASCII files)
+
+def getRecordCacheKey(record, version=0, atts=()):
+  ''' return a string that identifies the source file of a station record (path, size, and modification time), 
+      the parser version and the parser settings (record attributes in atts) '''
+  stat = os.stat(record.filename)
+  key = [('filename',os.path.abspath(record.filename)), ('size',stat.st_size), ('mtime',stat.st_mtime), 
+         ('version',version), ('variable',record.variable)]
+  key += [(att,getattr(record,att)) for att in atts]
+  return repr(key)
+
+def loadCachedRecord(record, cache_folder=None, lflags=False, version=0, atts=(), meta=()):
+  ''' load a parsed station record from cache, if the source file has not changed; otherwise parse the station 
+      file (using record.parseRecord) and save the parsed record in the cache (no cache is used, if cache_folder 
+      is None); meta are (integer) record attributes that are set by the parser and restored from the cache '''
+  if cache_folder is None: return record.parseRecord(lflags=lflags)
+  key = getRecordCacheKey(record, version=version, atts=atts)
+  # N.B.: the cache file name only depends on source file and variable, so that outdated entries are replaced
+  cachefile = '{:s}_{:s}'.format(os.path.abspath(record.filename), record.variable)
+  cachefile = '{:s}/{:s}_{:s}.npz'.format(cache_folder, os.path.basename(record.filename).split('.')[0], 
+                                          hashlib.md5(cachefile).hexdigest()[:12])
+  data = None
+  if os.path.exists(cachefile):
+    try:
+      npz = np.load(cachefile)
+      if str(npz['key']) == key:
+        data = npz['data']; flags = npz['flags']
+        for att,value in zip(meta,npz['meta']): setattr(record, att, int(value))
+      npz.close()
+    except (IOError, KeyError, ValueError): data = None # invalid cache file; just parse again
+  if data is None:
+    data, flags = record.parseRecord(lflags=True)
+    # N.B.: several worker processes may try to create the cache folder at the same time
+    try: os.makedirs(cache_folder)
+    except OSError as err: 
+      if err.errno != errno.EEXIST: raise
+    # write to temporary file first and rename, so that cache files are always complete
+    tmpfile = '{:s}.{:d}.tmp.npz'.format(cachefile[:-4], os.getpid())
+    np.savez(tmpfile, key=np.array(key), data=data, flags=flags, meta=np.array([getattr(record,att) for att in meta]))
+    os.rename(tmpfile, cachefile)
+  # return array
+  if lflags: return data, flags
+  else: return data
+
+## helper functions for parallel ingestion of station records (used by EC and GHCN)
+# N.B.: defined at module level to facilitate pickling
+def checkStationHeader(station):
+  ''' open station file and validate header (worker function for StationRecords) '''
+  station.checkHeader()
+def parseStationRecord(station, vardef=None, cache_folder=None):
+  ''' parse station record (or load from cache) and convert units (worker function for StationRecords) '''
+  data = station.loadRecord(cache_folder=cache_folder)
+  if vardef is not None: data = vardef.convert(data) # apply conversion function
+  return data
+
+
 # a function to load station data
 def loadEnsemble(names=None, name=None, title=None, varlist=None, aggregation=None, season=None, prov=None, 
                  shape=None, station=None, slices=None, obsslices=None, years=None, period=None, obs_period=None, 
@@ -11,8 +11,12 @@ import numpy as np
 import numpy.ma as ma # masked arrays
 from numpy.lib.stride_tricks import as_strided
 import scipy.stats as ss
-from scipy.interpolate import griddata
+from scipy.interpolate import griddata, CloughTocher2DInterpolator
+from scipy.spatial import Delaunay, cKDTree
+import scipy.sparse as sp
 import numbers
+import hashlib
+from collections import OrderedDict
 import functools
 import gc # garbage collection
 from warnings import warn
@@ -313,6 +317,89 @@ class ApplyTestOverList(object):
     return functools.partial(self.__call__, instance) # but using 'partial' is simpler
 
 
+## reusable interpolation from scattered points to a regular grid (used by gridVar and gridDataset)
+
+class PointGridder(object):
+  ''' 
+    Interpolation of scattered point data to a regular grid, which only triangulates the point set once 
+    (with the same results as scipy.interpolate.griddata); for linear and nearest-neighbour interpolation 
+    the interpolation weights are stored as a sparse matrix and applied to all slices at once, while cubic 
+    interpolation reuses the triangulation (data have to be 2D). 
+  '''
+  
+  def __init__(self, points, xi, method='cubic', rescale=False):
+    ''' points is a tuple of point coordinate vectors and xi a tuple of grid coordinate arrays (which 
+        are broadcast against each other, to define the shape of the grid) '''
+    points = [np.asarray(p) for p in points] # N.B.: masks are ignored (as in griddata)
+    xi = np.broadcast_arrays(*[np.asarray(x) for x in xi])
+    self.shape = xi[0].shape; self.method = method; self.rescale = rescale
+    self.npts = len(points[0]); self.ndim = ndim = len(points)
+    if ndim == 1: # N.B.: for 1D data griddata uses interp1d
+      self.points = tuple(points); self.xi = tuple(xi); return
+    points = np.column_stack(points).astype(np.float64)
+    xi = np.column_stack([x.ravel() for x in xi]).astype(np.float64)
+    if rescale: # scale to unit cube, same as scipy.interpolate
+      offset = points.mean(axis=0); scale = points.ptp(axis=0); scale[~(scale > 0)] = 1.
+      points = (points - offset) / scale; xi = (xi - offset) / scale
+    self.outside = None
+    if method == 'nearest':
+      idx = cKDTree(points).query(xi)[1]
+      self.weights = sp.csr_matrix((np.ones(len(xi)), (np.arange(len(xi)), idx)), shape=(len(xi),self.npts))
+    elif method == 'linear':
+      tri = Delaunay(points)
+      simplex = tri.find_simplex(xi); inside = simplex >= 0
+      # barycentric coordinates of grid points in their enclosing simplex
+      transform = tri.transform[simplex[inside]]
+      bary = np.einsum('ijk,ik->ij', transform[:,:ndim,:], xi[inside] - transform[:,ndim,:])
+      bary = np.column_stack((bary, 1. - bary.sum(axis=1)))
+      rows = np.repeat(np.nonzero(inside)[0], ndim+1)
+      cols = tri.simplices[simplex[inside]].ravel()
+      self.weights = sp.csr_matrix((bary.ravel(), (rows, cols)), shape=(len(xi),self.npts))
+      self.outside = ~inside
+    elif method == 'cubic' and ndim == 2:
+      self.tri = Delaunay(points); self.xi = xi
+    else: 
+      raise ValueError("Unknown interpolation method '{}' for {:d} dimensional data".format(method,ndim))
+    
+  def __call__(self, data, fill_value=np.NaN):
+    ''' interpolate data with points along the last axis; other axes are preserved and the point axis is 
+        replaced by the grid axes; grid points outside of the convex hull are set to fill_value '''
+    data = np.asarray(data)
+    if data.shape[-1] != self.npts: raise AxisError(data.shape)
+    rshp = data.shape[:-1]; values = data.reshape((-1,self.npts))
+    if self.ndim == 1:
+      grid_data = np.stack([griddata(self.points, v, self.xi, method=self.method, fill_value=fill_value, 
+                                     rescale=self.rescale) for v in values])
+      return grid_data.reshape(rshp+self.shape)
+    if self.method == 'cubic':
+      interp = CloughTocher2DInterpolator(self.tri, values.T, fill_value=fill_value)
+      grid_data = interp(self.xi) # N.B.: gradients are estimated for all slices at once
+    else:
+      grid_data = self.weights.dot(values.T) # sparse matrix product
+      if self.outside is not None: grid_data[self.outside,:] = fill_value
+    return grid_data.T.reshape(rshp+self.shape)
+
+_gridder_cache = OrderedDict() # recently used PointGridder instances
+max_gridder_cache = 8 # number of PointGridder instances that are kept
+
+def getPointGridder(points, xi, method='cubic', rescale=False, lcache=True):
+  ''' return a PointGridder instance for the given points, grid and method; if lcache is True, instances 
+      are cached, so that repeated interpolation between the same point set and grid is fast '''
+  if not lcache: return PointGridder(points, xi, method=method, rescale=rescale)
+  sha1 = hashlib.sha1('{}:{}:{:d}:{:d};'.format(method, bool(rescale), len(points), len(xi)))
+  for array in tuple(points) + tuple(xi):
+    array = np.ascontiguousarray(array, dtype=np.float64)
+    sha1.update(str(array.shape)); sha1.update(array)
+  key = sha1.hexdigest()
+  if key in _gridder_cache: 
+    gridder = _gridder_cache.pop(key) # will be reinserted as most recent
+  else: 
+    gridder = PointGridder(points, xi, method=method, rescale=rescale)
+    while len(_gridder_cache) >= max_gridder_cache: _gridder_cache.popitem(last=False) # oldest
+  _gridder_cache[key] = gridder
+  return gridder
+
+
 ## Variable class and derivatives 
 
 class Variable(object):
@@ -2194,8 +2281,9 @@ class Variable(object):
     return var
   
   def gridVar(self, point_axis=None, coord_vars=None, grid_axes=None, method='cubic', fill_value=np.NaN, 
-              rescale=None, asVar=True, lcheckAxis=True, lcheckVar=True):
-    ''' interpolate a one-dimensional point vector to a regular 2D grid '''
+              rescale=None, asVar=True, lcheckAxis=True, lcheckVar=True, lcache=True):
+    ''' interpolate a one-dimensional point vector to a regular 2D grid; the triangulation and interpolation 
+        weights are computed once for all slices and cached for other Variables (see getPointGridder) '''
     # some eligibility checks
     if self.dtype.kind in ('S',): 
         if lcheckVar: 
@@ -2224,21 +2312,13 @@ class Variable(object):
         gshp.append( len(gax) )
     cvec = tuple(cvec); gvec = tuple(gvec); gshp = tuple(gshp)    
     # interpolate to regular grid
+    gridder = getPointGridder(cvec, gvec, method=method, rescale=rescale, lcache=lcache)
     data = self.data_array
-    if data.ndim == 1:
-        grid_data = griddata(cvec, data, gvec, method=method, fill_value=fill_value, rescale=rescale)
-        assert grid_data.shape == gshp 
-    else:
+    if data.ndim > 1:
         data = np.moveaxis(data, self.axisIndex(pax,), -1) # move point dimension to the back
-        assert data.shape[-1] == pe
-        rshp = data.shape[:-1] # old shape of remaining dimensions
-        re = data.size/pe
-        data = data.reshape((re,pe)) # flatten other dimensions
-        # loop over dimensions
-        grid_data = np.zeros((re,)+gshp) # allocate new array
-        for i in range(re):
-            grid_data[i,:] = griddata(cvec, data[i,:], gvec, method=method, fill_value=fill_value, rescale=rescale) 
-        grid_data = grid_data.reshape(rshp+gshp) # return other dimensions to old shape
+    assert data.shape[-1] == pe
+    grid_data = gridder(data, fill_value=fill_value) # all other dimensions at once
+    assert grid_data.shape == data.shape[:-1]+gshp 
     # create new axes tuple and new variable
     if asVar: 
       axes = tuple([ax for ax in self.axes if ax.name != pax.name]) + grid_axes
@@ -3296,8 +3376,9 @@ class Dataset(object):
       var.load(fillValue=fillValue, **kwargs)
       
   def gridDataset(self, grid_axes=None, dsatts=None, method='cubic', fill_value=np.NaN, rescale=None,
-                  asVar=True, lcheckAxis=True, lcheckVar=True, deepcopy=False, coord_map=None):
-    ''' a wrapper for gridVar, which infers the point Axis and axes variables from the Dataset '''
+                  asVar=True, lcheckAxis=True, lcheckVar=True, deepcopy=False, coord_map=None, lcache=True):
+    ''' a wrapper for gridVar, which infers the point Axis and axes variables from the Dataset; all 
+        Variables share the same triangulation and interpolation weights '''
     # check axes
     point_axis = None; coord_vars = []
     for ax in grid_axes:
@@ -3318,7 +3399,8 @@ class Dataset(object):
             newvars[varname] = var.gridVar(point_axis=point_axis, coord_vars=tuple(coord_vars), 
                                            grid_axes=grid_axes, 
                                            method=method, fill_value=fill_value, rescale=rescale, 
-                                           asVar=asVar, lcheckAxis=lcheckAxis, lcheckVar=lcheckVar)
+                                           asVar=asVar, lcheckAxis=lcheckAxis, lcheckVar=lcheckVar, 
+                                           lcache=lcache)
         else:
             newvars[varname] = var.copy(deepcopy=deepcopy) # variables that are just copies
     # create new dataset with regridded and old variables
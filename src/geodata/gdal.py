@@ -15,6 +15,8 @@ import numpy.ma as ma
 from collections import OrderedDict
 import types  # needed to bind functions to objects
 import os, gzip # griddef pickles compress well
+import multiprocessing # parallel export of raster files
+from itertools import product
 try: import cPickle as pickle
 except: import pickle
 
@@ -103,8 +105,7 @@ class GridDefinition(object):
   geotransform = None  # 6-element vector defining a GDAL GeoTransform
   size = None  # tuple, defining the size of the x/lon and y/lat axes
   geolocator = False # whether or not geolocator arrays are available
-  lon2D = None # 2D field of longitude at each grid point
-  lat2D = None # 2D field of latitude at each grid point
+  _geolocators = None # holder for 2D fields of longitude and latitude (computed on first access, shared by copies)
       
   def __init__(self, name='', projection=None, geotransform=None, size=None, xlon=None, ylat=None, 
                lwrap360=None, geolocator=True, convention=None):
@@ -177,33 +178,72 @@ class GridDefinition(object):
       # N.B.: for some reason GDAL is very sensitive to type and does not understand numpy types
       dlon = ( urx - llx ) / ( xe - xs ); dlat = ( ury - lly ) / ( ye - ys )       
       self.scale = ( dlon + dlat ) / 2
-      # add geolocator arrays
-      if geolocator:
-        x2D, y2D = np.meshgrid(xlon.coord, ylat.coord) # if we have x/y arrays
-        xx = x2D.flatten().astype(np.float64); yy = y2D.flatten().astype(np.float64)
-        lon2D = np.zeros_like(xx, dtype=np.float32); lat2D = np.zeros_like(yy, dtype=np.float32) 
-        #for i in xrange(xx.size):
-        #  (lon2D[i],lat2D[i],tmp) = tx.TransformPoint(xx[i],yy[i])
-        # N.B.: apparently TransformPoints is not much faster than a simple loop... 
-        point_array = np.concatenate((x2D.reshape((x2D.size,1)),y2D.reshape((y2D.size,1))), axis=1)
-        #print point_array.shape; print point_array[:3,:]
-        point_array = np.asarray(tx.TransformPoints(point_array.astype(np.float64)), dtype=np.float32)
-        #print tmp.shape; print tmp[:3,:] # (lon2D,lat2D,zzz)
-        lon2D[:] = point_array[:,0]; lat2D[:] = point_array[:,1] 
-        lon2D = lon2D.reshape(x2D.shape); lat2D = lat2D.reshape(y2D.shape)
     else:
       self.scale = ( geotransform[1] + geotransform[5] ) / 2 # pretty straight forward
-      if geolocator:
-        lon2D, lat2D = np.meshgrid(xlon.coord, ylat.coord) # if we have x/y arrays
-        lon2D = lon2D.astype(np.float32); lat2D = lat2D.astype(np.float32) # astype always returns a newly allocated copy
     # set geotransform/axes attributes
     self.xlon = xlon
     self.ylat = ylat
     self.geotransform = geotransform
     self.size = size
     self.geolocator = geolocator
-    if geolocator: self.lon2D = lon2D; self.lat2D = lat2D
-    else: self.lon2D = None; self.lat2D = None
+    self._geolocators = dict() # N.B.: geolocator arrays are computed on first access
+    
+  def computeGeolocators(self):
+    ''' compute 2D geolocator arrays (longitude and latitude at each grid point); for projected grids, all 
+        grid points are transformed with a single call to TransformPoints '''
+    x2D, y2D = np.meshgrid(self.xlon.coord, self.ylat.coord) # if we have x/y arrays
+    if self.isProjected:
+      latlon = osr.SpatialReference() 
+      latlon.SetWellKnownGeogCS('WGS84') # a normal lat/lon coordinate system
+      tx = osr.CoordinateTransformation(self.projection,latlon)      
+      point_array = np.column_stack((x2D.ravel(),y2D.ravel())).astype(np.float64)
+      # N.B.: for some reason GDAL is very sensitive to type and does not understand numpy types
+      point_array = np.asarray(tx.TransformPoints(point_array), dtype=np.float32) # (lon2D,lat2D,zzz)
+      lon2D = np.ascontiguousarray(point_array[:,0]).reshape(x2D.shape)
+      lat2D = np.ascontiguousarray(point_array[:,1]).reshape(y2D.shape)
+    else:
+      lon2D = x2D.astype(np.float32); lat2D = y2D.astype(np.float32) # astype always returns a newly allocated copy
+    return lon2D, lat2D
+  
+  def getGeolocator(self, name):
+    ''' return a geolocator array ('lon2D' or 'lat2D'); the arrays are computed once and stored in a holder 
+        that is shared by all copies of this instance (None, if there are no geolocators) '''
+    if self._geolocators is None: self._geolocators = dict()
+    if name not in self._geolocators and self.geolocator: 
+      self._geolocators['lon2D'], self._geolocators['lat2D'] = self.computeGeolocators()
+    return self._geolocators.get(name,None)
+  
+  def setGeolocator(self, name, array):
+    ''' replace a geolocator array; N.B.: the holder is replaced as well, so that copies are not affected '''
+    geolocators = dict() if self._geolocators is None else self._geolocators.copy()
+    if array is None: geolocators.pop(name,None)
+    else: geolocators[name] = array
+    self._geolocators = geolocators
+  
+  @property
+  def lon2D(self):
+    ''' 2D field of longitude at each grid point (None, if there are no geolocators) '''
+    return self.getGeolocator('lon2D')
+  @lon2D.setter
+  def lon2D(self, lon2D):
+    self.setGeolocator('lon2D', lon2D)
+    
+  @property
+  def lat2D(self):
+    ''' 2D field of latitude at each grid point (None, if there are no geolocators) '''
+    return self.getGeolocator('lat2D')
+  @lat2D.setter
+  def lat2D(self, lat2D):
+    self.setGeolocator('lat2D', lat2D)
+    
+  def copy(self):
+    ''' return a shallow copy with new map axes; the projection, geotransform and geolocator arrays are shared 
+        (also arrays that are computed later), but the axes can be added to a different Dataset (Dataset.addAxis 
+        links the axis to the dataset) '''
+    griddef = self.__class__.__new__(self.__class__)
+    griddef.__dict__.update(self.__dict__)
+    griddef.xlon = self.xlon.copy(); griddef.ylat = self.ylat.copy()
+    return griddef
     
   def getProjection(self):
     ''' Convenience method that emulates behavior of the function of the same name '''
@@ -233,6 +273,8 @@ class GridDefinition(object):
     pickle['_xlon'] = len(self.xlon) 
     pickle['_ylat'] = len(self.ylat)
     del pickle['geotransform'], pickle['isProjected'], pickle['xlon'], pickle['ylat']
+    # geolocator arrays are large and can be recomputed on demand
+    pickle.pop('_geolocators',None)
     # return instance dict to pickle
     return pickle
   
@@ -250,6 +292,11 @@ class GridDefinition(object):
                          projected=self.isProjected)
     self.xlon = xlon; self.ylat = ylat
     del pickle['_geotransform'], pickle['_isProjected'], pickle['_xlon'], pickle['_ylat']
+    # geolocator arrays from old pickles can still be used
+    self._geolocators = dict()
+    for name in ('lon2D','lat2D'):
+      array = pickle.pop(name, pickle.pop('_'+name, None))
+      if array is not None: self._geolocators[name] = array
     # update instance dict with pickle dict
     self.__dict__.update(pickle)
     
@@ -264,10 +311,18 @@ def getGridDef(var):
 
 ## gid pickle functions
 griddef_pickle = '{0:s}_griddef.pickle.gz' # file pattern for pickled grids
+# process-level registry of loaded grid definitions: (grid, res, filepath) -> (file stamp, GridDefinition)
+_griddef_registry = dict()
+
+def clearGridDefRegistry():
+  ''' remove all grid definitions from the process-level registry (see loadPickledGridDef) '''
+  _griddef_registry.clear()
 
 # function to load pickled grid definitions
-def loadPickledGridDef(grid=None, res=None, filename=None, folder=None, check=True, lfilepath=False, lgzip=None):
-  ''' function to load pickled datasets '''
+def loadPickledGridDef(grid=None, res=None, filename=None, folder=None, check=True, lfilepath=False, lgzip=None, 
+                       lcache=True):
+  ''' function to load pickled datasets; if lcache is True, grid definitions are only unpickled once per 
+      process (and when the pickle file changes); callers receive copies with their own map axes '''
   if grid is not None and not isinstance(grid,basestring): raise TypeError(grid)
   if res is not None and not isinstance(res,basestring): raise TypeError(res)
   if filename is not None and not isinstance(filename,basestring): raise TypeError(filename)
@@ -291,10 +346,19 @@ def loadPickledGridDef(grid=None, res=None, filename=None, folder=None, check=Tr
       raise ValueError("The file extension '.gz' suggests a compressed pickle file, yet lgzip=False...")
   # load pickle
   if os.path.exists(filepath):
-      # open file and load pickle
-      op = gzip.open if lgzip else open
-      with op(filepath, 'r') as filehandle:
-          griddef = pickle.load(filehandle)
+      key = (grid, res, os.path.abspath(filepath))
+      stamp = (os.path.getmtime(filepath), os.path.getsize(filepath)) # reload, if the pickle changed
+      if lcache and key in _griddef_registry and _griddef_registry[key][0] == stamp:
+          griddef = _griddef_registry[key][1].copy() # copy of registered instance
+      else:
+          # open file and load pickle
+          op = gzip.open if lgzip else open
+          with op(filepath, 'r') as filehandle:
+              griddef = pickle.load(filehandle)
+          if lcache: 
+              _griddef_registry[key] = (stamp, griddef)
+              griddef = griddef.copy()
+          # N.B.: the registered instance is never handed out, because the axes will be linked to datasets
   elif check: 
       raise IOError, "GridDefinition pickle file '{0:s}' not found!".format(filepath) 
   else:
@@ -321,6 +385,8 @@ def pickleGridDef(griddef=None, folder=None, filename=None, loverwrite=True, lfe
     raise ValueError("The file extension '.gz' suggests a compressed pickle file, yet lgzip=False")
   # open file and save pickle
   if os.path.exists(filepath): os.remove(filepath)
+  for key in [key for key in _griddef_registry if key[2] == os.path.abspath(filepath)]: 
+    del _griddef_registry[key] # outdated
   op = gzip.open if lgzip else open
   with op(filepath, 'wb') as filehandle:
       pickle.dump(griddef, filehandle)
@@ -641,58 +707,25 @@ def addGDALtoVar(var, griddef=None, projection=None, geotransform=None, gridfold
           if self.fillValue is not None: fillValue = self.fillValue  # use default 
           elif self.dtype is not None: fillValue = ma.default_fill_value(self.dtype)
           else: raise GDALError, "Need Variable with valid dtype to pre-allocate GDAL array!"
-        if noDataValue is None: noDataValue = fillValue
         if load:
-          if not self.data: self.load()
-          if not self.data: raise DataError, 'Need data in Variable instance in order to load data into GDAL dataset!'
-          data = self.getArray(unmask=True, fillValue=fillValue)  # get unmasked data
-          data = data.reshape(self.bands, self.mapSize[0], self.mapSize[1])  # reshape to fit bands
+          # N.B.: to insure correct wrapping, geographic coordinate systems with longitudes reanging from 0 to 360 
+          #       can optionally be shifted back by 180, to conform to GDAL conventions (the shift will only 
+          #       affect the GDAL Dataset, not the actual Variable); GDAL enforces the shape (band, lat, lon)
+          data, geotransform, noDataValue = getRasterArray(self, wrap360=wrap360, fillValue=fillValue, 
+                                                           noDataValue=noDataValue, lupperleft=lupperleft, 
+                                                           lfillNaN=lfillNaN)
           if lperi: 
-            tmp = np.zeros((self.bands, self.mapSize[0], self.mapSize[1]+1))
+            tmp = np.zeros((self.bands, self.mapSize[0], self.mapSize[1]+1), dtype=data.dtype)
             tmp[:,:,0:-1] = data; tmp[:,:,-1] = data[:,:,0]
             data = tmp
-        elif allocate: 
-          data = np.zeros((self.bands,) + self.mapSize, dtype=self.dtype) + fillValue
-        # if we have a fillValue, replace NaN's with the fillValues
-        if lfillNaN and fillValue is not None and np.issubdtype(data.dtype, np.inexact): 
-          data[np.isnan(data)] = fillValue
-        # to insure correct wrapping, geographic coordinate systems with longitudes reanging 
-        # from 0 to 360 can optionally be shifted back by 180, to conform to GDAL conventions 
-        # (the shift will only affect the GDAL Dataset, not the actual Variable) 
-        if wrap360:
-          geotransform = list(self.geotransform)
-          shift = int( 180. / geotransform[1] )
-          assert len(self.xlon) == data.shape[2], "Make sure the X-Axis is the last one!"
-          # N.B.: GDAL enforces the following shape: (band, lat, lon)
-          if load: data = np.roll(data, shift, axis=2) # shift data along the x-axis
-          geotransform[0] = geotransform[0] - shift*geotransform[1] # record shift in geotransform 
-        else: geotransform = self.geotransform
-        # enforce orientation
-        if lupperleft and geotransform[5] > 0:
-          # use upper-left corner as reference; default in GDAL applications and requires dy < 0
-          geotransform = (geotransform[0],geotransform[1],geotransform[2],
-                          geotransform[3] + self.mapSize[0]*geotransform[5], # shift North
-                          geotransform[4], -1*geotransform[5]) # make dy < 0
-          data = flip(data, axis=-2) # flip y-axis
-        elif not lupperleft and geotransform[5] < 0:
-          # use lower-left corner as reference; default in GeoPy and works, if dy > 0
-          geotransform = (geotransform[0],geotransform[1],geotransform[2],
-                          geotransform[3] + self.mapSize[0]*geotransform[5], # shift South, dy < 0 !!!
-                          geotransform[4], -1*geotransform[5]) # make dy > 0
-          data = flip(data, axis=-2) # flip y-axis
-        # determine GDAL data type        
-        if self.dtype == 'float32': gdt = gdal.GDT_Float32
-        elif self.dtype == 'float64': gdt = gdal.GDT_Float64
-        elif self.dtype == 'int16': gdt = gdal.GDT_Int16
-        elif self.dtype == 'int32': gdt = gdal.GDT_Int32
-        elif np.issubdtype(self.dtype,(float,np.inexact)):
-          data = data.astype('f4'); gdt = gdal.GDT_Float32          
-        elif np.issubdtype(self.dtype,(int,np.integer)):
-          data = data.astype('i2'); gdt = gdal.GDT_Int16  
-        elif np.issubdtype(self.dtype,(bool,np.bool)):
-          data = data.astype('i2'); gdt = gdal.GDT_Int16  
-        else: raise TypeError, 'Cannot translate numpy data type into GDAL data type!'
-        #print self.name, self.dtype, data.dtype
+        else:
+          geotransform, shift, lflip = getRasterGeotransform(self, wrap360=wrap360, lupperleft=lupperleft)
+          if allocate: data = np.zeros((self.bands,) + self.mapSize, dtype=getRasterDtype(self.dtype)) + fillValue
+          else: data = None
+          if noDataValue is None: noDataValue = fillValue
+          if not self.masked: noDataValue = None
+        # determine GDAL data type
+        gdt = gdal_datatypes[getRasterDtype(self.dtype if data is None else data.dtype).name]
         # create GDAL dataset 
         xe = len(self.xlon); ye = len(self.ylat) 
         if lperi: dataset = ramdrv.Create(self.name, int(xe)+1, int(ye), int(self.bands), int(gdt))
@@ -705,7 +738,7 @@ def addGDALtoVar(var, griddef=None, projection=None, geotransform=None, gridfold
           # assign data
           for i in xrange(self.bands):
             dataset.GetRasterBand(i + 1).WriteArray(data[i, :, :])
-            if self.masked: dataset.GetRasterBand(i + 1).SetNoDataValue(float(noDataValue))
+            if noDataValue is not None: dataset.GetRasterBand(i + 1).SetNoDataValue(float(noDataValue))
       else: dataset = None
       # return dataset
       return dataset
@@ -907,15 +940,19 @@ def addGDALtoVar(var, griddef=None, projection=None, geotransform=None, gridfold
     # add new method to object
     var.mapMean = types.MethodType(mapMean, var) 
     
-    # save variable as Arc/Info ASCII Grid / ASCII raster file using GDAL
+    # save variable as Arc/Info ASCII Grid / ASCII raster file (natively or using GDAL)
     def ASCII_raster(self, prefix=None, folder=None, ext='.asc', filepath=None, wrap360=False, 
-                     fillValue=None, noDataValue=None, lcoord=False, lfortran=True, formatter=None):
+                     fillValue=None, noDataValue=None, lcoord=False, lfortran=True, formatter=None, 
+                     lgzip=False, lnative=True, fmt=None, NP=1, jobs=None):
       ''' Export data to  Arc/Info ASCII Grid (ASCII raster format); if no filename is given, the filename will 
           be constructed from the variable name and the slice; note that each file can only contain a single 
           horizontal slice. 
-          N.B.: The implementation is recursive, i.e. variables with more than two dimensions are sliced and 
-          each a number of separate calls to this function equal to the length of the dimension is issued; this
-          is repeated for every dimension (over two), until the input is two-dimensional.
+          By default, files are formatted and written natively (all values of a slice are formatted at once), 
+          optionally gzip-compressed (lgzip) and in parallel using NP processes; if a list is passed as jobs, 
+          the export job is only appended to the list and has to be written later (see writeASCIIrasters).
+          N.B.: The GDAL implementation (lnative=False) is recursive, i.e. variables with more than two dimensions
+          are sliced and each a number of separate calls to this function equal to the length of the dimension is 
+          issued; this is repeated for every dimension (over two), until the input is two-dimensional.
       '''
       # figure out filepath
       if filepath:
@@ -927,17 +964,39 @@ def addGDALtoVar(var, griddef=None, projection=None, geotransform=None, gridfold
           fp = filepath.split('/') # currently only works for Linux paths
           folder = '/'.join(fp[:-1]); filename = fp[-1]
           if '.' in filename: 
-            fn = filename.split('.')
-            if len(fn) != 2: raise NotImplementedError
-            prefix = fn[0]; ext = '.{:s}'.format(fn[1]) # add dot back in
+            prefix, ext = filename.split('.',1)
+            ext = '.{:s}'.format(ext) # add dot back in (can be multiple extensions, e.g. '.asc.gz')
           else: 
             prefix = filename; ext = None
+        elif lgzip and filepath[-3:] != '.gz': filepath += '.gz' 
+        if (ext or filepath)[-3:] == '.gz': lgzip = True # compression is inferred from the extension
       else:
         if folder is None: 
           raise IOError, "Need to specify a folder or absolute path to export to ASCII raster file."
         prefix = prefix or self.name
+      if lgzip: 
+        if not lnative: raise ArgumentError, "Compressed ASCII raster files can only be written natively."
+        if (ext or '')[-3:] != '.gz': ext = '{:s}.gz'.format(ext or '') # append gzip extension
+      # native export
+      if lnative:
+        if self.ndim < 2: raise NotImplementedError, self
+        # N.B.: slices are unmasked and reoriented individually by the writers, so that no copy of the 
+        #       entire variable is necessary; the data have to be loaded before the workers are forked
+        if not self.data: self.load()
+        if not self.data: raise DataError, 'Need data in Variable instance in order to export raster data!'
+        if self.ndim == 2: 
+          if not filepath: filepath = '{:s}/{:s}{:s}'.format(folder,prefix,ext or '')
+          filelist = [filepath]
+        else:
+          tags = [getSliceTags(ax, lcoord=lcoord, lfortran=lfortran, formatter=formatter) for ax in self.axes[:-2]]
+          filelist = ['{:s}/{:s}_{:s}{:s}'.format(folder,prefix,'_'.join(tag),ext or '') for tag in product(*tags)]
+          # N.B.: the order of file paths (C-order) corresponds to the order of bands in the data array
+        job = (self, dict(wrap360=wrap360, fillValue=fillValue, noDataValue=noDataValue), fmt, filelist)
+        if jobs is None: writeASCIIrasters([job], NP=NP) # write files now
+        else: jobs.append(job) # defer writing 
+        if self.ndim == 2: filelist = filepath # return a single file path for 2D fields
       # handle different cases with recursion
-      if self.ndim == 2: 
+      elif self.ndim == 2: 
         # N.B.: GDAL can only write 2D datasets to ASCII raster; multi-dimensional datasets are 
         #       sliced recursively until they are 2D; at this point the recursion ends and the 
         #       sliced dataset/Variable can be exported to ASCII raster format (one per file).
@@ -959,32 +1018,18 @@ def addGDALtoVar(var, griddef=None, projection=None, geotransform=None, gridfold
       elif self.ndim > 2: 
         # for ND fields, a new file for each band is necessary, hence filepath changes for every band
         fax = self.axes[0] # take first axis to iterate over
-        lenax = len(fax); axname = fax.name
-        if not lcoord: one = 1 if lfortran else 0 # Fortran or C indexing
-        # figure out formatter
-        if formatter and axname in formatter:
-          fmt = formatter[axname]
-          if isinstance(fmt, (list,tuple)):
-            axtag = fmt[0]; fmt = fmt[1]
-          else: axtag = None # assign below           
-        else:
-          axtag = None # assign below
-          if lcoord: fmt = '{}' # just a default... usually user-specified
-          else: fmt = '{{:0{:d}d}}'.format(int(np.ceil(np.log10(lenax+one)))) # number of digits
-          # N.B.: for Fortran convetion, start counting at 1, hence +1
-        if axtag is None: axtag = axname if lcoord else 'i{:s}'.format(axname.title())
-        prefix = '{:s}_{:s}_{:s}'.format(prefix,axtag,fmt)
+        tags = getSliceTags(fax, lcoord=lcoord, lfortran=lfortran, formatter=formatter)
         # loop over bands
         filelist = []
-        for i in xrange(lenax):
+        for i,tag in enumerate(tags):
           # work on each slice individually
-          slcvar = self.slicing(lidx=True, **{axname:i})
+          slcvar = self.slicing(lidx=True, **{fax.name:i})
           # assemble simplified file path
-          if lcoord: pf = prefix.format(fax[i]) # use actual coordinate value
-          else: pf = prefix.format(i+one) # start index at 1 --- Fortran convention
+          pf = '{:s}_{:s}'.format(prefix,tag)
           # now call this function recursively for every slice, until input is 2D
           filepath = ASCII_raster(slcvar, prefix=pf, folder=folder, ext=ext, filepath=None, 
-                                  wrap360=wrap360, fillValue=fillValue, noDataValue=noDataValue)
+                                  wrap360=wrap360, fillValue=fillValue, noDataValue=noDataValue, 
+                                  lcoord=lcoord, lfortran=lfortran, formatter=formatter, lnative=False)
           if isinstance(filepath, basestring): filelist.append(filepath)
           else: filelist.extend(filepath)
           # N.B.: the function basically returns the last filepath
@@ -997,6 +1042,211 @@ def addGDALtoVar(var, griddef=None, projection=None, geotransform=None, gridfold
   # # the return value is actually not necessary, since the object is modified immediately
   return var
 
+## native export to ASCII raster format (without GDAL; supports compression and parallel writing)
+
+def getSliceTags(axis, lcoord=False, lfortran=True, formatter=None):
+  ''' return a list of file name tags for all slices along an axis (for export to ASCII raster format) '''
+  lenax = len(axis); axname = axis.name
+  one = 1 if lfortran else 0 # Fortran or C indexing
+  # figure out formatter
+  if formatter and axname in formatter:
+    fmt = formatter[axname]
+    if isinstance(fmt, (list,tuple)):
+      axtag = fmt[0]; fmt = fmt[1]
+    else: axtag = None # assign below           
+  else:
+    axtag = None # assign below
+    if lcoord: fmt = '{}' # just a default... usually user-specified
+    else: fmt = '{{:0{:d}d}}'.format(int(np.ceil(np.log10(lenax+one)))) # number of digits
+    # N.B.: for Fortran convetion, start counting at 1, hence +1
+  if axtag is None: axtag = axname if lcoord else 'i{:s}'.format(axname.title())
+  pattern = '{:s}_{:s}'.format(axtag,fmt)
+  if lcoord: return [pattern.format(axis[i]) for i in xrange(lenax)] # use actual coordinate value
+  else: return [pattern.format(i+one) for i in xrange(lenax)] # start index at 1 --- Fortran convention
+
+def getRasterDtype(dtype):
+  ''' return the numpy data type that is used for raster data (the same as the GDAL data type) '''
+  dtype = np.dtype(dtype)
+  if dtype.name in ('float32','float64','int16','int32'): return dtype
+  elif np.issubdtype(dtype, np.inexact): return np.dtype('f4')
+  elif np.issubdtype(dtype, np.integer) or dtype == np.bool_: return np.dtype('i2')
+  else: raise TypeError, "Cannot translate numpy data type '{}' into GDAL data type!".format(dtype)
+
+def getRasterGeotransform(var, wrap360=False, lupperleft=True):
+  ''' return the geotransform of a GDAL-enabled Variable for raster data, along with the shift of the x-axis 
+      and whether or not the y-axis has to be flipped; geographic coordinate systems with longitudes ranging 
+      from 0 to 360 can be shifted back by 180 (wrap360), and the reference point is either the upper-left 
+      corner (default in GDAL applications and ASCII raster files; requires dy < 0) or the lower-left corner 
+      (default in GeoPy; dy > 0) '''
+  geotransform = list(var.geotransform); shift = 0
+  if wrap360:
+    shift = int( 180. / geotransform[1] )
+    geotransform[0] = geotransform[0] - shift*geotransform[1] # record shift in geotransform 
+  lflip = ( geotransform[5] > 0 ) if lupperleft else ( geotransform[5] < 0 )
+  if lflip:
+    geotransform[3] = geotransform[3] + var.mapSize[0]*geotransform[5] # shift reference point
+    geotransform[5] = -1*geotransform[5] # reverse dy
+  return tuple(geotransform), shift, lflip
+
+def getRasterArray(var, wrap360=False, fillValue=None, noDataValue=None, lupperleft=True, lfillNaN=True, band=None):
+  ''' return the data of a GDAL-enabled Variable as an unmasked array of 2D bands with upper-left reference 
+      point (as in ASCII raster files), along with the geotransform and the no-data value (None, if not masked); 
+      if a band index is given, only that band is unmasked (copied) and returned as a 2D array '''
+  if not var.gdal: raise GDALError, "Variable '{:s}' is not GDAL-enabled.".format(var.name)
+  if (var.axisIndex(var.xlon) != var.ndim-1) or (var.axisIndex(var.ylat) != var.ndim-2):
+    raise NotImplementedError, "Horizontal axes have to be the last indices."
+  if fillValue is None:
+    if var.fillValue is not None: fillValue = var.fillValue  # use default 
+    elif var.dtype is not None: fillValue = ma.default_fill_value(var.dtype)
+    else: raise GDALError, "Need Variable with valid dtype to export raster data!"
+  if noDataValue is None: noDataValue = fillValue
+  if not var.data: var.load()
+  if not var.data: raise DataError, 'Need data in Variable instance in order to export raster data!'
+  data = var.getArray(unmask=False, copy=False).reshape((var.bands,)+var.mapSize) # reshape to fit bands
+  if band is not None: data = data[band,:,:] # only one band
+  # get unmasked data (a copy)
+  if ma.getmask(data) is not ma.nomask: data = data.filled(fill_value=fillValue)
+  else: data = np.array(data) 
+  # replace NaN's with the fillValue
+  if lfillNaN and np.issubdtype(data.dtype, np.inexact): data[np.isnan(data)] = fillValue
+  # shift x-axis and enforce orientation
+  geotransform, shift, lflip = getRasterGeotransform(var, wrap360=wrap360, lupperleft=lupperleft)
+  if shift: data = np.roll(data, shift, axis=-1) # shift data along the x-axis
+  if lflip: data = flip(data, axis=-2) # flip y-axis
+  # use the same data types as GDAL
+  dtype = getRasterDtype(data.dtype)
+  if data.dtype != dtype: data = data.astype(dtype)
+  # no-data value is only written for masked data
+  if not var.masked: noDataValue = None
+  return data, geotransform, noDataValue
+
+def writeESRIgrid(filepath, data, geotransform, noDataValue=None, fmt=None, lgzip=None):
+  ''' write a 2D array to an ESRI/ArcInfo ASCII grid file (optionally gzip-compressed); the geotransform has 
+      to use the upper-left corner as reference (dy < 0) and the data have to be oriented accordingly; 
+      all values are formatted at once in a single string operation '''
+  if data.ndim != 2: raise DataError, "Can only write 2D arrays to ASCII raster files: {}".format(data.shape)
+  if geotransform[2] != 0 or geotransform[4] != 0 or geotransform[5] >= 0:
+    raise GDALError, "ASCII raster files require a North-up geotransform: {}".format(geotransform)
+  je,ie = data.shape; dx = geotransform[1]; dy = -1*geotransform[5]
+  if abs(dx-dy) > 1.e-10*dx: raise GDALError, "ASCII raster files require square grid cells: {} x {}".format(dx,dy)
+  if fmt is None:
+    if np.issubdtype(data.dtype, np.integer): fmt = '%d'
+    elif data.dtype.itemsize <= 4: fmt = '%.9g'
+    else: fmt = '%.17g'
+    # N.B.: 9 and 17 significant digits are sufficient to restore single and double precision values exactly
+  if lgzip is None: lgzip = filepath[-3:] == '.gz' # auto-detect
+  # assemble header (lower-left corner as reference)
+  header = 'ncols        {:d}\nnrows        {:d}\n'.format(ie,je)
+  header += 'xllcorner    {:.12f}\nyllcorner    {:.12f}\n'.format(geotransform[0],geotransform[3]-je*dy)
+  header += 'cellsize     {:.12f}\n'.format(dx)
+  if noDataValue is not None: header += 'NODATA_value  {:s}\n'.format(fmt%noDataValue)
+  # format entire array at once (much faster than formatting rows or values individually)
+  body = ( ( ' '.join([fmt]*ie) + '\n' ) * je ) % tuple(data.ravel().tolist())
+  # write file (compressed or not)
+  with gzip.open(filepath, mode='wb', compresslevel=6) if lgzip else open(filepath, mode='wb') as f:
+    # N.B.: the default compression level of 9 is a lot slower and files are only marginally smaller
+    f.write(header); f.write(body)
+  return filepath
+
+# export jobs of worker processes
+_raster_jobs = None
+
+def _initRasterExport(jobs):
+  ''' initialize worker process with export jobs (Variables are inherited from parent process, if possible) '''
+  global _raster_jobs
+  _raster_jobs = jobs
+
+def _writeRasterSlice(args):
+  ''' worker function that writes one 2D slice of an export job to an ASCII raster file '''
+  n, i = args
+  var, rasterargs, fmt, filelist = _raster_jobs[n]
+  data, geotransform, noDataValue = getRasterArray(var, band=i, **rasterargs) # unmask only this slice
+  return writeESRIgrid(filelist[i], data, geotransform, noDataValue=noDataValue, fmt=fmt)
+
+def writeASCIIrasters(jobs, NP=1, chunksize=4):
+  ''' write ASCII raster files for a list of export jobs using a pool of NP processes; each job consists of 
+      a GDAL-enabled Variable, keyword arguments for getRasterArray, a number format and a list of file paths 
+      (one per band); since only indices are passed to the workers and slices are unmasked individually, 
+      the number of concurrently processed slices is limited by the pool size; returns list of file paths '''
+  tasks = [(n,i) for n,job in enumerate(jobs) for i in xrange(len(job[-1]))]
+  if NP is not None and NP > 1 and len(tasks) > 1:
+    # N.B.: with 'fork', workers inherit the job data from the parent process, so that nothing is copied
+    pool = multiprocessing.Pool(processes=min(NP,len(tasks)), initializer=_initRasterExport, initargs=(jobs,))
+    try: filelist = pool.map(_writeRasterSlice, tasks, chunksize=chunksize)
+    except:
+      pool.terminate()
+      raise
+    else: 
+      pool.close(); pool.join()
+  else:
+    _initRasterExport(jobs)
+    try: filelist = [_writeRasterSlice(task) for task in tasks]
+    finally: _initRasterExport(None) # release data
+  return filelist
+
+
+## export of multi-band raster stacks to flat binary or GeoTIFF format
+
+# ESRI .hdr pixel types and GDAL data types for numpy data types
+ehdr_pixeltypes = dict(f='FLOAT', i='SIGNEDINT', u='UNSIGNEDINT')
+gdal_datatypes = dict(float32=gdal.GDT_Float32, float64=gdal.GDT_Float64, int16=gdal.GDT_Int16, int32=gdal.GDT_Int32, 
+                      uint8=gdal.GDT_Byte, uint16=gdal.GDT_UInt16, uint32=gdal.GDT_UInt32)
+
+def writeBinaryRaster(filepath, data, geotransform, noDataValue=None, dtype=None, atts=None):
+  ''' write a stack of 2D bands to a flat little-endian binary file (band-sequential) with a sidecar header 
+      in ESRI .hdr format, which can also be read by GDAL; the geotransform has to use the upper-left corner 
+      as reference (dy < 0), and additional header entries can be passed as atts; returns header file path '''
+  if data.ndim == 2: data = data.reshape((1,)+data.shape) # single band
+  if data.ndim != 3: raise DataError, "Can only write stacks of 2D bands to binary raster files: {}".format(data.shape)
+  if geotransform[2] != 0 or geotransform[4] != 0 or geotransform[5] >= 0:
+    raise GDALError, "Binary raster files require a North-up geotransform: {}".format(geotransform)
+  dtype = np.dtype(dtype or data.dtype).newbyteorder('<') # always little-endian
+  if dtype.kind not in ehdr_pixeltypes: raise TypeError, "Unsupported data type for binary raster files: {}".format(dtype)
+  nb,je,ie = data.shape
+  # write data band by band (only one band is converted at a time)
+  with open(filepath, mode='wb') as f:
+    for i in xrange(nb): data[i,:,:].astype(dtype).tofile(f)
+  # assemble header (reference point is the center of the upper-left cell)
+  header = [('BYTEORDER','I'), ('LAYOUT','BSQ'), ('NROWS',je), ('NCOLS',ie), ('NBANDS',nb), 
+            ('NBITS',dtype.itemsize*8), ('PIXELTYPE',ehdr_pixeltypes[dtype.kind]), 
+            ('ULXMAP',repr(geotransform[0]+geotransform[1]/2.)), ('ULYMAP',repr(geotransform[3]+geotransform[5]/2.)), 
+            ('XDIM',repr(geotransform[1])), ('YDIM',repr(-1*geotransform[5]))]
+  if noDataValue is not None: header.append(('NODATA',dtype.type(noDataValue)))
+  if atts: header.extend(atts.items())
+  headerfile = os.path.splitext(filepath)[0] + '.hdr'
+  with open(headerfile, mode='w') as f:
+    f.writelines(['{:14s} {}\n'.format(key,value) for key,value in header])
+  return headerfile
+
+def writeGeoTIFF(filepath, data, geotransform, projection=None, noDataValue=None, dtype=None, atts=None, 
+                 blocksize=None, compress=None):
+  ''' write a stack of 2D bands to a GeoTIFF file using GDAL; if blocksize is given, the file is tiled
+      (tiles have to be multiples of 16), and additional meta data can be passed as atts '''
+  if data.ndim == 2: data = data.reshape((1,)+data.shape) # single band
+  if data.ndim != 3: raise DataError, "Can only write stacks of 2D bands to GeoTIFF files: {}".format(data.shape)
+  dtype = np.dtype(dtype or data.dtype)
+  if dtype.name not in gdal_datatypes: raise TypeError, "Unsupported data type for GeoTIFF files: {}".format(dtype)
+  nb,je,ie = data.shape
+  # creation options
+  options = ['BIGTIFF=IF_SAFER'] # long time-series can exceed 4GB
+  if blocksize:
+    if isinstance(blocksize,(int,np.integer)): blocksize = (blocksize,blocksize)
+    options += ['TILED=YES', 'BLOCKXSIZE={:d}'.format(blocksize[0]), 'BLOCKYSIZE={:d}'.format(blocksize[1])]
+  if compress: options.append('COMPRESS={:s}'.format(compress))
+  # create file and write data band by band
+  dataset = gdal.GetDriverByName('GTiff').Create(filepath, int(ie), int(je), int(nb), gdal_datatypes[dtype.name], options)
+  dataset.SetGeoTransform(geotransform)
+  if projection is not None: dataset.SetProjection(projection.ExportToWkt())
+  if atts: dataset.SetMetadata({key:str(value) for key,value in atts.iteritems()})
+  for i in xrange(nb):
+    band = dataset.GetRasterBand(i+1)
+    band.WriteArray(data[i,:,:].astype(dtype))
+    if noDataValue is not None: band.SetNoDataValue(float(noDataValue))
+  # for good form, indirectly close the dataset
+  dataset.FlushCache(); dataset = None; band = None
+  return filepath
+
+
 def addGDALtoDataset(dataset, griddef=None, projection=None, geotransform=None, gridfolder=None, 
                      lwrap360=None, geolocator=False, lforce=False, loverride=False):
   ''' 
@@ -1224,12 +1474,14 @@ def addGDALtoDataset(dataset, griddef=None, projection=None, geotransform=None,
     # add new method to object
     dataset.mapMean = types.MethodType(mapMean, dataset)
     
-    # save variable as Arc/Info ASCII Grid / ASCII raster file using GDAL
+    # save variable as Arc/Info ASCII Grid / ASCII raster file (natively or using GDAL)
     def ASCII_raster(self, varlist=None, prefix=None, folder=None, ext='.asc', wrap360=False, 
-                     fillValue=None, noDataValue=None, lcoord=False, lfortran=True, formatter=None):
+                     fillValue=None, noDataValue=None, lcoord=False, lfortran=True, formatter=None,
+                     lgzip=False, lnative=True, fmt=None, NP=1):
       ''' Export data to  Arc/Info ASCII Grid (ASCII raster format); the filename will be constructed 
           from a prefix, the variable name and the slice; note that each file can only contain a single 
-          horizontal slice (2D).  
+          horizontal slice (2D). In native mode, the slices of all variables are written (and optionally
+          compressed) by a single pool of NP processes.
       '''
       # check arguments
       if varlist is None: varlist = self.variables.keys()
@@ -1245,7 +1497,7 @@ def addGDALtoDataset(dataset, griddef=None, projection=None, geotransform=None,
         raise ArgumentError, "A valid folder is necessary to export a dataset to ASCII raster format."
       if not os.path.exists(folder): os.makedirs(folder) # make sure folder exists
       # loop over variables
-      filedict = dict()
+      filedict = dict(); jobs = [] if lnative else None
       for varname,vartag in varlist.iteritems():
         var = self.variables[varname] # variable isntance
         if vartag is None: vartag = var.name
@@ -1256,9 +1508,12 @@ def addGDALtoDataset(dataset, griddef=None, projection=None, geotransform=None,
           # call export function on each variable
           filelist = var.ASCII_raster(prefix=pf, folder=folder, ext=ext, filepath=None, wrap360=wrap360, 
                                       fillValue=fillValue, noDataValue=noDataValue, lcoord=lcoord, 
-                                      lfortran=lfortran, formatter=formatter)
+                                      lfortran=lfortran, formatter=formatter, lgzip=lgzip, 
+                                      lnative=lnative, fmt=fmt, jobs=jobs)
           if isinstance(filelist,basestring): filelist = [filelist]
           filedict[vartag] = filelist
+      # write all files at once (native mode only)
+      if lnative: writeASCIIrasters(jobs, NP=NP)
       return filedict
     # add new method to object
     dataset.ASCII_raster = types.MethodType(ASCII_raster, dataset)    
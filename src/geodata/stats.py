@@ -18,7 +18,7 @@ import functools
 # internal imports
 from geodata.base import Variable, Axis
 from geodata.misc import DataError, ArgumentError, VariableError, AxisError, DistVarError
-from utils.misc import standardize, smooth, detrend, apply_over_arrays
+from utils.misc import standardize, smooth, detrend
 import utils.stats as myss # modified stats fucntions from scipy 
 from plotting.properties import getPlotAtts
 
@@ -634,6 +634,43 @@ def asDistVar(var, axis='time', dist=None, lflatten=False, name=None, atts=None,
   # return DistVar instance
   return dvar
 
+# generate random resampling indices for all points at once
+def resampling_indices(npt, sz, nsamples, seed=None, replace=True):
+  ''' return an integer array of shape (npt,nsamples) with random indices into sample vectors of length sz;
+      draws are with replacement (bootstrap) or without (random subset); the seed makes results reproducible '''
+  rng = np.random.RandomState(seed)
+  if replace: idx = rng.randint(sz, size=(npt,nsamples))
+  else: idx = np.argsort(rng.random_sample((npt,sz)), axis=-1)[:,:nsamples]
+  return idx
+
+# generate cross-validation masks for all points with a single vectorized permutation
+def crossval_masks(shape, sz, ncv=0.2, mode='random', seed=None):
+  ''' return boolean validation masks with shape (nfold,)+shape+(sz,); mode 'random' selects a random 
+      fraction ncv (or 1/ncv, if ncv >= 2) of samples for validation, 'regular' every ncv-th sample, and 
+      'kfold' randomly assigns samples to ncv folds of (nearly) equal size (one mask per fold) '''
+  npt = int(np.prod(shape)); mode = mode.lower()
+  if mode in ('random','kfold'):
+    rng = np.random.RandomState(seed)
+    perm = np.argsort(rng.random_sample((npt,sz)), axis=-1) # an independent permutation for each point
+    pidx = np.arange(npt).reshape((npt,1)) # point indices for fancy indexing
+  if mode == 'random':
+    if ncv < 1: nval = sz - int(np.round((1-ncv)*sz)) # convert fraction to number of elements
+    elif ncv >= 2: nval = int(np.round(sz/float(ncv))) # treat as denominator of fraction used for validation
+    else: raise ValueError, ncv
+    masks = np.zeros((1,npt,sz), dtype=np.bool_)
+    masks[0][pidx,perm[:,:nval]] = True
+  elif mode == 'regular':
+    if ncv < 2 or int(ncv) != ncv: raise ValueError, ncv # denominator of fraction used for validation
+    masks = np.zeros((1,npt,sz), dtype=np.bool_)
+    masks[0,:,int(ncv)-1::int(ncv)] = True
+  elif mode == 'kfold':
+    if ncv < 2 or int(ncv) != ncv: raise ValueError, ncv # number of folds
+    folds = np.zeros((npt,sz), dtype=np.int16)
+    folds[pidx,perm] = np.arange(sz, dtype=np.int16) % int(ncv)
+    masks = folds.reshape((1,npt,sz)) == np.arange(int(ncv), dtype=np.int16).reshape((int(ncv),1,1))
+  else: raise ArgumentError, "Unknown cross-validation mode '{:s}'.".format(mode)
+  return masks.reshape((len(masks),)+tuple(shape)+(sz,))
+
 # base class for distributions 
 class DistVar(Variable):
   '''
@@ -644,15 +681,22 @@ class DistVar(Variable):
   '''
   dist_type = '' # name of the distribution type
   paramAxis = None # axis for distribution parameters (None is distribution objects are stored)
+  fit_converged = None # convergence flag for each point (vectorized fit only)
+  fit_niter = None # number of iterations for each point (vectorized fit only)
+  crossval_params = None # parameters fitted to each training set (k-fold cross-validation only)
+  _crossval_bits = None # cross-validation masks, stored as bits
+  _crossval_size = None # sample size of cross-validation masks
 
   def __init__(self, name=None, units=None, axes=None, samples=None, nsamples=None, params=None, axis=None, 
                dtype=None, lflatten=False, masked=None, mask=None, fillValue=None, atts=None, ldebug=False, 
-               lbootstrap=False, nbs=1000, bootstrap_axis='bootstrap', 
+               lbootstrap=False, nbs=1000, bootstrap_axis='bootstrap', bs_batch=None, bs_seed=None, 
                lcrossval=False, ncv=0.2, crossval_mode='random', **kwargs):
     '''
       This method creates a new DisVar instance from data and parameters. If data is provided, a sample
       axis has to be specified or the last (innermost) axis is assumed to be the sample axis.
       An estimation/fit will be performed at every grid point and stored in an array.
+      Bootstrap replicates are generated in batches of 'bs_batch' replicates immediately before fitting,
+      so that only parameters are retained; replicate i uses the random seed 'bs_seed'+i.
       Note that 'dtype' and 'units' refer to the sample data, not the distribution.
     '''
     # if parameters are provided
@@ -710,66 +754,40 @@ class DistVar(Variable):
       if nsamples is None: nsamples = sz
       if nsamples < 2: raise ValueError, nsamples # check samples[:] as well!
       if nsamples > sz: raise ValueError, sz  
-      ## add bootstrap axis and generate bootstrap samples
+      ## add bootstrap axis (bootstrap samples are generated immediately before fitting)
       if lbootstrap:
+        if lcrossval: raise NotImplementedError, "Cross-validation is not supported in combination with bootstrapping."
         # create and add bootstrap axis
         bsatts = dict(name=bootstrap_axis,units='',long_name='Bootstrap Samples')
         bsax = Axis(coord=np.arange(nbs), atts=bsatts)
         axes = (bsax,) + axes # add this axis as outer-most
-        shape = (nbs,) + samples.shape
-        # resample the samples (nbs times)
-        bootstrap = np.zeros(shape, dtype=samples.dtype) # allocate memory
-        if lns: # select a random subset (without replacement)
-          bootstrap[0,:] = np.apply_along_axis(np.random.choice, -1, samples, size=nsamples, replace=False)
-        else: bootstrap[0,:] = samples # first element is the real sample data
-        for i in xrange(1,nbs): # take random draws with replacement
-          bootstrap[i,:] = np.apply_along_axis(np.random.choice, -1, samples, size=nsamples, replace=True)
-          #idx = np.random.randint(sz, size=nsamples) # select random indices
-          #bootstrap[i,:] = samples.take(idx, axis=-1) # write random sample into array
-        samples = bootstrap
-        # N.B.: from here one everything should proceed normally, with the extra bootstrap axis in the 
-        #       resulting DistVar object; obtain confidence intervalls as percentiles along this axis
-        # N.B.: In order to save memory, this could be inplemented more efficiently within the fit-       
-        #       functions, so that the resampling only occurs immediately before fitting.
-        #       Essentially, there would be two separate estimations, one with the original sample 
-        #       vector, and a given number of estimations with prior resampling; these would then be 
-        #       stacked along the bootstrap axis.
-        # N.B.: Performing resampling and estimation iteratively, one by one, would also save memory, 
-        #       but prevent parallelization of the bootstrap process.
+        # N.B.: the resulting DistVar object has an extra bootstrap axis; obtain confidence intervalls 
+        #       as percentiles along this axis
       elif lns: 
         # select a random subset (without replacement)
         samples = np.apply_along_axis(np.random.choice, -1, samples, size=nsamples, replace=False)
       sz = samples.shape[-1] # update
-      ## exclude a regular subset/fraction for cross-validation 
+      ## exclude a subset/fraction for cross-validation 
       if lcrossval:
-        idx_dtype = np.int16 if sz < 32767 else (np.int32 if sz < 2147483647 else np.int64) # save some memory
-        #ncv = 3 if lcrossval is True else int(lcrossval)
         if 1 < ncv < 2: raise ValueError, lcrossval
-        if crossval_mode.lower() == 'random': # default: use a random subset
-          if ncv < 1: nncv = int(np.round((1-ncv)*sz)) # convert fraction to number of elements
-          else: nncv = int(sz - np.round(sz/ncv)) # treat as denominator of fraction used for validation
-          idx_rng = np.tile(np.arange(sz, dtype=idx_dtype), samples.shape[:-1]+(1,))
-          idx_rng = np.apply_along_axis(np.random.choice, -1, idx_rng, size=nncv, replace=False)
-          # save cross-validation mask
-          crossval_mask = np.ones(samples.shape, dtype=np.bool8, order='C')
-          apply_over_arrays(np.put, crossval_mask, idx_rng, v=np.bool(0), mode='raise')
-          check_mask = crossval_mask.sum(axis=-1)
-          assert crossval_mask.shape == samples.shape
-          assert check_mask.min() == check_mask.max(), (check_mask.min(),check_mask.max()) 
-          assert check_mask.mean() == sz-nncv, (check_mask.mean(),nncv) 
+        cvmasks = crossval_masks(samples.shape[:-1], sz, ncv=ncv, mode=crossval_mode)
+        self._crossval_bits = np.packbits(cvmasks, axis=-1) # store compactly
+        self._crossval_size = sz
+        if len(cvmasks) == 1: 
+          # a single validation set of equal size at every point: fit the remaining samples
+          ntrain = sz - int(cvmasks[0].reshape((-1,sz))[0,:].sum())
+          samples = samples[np.invert(cvmasks[0])].reshape(samples.shape[:-1]+(ntrain,))
         else:
-          # a deterministic subset 
-          if ncv < 1: raise ValueError, lcrossval # denominator of fraction used for validation
-          idx_rng = []
-          for icv in xrange(0,sz,ncv):
-            idx_rng += np.arange(icv,min(icv+ncv-1,sz), order='C', dtype=idx_dtype)
-          idx_rng = np.concatenate(idx_rng)
-        #idx_rng = np.random.randint(saxlen, size=saxlen)[idx_rng] # use a randome sample...
-        subsample = np.zeros_like(idx_rng, dtype=samples.dtype, order='C', subok=True) # allocate subsample
-        apply_over_arrays(np.take, samples, idx_rng, axis=-1, out=subsample, mode='raise')
-        samples = subsample # use subsample instead of full sample
+          # k-fold: fit all training sets at once (validation samples are masked as NaN); the 
+          #         DistVar itself is fitted to the full sample
+          self.crossval_params = self._estimate_distribution(np.where(cvmasks, np.NaN, samples), ldebug=ldebug, **kwargs)
+        del cvmasks
       # estimate distribution parameters
-      params = self._estimate_distribution(samples, ldebug=ldebug, **kwargs)
+      if lbootstrap:
+        params = self._bootstrap_distribution(samples, nbs=nbs, nsamples=nsamples, lns=lns, bs_batch=bs_batch, 
+                                              bs_seed=bs_seed, ldebug=ldebug, **kwargs)
+      else: 
+        params = self._estimate_distribution(samples, ldebug=ldebug, **kwargs)
       # N.B.: the method estimate() should be implemented by specific child classes      
       # N.B.: 'ic' are initial guesses for parameter values; 'kwargs' are for the estimator algorithm 
     # sample fillValue
@@ -793,7 +811,6 @@ class DistVar(Variable):
     assert self.masked == masked
     self.dtype = dtype # property is overloaded in DistVar
     self.crossval = ncv if lcrossval and samples is not None else 0
-    self.crossval_mask = crossval_mask if lcrossval and crossval_mode.lower() == 'random' else None
     # N.B.: in this variable dtype and units refer to the sample data, not the distribution!
     if params.ndim > 0 and self.hasAxis(params_name):
       self.paramAxis = self.getAxis(params_name) 
@@ -804,6 +821,18 @@ class DistVar(Variable):
     self.pdf = self.PDF
     self.cdf = self.CDF
     
+  @property
+  def crossval_folds(self):
+    ''' Boolean validation masks for each fold (first axis), unpacked from bits (None if not available). '''
+    if self._crossval_bits is None: return None
+    return np.unpackbits(self._crossval_bits, axis=-1)[...,:self._crossval_size].astype(np.bool_)
+  
+  @property
+  def crossval_mask(self):
+    ''' Boolean mask of validation samples, if there is only one validation set (None otherwise). '''
+    folds = self.crossval_folds
+    return folds[0] if folds is not None and len(folds) == 1 else None
+  
   @property
   def dtype(self):
     ''' The data type of the samlple data (inferred from initialization data). '''
@@ -862,6 +891,42 @@ class DistVar(Variable):
   def _estimate_distribution(self, samples, ldebug=False, **kwargs):
     ''' esimtate/fit distribution from sample array for each grid point and return parameters as ndarray  '''
     raise NotImplementedError
+  # resample and estimate distribution parameters for a set of bootstrap replicates
+  def _bootstrap_distribution(self, samples, nbs=1000, nsamples=None, lns=False, bs_batch=None, bs_seed=None, 
+                              ldebug=False, **kwargs):
+    ''' generate bootstrap replicates in batches and fit each batch immediately, so that only the parameters 
+        of all replicates have to be stored; the first replicate is the original sample (or a random subset, 
+        if lns=True); indices for each replicate are drawn with a separate seed, so that results do not depend
+        on the batch size; within batches, fitting is distributed over points and replicates as usual '''
+    shape = samples.shape[:-1]; sz = samples.shape[-1]
+    npt = int(np.prod(shape)); nsamples = nsamples or sz
+    if bs_seed is None: bs_seed = np.random.randint(np.iinfo(np.int32).max - nbs) # depends on global state
+    if bs_batch is None: bs_batch = max(1, 2**22//max(1,npt*nsamples)) # limit batch memory footprint
+    flat_samples = samples.reshape((npt,sz))
+    pidx = np.arange(npt).reshape((npt,1)) # point indices for fancy indexing
+    params = None; fit_converged = None; fit_niter = None
+    for i in xrange(0,nbs,bs_batch):
+      nb = min(bs_batch,nbs-i)
+      batch = np.zeros((nb,npt,nsamples), dtype=samples.dtype)
+      for j in xrange(nb):
+        if i+j == 0 and not lns: batch[j,:] = flat_samples # first element is the real sample data
+        else: # random subset without replacement or random draws with replacement
+          idx = resampling_indices(npt, sz, nsamples, seed=bs_seed+i+j, replace=(i+j > 0))
+          batch[j,:] = flat_samples[pidx,idx]
+      batch = batch.reshape((nb,)+shape+(nsamples,))
+      res = self._estimate_distribution(batch, ldebug=ldebug, **kwargs)
+      # allocate parameter array, once the type and shape of parameters are known
+      if params is None: params = np.zeros((nbs,)+res.shape[1:], dtype=res.dtype)
+      params[i:i+nb,:] = res
+      if self.fit_converged is not None: # collect convergence diagnostics
+        if fit_converged is None:
+          fit_converged = np.zeros((nbs,)+shape, dtype=np.bool_); fit_niter = np.zeros((nbs,)+shape, dtype=np.int32)
+        fit_converged[i:i+nb,:] = self.fit_converged; fit_niter[i:i+nb,:] = self.fit_niter
+      del batch, res
+    self.fit_converged = fit_converged; self.fit_niter = fit_niter
+    if ldebug: print("Fitted {:d} bootstrap replicates in batches of {:d}".format(nbs,bs_batch))
+    return params
+
   # distribution-specific method; should be overloaded by subclass
   def _sample_distribution(self, n):
     ''' draw n samples from the distribution for each grid point and return as ndarray '''
@@ -1131,6 +1196,24 @@ def kde_cdf(kde, support=None, n=0, fillValue=np.NaN):
       fct = lambda s: kde[0].integrate_box_1d(-1*np.inf,s)
       res = np.asarray([fct(s) for s in support])
     return res
+
+# extract sample data and bandwidths from an array of KDE objects for vectorized evaluation
+def kde_arrays(kernels):
+  ''' return a padded 2D array of sample data (NaN-padded), kernel bandwidths, and sample weights (or None)
+      from an array of gaussian_kde objects (None entries are returned with NaN bandwidth) '''
+  kernels = ma.getdata(kernels).ravel()
+  nmax = max([kde.n for kde in kernels if kde is not None] or [1])
+  dataset = np.zeros((len(kernels),nmax)) + np.NaN
+  bandwidth = np.zeros(len(kernels)) + np.NaN
+  weights = None
+  for i,kde in enumerate(kernels):
+    if kde is None: continue
+    dataset[i,:kde.n] = kde.dataset.ravel()
+    bandwidth[i] = np.sqrt(kde.covariance.ravel()[0])
+    if getattr(kde, '_weights', None) is not None: # only newer SciPy versions support weights
+      if weights is None: weights = np.zeros_like(dataset)
+      weights[i,:kde.n] = kde._weights
+  return dataset, bandwidth, weights
   
 # Subclass of DistVar implementing Kernel Density Estimation
 class VarKDE(DistVar):
@@ -1141,19 +1224,21 @@ class VarKDE(DistVar):
   def _estimate_distribution(self, samples, ic_shape=None, ic_args=None, ic_loc=None, ic_scale=None, ldebug=False, **kwargs):
     ''' esimtate/fit distribution from sample array for each grid point and return parameters as ndarray  '''
     fct = functools.partial(kde_estimate, ldebug=ldebug, **kwargs)
-    kernels = apply_along_axis(fct, samples.ndim-1, samples, chunksize=100//len(samples)).squeeze()
+    kernels = apply_along_axis(fct, samples.ndim-1, samples, chunksize=100//len(samples))
+    kernels = kernels.reshape(samples.shape[:-1]) # N.B.: squeeze would also remove singleton dimensions
     assert samples.shape[:-1] == kernels.shape
     # return an array of kernels
     return kernels
 
   # distribution-specific method; should be overloaded by subclass
   def _density_distribution(self, support):
-    ''' compute PDF at given support points for each grid point and return as ndarray '''
-    n = len(support); fillValue = self.fillValue or np.NaN
-    data = self.data_array.reshape(self.data_array.shape+(1,)) # expand
-    fct = functools.partial(kde_eval, support=support, n=n, fillValue=fillValue)
-    pdf = apply_along_axis(fct, self.ndim, data, chunksize=100//n)
-    assert pdf.shape == self.shape + (len(support),)
+    ''' compute PDF at given support points for each grid point and return as ndarray; kernel sums
+        are evaluated for all points at once (in memory-bounded chunks) '''
+    fillValue = self.fillValue or np.NaN
+    dataset, bandwidth, weights = kde_arrays(self.data_array)
+    pdf = myss.gaussian_kde_pdf(dataset, bandwidth, support, weights=weights)
+    pdf[np.isnan(bandwidth),:] = fillValue
+    pdf = pdf.reshape(self.shape + (len(support),))
     return pdf
   
   # distribution-specific method; should be overloaded by subclass
@@ -1170,12 +1255,13 @@ class VarKDE(DistVar):
   
   # distribution-specific method; should be overloaded by subclass
   def _cumulative_distribution(self, support):
-    ''' integrate PDF over given support to produce a CDF and return as ndarray '''
-    n = len(support); fillValue = self.fillValue or np.NaN
-    data = self.data_array.reshape(self.data_array.shape+(1,))
-    fct = functools.partial(kde_cdf, support=support, n=n, fillValue=fillValue)
-    cdf = apply_along_axis(fct, self.ndim, data, chunksize=100//n)
-    assert cdf.shape == self.shape + (len(support),)
+    ''' integrate PDF over given support to produce a CDF and return as ndarray; the integrals of
+        Gaussian kernels are computed for all points at once, using the error function '''
+    fillValue = self.fillValue or np.NaN
+    dataset, bandwidth, weights = kde_arrays(self.data_array)
+    cdf = myss.gaussian_kde_cdf(dataset, bandwidth, support, weights=weights)
+    cdf[np.isnan(bandwidth),:] = fillValue
+    cdf = cdf.reshape(self.shape + (len(support),))
     return cdf
   
 ## VarRV subclass and helper functions
@@ -1247,6 +1333,28 @@ def rv_fit(sample, dist_type=None, ic_shape=None, ic_args=None, ic_loc=None, ic_
       res = (np.NaN,)*plen
   return res # already is a tuple
 
+# check if the vectorized fitting engine supports a distribution and fit arguments
+def rv_fit_vectorizable(dist_type, ic_shape=None, ic_args=None, ic_loc=None, ic_scale=None, lpersist=False, **kwargs):
+  ''' return True, if the distribution can be fitted with the vectorized engine (utils.stats.mle_fit);
+      gamma and Weibull distributions are only supported with a fixed location parameter and without 
+      shape constraints, and initial guesses and persistence are only supported by the scipy fit '''
+  if dist_type not in myss.vectorized_dists: return False
+  if lpersist or any(ic is not None for ic in (ic_shape, ic_args, ic_loc, ic_scale)): return False
+  if dist_type in ('gamma','weibull_min') and ( kwargs.get('lpositiveShape') or kwargs.get('lnegativeShape') ): return False
+  if any(key not in ('f0','floc','lpositiveShape','lnegativeShape') for key in kwargs): return False
+  if 'f0' in kwargs and dist_type not in ('genextreme','gamma','weibull_min'): return False
+  if dist_type in ('gamma','weibull_min'): return 'floc' in kwargs
+  else: return 'floc' not in kwargs
+
+# estimate RV parameters for all sample vectors at once (vectorized)
+def rv_fit_vectorized(samples, axis=-1, dist_type=None, plen=None, **kwargs):
+  ''' fit distribution parameters using the vectorized maximum-likelihood engine and append the 
+      convergence flag and number of iterations, so that results can be passed through apply_along_axis '''
+  params, converged, niter = myss.mle_fit(samples, dist_type, axis=axis, **kwargs)
+  assert params.shape[-1] == plen
+  diag = np.stack((converged, niter), axis=-1).astype(params.dtype)
+  return np.concatenate((params, diag), axis=-1)
+
 # evaluate a RV distribution type over a given support with given parameters
 def rv_eval(params, dist_type=None, fct_type=None, support=None, n=None, fillValue=np.NaN):
   if np.any(np.isnan(params)): res = np.zeros(len(support))+fillValue 
@@ -1352,14 +1460,33 @@ class VarRV(DistVar):
     return attr
   
   # distribution-specific method; should be overloaded by subclass
-  def _estimate_distribution(self, samples, ic_shape=None, ic_args=None, ic_loc=None, ic_scale=None, lpersist=False, ldebug=False, **kwargs):
-    ''' esimtate/fit distribution from sample array for each grid point and return parameters as ndarray  '''
+  def _estimate_distribution(self, samples, ic_shape=None, ic_args=None, ic_loc=None, ic_scale=None, lpersist=False, 
+                             ldebug=False, lvectorize=None, **kwargs):
+    ''' esimtate/fit distribution from sample array for each grid point and return parameters as ndarray;
+        common distributions are fitted for all points simultaneously (lvectorize=None/True), in which 
+        case initial guesses are estimated from L-moments and convergence diagnostics are retained '''
+    plen = self.dist_class.numargs + 2 # infer number of parameters
+    icargs = dict(ic_shape=ic_shape, ic_args=ic_args, ic_loc=ic_loc, ic_scale=ic_scale, lpersist=lpersist)
+    if lvectorize is None: lvectorize = rv_fit_vectorizable(self.dist_type, **dict(kwargs, **icargs))
+    elif lvectorize and not rv_fit_vectorizable(self.dist_type, **dict(kwargs, **icargs)):
+      argnames = kwargs.keys() + [key for key,arg in icargs.items() if arg is not None and arg is not False]
+      raise DistVarError, "Vectorized fitting is not supported for distribution '{:s}' with arguments {:s}.".format(self.dist_type, str(argnames))
+    if lvectorize:
+      # N.B.: initial guesses are estimated from L-moments (explicit guesses or persistence imply the scipy fit)
+      fct = functools.partial(rv_fit_vectorized, dist_type=self.dist_type, plen=plen, **kwargs)
+      res = apply_along_axis(fct, samples.ndim-1, samples, chunksize=max(1,1000000//samples.shape[-1]), laax=False)
+      assert samples.shape[:-1]+(plen+2,) == res.shape
+      params = np.ascontiguousarray(res[...,:plen])
+      self.fit_converged = res[...,plen] > 0; self.fit_niter = res[...,plen+1].astype(np.int32)
+      if ldebug: 
+        print("{:s}: {:d} of {:d} points converged (max. {:d} iterations)".format(self.dist_type, int(self.fit_converged.sum()), 
+                                                                             self.fit_converged.size, int(self.fit_niter.max())))
+      return params
     if lpersist: # reset global parameters
       global_loc   = None # location parameter ("mean")
       global_scale = None # scale parameter ("standard deviation")
       global_shape = None # single shape parameter
       global_args  = None # multiple shape parameters
-    plen = self.dist_class.numargs + 2 # infer number of parameters
     fct = functools.partial(rv_fit, ic_shape=ic_shape, ic_args=ic_args, ic_loc=ic_loc, ic_scale=ic_scale, plen=plen, 
                             dist_type=self.dist_type, lpersist=lpersist, ldebug=ldebug, **kwargs)
     params = apply_along_axis(fct, samples.ndim-1, samples, chunksize=100//plen//len(samples))
@@ -1552,15 +1679,22 @@ class VarRV(DistVar):
                                           lcheckVar=True, lcheckAxis=True)
     # select cross-validation subset/fraction
     sz = sample_data.shape[-1] # all sample dimensions should be collapsed by now
+    params = self.data_array; lfolds = False; lnanfolds = None
     if lcrossval: 
       idx_dtype = np.int16 if sz < 32767 else (np.int32 if sz < 2147483647 else np.int64) # save some memory
-      if self.crossval_mask is not None: # created for random subset (default)
-        assert self.crossval_mask.shape == sample_data.shape, self.crossval_mask.shape 
-        check_mask = self.crossval_mask.sum(axis=-1); mask_len = int(check_mask.mean())
-        subsample = np.zeros(check_mask.shape+(mask_len,), dtype=sample_data.dtype, order='C')
-        apply_over_arrays(np.compress, self.crossval_mask, sample_data, out=subsample, axis=-1)
-        sample_data = subsample # replace sample with appropriate sub-sample
-        #print sample_data.shape, sample_data.mean()
+      folds = self.crossval_folds
+      if folds is not None and len(folds) == 1: # a single validation set of equal size at every point
+        assert folds.shape[1:] == sample_data.shape, folds.shape 
+        sample_data = sample_data[folds[0]].reshape(sample_data.shape[:-1]+(-1,))
+      elif folds is not None: 
+        # k-fold: test all folds in one pass, using the parameters fitted to the corresponding training set
+        assert folds.shape[1:] == sample_data.shape, folds.shape 
+        if nsamples: raise ArgumentError, "Random subsets are not supported with k-fold cross-validation."
+        # N.B.: samples outside of the validation set are replaced by NaN, so the test always has to ignore 
+        #       NaN's; without ignoreNaN, folds with missing values in the validation set are invalid (NaN)
+        if not ignoreNaN: lnanfolds = np.any(np.logical_and(folds, np.isnan(sample_data)), axis=-1)
+        sample_data = np.where(folds, sample_data, np.NaN)
+        params = self.crossval_params; lfolds = True
       else:
         ncv = self.crossval if lcrossval is True else lcrossval
         if ncv == 0 or int(ncv) != ncv: raise ValueError, self.crossval
@@ -1579,9 +1713,12 @@ class VarRV(DistVar):
     # apply test function (parallel)
     #print sample_data.shape, sample_data.mean()
     fct = functools.partial(rv_stats_test, nparams=len(self.paramAxis), dist_type=self.dist_type, reta=reta,
-                            stats_test=stats_test, ignoreNaN=ignoreNaN, N=N, alternative=alternative, mode=mode)
-    data_array = np.concatenate((self.data_array, sample_data), axis=sax) # merge params and sample arrays (only one argument array per point along axis) 
-    pval = apply_along_axis(fct, sax, data_array, chunksize=100000//len(data_array)) # apply test in parallel, distributing the data
+                            stats_test=stats_test, ignoreNaN=ignoreNaN or lfolds, N=N, alternative=alternative, mode=mode)
+    data_array = np.concatenate((params, sample_data), axis=-1) # merge params and sample arrays (only one argument array per point along axis) 
+    pval = apply_along_axis(fct, data_array.ndim-1, data_array, chunksize=100000//len(data_array)) # apply test in parallel, distributing the data
+    if lfolds: 
+      if lnanfolds is not None: pval[lnanfolds] = np.NaN
+      pval = np.mean(pval, axis=0) if lnanfolds is not None else np.nanmean(pval, axis=0) # average over folds
     assert pval.ndim == sax
     assert pval.shape == self.shape[:-1]
     #print pval.shape,pval.mean()
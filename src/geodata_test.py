@@ -19,7 +19,7 @@ import utils.nanfunctions as nf
 from utils.nctools import writeNetCDF
 from geodata.misc import isZero, isOne, isEqual, isNumber
 from geodata.base import Variable, Axis, Dataset, Ensemble, concatVars, concatDatasets
-from geodata.stats import VarKDE, VarRV, asDistVar
+from geodata.stats import VarKDE, VarRV, asDistVar, rv_fit_vectorizable
 from geodata.stats import kstest, ttest, mwtest, wrstest, pearsonr, spearmanr
 from datasets.common import data_root
 from wrfavg.wrfout_average import ldebug
@@ -366,6 +366,114 @@ class BaseVarTest(unittest.TestCase):
             # N.B.: the CDF/sample axes here are in different locations!    
             assert np.all(dvar.data_array.mask, axis=-1).sum() >= np.all(var.data_array.mask, axis=0).sum()
 
+  def testVectorizedFit(self):
+    ''' compare the vectorized maximum-likelihood fit with the scipy fit at every point '''
+    import utils.stats as myss
+    # random test data with some missing values
+    samples = ss.genextreme.rvs(-0.1, loc=10, scale=3, size=(20,30))
+    samples[0,:5] = np.NaN; samples[1,:] = np.NaN
+    for dist,kwargs in (('norm',dict()), ('gumbel_r',dict()), ('genextreme',dict()),
+                        ('genextreme',dict(f0=0)), ('gamma',dict(floc=0)), ('weibull_min',dict(floc=0))):
+      params, converged, niter = myss.mle_fit(samples, dist, axis=-1, **kwargs)
+      assert params.shape == (20,myss.vectorized_dists[dist])
+      assert np.all(np.isnan(params[1,:])) and not converged[1]
+      assert np.all(converged[2:]) and niter.max() < 100
+      if 'f0' in kwargs: assert isZero(params[:,0][converged])
+      # the likelihood should be at least as high as with the scipy fit
+      for i in (0,2,3):
+        sample = samples[i,np.invert(np.isnan(samples[i,:]))]
+        sparams = getattr(ss,dist).fit(sample, **kwargs)
+        llv = getattr(ss,dist).logpdf(sample, *params[i,:]).sum()
+        lls = getattr(ss,dist).logpdf(sample, *sparams).sum()
+        assert llv >= lls - 1e-3*np.abs(lls), (dist, llv, lls)
+    # vectorized fit through VarRV
+    var = Variable(name='MaxPrecip', units='mm/day', axes=self.axes,
+                   data=ss.gumbel_r.rvs(loc=10, scale=3, size=self.size))
+    distvar = var.fitDist(axis='time', dist='genextreme', lvectorize=True)
+    assert distvar.shape == self.size[1:]+(3,)
+    assert distvar.fit_converged.shape == self.size[1:] and np.all(distvar.fit_converged)
+    # initial guesses, persistence and unsupported shape constraints imply the scipy fit
+    assert rv_fit_vectorizable('genextreme', lpositiveShape=True)
+    assert not rv_fit_vectorizable('genextreme', ic_shape=0.1) and not rv_fit_vectorizable('norm', lpersist=True)
+    assert not rv_fit_vectorizable('gamma', floc=0, lpositiveShape=True)
+    distvar = var.fitDist(axis='time', dist='genextreme', ic_shape=0.1)
+    assert distvar.shape == self.size[1:]+(3,) and distvar.fit_converged is None
+
+  def testVectorizedKDE(self):
+    ''' compare the vectorized KDE evaluation with the per-point evaluation of the kernels '''
+    from geodata.stats import kde_eval, kde_cdf
+    data = ss.gamma.rvs(2, loc=0, scale=3, size=self.size)
+    data[:,0,0] = np.NaN; data[:12,1,2] = np.NaN # no kernel and a smaller sample
+    var = Variable(name='test', units='', axes=self.axes, data=data)
+    distvar = var.fitDist(axis='time', dist='kde')
+    support = np.linspace(-5, 30, 50)
+    pdf = np.ma.filled(distvar.pdf(support=support, asVar=False), np.NaN)
+    cdf = np.ma.filled(distvar.cdf(support=support, asVar=False), np.NaN)
+    assert pdf.shape == cdf.shape == self.size[1:]+(len(support),)
+    for idx in np.ndindex(self.size[1:]):
+      kde = (distvar.data_array[idx],)
+      refpdf = kde_eval(kde, support=support, n=len(support)); refcdf = kde_cdf(kde, support=support, n=len(support))
+      if kde[0] is None: assert np.all(np.isnan(pdf[idx])) and np.all(np.isnan(cdf[idx]))
+      else: assert np.allclose(pdf[idx], refpdf, rtol=1e-10, atol=1e-14) and np.allclose(cdf[idx], refcdf, rtol=1e-8, atol=1e-12)
+
+  def testCrossValKFold(self):
+    ''' test k-fold cross-validation with missing values '''
+    data = ss.norm.rvs(loc=10, scale=3, size=self.size)
+    data[:,0,0] = np.NaN; data[5,1,2] = np.NaN # one invalid and one point with a missing value
+    var = Variable(name='test', units='', axes=self.axes, data=data)
+    distvar = var.fitDist(axis='time', dist='norm', lcrossval=True, ncv=4, crossval_mode='kfold')
+    assert distvar.crossval_folds.shape == (4,)+self.size[1:]+self.size[:1]
+    pval = distvar.kstest(var, lcrossval=True, ignoreNaN=True, asVar=False)
+    pval = np.ma.filled(pval, np.NaN)
+    assert np.isnan(pval[0,0]) and np.isfinite(pval[1,2]) and np.sum(np.isfinite(pval)) == 7 
+    # without ignoreNaN, the point with a missing value is invalid, but not the others
+    pval = distvar.kstest(var, lcrossval=True, ignoreNaN=False, asVar=False)
+    pval = np.ma.filled(pval, np.NaN)
+    assert np.isnan(pval[0,0]) and np.isnan(pval[1,2]) and np.sum(np.isfinite(pval)) == 6 
+
+  def testBootstrap(self):
+    ''' test batched bootstrap fits: reproducibility, batch size and comparison with per-replicate resampling '''
+    from geodata.stats import resampling_indices
+    rng = np.random.RandomState(42); nbs = 200
+    data = ss.norm.rvs(loc=10, scale=3, size=self.size, random_state=rng)
+    var = Variable(name='test', units='', axes=self.axes, data=data)
+    # resampling indices are reproducible and only depend on the seed
+    idx = resampling_indices(8, 48, 48, seed=1)
+    assert idx.shape == (8,48) and idx.min() >= 0 and idx.max() < 48 and np.all(idx == resampling_indices(8, 48, 48, seed=1))
+    idx = resampling_indices(8, 48, 20, seed=1, replace=False)
+    assert idx.shape == (8,20) and all(len(np.unique(row)) == 20 for row in idx)
+    # fixed seeds give identical results, independent of the batch size
+    bootstrap = lambda **kwargs: var.fitDist(axis='time', dist='norm', lbootstrap=True, nbs=nbs, **kwargs)
+    distvar = bootstrap(bs_seed=42, bs_batch=7)
+    params = distvar.data_array
+    assert distvar.shape == (nbs,)+self.size[1:]+(2,) and distvar.axes[0].name == 'bootstrap'
+    assert np.all(bootstrap(bs_seed=42, bs_batch=nbs).data_array == params)
+    assert np.all(bootstrap(bs_seed=42, bs_batch=1).data_array == params)
+    assert not np.all(bootstrap(bs_seed=43, bs_batch=7).data_array == params)
+    # the first replicate is the original sample
+    assert isEqual(params[0,:], var.fitDist(axis='time', dist='norm').data_array)
+    # compare to fitting all replicates at once, after drawing each replicate separately
+    samples = np.rollaxis(data, 0, data.ndim).reshape((-1,self.size[0])); npt = len(samples)
+    pidx = np.arange(npt).reshape((npt,1))
+    replicates = [samples] + [samples[pidx,resampling_indices(npt, self.size[0], self.size[0], seed=42+i)] 
+                              for i in xrange(1,nbs)]
+    replicates = np.stack(replicates).reshape((nbs,)+self.size[1:]+self.size[:1])
+    bsax = Axis(name='bootstrap', units='', coord=np.arange(nbs))
+    refvar = Variable(name='test', units='', axes=(bsax,)+self.axes[1:]+self.axes[:1], data=replicates)
+    assert isEqual(refvar.fitDist(axis='time', dist='norm').data_array, params)
+    # statistics of the bootstrap distribution agree with the original sampling loop (random draws per point)
+    oldsmpl = np.zeros((nbs,)+samples.shape); oldsmpl[0,:] = samples
+    for i in xrange(1,nbs):
+      oldsmpl[i,:] = np.apply_along_axis(rng.choice, -1, samples, size=self.size[0], replace=True)
+    oldsmpl = oldsmpl.reshape(replicates.shape)
+    refvar = Variable(name='test', units='', axes=(bsax,)+self.axes[1:]+self.axes[:1], data=oldsmpl)
+    oldparams = refvar.fitDist(axis='time', dist='norm').data_array
+    assert oldparams.shape == params.shape
+    stderr = 3./np.sqrt(self.size[0]) # standard error of the mean
+    assert np.allclose(params[:,:,:,0].mean(axis=0), oldparams[:,:,:,0].mean(axis=0), atol=0.5*stderr)
+    assert np.allclose(params[:,:,:,0].std(axis=0), oldparams[:,:,:,0].std(axis=0), rtol=0.25)
+    assert np.allclose(params[:,:,:,0].std(axis=0), params[0,:,:,1]/np.sqrt(self.size[0]), rtol=0.3)
+
   def testEnsemble(self):
     ''' test the Ensemble container class '''
     # test object
@@ -419,6 +527,19 @@ class BaseVarTest(unittest.TestCase):
         # check
         assert gridvar.hasAxis(x.name) and gridvar.hasAxis(y.name), gridvar
         assert gridvar.shape == (len(t),len(x),len(y)), gridvar
+        # compare to griddata (weights are computed once for all slices and cached)
+        from scipy.interpolate import griddata
+        from geodata.base import getPointGridder
+        var = Variable(axes=(t,s), data=rnd.rand(len(t),pts), name='data', units='none')
+        gvec = (x[:].reshape((size,1)), y[:].reshape((1,size)))
+        for method in ('nearest','linear','cubic'):
+            gridvar = var.gridVar(point_axis=s.name, coord_vars=(xv,yv), grid_axes=(x,y), method=method)
+            assert gridvar.shape == (len(t),len(x),len(y)), gridvar
+            for i in range(len(t)):
+                ref = griddata((xv[:],yv[:]), var[i,:], gvec, method=method)
+                assert np.allclose(gridvar[i,:], ref, equal_nan=True), method
+            gridder = getPointGridder((xv[:],yv[:]), gvec, method=method)
+            assert getPointGridder((xv[:],yv[:]), gvec, method=method) is gridder
 
   def testIndexing(self):
     ''' test indexing and slicing '''
@@ -1820,6 +1941,116 @@ class GDALVarTest(NetCDFVarTest):
                                 prefix=var.atts.long_name, ext='')
     for filepath in filelist: assert os.path.exists(filepath), filepath
 
+  def testASCIIroundTrip(self):
+    ''' test that natively written (and compressed) ASCII raster files can be restored exactly '''
+    from utils.ascii import readASCIIraster
+    # get test objects
+    var = self.var # NCVar object
+    if var.hasAxis('time'): var = var(time=slice(0,100,10)) # not too much...
+    var.load()
+    # prepare folder for test data
+    folder = '{:s}/ASCII_raster/'.format(workdir)
+    if os.path.exists(folder): shutil.rmtree(folder)
+    os.mkdir(folder)
+    # single and double precision, written in parallel and with a compressed file extension
+    for dtype in (np.float32, np.float64):
+      tmp = var.copy(data=var.data_array.astype(dtype))
+      filelist = tmp.ASCII_raster(filepath=folder+'test.asc.gz', fillValue=-9999, NP=2)
+      assert len(filelist) == tmp.bands, filelist
+      refs = tmp.data_array.reshape((tmp.bands,)+tmp.mapSize)
+      for filepath,ref in zip(filelist,refs):
+        assert filepath.endswith('.asc.gz') and os.path.exists(filepath), filepath
+        data, geotransform = readASCIIraster(filepath, dtype=dtype, lmask=True, lgeotransform=True)
+        assert isEqual(np.asarray(geotransform), np.asarray(tmp.geotransform)), geotransform
+        assert np.all(ma.getmaskarray(data) == ma.getmaskarray(ref)) 
+        assert np.all(data.compressed() == ref.compressed()) # lossless
+      # 2D slice
+      filepath = tmp(time=0, lidx=True).ASCII_raster(filepath=folder+'test_2D.asc', lgzip=True) if tmp.ndim > 2 else None
+      if filepath: assert filepath.endswith('.asc.gz') and os.path.exists(filepath), filepath
+
+  def testReadASCIIrasters(self):
+    ''' test the native ESRI ASCII grid parser and parallel reading of multi-dimensional rasters '''
+    import gzip
+    from utils.ascii import readRasterArray, readESRIgrid
+    # prepare folder for test data
+    folder = '{:s}/ASCII_rasters/'.format(workdir)
+    if os.path.exists(folder): shutil.rmtree(folder)
+    os.mkdir(folder)
+    # write small compressed rasters; the first data row starts with 'nan' 
+    je, ie = 4, 5; years = range(2000,2003); months = range(1,5)
+    header = 'ncols {:d}\nnrows {:d}\nxllcorner -100.0\nyllcorner 40.0\ncellsize 0.5\nNODATA_value -9999\n'.format(ie,je)
+    refs = rnd.randn(len(years),len(months),je,ie).astype(np.float32)
+    refs[...,0,0] = np.NaN # first value of the first data row (top)
+    refs[...,1,1] = -9999 # no-data value
+    for y,year in enumerate(years):
+      for m,month in enumerate(months):
+        if y == 1 and m == 2: continue # a missing file
+        f = gzip.open(folder+'test_{:04d}_{:02d}.asc.gz'.format(year,month), 'wb')
+        f.write(header + '\n'.join(' '.join('{:.9g}'.format(val) for val in row) for row in refs[y,m,:,:]) + '\n')
+        f.close()
+    refs = ma.masked_equal(refs[...,::-1,:], -9999) # rasters are flipped (south-up)
+    refs[1,2,:,:] = ma.masked; refs[...,-1,0] = ma.masked # missing raster and NaN's (can't compare)
+    # native parser: 'nan' in the first data row is not a header; keyword arguments go to genfromtxt
+    filepath = folder+'test_2000_01.asc.gz'
+    data, geotransform, na = readESRIgrid(filepath, lgzip=None, dtype=np.float32)
+    assert data.shape == (je,ie) and na == -9999 and geotransform == (-100.,0.5,0.,40.,0.,0.5), geotransform
+    assert np.isnan(data[-1,0]) and data.mask[-2,1] and np.all(data[:-1,:].compressed() == refs[0,0,:-1,:].compressed())
+    data2 = readESRIgrid(filepath, lgzip=None, dtype=np.float32, comments='#')[0]
+    assert np.all(data2.mask == data.mask) and np.all(data2.filled(0)[:-1,:] == data.filled(0)[:-1,:])
+    self.assertRaises(TypeError, readESRIgrid, filepath, lgzip=None, nonsense=True)
+    # serial and parallel reading of all rasters (with a missing raster)
+    file_pattern = folder+'test_{YEAR:04d}_{MONTH:02d}.asc.gz'
+    for NP in (1,2):
+      data, geotransform = readRasterArray(file_pattern, lgzip=None, lgdal=False, dtype=np.float32, lmask=True, 
+                                           axes=('YEAR','MONTH'), YEAR=years, MONTH=months, lskipMissing=True, NP=NP)
+      assert data.shape == refs.shape and geotransform == (-100.,0.5,0.,40.,0.,0.5), geotransform
+      assert np.all(data.mask[1,2,:,:]) and np.all(data.mask[...,-2,1])
+      data[...,-1,0] = ma.masked # can't compare NaN's
+      assert np.all(data.mask == refs.mask) and np.all(data.compressed() == refs.compressed())
+    shutil.rmtree(folder)
+
+  def testWriteRasterStack(self):
+    ''' test round-trip of multi-band raster stacks in flat binary and GeoTIFF format '''
+    from osgeo import gdal
+    from geodata.gdal import getRasterArray, writeBinaryRaster, writeGeoTIFF
+    # get test objects
+    var = self.var # NCVar object
+    if var.hasAxis('time'): var = var(time=slice(0,100,10)) # not too much...
+    data, geotransform, noDataValue = getRasterArray(var, noDataValue=-9999)
+    data = data.astype(np.float32); nb,je,ie = data.shape
+    # prepare folder for test data
+    folder = '{:s}/raster_stack/'.format(workdir)
+    if os.path.exists(folder): shutil.rmtree(folder)
+    os.mkdir(folder)
+    ## flat binary with ESRI header
+    filepath = folder+var.name+'.bsq'
+    headerfile = writeBinaryRaster(filepath, data, geotransform, noDataValue=noDataValue, dtype='float32', 
+                                   atts=dict(VARIABLE=var.name))
+    with open(headerfile, 'r') as f: 
+      header = {key:value.strip() for key,value in (line.split(None,1) for line in f)}
+    assert (int(header['NBANDS']),int(header['NROWS']),int(header['NCOLS'])) == data.shape, header
+    assert header['VARIABLE'] == var.name and header['PIXELTYPE'] == 'FLOAT', header
+    assert isEqual(float(header['ULXMAP']), geotransform[0]+geotransform[1]/2.), header
+    assert isEqual(float(header['ULYMAP']), geotransform[3]+geotransform[5]/2.), header
+    if noDataValue is not None: assert float(header['NODATA']) == noDataValue, header
+    assert np.all(np.fromfile(filepath, dtype='<f4').reshape(data.shape) == data)
+    # GDAL can read the header as well
+    dataset = gdal.Open(filepath)
+    assert dataset.RasterCount == nb and isEqual(np.asarray(dataset.GetGeoTransform()), np.asarray(geotransform))
+    assert np.all(dataset.ReadAsArray().reshape(data.shape) == data)
+    dataset = None
+    ## GeoTIFF (tiled and compressed)
+    filepath = writeGeoTIFF(folder+var.name+'.tif', data, geotransform, projection=var.projection, 
+                            noDataValue=noDataValue, dtype='float32', atts=dict(VARIABLE=var.name), 
+                            blocksize=16, compress='DEFLATE')
+    dataset = gdal.Open(filepath)
+    assert dataset.RasterCount == nb and dataset.GetMetadata()['VARIABLE'] == var.name
+    assert isEqual(np.asarray(dataset.GetGeoTransform()), np.asarray(geotransform))
+    assert np.all(dataset.ReadAsArray().reshape(data.shape) == data)
+    if noDataValue is not None: assert dataset.GetRasterBand(1).GetNoDataValue() == noDataValue
+    assert dataset.GetRasterBand(1).GetBlockSize() == [16,16]
+    dataset = None
+
 
 class DatasetGDALTest(DatasetNetCDFTest):  
   
@@ -1862,6 +2093,53 @@ class DatasetGDALTest(DatasetNetCDFTest):
     for var in dataset.variables.values():
       assert (var.ndim >= 2 and var.hasAxis(dataset.xlon) and var.hasAxis(dataset.ylat)) == var.gdal              
 
+  def testGridDefinition(self):
+    ''' test lazy geolocators and the grid definition registry '''
+    from geodata.gdal import GridDefinition, pickleGridDef, loadPickledGridDef
+    import pickle, tempfile, shutil
+    griddef = self.dataset.griddef
+    griddef = GridDefinition(name='test', projection=griddef.projection, xlon=griddef.xlon, ylat=griddef.ylat)
+    assert griddef.geolocator and 'lon2D' not in griddef._geolocators # not computed yet
+    lon2D, lat2D = griddef.lon2D, griddef.lat2D
+    assert lon2D.shape == lat2D.shape == (len(griddef.ylat),len(griddef.xlon))
+    # geolocators are not pickled, but recomputed on demand
+    copy = pickle.loads(pickle.dumps(griddef, protocol=2))
+    assert 'lon2D' not in copy._geolocators and isEqual(copy.lon2D, lon2D) and isEqual(copy.lat2D, lat2D)
+    # the registry only unpickles once, until the pickle changes, but returns copies with new axes
+    import weakref
+    from geodata.gdal import _griddef_registry
+    folder = tempfile.mkdtemp()
+    pickleGridDef(griddef, folder=folder, lfeedback=False)
+    first = loadPickledGridDef(grid='test', folder=folder)
+    getRegistered = lambda: [gd for key,(stamp,gd) in _griddef_registry.items() if key[2].startswith(folder)][0]
+    registered = getRegistered()
+    second = loadPickledGridDef(grid='test', folder=folder)
+    assert first is not registered and second is not registered and first is not second
+    assert first.xlon is not second.xlon and first.ylat is not second.ylat
+    assert first.projection is registered.projection and isEqual(first.xlon.coord, second.xlon.coord)
+    assert loadPickledGridDef(grid='test', folder=folder, lcache=False) is not registered
+    # geolocators are computed once for all copies (and the registered instance)
+    ncalls = []; compute = GridDefinition.computeGeolocators
+    GridDefinition.computeGeolocators = lambda self: ncalls.append(1) or compute(self)
+    try:
+      assert 'lon2D' not in registered._geolocators
+      assert isEqual(first.lon2D, lon2D) and second.lat2D is first.lat2D and registered.lon2D is first.lon2D
+      third = loadPickledGridDef(grid='test', folder=folder)
+      assert third.lon2D is first.lon2D and len(ncalls) == 1
+      # replacing geolocators does not affect other copies
+      third.lon2D = lon2D.copy(); assert third.lon2D is not first.lon2D and registered.lon2D is first.lon2D
+    finally: GridDefinition.computeGeolocators = compute
+    del third
+    # datasets using the grid are not kept alive by the registry
+    dataset = Dataset(name='test', axes=(first.xlon, first.ylat))
+    assert first.xlon.dataset is dataset and second.xlon.dataset is None
+    ref = weakref.ref(dataset); del dataset, first; gc.collect()
+    assert ref() is None
+    pickleGridDef(griddef, folder=folder, lfeedback=False)
+    loadPickledGridDef(grid='test', folder=folder)
+    assert getRegistered() is not registered
+    shutil.rmtree(folder)
+
   def testIndexing(self):
     # check if GDAL features are propagated
     dataset = self.dataset # dataset object
@@ -1987,6 +2265,7 @@ if __name__ == "__main__":
 #     specific_tests += ['Copy']
 #     specific_tests += ['ApplyToAll']
 #     specific_tests += ['AddProjection']
+#     specific_tests += ['GridDefinition']
 #     specific_tests += ['Indexing']
 #     specific_tests += ['SeasonalReduction']
 #     specific_tests += ['MapReduction']
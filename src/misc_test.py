@@ -42,16 +42,16 @@ class MultiProcessTest(unittest.TestCase):
 
   def testApplyAlongAxis(self):
     ''' test parallelized version of Numpy's apply_along_axis '''    
-    from processing.multiprocess import apply_along_axis, test_aax, test_noaax
+    from processing.multiprocess import apply_along_axis, test_aax, test_noaax, getApplyPool
     import functools
     
-    def run_test(fct, kw=0, axis=1, laax=True):
+    def run_test(fct, kw=0, axis=1, laax=True, lshared=True):
       ff = functools.partial(fct, kw=kw)
       shape = (500,100)
       data = np.arange(np.prod(shape), dtype='float').reshape(shape)
       assert data.shape == shape
       # parallel implementation using my wrapper
-      pres = apply_along_axis(ff, axis, data, NP=2, ldebug=True, laax=laax)
+      pres = apply_along_axis(ff, axis, data, NP=2, ldebug=True, laax=laax, lshared=lshared)
       print pres.shape
       assert pres.shape == data.shape
       assert isZero(pres.mean(axis=axis)+kw) and isZero(pres.std(axis=axis)-1.)
@@ -65,6 +65,41 @@ class MultiProcessTest(unittest.TestCase):
     # run tests 
     run_test(test_noaax, kw=1, laax=False) # without Numpy's apply_along_axis
     run_test(test_aax, kw=1, laax=True) # Numpy's apply_along_axis
+    pool = getApplyPool(2) # the worker pool persists between calls
+    run_test(test_aax, kw=1, laax=True, lshared=False) # pickle data instead of shared memory
+    assert getApplyPool(2) is pool
+    # reduction along a different axis, with masked input (can not use shared memory)
+    data = np.ma.masked_less(np.arange(500*100, dtype='float').reshape((100,500)), 10)
+    pres = apply_along_axis(np.ma.mean, 0, data, NP=2, chunksize=100, laax=False)
+    assert pres.shape == (500,) and isEqual(pres, data.mean(axis=0))
+    pres = apply_along_axis(np.mean, 0, data.filled(0), NP=2, chunksize=100, laax=False)
+    assert pres.shape == (500,) and isEqual(pres, data.filled(0).mean(axis=0))
+    # functions defined in __main__ after the workers were forked require a new pool
+    from processing.multiprocess import isForkSafe, snapshotMain, waitForResults, WorkerError, closeApplyPool
+    def late(arr, axis=0): return arr
+    assert isForkSafe(test_aax, dict()) and isForkSafe(functools.partial(np.mean, axis=1), dict())
+    late.__module__ = '__main__'
+    assert not isForkSafe(functools.partial(late, axis=1), snapshotMain())
+    pool = getApplyPool(2); assert getApplyPool(2, fct=late) is not pool
+    # a dead worker raises an error, instead of blocking forever
+    pool = getApplyPool(2)
+    self.assertRaises(WorkerError, waitForResults, [pool.apply_async(os._exit, (1,))], pool, interval=0.1)
+    closeApplyPool(lterminate=True)
+    
+  def testApplyAlongAxisInPool(self):
+    ''' test apply_along_axis in pool jobs, after the parent process has used its persistent pool '''
+    import processing.multiprocess as mp
+    from processing.multiprocess import apply_along_axis, getApplyPool, asyncPoolEC, test_func_aax
+    data = np.arange(400, dtype='float').reshape((100,4))
+    assert isEqual(apply_along_axis(np.sum, 1, data, NP=2, chunksize=10), data.sum(axis=1))
+    # daemonic pool workers run serially (instead of using the parent's pool, which would block)
+    ec = asyncPoolEC(test_func_aax, [(n,) for n in xrange(1,4)], dict(), NP=2, ldebug=ldebug, ltrialnerror=True)
+    assert ec == 0
+    # a pool that was inherited from another process is replaced
+    pool = getApplyPool(2); mp._aax_pool_pid = -1
+    assert getApplyPool(2) is not pool
+    pool.terminate(); pool.join()
+    mp.closeApplyPool()
 
   
   def testAsyncPool(self):
@@ -79,8 +114,258 @@ class MultiProcessTest(unittest.TestCase):
     ec = asyncPoolEC(test_func_ec, args, kwargs, NP=NP, ldebug=ldebug, ltrialnerror=False)
     assert ec == 0
     
+  def testAsyncPoolSchedule(self):
+    ''' test size-aware scheduling with memory limit and runtime recording '''    
+    from processing.multiprocess import asyncPoolEC, test_func_dec, test_func_ec, test_func_dag, loadRuntimes, getJobKey
+    import tempfile, shutil
+    folder = tempfile.mkdtemp()
+    runtime_file = '{:s}/runtimes.json'.format(folder)
+    args = [(n,) for n in xrange(5)]
+    kwargs = dict(wait=0.1)
+    costs = [1,5,2,4,3]; memory = [1,2,1,2,4] # last job exceeds memory limit and runs alone
+    ec = asyncPoolEC(test_func_dec, args, kwargs, NP=NP, ldebug=ldebug, ltrialnerror=True, 
+                     costs=costs, memory=memory, max_memory=3, runtime_file=runtime_file)
+    assert ec == 0
+    ec = asyncPoolEC(test_func_ec, args, kwargs, NP=NP, ldebug=ldebug, ltrialnerror=True, 
+                     costs=costs, memory=memory, max_memory=3)
+    assert ec == 4
+    # runtimes of successful jobs are recorded
+    runtimes = loadRuntimes(runtime_file)
+    assert all(getJobKey(arguments) in runtimes for arguments in args)
+    # a job that kills its worker fails, instead of blocking forever; the other jobs still run
+    fp = lambda n: '{:s}/output_{:d}.txt'.format(folder,n)
+    args = [(n, None, fp(n), 0.1*n, n == 2) for n in xrange(6)] # n, inputs, output, wait, lexit
+    ec = asyncPoolEC(test_func_dag, args, dict(), NP=NP, ldebug=ldebug, ltrialnerror=True, 
+                     costs=[1]*len(args), interval=0.1)
+    assert ec == 1
+    assert all(os.path.exists(fp(n)) != (n == 2) for n in xrange(len(args)))
+    shutil.rmtree(folder)
+    
+  def testWorkerPool(self):
+    ''' test the managed worker pool service '''
+    from processing.multiprocess import startWorkerPool, getWorkerPool, stopWorkerPool, getApplyPool
+    from processing.multiprocess import asyncPoolEC, apply_along_axis, test_func_dec, test_noaax
+    pool = startWorkerPool(NP=NP, modules=('numpy',))
+    assert getWorkerPool() is pool and pool.ping()
+    pids = set(process.pid for process in pool.pool._pool)
+    # submit tasks directly
+    assert pool.submit(max, args=(1,2)).get() == 2
+    assert pool.map(abs, [-1,-2,3]) == [1,2,3]
+    # parallel operations use the managed pool and do not shut it down
+    assert getApplyPool(NP+1) is pool.pool
+    data = np.arange(1000*10, dtype='float').reshape((1000,10))
+    assert isEqual(apply_along_axis(test_noaax, 1, data, NP=NP, chunksize=100, laax=False), test_noaax(data, axis=1))
+    args = [(n,) for n in xrange(4)]
+    assert asyncPoolEC(test_func_dec, args, dict(wait=0.1), NP=NP, ldebug=ldebug, ltrialnerror=True) == 0
+    assert pool.ping() and set(process.pid for process in pool.pool._pool) == pids
+    # restart replaces workers
+    pool.restart()
+    assert pool.ping() and not pids.intersection(process.pid for process in pool.pool._pool)
+    # clean shutdown
+    stopWorkerPool()
+    assert getWorkerPool() is None and not pool.running and not pool.ping()
+    self.assertRaises(ValueError, pool.submit, max, (1,2))
+    
+  def testTelemetry(self):
+    ''' test per-task telemetry records and summary '''    
+    from processing.multiprocess import asyncPoolEC, test_func_dag, loadTelemetry, summarizeTelemetry
+    import tempfile, shutil
+    folder = tempfile.mkdtemp()
+    telemetry_file = '{:s}/telemetry.jsonl'.format(folder)
+    args = [(n,) for n in xrange(-1,3)] # first job fails
+    kwargs = dict(output='{:s}/output.txt'.format(folder))
+    ec = asyncPoolEC(test_func_dag, args, kwargs, NP=NP, ldebug=ldebug, ltrialnerror=True, 
+                     telemetry_file=telemetry_file)
+    assert ec == 1
+    records = loadTelemetry(telemetry_file)
+    assert len(records) == len(args)
+    assert len(set(record['run'] for record in records)) == 1
+    assert sorted(record['job'] for record in records) == sorted('[{:d}]'.format(n) for n, in args)
+    for record in records:
+      assert record['ec'] == (1 if record['job'] == '[-1]' else 0)
+      assert record['wall'] >= record['phases']['write'] >= 0
+      assert isEqual(sum(record['phases'].values()), record['wall'])
+    # summary table with one row per task and totals
+    table = summarizeTelemetry(records)
+    assert 'Total' in table and 'Write [s]' in table
+    shutil.rmtree(folder)
+    
+  def testAsyncPoolDAG(self):
+    ''' test DAG scheduler with file dependencies '''    
+    from processing.multiprocess import asyncPoolDAG, DAGJob, test_func_dag
+    import tempfile, shutil
+    folder = tempfile.mkdtemp()
+    fp = lambda name: '{:s}/{:s}.txt'.format(folder,name)
+    # chain: a -> b -> d, c -> d, and a failing job f -> g (g is skipped)
+    jobs = []
+    jobs.append(DAGJob(test_func_dag, args=(4,), kwargs=dict(inputs=[fp('b')], output=fp('d')), 
+                       inputs=[fp('b')], outputs=[fp('d')], name='b->d'))
+    jobs.append(DAGJob(test_func_dag, args=(2,), kwargs=dict(inputs=[fp('a')], output=fp('b')), 
+                       inputs=[fp('a')], outputs=[fp('b')], name='a->b'))
+    jobs.append(DAGJob(test_func_dag, args=(1,), kwargs=dict(output=fp('a')), outputs=[fp('a')], name='a'))
+    jobs.append(DAGJob(test_func_dag, args=(-1,), kwargs=dict(output=fp('f')), outputs=[fp('f')], name='f'))
+    jobs.append(DAGJob(test_func_dag, args=(0,), kwargs=dict(inputs=[fp('f')], output=fp('g')), 
+                       inputs=[fp('f')], outputs=[fp('g')], name='f->g'))
+    for nproc in (1,NP):
+      ec = asyncPoolDAG(jobs, NP=nproc, ldebug=ldebug, ltrialnerror=True)
+      assert ec == 2 # f failed and g was skipped
+      assert int(open(fp('d')).read()) == 7
+      assert not os.path.exists(fp('g'))
+      for name in 'abdf': os.remove(fp(name))
+    # missing inputs that no job produces: only non-strict jobs run
+    jobs = [DAGJob(test_func_dag, args=(3,), kwargs=dict(output=fp('h')), inputs=[fp('x')], outputs=[fp('h')], 
+                   name='x->h', lstrict=False),
+            DAGJob(test_func_dag, args=(3,), kwargs=dict(output=fp('i')), inputs=[fp('x')], outputs=[fp('i')], name='x->i')]
+    assert asyncPoolDAG(jobs, NP=NP, ldebug=ldebug) == 1
+    assert os.path.exists(fp('h')) and not os.path.exists(fp('i'))
+    # a dead worker raises an error, instead of blocking forever
+    from processing.multiprocess import WorkerError
+    jobs = [DAGJob(test_func_dag, args=(0,), kwargs=dict(output=fp('j'), lexit=True), outputs=[fp('j')], name='exit')]
+    self.assertRaises(WorkerError, asyncPoolDAG, jobs, NP=NP, ldebug=ldebug, interval=0.1)
+    # cyclic dependencies
+    jobs = [DAGJob(test_func_dag, args=(0,), inputs=[fp('p')], outputs=[fp('q')], name='p->q'),
+            DAGJob(test_func_dag, args=(0,), inputs=[fp('q')], outputs=[fp('p')], name='q->p')]
+    self.assertRaises(ValueError, asyncPoolDAG, jobs, NP=1)
+    shutil.rmtree(folder)
+    
 
   
+## tests for processing utilities
+class ProcessingTest(unittest.TestCase):  
+   
+  def setUp(self):
+    ''' create a temporary folder '''
+    import tempfile
+    self.folder = tempfile.mkdtemp() + '/'
+      
+  def tearDown(self):
+    ''' clean up '''
+    import shutil
+    shutil.rmtree(self.folder)
+    gc.collect()
+
+  def testRunJournal(self):
+    ''' test resuming an interrupted job from a checkpoint '''
+    from geodata.base import Dataset, Variable, Axis
+    from geodata.netcdf import DatasetNetCDF
+    from processing.process import CentralProcessingUnit
+    from processing.misc import RunJournal
+    x = Axis(name='x', units='', coord=np.arange(5.))
+    source = Dataset(name='source', varlist=[Variable(name=name, units='', axes=(x,), data=np.arange(5.)+i) 
+                                             for i,name in enumerate(('a','b','c'))])
+    tmpfilepath = self.folder + 'tmp_test.nc'
+    calls = []
+    def double(var, fail=None):
+      calls.append(var.name)
+      if var.name == fail: raise ValueError, var.name # interrupt job
+      return var.copy(data=var.data_array*2)
+    def run(fail=None):
+      journal = RunJournal(tmpfilepath, job='test.nc')
+      if os.path.exists(tmpfilepath): os.remove(tmpfilepath)
+      sink = DatasetNetCDF(folder=self.folder, filelist=['tmp_test.nc'], atts=dict(name='test'), mode='w')
+      CPU = CentralProcessingUnit(source, sink, tmp=False, feedback=False, journal=journal)
+      try: CPU.process(lambda var: double(var, fail=fail), flush=True)
+      finally: sink.close()
+      return journal
+    # first run is interrupted after one variable
+    fail = source.variables.keys()[1]
+    self.assertRaises(ValueError, run, fail=fail)
+    assert len(calls) == 2
+    # second run restores the first variable and only computes the rest
+    del calls[:]
+    journal = run()
+    assert calls == source.variables.keys()[1:]
+    assert sorted(journal.units) == ['a','b','c']
+    sink = DatasetNetCDF(folder=self.folder, filelist=['tmp_test.nc'], mode='r')
+    for var in source: assert isEqual(sink[var.name][:], var[:]*2)
+    sink.close()
+    # remove journal after job is completed
+    journal.discard()
+    assert os.listdir(self.folder) == ['tmp_test.nc']
+
+  def testFingerprint(self):
+    ''' test content fingerprints for incremental rebuilds '''
+    import shutil, time
+    import netCDF4 as nc
+    from datetime import datetime, timedelta
+    from processing.misc import getFingerprint, isUpToDate, readFingerprint
+    # source files in two locations
+    os.mkdir(self.folder+'src'); os.mkdir(self.folder+'copy')
+    srcfile = self.folder+'src/source.dat'; cpyfile = self.folder+'copy/source.dat'
+    with open(srcfile, 'wb') as f: f.write(np.random.rand(2**16).tostring()) # larger than sample
+    shutil.copy(srcfile, cpyfile); time.sleep(0.01); os.utime(cpyfile, None) # touch copy
+    fingerprint = getFingerprint([srcfile], params=dict(grid='test'), version=1)
+    # fingerprint does not depend on location or modification time, but on parameters and content
+    assert fingerprint == getFingerprint([cpyfile], params=dict(grid='test'), version=1)
+    assert fingerprint != getFingerprint([srcfile], params=dict(grid='other'), version=1)
+    assert fingerprint != getFingerprint([srcfile], params=dict(grid='test'), version=2)
+    with open(cpyfile, 'r+b') as f: f.seek(0); f.write('modified')
+    assert fingerprint != getFingerprint([cpyfile], params=dict(grid='test'), version=1)
+    # legacy output without fingerprint: newer than source is adopted, older is rebuilt
+    outfile = self.folder+'output.nc'
+    ncfile = nc.Dataset(outfile, 'w'); ncfile.setncattr('name','test'); ncfile.close()
+    assert not isUpToDate(outfile, fingerprint, srcage=datetime.now()+timedelta(days=1))
+    assert readFingerprint(outfile) is None
+    assert isUpToDate(outfile, fingerprint, srcage=datetime.now()-timedelta(days=1))
+    assert readFingerprint(outfile) == fingerprint
+    # with fingerprint, only the fingerprint matters
+    assert isUpToDate(outfile, fingerprint, srcage=datetime.now()+timedelta(days=1))
+    assert not isUpToDate(outfile, fingerprint[::-1], srcage=None)
+    # output folders store the fingerprint in a file
+    assert isUpToDate(self.folder+'src', fingerprint, srcage=None)
+    assert readFingerprint(self.folder+'src') == fingerprint
+
+  def testJobCosts(self):
+    ''' test job cost estimates from recorded runtimes, with records missing for some jobs '''
+    from processing.misc import getJobCosts, getJobMemory
+    from processing.multiprocess import saveRuntimes, getJobKey
+    runtime_file = self.folder+'runtimes.json'
+    args = [('NoData', 'climatology', dict(period=n)) for n in xrange(4)]
+    saveRuntimes(runtime_file, {getJobKey(args[n]):runtime for n,runtime in enumerate((10.,30.,20.))})
+    # the new job is assumed to take the median of the known runtimes
+    assert getJobCosts(args, runtime_file=runtime_file) == [10.,30.,20.,20.]
+    # without any records, the size of the source files is used (no files here)
+    assert getJobCosts(args[3:], runtime_file=runtime_file) == [0]
+    assert getJobMemory(args, factor=2.) == [0.]*4
+
+  def testQuantileMapping(self):
+    ''' test training and application of quantile mapping bias correction '''
+    import pickle
+    from processing.bc_methods import getBCmethods
+    # daily time-series with different distributions on a small grid
+    time = Axis(name='time', units='day', coord=np.arange(1000.))
+    x = Axis(name='x', units='', coord=np.arange(4.)); y = Axis(name='y', units='', coord=np.arange(3.))
+    simdata = np.random.gamma(2., 2., (1000,3,4)); obsdata = np.random.gamma(3., 1.5, (1000,3,4)) + 1.
+    sim = Dataset(name='sim', varlist=[Variable(name='pr', units='mm/day', axes=(time,y,x), data=simdata)])
+    obs = Dataset(name='obs', varlist=[Variable(name='pr', units='mm/day', axes=(time,y,x), data=obsdata)])
+    BC = getBCmethods('QM', nquantiles=50)
+    BC.train(sim, obs)
+    srctable, tgttable = BC._correction['pr']
+    assert srctable.shape == (50,3,4) and srctable.dtype == np.float32
+    # compare with quantiles and interpolation at a single point
+    probs = ( np.arange(50) + 0.5 ) / 50
+    assert np.allclose(srctable[:,1,2], np.percentile(simdata[:,1,2], probs*100), rtol=1e-5)
+    # tables survive pickling and correction maps the simulated to the observed distribution
+    BC = pickle.loads(pickle.dumps(BC, protocol=-1))
+    bcdata = BC.correct(sim)['pr'][:]
+    assert bcdata.shape == simdata.shape
+    inside = ( simdata[:,1,2] >= srctable[0,1,2] ) & ( simdata[:,1,2] <= srctable[-1,1,2] )
+    reference = np.interp(simdata[:,1,2], srctable[:,1,2].astype(np.float64), tgttable[:,1,2].astype(np.float64))
+    assert np.allclose(bcdata[inside,1,2], reference[inside], rtol=1e-5)
+    assert np.allclose(np.percentile(bcdata, probs*100, axis=0), tgttable, rtol=0.05)
+    # ratio extrapolation beyond the table range
+    above = simdata[:,1,2] > srctable[-1,1,2]
+    assert np.allclose(bcdata[above,1,2], simdata[above,1,2]*tgttable[-1,1,2]/srctable[-1,1,2], rtol=1e-5)
+    # zero-inflated data: dry days are tied quantiles and have to remain dry
+    from processing.bc_methods import getQuantileTable, mapQuantiles
+    simdata = np.random.gamma(0.8, 4., (3650,4)); simdata[np.random.uniform(size=simdata.shape) < 0.6] = 0.
+    obsdata = np.random.gamma(0.7, 4.6, (3650,4)); obsdata[np.random.uniform(size=obsdata.shape) < 0.4] = 0.
+    srctable = getQuantileTable(simdata, nquantiles=100); tgttable = getQuantileTable(obsdata, nquantiles=100)
+    bcdata = mapQuantiles(simdata, srctable, tgttable, lratio=True)
+    assert np.all(bcdata[simdata == 0] == 0) and np.all(bcdata[simdata > 0] > 0)
+    assert abs(bcdata.mean() - obsdata.mean()) < 0.1*obsdata.mean()
+    
+
 ## tests related to loading datasets
 class DatasetsTest(unittest.TestCase):  
    
@@ -313,24 +598,407 @@ class DatasetsTest(unittest.TestCase):
     # But diff first, to check for actual updates!
     # P/S at the moment I'm importing the custom nanfunctions directly
     
+  def testLoadGageStations(self):
+    ''' test loading of many gage stations into one dataset (with and without cache files) '''
+    import tempfile, shutil
+    import datasets.WSC as WSC
+    # create monthly CSV and meta data files for two stations (the second one starts later)
+    folder = tempfile.mkdtemp(); names = ['River_Upper','River_Lower']; years = range(1980,1985)
+    for n,name in enumerate(names):
+      with open('{:s}/{:s}_Monthly.csv'.format(folder,name), 'w') as f:
+        f.write('ID,PARAM,TYPE,YEAR,' + ','.join('M{:02d},SYM'.format(m) for m in xrange(1,13)) + '\n')
+        for year in years[n:]:
+          f.write('ID{:d},1,1,{:d},'.format(n,year) + ','.join('{:.2f},'.format(10*n+year-1980+m/100.) for m in xrange(12)) + '\n')
+      with open('{:s}/{:s}_Metadata.csv'.format(folder,name), 'w') as f:
+        f.write('Station Name,Station Number,Drainage Area,\n')
+        f.write('"{:s}",ID{:d},{:.1f},\n'.format(name.replace('_',' '),n,100.*(n+1)))
+    # load without cache files (default); records are kept in memory
+    WSC.gage_records.clear()
+    dataset = WSC.loadGageStations(stations=names, folder=folder, lkgs=True)
+    assert not os.path.exists('{:s}/cache/'.format(folder))
+    assert 0 < len(WSC.gage_records) <= WSC.max_gage_records
+    assert dataset.atts.period == (years[0],years[-1]+1), dataset.atts.period
+    discharge = dataset.discharge.getArray()
+    assert discharge.shape == (2,len(years)*12), discharge.shape
+    assert np.all(discharge.mask[1,:12]) and not np.any(discharge.mask[1,12:]) and not np.any(discharge.mask[0,:])
+    assert isEqual(discharge[0,:12], ( np.arange(12)/100. )*1000.) # kg/s
+    assert isEqual(discharge[1,-12:], ( 14+np.arange(12)/100. )*1000.) 
+    assert isEqual(dataset.shp_area[:], np.array([100.,200.])*1e6)
+    # the in-memory cache is bounded
+    max_gage_records = WSC.max_gage_records; WSC.max_gage_records = 1
+    WSC.loadGageStations(stations=names, folder=folder, lkgs=True)
+    assert len(WSC.gage_records) == 1
+    WSC.max_gage_records = max_gage_records
+    # cache files have to be requested explicitly and give the same results
+    WSC.gage_records.clear()
+    WSC.loadGageStations(stations=names, folder=folder, lkgs=True, lcache=True)
+    assert len(os.listdir('{:s}/cache/'.format(folder))) == len(names)
+    WSC.gage_records.clear()
+    cached = WSC.loadGageStations(stations=names, folder=folder, lkgs=True, lcache=True)
+    assert isEqual(cached.discharge.getArray(), discharge)
+    shutil.rmtree(folder)
+    
+  def testStationRecordCache(self):
+    ''' test caching of parsed station records (cache hits and misses, invalidation and meta data) '''
+    import tempfile, shutil
+    from datasets.common import loadCachedRecord
+    # a minimal station record: the parser counts calls and sets the begin date from the file
+    class TestRecord(object):
+      variable = 'precip'; begin_year = 0; begin_mon = 0
+      def __init__(self, filename): 
+        self.filename = filename; self.nparse = 0
+      def parseRecord(self, lflags=False):
+        self.nparse += 1
+        values = np.loadtxt(self.filename, dtype=np.float32)
+        self.begin_year, self.begin_mon = int(values[0]), int(values[1])
+        data = values[2:]; flags = np.where(np.isnan(data), 'M', '').astype('S1') 
+        if lflags: return data, flags
+        else: return data
+    folder = tempfile.mkdtemp(); cache_folder = folder + '/cache/' # does not exist yet
+    filename = folder + '/precip_1.txt'
+    np.savetxt(filename, [1979, 3, 1., np.NaN, 3.])
+    # cache miss: parse and create cache file
+    record = TestRecord(filename)
+    data = loadCachedRecord(record, cache_folder=cache_folder, meta=('begin_year','begin_mon'))
+    assert record.nparse == 1 and len(os.listdir(cache_folder)) == 1
+    assert isEqual(np.ma.masked_invalid(data), np.ma.masked_invalid(np.array([1., np.NaN, 3.])))
+    # cache hit: no parsing, but the meta data set by the parser are restored
+    record = TestRecord(filename)
+    cached, flags = loadCachedRecord(record, cache_folder=cache_folder, lflags=True, meta=('begin_year','begin_mon'))
+    assert record.nparse == 0 and record.begin_year == 1979 and record.begin_mon == 3
+    assert isEqual(np.ma.masked_invalid(cached), np.ma.masked_invalid(data)) and list(flags) == ['','M','']
+    # a different parser version or a changed source file invalidate the cache entry
+    loadCachedRecord(record, cache_folder=cache_folder, version=1)
+    assert record.nparse == 1
+    np.savetxt(filename, [1980, 1, 4., 5., 6., 7.])
+    record = TestRecord(filename)
+    data = loadCachedRecord(record, cache_folder=cache_folder, version=1, meta=('begin_year','begin_mon'))
+    assert record.nparse == 1 and isEqual(data, np.array([4., 5., 6., 7.]))
+    record = TestRecord(filename)
+    loadCachedRecord(record, cache_folder=cache_folder, version=1, meta=('begin_year','begin_mon'))
+    assert record.nparse == 0 and record.begin_year == 1980 and record.begin_mon == 1
+    assert len(os.listdir(cache_folder)) == 1 # outdated entries are replaced
+    # no cache
+    loadCachedRecord(record, cache_folder=None)
+    assert record.nparse == 1
+    shutil.rmtree(folder)
+    
+  def testParallelStationRecords(self):
+    ''' compare serial and parallel ingestion of EC station records (with and without cache) '''
+    import tempfile, shutil
+    import datasets.EC as EC
+    folder = tempfile.mkdtemp(); os.mkdir(folder+'/dt/')
+    # write station file and daily precipitation records for a few stations with different periods
+    stations = [('1100001','BC',1979,1,1980,12), ('1100002','AB',1979,6,1980,3), ('1100003','ON',1980,2,1981,11)]
+    with open(folder+'/stations.txt', 'w') as f:
+      f.write('Daily precipitation stations\nStations de precipitation quotidienne\n')
+      f.write(' '.join(EC.ec_header_format)+'\n'+' '.join(EC.ec_header_format)+'\n')
+      for n,(stnid,prov,by,bm,ey,em) in enumerate(stations):
+        f.write('{:d} {:s} {:s} {:d} {:d} {:d} {:d} {:.1f} {:.1f} 100.0 N Station {:d}\n'.format(n+1,stnid,prov,by,bm,ey,em,49.+n,-120.+n,n))
+    for n,(stnid,prov,by,bm,ey,em) in enumerate(stations):
+      with open('{:s}/dt/dt{:s}.txt'.format(folder,stnid), 'w') as f:
+        f.write('{:s},Station {:d},{:s},Not Joined,Daily Precipitation,mm\n'.format(stnid,n,prov))
+        f.write('Year Mo '+' '.join('Day{:02d}'.format(d) for d in xrange(1,32))+'\n')
+        for m in xrange((ey-by)*12+em-bm+1):
+          values = ['{:.1f}'.format(v) for v in np.random.gamma(0.5, 4., 31)]
+          values[m%31] = '-9999.99M'; values[(m+7)%31] += 'T' # missing values and flags
+          f.write('{:4d} {:02d} '.format(by+(bm-1+m)//12,(bm-1+m)%12+1)+' '.join(values)+'\n')
+    # read station data serially and in parallel and compare monthly means
+    results = []
+    for NP,lcache in ((1,False),(2,False),(2,True),(1,True)):
+      records = EC.StationRecords(folder=folder, variables=dict(precip=EC.precip_vars['precip']), extremes=[], 
+                                  NP=NP, lcache=lcache)
+      records.prepareDataset(folder=folder, filename='test_{:d}.nc'.format(len(results)))
+      records.readStationData(nreport=0)
+      results.append(records.dataset.precip.getArray(unmask=True, fillValue=np.NaN))
+      records.dataset.close()
+    assert results[0].shape == (len(stations),36), results[0].shape
+    assert np.all(np.isnan(results[0][1,:5])) and not np.any(np.isnan(results[0][1,5:15]))
+    for result in results[1:]:
+      assert isEqual(np.ma.masked_invalid(result), np.ma.masked_invalid(results[0]))
+    assert len(os.listdir(folder+'/cache/')) == len(stations)
+    shutil.rmtree(folder)
+    
+  def testStationRecordParsers(self):
+    ''' compare the vectorized EC and GHCN record parsers with line-by-line loops (values, flags and warnings) '''
+    import tempfile, shutil, warnings
+    import datasets.EC as EC, datasets.GHCN as GHCN
+    from geodata.misc import DateError
+    folder = tempfile.mkdtemp(); rng = np.random.RandomState(42)
+    ## EC records: flags, missing months, out-of-range values and lines after the end date
+    vardef = EC.precip_vars['precip']; ecfile = folder+'/dt1100001.txt'
+    with open(ecfile, 'w') as f:
+      f.write('1100001,Test Station,BC,Not Joined,Daily Precipitation,mm\n')
+      f.write('Year Mo '+' '.join('Day{:02d}'.format(d) for d in xrange(1,32))+'\n')
+      for m in xrange(30):
+        values = ['{:.1f}'.format(v) for v in rng.gamma(0.5, 4., 31)]
+        if m == 4: values = ['-9999.99M']*31 # missing month
+        values[m] = '{:.1f}{:s}'.format(rng.gamma(0.5, 4.),'TEACLXYZ'[m%8]) # flags
+        if m%7 == 1: values[m+1] = '-5.0' # below minimum
+        if m%9 == 2: values[m+1] = '1500.0E' # above maximum
+        line = '{:4d} {:02d} '.format(1979+(m+6)//12,(m+6)%12+1)+' '.join(values)
+        if m%5 == 3: line = line.replace(' -9999.99M', '-9999.99M') # values without separator
+        f.write(line+'\n')
+    ecrec = EC.DailyStationRecord(id='1100001', name='Test Station', prov='BC', joined=False, filename=ecfile, 
+                                  begin_year=1979, begin_mon=7, end_year=1981, end_mon=10, lat=49., lon=-120., 
+                                  alt=100., **vardef.getKWargs())
+    def parseEC(record):
+      ''' the original line-by-line parser (also returns flags) '''
+      nmon = (record.end_year - record.begin_year)*12 + record.end_mon - record.begin_mon + 1
+      data = np.zeros(nmon*31, dtype=record.dtype) + np.NaN; flags = np.zeros(nmon*31, dtype='S1')
+      oldyear = record.begin_year; oldmon = record.begin_mon - 1; lm = len(record.missing); z = 0
+      for line in open(record.filename).readlines()[1:]:
+        ll = line.replace('-9999.9', ' -9999.9').split() 
+        if not ( ll[0].isdigit() and ll[1].isdigit() ): continue # title line
+        year = int(ll[0]); mon = int(ll[1])
+        if year == oldyear and mon == oldmon+1: pass
+        elif year == oldyear+1 and oldmon == 12 and mon ==1: pass 
+        else: raise DateError, line
+        oldyear = year; oldmon = mon
+        if year > record.end_year or ( year == record.end_year and mon > record.end_mon ): continue
+        for num in ll[2:]:
+          if num[:lm] != record.missing:
+            if num[-1].isdigit(): n = float(num)
+            else: n = float(num[:-1]); flags[z] = num[-1] # remove data flag
+            if n < record.varmin: warnings.warn("Encountered value '{:s}' below minimum in line (ignored):\n {:s}".format(num,line))
+            elif n > record.varmax: warnings.warn("Encountered value '{:s}' above maximum in line (ignored):\n {:s}".format(num,line))
+            else: data[z] = n
+          z += 1
+      return data, flags
+    ## GHCN records: two interleaved variables, missing months, flags and out-of-range values
+    vardef = GHCN.precip_vars['precip']; ghcnfile = folder+'/CA001100001.dly'
+    with open(ghcnfile, 'w') as f:
+      for m in xrange(26):
+        for var in ('TMAX','PRCP'):
+          if var == 'PRCP' and m in (0,5,6,13): continue # missing months
+          values = rng.randint(0, 500, 31)
+          values[rng.uniform(size=31) < 0.2] = -9999
+          if m%4 == 1: values[m] = -12 # below minimum
+          if m%6 == 2: values[m] = 12000 # above maximum
+          flags = [' '*3]*31; flags[m] = 'T'; flags[(m+3)%31] = ' G7' 
+          f.write('CA001100001{:4d}{:02d}{:s}'.format(1980+(m+1)//12,(m+1)%12+1,var))
+          f.write(''.join('{:5d}{:3s}'.format(v,fl) for v,fl in zip(values,flags))+'\n')
+    ghcnrec = GHCN.DailyStationRecord(id='CA001100001', name='Test Station', filename=ghcnfile, begin_year=0, 
+                                      begin_mon=0, end_year=0, end_mon=0, lat=49., lon=-120., alt=100., 
+                                      **vardef.getKWargs())
+    def parseGHCN(record):
+      ''' the original line-by-line parser (also returns flags) '''
+      lines = open(record.filename).readlines()
+      begin_year = int(lines[0][11:15]); begin_mon = int(lines[0][15:17])
+      nmon = ( int(lines[-1][11:15]) - begin_year )*12 + int(lines[-1][15:17]) - begin_mon + 1
+      data = np.zeros(nmon*31, dtype=record.dtype) + np.NaN; flags = np.zeros(nmon*31, dtype='S3')
+      lm = len(record.missing)
+      for line in lines:
+        if line[17:21] != record.variable: continue
+        z = ( ( int(line[11:15]) - begin_year )*12 + int(line[15:17]) - begin_mon )*31 # skip missing months
+        for count in xrange(21,266,8):
+          num = line[count:count+5]
+          if num[:lm] != record.missing:
+            n = int(num)
+            if n < record.varmin: warnings.warn("Encountered value '{:s}' below minimum in line (ignored):\n {:s}".format(num,line))
+            elif n > record.varmax: warnings.warn("Encountered value '{:s}' above maximum in line (ignored):\n {:s}".format(num,line))
+            else: data[z] = n
+          flags[z] = line[count+5:count+8]; z += 1
+      return data, flags
+    ## compare values, flags and warnings
+    for record,parser in ((ecrec,parseEC),(ghcnrec,parseGHCN)):
+      with warnings.catch_warnings(record=True) as refwarn:
+        warnings.simplefilter('always')
+        refdata, refflags = parser(record)
+      with warnings.catch_warnings(record=True) as recwarn:
+        warnings.simplefilter('always')
+        data, flags = record.parseRecord(lflags=True)
+      assert data.shape == refdata.shape, (data.shape, refdata.shape)
+      assert isEqual(np.ma.masked_invalid(data), np.ma.masked_invalid(refdata))
+      assert np.all(np.isnan(data) == np.isnan(refdata)) and np.all(flags == refflags)
+      assert len(refwarn) > 0 and [str(w.message) for w in recwarn] == [str(w.message) for w in refwarn]
+    assert ghcnrec.begin_year == 1980 and ghcnrec.begin_mon == 2 and ghcnrec.end_year == 1982 and ghcnrec.end_mon == 3
+    assert np.all(np.isnan(data[:31])) and np.all(np.isnan(data[5*31:7*31])) # missing months
+    ## records before the begin date or gaps in the record raise DateError
+    with open(ghcnfile, 'w') as f:
+      for year,mon,var in ((1980,2,'TMAX'),(1980,1,'PRCP'),(1980,2,'PRCP')):
+        f.write('CA001100001{:4d}{:02d}{:s}'.format(year,mon,var)+'    0   '*31+'\n')
+    self.assertRaises(DateError, ghcnrec.parseRecord)
+    lines = open(ecfile).readlines(); del lines[10]
+    open(ecfile, 'w').writelines(lines)
+    self.assertRaises(DateError, ecrec.parseRecord)
+    shutil.rmtree(folder)
+    
+  def testStationIndex(self):
+    ''' compare vectorized station selection (StationIndex) with test functions for individual stations '''
+    import tempfile, shutil, functools
+    import datasets.common as common
+    from datasets.common import StationIndex, getStationIndex, applyStationIndex, selectElements
+    from geodata.misc import AxisError
+    from geodata.netcdf import DatasetNetCDF
+    # dataset with station meta data (with some missing values)
+    ns = 500; rng = np.random.RandomState(42)
+    station = Axis(name='station', coord=np.arange(1,ns+1), units='#')
+    lat = rng.uniform(30., 80., ns); lat[::50] = np.NaN
+    dataset = Dataset(name='test', varlist=[
+        Variable(name='stn_lat', units='deg N', axes=(station,), data=lat), 
+        Variable(name='stn_lon', units='deg E', axes=(station,), data=rng.uniform(-140., -50., ns)),
+        Variable(name='stn_zs', units='m', axes=(station,), data=rng.normal(500., 800., ns)),
+        Variable(name='stn_prov', units='', axes=(station,), data=rng.choice(['BC','AB','ON'], ns)),])
+    # test functions for individual stations (as in the original selection)
+    def test_lat(val,index,dataset,axis): return val[0] <= dataset.stn_lat[index] <= val[1] 
+    def test_lon(val,index,dataset,axis): return val[0] <= dataset.stn_lon[index] <= val[1] 
+    def test_maxz(val,index,dataset,axis): return np.abs(dataset.stn_zs[index]) <= val
+    def test_prov(val,index,dataset,axis): return dataset.stn_prov[index] in val
+    def test_radius(val,index,dataset,axis):
+      lat1 = np.radians(val[0]); lat2 = np.radians(dataset.stn_lat[index]); dlon = np.radians(dataset.stn_lon[index]-val[1])
+      a = np.sin((lat2-lat1)/2.)**2 + np.cos(lat1)*np.cos(lat2)*np.sin(dlon/2.)**2
+      return 2.*6371.*np.arcsin(np.sqrt(min(a,1.))) <= val[2]
+    suites = [([test_lat], [functools.partial(StationIndex.box, lat=(45.,60.))]),
+              ([test_lon], [functools.partial(StationIndex.box, lon=(-120.,-80.))]),
+              ([test_lat,test_lon], [functools.partial(StationIndex.box, lat=(45.,60.), lon=(-120.,-80.))]),
+              ([test_maxz], [functools.partial(StationIndex.between, name='stn_zs', upper=1000., labs=True)]),
+              ([test_prov,test_lat], [functools.partial(StationIndex.isin, name='stn_prov', values=('BC','ON')),
+                                      functools.partial(StationIndex.box, lat=(45.,60.))]),
+              ([test_radius], [functools.partial(StationIndex.radius, lat=55., lon=-100., radius=1500.)]),]
+    vals = dict(test_lat=(45.,60.), test_lon=(-120.,-80.), test_maxz=1000., test_prov=('BC','ON'), 
+                test_radius=(55.,-100.,1500.))
+    for tests,conditions in suites:
+      tests = [functools.partial(test, vals[test.__name__]) for test in tests]
+      testFct = lambda index,dataset,axis: all(test(index,dataset,axis) for test in tests)
+      ref = selectElements([dataset], axis='station', testFct=testFct)[0]
+      sel = selectElements([dataset], axis='station', maskFct=functools.partial(applyStationIndex, conditions))[0]
+      assert 0 < len(sel.station) < ns and np.all(sel.station.coord == ref.station.coord), conditions
+    # spatial queries without station coordinates
+    index = StationIndex(columns=dict(stn_lon=dataset.stn_lon[:]), coord=station.coord)
+    assert np.all(index.box(lon=(-120.,-80.)) == StationIndex.fromDataset(dataset).box(lon=(-120.,-80.)))
+    self.assertRaises(AxisError, index.box, lat=(45.,60.))
+    self.assertRaises(AxisError, index.radius, lat=55., lon=-100., radius=1500.)
+    # cache round trip: in memory and in a cache file
+    folder = tempfile.mkdtemp(); cache_folder = folder + '/cache/'
+    writeNetCDF(dataset, folder+'/stations.nc', writeData=True, close=True)
+    ncds = DatasetNetCDF(folder=folder, filelist=['stations.nc'], mode='r')
+    common.station_indices.clear()
+    index = getStationIndex(ncds, axis='station', cache_folder=cache_folder)
+    assert len(common.station_indices) == 1 and len(os.listdir(cache_folder)) == 1
+    assert getStationIndex(ncds, axis='station', cache_folder=cache_folder) is index
+    common.station_indices.clear()
+    fromDataset = StationIndex.fromDataset
+    StationIndex.fromDataset = None # make sure the index is loaded from the cache file
+    try: cached = getStationIndex(ncds, axis='station', cache_folder=cache_folder)
+    finally: StationIndex.fromDataset = fromDataset
+    assert cached is not index and np.all(cached.coord == index.coord) and set(cached.columns) == set(index.columns)
+    for name,col in index.columns.iteritems():
+      assert np.all((cached.columns[name] == col) | (col != col)), name
+    assert np.all(cached.radius(lat=55., lon=-100., radius=1500.) == index.radius(lat=55., lon=-100., radius=1500.))
+    ncds.close(); common.station_indices.clear()
+    shutil.rmtree(folder)
+    
+  def testMonthlyAggregation(self):
+    ''' compare vectorized monthly means and extremes of daily station data with day-by-day loops '''
+    import calendar
+    from datasets.common import days_per_month, monthLengths, monthlyMean, monthlyExtrema, consecutiveExtrema
+    # daily data for a few stations, padded to 31 days per month (with missing values)
+    ns, nm = 3, 26 # more than two years, including a leap year
+    data = np.random.gamma(0.5, 4., (ns,nm,31)); data[data < 1.] = 0.
+    data[np.random.uniform(size=data.shape) < 0.05] = np.NaN; data[1,4,:] = np.NaN
+    lmons = monthLengths(np.arange(nm), origin=1979)
+    for m in xrange(nm): data[:,m,lmons[m]:] = np.NaN # padding
+    # reference values, computed month by month and day by day (as in the old implementation)
+    means = np.zeros((ns,nm)) + np.NaN; maxima = means.copy(); wetdays = means.copy()
+    for s in xrange(ns):
+      run = 0
+      for m in xrange(nm):
+        # figure out length of month
+        if m%12 == 1: # February
+          if calendar.isleap(1979 + m/12): lmon = 29
+          else: lmon = 28
+        else: lmon = int(days_per_month[m%12])
+        assert lmons[m] == lmon, (m, lmon)
+        days = data[s,m,:lmon]; valid = days[np.invert(np.isnan(days))]
+        if len(valid) > 0: means[s,m] = valid.mean(); maxima[s,m] = valid.max()
+        wetdays[s,m] = 0
+        for day in days:
+          run = run + 1 if day > 0 else 0 # N.B.: missing days end a run
+          wetdays[s,m] = max(wetdays[s,m], run)
+    # compare to vectorized functions (months without valid days are NaN)
+    assert np.all(np.isnan(means) == np.all(np.isnan(data), axis=-1))
+    assert isEqual(np.ma.masked_invalid(monthlyMean(data, lmons)), np.ma.masked_invalid(means))
+    assert isEqual(np.ma.masked_invalid(monthlyExtrema(data, lmons, mode='max')), np.ma.masked_invalid(maxima))
+    assert isEqual(consecutiveExtrema(data, lmons, mode='above', threshold=0.), wetdays)
+    # months with too few valid days
+    assert np.all(np.isnan(monthlyMean(data, lmons, min_days=32)))
+    
+  def testSnoDASconversion(self):
+    ''' compare the parallel batch conversion of SnoDAS binary files with the day-by-day reader '''
+    import tempfile, shutil, gzip
+    import netCDF4 as nc
+    import datasets.SnoDAS as SnoDAS
+    folder = tempfile.mkdtemp(); varname = 'snow'
+    # use a small grid for testing (module variable; also inherited by worker processes)
+    snodas_shape2d = SnoDAS.snodas_shape2d; SnoDAS.snodas_shape2d = shape2d = (8,16)
+    try:
+      # write compressed binary files (with missing values and one missing file)
+      dates = np.arange('2010-01-01','2010-01-12', dtype='datetime64[D]')
+      for n,date in enumerate(dates):
+        if n == 5: continue
+        data = np.random.randint(0, 1000, size=shape2d).astype(SnoDAS.binary_dtype)
+        data[np.random.uniform(size=shape2d) < 0.1] = SnoDAS.missing_value
+        subfolder,filename = SnoDAS.getFilenameFolder(varname=varname, date=date, root_folder=folder)
+        os.makedirs(subfolder)
+        with gzip.open(subfolder+filename, mode='wb') as f: f.write(data.tostring())
+      # create small NetCDF file with the same layout as creatNetCDF
+      ncds = nc.Dataset(folder+'/test.nc', mode='w', format='NETCDF4')
+      ncds.createDimension('time', size=None) 
+      ncds.createDimension('lat', size=shape2d[0]); ncds.createDimension('lon', size=shape2d[1])
+      ncds.createVariable('time', 'i4', ('time',)); ncds.createVariable('time_stamp', str, ('time',))
+      ncds.createVariable(varname, SnoDAS.netcdf_dtype, ('time','lat','lon'), chunksizes=(4,)+shape2d, 
+                          fill_value=SnoDAS.missing_value, zlib=True)
+      # convert serially and append the remaining days in parallel (slabs are not aligned with chunks)
+      nt = SnoDAS.convertBinaryBatch(varname, dates[:3], ncds, time_offset=0, NP=1, root_folder=folder, lfeedback=False)
+      assert nt == 3
+      nt = SnoDAS.convertBinaryBatch(varname, dates[3:], ncds, time_offset=nt, NP=2, root_folder=folder, lfeedback=False)
+      assert nt == len(dates)
+      # compare to day-by-day reader
+      for n,date in enumerate(dates):
+        ref = SnoDAS.readBinaryFile(varname=varname, date=date, root_folder=folder)
+        data = ncds[varname][n,:,:]
+        assert np.all(np.ma.getmaskarray(data) == np.ma.getmaskarray(ref))
+        assert np.all(data.compressed() == ref.compressed())
+        assert ncds['time'][n] == n and ncds['time_stamp'][n] == str(date-1)
+      assert np.all(ncds[varname][5,:,:].mask)
+      ncds.close()
+    finally:
+      SnoDAS.snodas_shape2d = snodas_shape2d
+      shutil.rmtree(folder)
+    
     
 if __name__ == "__main__":
 
     
     specific_tests = []
 #     specific_tests += ['ApplyAlongAxis']
+#     specific_tests += ['ApplyAlongAxisInPool']
 #     specific_tests += ['AsyncPool']    
+#     specific_tests += ['WorkerPool']
+#     specific_tests += ['RunJournal']
+#     specific_tests += ['Fingerprint']
+#     specific_tests += ['JobCosts']
+#     specific_tests += ['QuantileMapping']
 #     specific_tests += ['ExpArgList']
 #     specific_tests += ['LoadDataset']
 #     specific_tests += ['BasicLoadEnsembleTS']
 #     specific_tests += ['AdvancedLoadEnsembleTS']
 #     specific_tests += ['LoadStandardDeviation']
+#     specific_tests += ['LoadGageStations']
+#     specific_tests += ['StationRecordCache']
+#     specific_tests += ['ParallelStationRecords']
+#     specific_tests += ['StationRecordParsers']
+#     specific_tests += ['StationIndex']
+#     specific_tests += ['MonthlyAggregation']
+#     specific_tests += ['SnoDASconversion']
 
 
     # list of tests to be performed
     tests = [] 
     # list of variable tests
     tests += ['MultiProcess']
+    tests += ['Processing']
 #     tests += ['Datasets'] 
     
 
@@ -33,6 +33,8 @@ def getBCmethods(method, **bcargs):
         return SMBC(**bcargs)
     elif method.upper() == 'AABC':
         return AABC(**bcargs)
+    elif method.upper() == 'QM' or method.lower() == 'quantilemapping':
+        return QuantileMapping(**bcargs)
     else:
         raise NotImplementedError(method)
   
@@ -56,6 +58,72 @@ def getPickleFileName(method=None, obs_name=None, mode=None, periodstr=None, gri
     picklefile = pattern.format(name) # insert name into fixed pattern
     return picklefile
 
+def getQuantileTable(data, nquantiles=100, axis=0, dtype=np.float32):
+    ''' compute a table of quantiles (at the probabilities (k+0.5)/nquantiles) along the sample axis for every 
+        element of the remaining dimensions; NaN's are ignored and all-NaN elements produce NaN quantiles '''
+    if isinstance(data,np.ma.MaskedArray): data = data.astype(np.float64).filled(np.NaN)
+    data = np.moveaxis(np.asarray(data, dtype=np.float64), axis, 0) # sample axis first
+    shape = data.shape[1:]; ns = data.shape[0]
+    data = data.reshape((ns,-1)) # one column per element
+    probs = ( np.arange(nquantiles, dtype=np.float64) + 0.5 ) / nquantiles
+    nvalid = np.isfinite(data).sum(axis=0)
+    if np.all(nvalid == ns):
+        # fast path: all columns share the same sample positions, so we only need these order statistics
+        pos = probs * (ns-1); lo = np.floor(pos).astype(np.intp); hi = np.minimum(lo+1, ns-1)
+        data = np.partition(data, np.union1d(lo,hi), axis=0)
+        frac = (pos - lo)[:,np.newaxis]
+        table = data[lo,:]*(1.-frac) + data[hi,:]*frac
+    else:
+        # N.B.: NaN's are sorted to the end, so we can interpolate within the valid part of each column
+        data = np.sort(data, axis=0)
+        nmax = np.maximum(nvalid-1, 0)[np.newaxis,:]
+        pos = probs[:,np.newaxis] * nmax; lo = np.floor(pos).astype(np.intp); hi = np.minimum(lo+1, nmax)
+        cols = np.arange(data.shape[1])[np.newaxis,:]
+        frac = pos - lo
+        table = data[lo,cols]*(1.-frac) + data[hi,cols]*frac
+        table[:,nvalid == 0] = np.NaN
+    return table.reshape((nquantiles,)+shape).astype(dtype)
+
+def mapQuantiles(data, srctable, tgttable, axis=0, lratio=False):
+    ''' map data from the distribution described by the quantiles in srctable to the distribution in tgttable, 
+        using piecewise linear interpolation between quantiles; beyond the outermost quantiles the correction 
+        of the end points is extrapolated as a difference (or ratio, if lratio); values that are equal to a run 
+        of tied source quantiles (e.g. dry days) are mapped to the target quantile at the midpoint of the run '''
+    lmask = isinstance(data,np.ma.MaskedArray)
+    if lmask: mask = np.ma.getmaskarray(data); data = data.astype(np.float64).filled(np.NaN)
+    data = np.moveaxis(np.asarray(data, dtype=np.float64), axis, -1) # sample axis last
+    shape = data.shape; nq = srctable.shape[0]
+    if srctable.shape != tgttable.shape or srctable.shape[1:] != shape[:-1] or nq < 2:
+        raise DataError("Quantile tables {} do not match data shape {}.".format(srctable.shape,shape))
+    # N.B.: a contiguous copy with one row per grid point makes np.interp (binary search in C) faster than 
+    #       any search over the entire field at once
+    data = np.ascontiguousarray(data.reshape((-1,shape[-1])))
+    src = srctable.reshape((nq,-1)).T.astype(np.float64); tgt = tgttable.reshape((nq,-1)).T.astype(np.float64)
+    out = np.empty_like(data)
+    ranks = np.arange(nq, dtype=np.float64)
+    lties = ( src[:,1:] == src[:,:-1] ).any(axis=1)
+    for n in range(data.shape[0]):
+        if np.isnan(src[n,0]): out[n,:] = np.NaN # missing tables produce missing values
+        else: out[n,:] = np.interp(data[n,:], src[n,:], tgt[n,:])
+        if lties[n]:
+            # N.B.: np.interp would map all values in a run of ties to the target quantile at one end of the 
+            #       run, e.g. all dry days to the wettest of the corresponding target quantiles
+            values, first, counts = np.unique(src[n,:], return_index=True, return_counts=True)
+            for value,k,count in zip(values[counts > 1], first[counts > 1], counts[counts > 1]):
+                out[n,data[n,:] == value] = np.interp(k + (count-1)/2., ranks, tgt[n,:])
+    # extrapolate the correction of the end points beyond the outermost quantiles (vectorized)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        below = data < src[:,:1]; above = data > src[:,-1:]
+        if lratio:
+            r0 = np.where(src[:,:1] > 0, tgt[:,:1]/src[:,:1], 1.); r1 = np.where(src[:,-1:] > 0, tgt[:,-1:]/src[:,-1:], 1.)
+            out = np.where(below, data*r0, np.where(above, data*r1, out))
+        else:
+            out = np.where(below, data+(tgt[:,:1]-src[:,:1]), np.where(above, data+(tgt[:,-1:]-src[:,-1:]), out))
+    out[np.isnan(data)] = np.NaN
+    out = np.moveaxis(out.reshape(shape), -1, axis)
+    if lmask: out = np.ma.masked_array(out, mask=mask|np.isnan(out))
+    return out
+
 ## classes that implement bias correction 
 
 class BiasCorrection(object):
@@ -169,7 +237,7 @@ class BiasCorrection(object):
                 stats = None
             else:
                 delta = bcvar.data_array - obsvar.data_array
-                correction = np.mean(self._correction[varname]) # can be scalar 
+                correction = self._meanCorrection(varname) # can be scalar 
                 bias = delta.mean()
                 if bias < eps: bias = 0.
                 rmse = np.asscalar(np.sqrt(np.mean(delta**2)))
@@ -182,6 +250,10 @@ class BiasCorrection(object):
         self._validation = validation # also store
         return validation
     
+    def _meanCorrection(self, varname):
+        ''' average magnitude of the correction for a variable (used for validation) '''
+        return np.mean(self._correction[varname])
+    
     def picklefile(self, obs_name=None, mode=None, periodstr=None, gridstr=None, domain=None, tag=None):
         ''' generate a standardized name for the pickle file, based on arguments '''
         if self._picklefile is None:      
@@ -289,6 +361,51 @@ class AABC(Delta):
         return r
         
         
+class QuantileMapping(BiasCorrection):
+    ''' A class that implements grid point-wise empirical quantile mapping: for each grid point, a table of 
+        quantiles of the simulated and observed distribution along the sample (time) axis is stored, and values 
+        are mapped from the simulated to the observed distribution by interpolation between quantiles. '''
+    name = 'QM' # name used in file names
+    long_name = 'Empirical Quantile Mapping' # name for printing
+    _ratio_units = Delta._ratio_units # variable units that indicate ratio (for extrapolation)
+    
+    def __init__(self, varlist=None, nquantiles=100, sample_axis='time', dtype=np.float32, **bcargs):
+        ''' number of quantiles and name of the sample axis, along which distributions are computed '''
+        super(QuantileMapping,self).__init__(varlist=varlist, **bcargs)
+        self.nquantiles = nquantiles
+        self.sample_axis = sample_axis
+        self.dtype = dtype # N.B.: tables in single precision keep pickles compact
+    
+    def _trainVar(self, var, obsvar, **kwargs):
+        ''' compute quantile tables for simulation and observations; returns a tuple of (source, target) tables '''
+        if not var.hasAxis(self.sample_axis) or not obsvar.hasAxis(self.sample_axis): 
+            raise DataError("Variable '{:s}' has no sample axis '{:s}'.".format(var.name,self.sample_axis))
+        srctable = getQuantileTable(var.data_array, nquantiles=self.nquantiles, 
+                                    axis=var.axisIndex(self.sample_axis), dtype=self.dtype)
+        tgttable = getQuantileTable(obsvar.data_array, nquantiles=self.nquantiles, 
+                                    axis=obsvar.axisIndex(self.sample_axis), dtype=self.dtype)
+        if srctable.shape != tgttable.shape: 
+            raise DataError("Grids of '{:s}' and observations do not match: {} != {}".format(var.name,srctable.shape,tgttable.shape))
+        # return correction parameters, i.e. quantile tables
+        return (srctable, tgttable)
+          
+    def _correctVar(self, var, varname=None, **kwargs):
+        ''' map data from the simulated to the observed distribution at every grid point '''
+        if varname is None: varname = var.name # allow for variable mapping
+        if not var.hasAxis(self.sample_axis): 
+            raise DataError("Variable '{:s}' has no sample axis '{:s}'.".format(var.name,self.sample_axis))
+        srctable, tgttable = self._correction[varname]
+        data = mapQuantiles(var.data_array, srctable, tgttable, axis=var.axisIndex(self.sample_axis), 
+                            lratio=var.units in self._ratio_units)
+        # return bias-corrected data (copy)
+        return data.astype(var.dtype) if np.issubdtype(var.dtype,np.inexact) else data
+    
+    def _meanCorrection(self, varname):
+        ''' average difference between observed and simulated quantiles '''
+        srctable, tgttable = self._correction[varname]
+        return np.nanmean(tgttable.astype(np.float64) - srctable)
+        
+        
 class MyBC(BiasCorrection):
     ''' A BiasCorrection class that implements snowmelt shift and utilizes different (unobserved) precipitation types '''
     
@@ -18,8 +18,8 @@ import logging
 # internal imports
 from geodata.misc import DateError, printList
 from datasets import gridded_datasets
-from processing.multiprocess import asyncPoolEC
-from processing.misc import getMetaData,  getExperimentList, loadYAML
+from processing.multiprocess import asyncPoolEC, recordPhase
+from processing.misc import getMetaData,  getExperimentList, loadYAML, getJobCosts, getJobMemory
 from datasets.common import loadDataset
 from processing.bc_methods import getBCmethods
 
@@ -78,7 +78,7 @@ def generateBiasCorrection(dataset, mode, dataargs, obs_dataset, bc_method, bc_a
   else:
           
     ## actually load datasets
-    dataset = loadfct() # load source data
+    with recordPhase('load'): dataset = loadfct() # load source data
     # check period
     if 'period' in dataset.atts and dataargs.periodstr != dataset.atts.period: # a NetCDF attribute
       raise DateError, "Specifed period is inconsistent with netcdf records: '{:s}' != '{:s}'".format(periodstr,dataset.atts.period)
@@ -97,7 +97,7 @@ def generateBiasCorrection(dataset, mode, dataargs, obs_dataset, bc_method, bc_a
     
     
     # "train", i.e. optimize fit parameters
-    BC.train(dataset, obs_dataset)
+    with recordPhase('compute'): BC.train(dataset, obs_dataset)
     
     # print bias-correction
     if not lparallel and ldebug:
@@ -113,10 +113,12 @@ def generateBiasCorrection(dataset, mode, dataargs, obs_dataset, bc_method, bc_a
       op = gzip.open 
       picklepath += '.gz'
     else: op = open
-    with op(picklepath, 'wb') as filehandle:
-      pickle.dump(BC, filehandle, protocol=-1) # should be new binary protocol
-    if not os.path.exists(picklepath):
+    tmppath = '{:s}.{:d}.tmp'.format(picklepath, os.getpid()) # write to temporary file and rename
+    with op(tmppath, 'wb') as filehandle:
+      with recordPhase('write'): pickle.dump(BC, filehandle, protocol=-1) # should be new binary protocol
+    if not os.path.exists(tmppath):
       raise IOError, "Error while saving Pickle to '{0:s}'".format(picklepath)
+    os.rename(tmppath, picklepath) # N.B.: atomic, i.e. an interrupted run never leaves a partial pickle
 
       
     # write results to file
@@ -141,6 +143,22 @@ if __name__ == '__main__':
   if os.environ.has_key('PYAVG_DEBUG'): 
     ldebug =  os.environ['PYAVG_DEBUG'] == 'DEBUG' 
   else: ldebug = False
+  # file for performance telemetry of each job (JSON lines)
+  if os.environ.has_key('PYAVG_TELEMETRY'): 
+    telemetry_file = os.environ['PYAVG_TELEMETRY']
+  else: telemetry_file = None
+  # memory limit for concurrent jobs (in GB)
+  if os.environ.has_key('PYAVG_MEMORY'): 
+    max_memory = float(os.environ['PYAVG_MEMORY'])*1024**3
+  else: max_memory = None
+  # memory requirements of a job as a multiple of the source file size
+  if os.environ.has_key('PYAVG_MEMFACTOR'): 
+    memory_factor = float(os.environ['PYAVG_MEMFACTOR'])
+  else: memory_factor = 3.
+  # file with recorded job runtimes (for scheduling)
+  if os.environ.has_key('PYAVG_RUNTIMES'): 
+    runtime_file = os.environ['PYAVG_RUNTIMES']
+  else: runtime_file = None
   # run script in batch or interactive mode
   if os.environ.has_key('PYAVG_BATCH'): 
     lbatch =  os.environ['PYAVG_BATCH'] == 'BATCH' 
@@ -238,6 +256,7 @@ if __name__ == '__main__':
 #     grid = 'son1' # need a common grid for all datasets
     bc_method = 'AABC' # annual average bias correction method
 #     bc_method = 'Delta' # grid-point-wise monthly bias correction method
+#     bc_method = 'QM' # grid-point-wise quantile mapping (needs time-series in obs_mode and modes)
     bc_args = dict() # paramters for bias correction
   
   ## process arguments
@@ -335,6 +354,10 @@ if __name__ == '__main__':
   # N.B.: formats will be iterated over inside export function
   
   ## call parallel execution function
-  ec = asyncPoolEC(generateBiasCorrection, args, kwargs, NP=NP, ldebug=ldebug, ltrialnerror=True)
+  # estimate job costs (longest first) and memory requirements for scheduling
+  costs = getJobCosts(args, runtime_file=runtime_file); memory = getJobMemory(args, factor=memory_factor)
+  ec = asyncPoolEC(generateBiasCorrection, args, kwargs, NP=NP, ldebug=ldebug, ltrialnerror=True, 
+                   costs=costs, memory=memory, max_memory=max_memory, runtime_file=runtime_file, 
+                   telemetry_file=telemetry_file)
   # exit with fraction of failures (out of 10) as exit code
   exit(int(10+int(10.*ec/len(args))) if ec > 0 else 0)
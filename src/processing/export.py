@@ -13,19 +13,24 @@ import os, shutil, gzip # check if files are present etc.
 import numpy as np
 from importlib import import_module
 from datetime import datetime
+from collections import OrderedDict
 import logging     
 # internal imports
 from geodata.base import Dataset, concatDatasets
-from geodata.gdal import addGDALtoDataset, addGDALtoVar
+from geodata.gdal import addGDALtoDataset, addGDALtoVar, getRasterArray, writeBinaryRaster, writeGeoTIFF
 from geodata.misc import DateError, DatasetError, printList, ArgumentError, VariableError, GDALError
 from datasets import gridded_datasets
-from processing.multiprocess import asyncPoolEC
-from processing.misc import getMetaData,  getExperimentList, loadYAML, getTargetFile
+from processing.multiprocess import asyncPoolEC, recordPhase
+from processing.misc import getMetaData,  getExperimentList, loadYAML, getTargetFile, getJobCosts, getJobMemory,\
+  getFingerprint, isUpToDate, writeFingerprint
 from utils.nctools import writeNetCDF
 # new variable functions and bias-correction 
 import processing.newvars as newvars
 from processing.bc_methods import getPickleFileName
 
+# version of the processing code in this module; increment to rebuild all outputs (see getFingerprint)
+code_version = 1
+
 ## helper classes to handle different file formats
 
 class FileFormat(object):
@@ -47,8 +52,9 @@ class FileFormat(object):
     self.filepath = None
     return self.filepath
 
-  def prepareDestination(self, srcage=None, loverwrite=False):
-    ''' create or clear the destination folder, as necessary, and check if source is newer (for skipping) '''
+  def prepareDestination(self, srcage=None, loverwrite=False, fingerprint=None):
+    ''' create or clear the destination folder, as necessary, and check if the fingerprint of the source has 
+        changed (or, without fingerprint, if the source is newer), for skipping '''
     pass
 
   def exportDataset(self, dataset):
@@ -85,18 +91,21 @@ class NetCDF(object):
     self.filepath = '{:s}/{:s}'.format(avgfolder,filename)
     return self.filepath
 
-  def prepareDestination(self, srcage=None, loverwrite=False, lparallel=True):
-    ''' create or clear the destination folder, as necessary, and check if source is newer (for skipping) '''
+  def prepareDestination(self, srcage=None, loverwrite=False, fingerprint=None, lparallel=True):
+    ''' create or clear the destination folder, as necessary, and check if the fingerprint of the source has 
+        changed (or, without fingerprint, if the source is newer), for skipping '''
     # prepare target dataset (which is a NetCDF file)
-    filepath = self.filepath
+    filepath = self.filepath; self.fingerprint = fingerprint
     if os.path.exists(filepath):
       if loverwrite:
         os.remove(filepath) # remove old file
         lskip = False # actually do export
       else:
-        age = datetime.fromtimestamp(os.path.getmtime(filepath))
-        # if source file is newer than sink file or if sink file is a stub, recompute, otherwise skip
-        lskip = ( age > srcage ) and os.path.getsize(filepath) > 1e4 # skip if newer than source
+        if fingerprint: lskip = isUpToDate(filepath, fingerprint, srcage=srcage, minsize=1e4)
+        else:
+          age = datetime.fromtimestamp(os.path.getmtime(filepath))
+          # if source file is newer than sink file or if sink file is a stub, recompute, otherwise skip
+          lskip = ( age > srcage ) and os.path.getsize(filepath) > 1e4 # skip if newer than source
     else: lskip = False    
     # return with a decision on skipping
     return lskip 
@@ -105,16 +114,22 @@ class NetCDF(object):
     ''' method to export a Dataset instance to NetCDF format and write to disk '''
     # create NetCDF file
     filepath = self.filepath
-    writeNetCDF(dataset=dataset, ncfile=filepath, **self.export_arguments)
+    folder,filename = os.path.split(filepath)
+    tmpfilepath = os.path.join(folder,'tmp_export_'+filename) # write to temporary file and rename
+    writeNetCDF(dataset=dataset, ncfile=tmpfilepath, **self.export_arguments)
     # check first and last
-    if not os.path.exists(filepath): raise IOError, filepath
+    if not os.path.exists(tmpfilepath): raise IOError, tmpfilepath
+    if self.fingerprint: writeFingerprint(tmpfilepath, self.fingerprint) # record for incremental rebuilds
+    os.rename(tmpfilepath,filepath) # N.B.: atomic, i.e. an interrupted export never leaves a partial file
    
 class ASCII_raster(FileFormat):
-  ''' A class to handle exports to ASCII_raster format. '''
+  ''' A class to handle exports to ASCII_raster format; files can be gzip-compressed (lgzip) and are written
+      in parallel with NP processes. '''
   
-  def __init__(self, project=None, folder=None, prefix=None, bc_method=None, **expargs):
+  def __init__(self, project=None, folder=None, prefix=None, bc_method=None, lgzip=False, NP=1, **expargs):
     ''' take arguments that have been passed from caller and initialize parameters '''
     self.project = project; self.folder_pattern = folder; self.prefix_pattern = prefix; self.bc_method = bc_method
+    self.lgzip = lgzip; self.NP = NP
     self.export_arguments = expargs
   
   @property
@@ -162,9 +177,11 @@ class ASCII_raster(FileFormat):
     # return folder (no filename)
     return self.folder
   
-  def prepareDestination(self, srcage=None, loverwrite=False):
-    ''' create or clear the destination folder, as necessary, and check if source is newer (for skipping) '''
+  def prepareDestination(self, srcage=None, loverwrite=False, fingerprint=None):
+    ''' create or clear the destination folder, as necessary, and check if the fingerprint of the source has 
+        changed (or, without fingerprint, if the source is newer), for skipping '''
     ## prepare target dataset (which is mainly just a folder)
+    self.fingerprint = fingerprint
     if not os.path.exists(self.folder): 
       # create new folder
       os.makedirs(self.folder)
@@ -173,11 +190,14 @@ class ASCII_raster(FileFormat):
       shutil.rmtree(self.folder) # remove old folder and contents
       os.makedirs(self.folder) # create new folder
       lskip = False # actually do export
+    elif fingerprint: lskip = isUpToDate(self.folder, fingerprint, srcage=srcage)
     else:
       age = datetime.fromtimestamp(os.path.getmtime(self.folder))
       # if source file is newer than target folder, recompute, otherwise skip
       lskip = ( age > srcage ) # skip if newer than source 
     if not os.path.exists(self.folder): raise IOError, self.folder
+    if fingerprint and not lskip: writeFingerprint(self.folder, 'incomplete') 
+    # N.B.: files are written directly into the folder, so an interrupted export must not look up-to-date
     ## put in alternative symlink (relative path) for period section
     if self.altprdlnk:
       root_folder, link_dest, link_name = self.altprdlnk
@@ -197,12 +217,62 @@ class ASCII_raster(FileFormat):
   def exportDataset(self, dataset):
     ''' method to write a Dataset instance to disk in the given format; this will be format specific '''
     # export dataset to raster format
-    filedict = dataset.ASCII_raster(prefix=self.prefix, varlist=None, folder=self.folder, **self.export_arguments)
+    filedict = dataset.ASCII_raster(prefix=self.prefix, varlist=None, folder=self.folder, lgzip=self.lgzip, 
+                                    NP=self.NP, **self.export_arguments)
     # check first and last
     if not os.path.exists(filedict.values()[0][0]): raise IOError, filedict.values()[0][0] # random check
     if not os.path.exists(filedict.values()[-1][-1]): raise IOError, filedict.values()[-1][-1] # random check
+    if self.fingerprint: writeFingerprint(self.folder, self.fingerprint) # record for incremental rebuilds
+
 
+class RasterStack(ASCII_raster):
+  ''' A class to handle exports to multi-band raster stacks (one file per variable and one band per time step)
+      in flat binary (little-endian, band-sequential, with ESRI .hdr header) or GeoTIFF format. '''
   
+  def __init__(self, project=None, folder=None, prefix=None, bc_method=None, fileformat='binary', dtype='float32', 
+               blocksize=None, compress=None, fillValue=None, noDataValue=None, wrap360=False, **expargs):
+    ''' take arguments that have been passed from caller and initialize parameters '''
+    self.project = project; self.folder_pattern = folder; self.prefix_pattern = prefix; self.bc_method = bc_method
+    if fileformat == 'binary': 
+      if blocksize or compress: raise ArgumentError, "Tiling and compression are only supported for GeoTIFF format."
+      self.ext = '.bsq'
+    elif fileformat == 'geotiff': self.ext = '.tif'
+    else: raise NotImplementedError, fileformat
+    self.fileformat = fileformat; self.dtype = dtype; self.blocksize = blocksize; self.compress = compress
+    self.fillValue = fillValue; self.noDataValue = noDataValue; self.wrap360 = wrap360
+    # N.B.: common export parameters of raster formats; variables are written serially, so NP has no effect
+    self.NP = expargs.pop('NP', 1)
+    if expargs.pop('lgzip', False): raise ArgumentError, "Use 'compress' to compress raster stacks (GeoTIFF only)."
+    if expargs: raise ArgumentError, "Unknown export parameters: {}".format(expargs.keys())
+    
+  def exportDataset(self, dataset):
+    ''' method to write all variables of a Dataset instance to raster stacks (one file per variable) '''
+    for var in dataset.variables.itervalues():
+      if not var.gdal: continue # only map-like variables
+      # load data and reorient to upper-left reference point
+      data, geotransform, noDataValue = getRasterArray(var, wrap360=self.wrap360, fillValue=self.fillValue, 
+                                                       noDataValue=self.noDataValue)
+      # meta data for header: bands are the non-horizontal axes in C-order
+      atts = OrderedDict(VARIABLE=var.name)
+      atts['UNITS'] = var.units
+      if var.ndim == 3:
+        atts['BANDAXIS'] = var.axes[0].name; atts['BANDUNITS'] = var.axes[0].units
+        atts['BANDCOORDS'] = ' '.join([str(c) for c in var.axes[0].coord])
+      elif var.ndim > 3:
+        atts['BANDAXES'] = ' '.join([ax.name for ax in var.axes[:-2]])
+        atts['BANDSHAPE'] = ' '.join([str(n) for n in var.shape[:-2]])
+      # write file
+      filename = '{:s}_{:s}{:s}'.format(self.prefix,var.name,self.ext) if self.prefix else var.name+self.ext
+      filepath = '{:s}/{:s}'.format(self.folder,filename)
+      if self.fileformat == 'binary':
+        writeBinaryRaster(filepath, data, geotransform, noDataValue=noDataValue, dtype=self.dtype, atts=atts)
+      elif self.fileformat == 'geotiff':
+        writeGeoTIFF(filepath, data, geotransform, projection=var.projection, noDataValue=noDataValue, 
+                     dtype=self.dtype, atts=atts, blocksize=self.blocksize, compress=self.compress)
+      if not os.path.exists(filepath): raise IOError, filepath
+    if self.fingerprint: writeFingerprint(self.folder, self.fingerprint) # record for incremental rebuilds
+    
+
 def getFileFormat(fileformat, bc_method=None, **expargs):
   ''' function that returns an instance of a specific FileFormat child class specified in expformat; 
       other kwargs are passed on to constructor of FileFormat '''
@@ -211,6 +281,8 @@ def getFileFormat(fileformat, bc_method=None, **expargs):
     return ASCII_raster(bc_method=bc_method, **expargs)
   elif fileformat.lower() in ('netcdf','netcdf4'):
     return NetCDF(bc_method=bc_method, **expargs)
+  elif fileformat.lower() in ('binary','geotiff'):
+    return RasterStack(bc_method=bc_method, fileformat=fileformat.lower(), **expargs)
   else:
     raise NotImplementedError, fileformat
   
@@ -284,14 +356,24 @@ def performExport(dataset, mode, dataargs, expargs, bcargs, loverwrite=False,
     expformat = expargs.pop('format') # needed to get FileFormat object
     exp_list= expargs.pop('exp_list') # this handled outside of export
     compute_list = expargs.pop('compute_list', []) # variables to be (re-)computed - by default all
+    if lparallel and 'NP' in expargs: expargs['NP'] = 1 
+    # N.B.: worker processes can not start their own pool, so files are only written in parallel, 
+    #       if datasets are processed serially
     # initialize FileFormat class instance
     fileFormat = getFileFormat(expformat, bc_method=bc_method, **expargs)
     # get folder for target dataset and do some checks
     expname = '{:s}_d{:02d}'.format(dataset_name,domain) if domain else dataset_name
     expfolder = fileFormat.defineDataset(dataset=dataset, mode=mode, dataargs=dataargs, lwrite=True, ldebug=ldebug)
   
+    # fingerprint of source files (and bias-correction pickle), parameters and code version
+    srcfiles = list(dataargs.filelist) + ([picklepath] if bc_method else [])
+    params = dict(format=expformat, expargs={key:value for key,value in expargs.iteritems() if key != 'NP'}, 
+                  exp_list=exp_list, compute_list=compute_list, lm3=lm3, 
+                  bc=(bc_method, bc_varlist, bc_varmap) if bc_method else None) # N.B.: NP does not affect results
+    fingerprint = getFingerprint(srcfiles, params=params, version=code_version)
+  
     # prepare destination for new dataset
-    lskip = fileFormat.prepareDestination(srcage=max(srcage,pickleage), loverwrite=loverwrite)
+    lskip = fileFormat.prepareDestination(srcage=max(srcage,pickleage), loverwrite=loverwrite, fingerprint=fingerprint)
   
     # depending on last modification time of file or overwrite setting, start computation, or skip
     if lskip:        
@@ -302,7 +384,7 @@ def performExport(dataset, mode, dataargs, expargs, bcargs, loverwrite=False,
     else:
             
       ## actually load datasets
-      source = loadfct() # load source data
+      with recordPhase('load'): source = loadfct() # load source data
       # check period
       if 'period' in source.atts and dataargs.periodstr != source.atts.period: # a NetCDF attribute
           raise DateError, "Specifed period is inconsistent with netcdf records: '{:s}' != '{:s}'".format(periodstr,source.atts.period)
@@ -334,7 +416,7 @@ def performExport(dataset, mode, dataargs, expargs, bcargs, loverwrite=False,
       
       # apply bias-correction
       if bc_method:
-          source = BC.correct(source, asNC=False, varlist=bc_varlist, varmap=bc_varmap) # load bias-corrected variables into memory
+          with recordPhase('compute'): source = BC.correct(source, asNC=False, varlist=bc_varlist, varmap=bc_varmap) # load bias-corrected variables into memory
         
       # N.B.: for variables that are not bias-corrected, data are not loaded immediately but on demand; this way 
       #       I/O and computing can be further disentangled and not all variables are always needed
@@ -360,7 +442,7 @@ def performExport(dataset, mode, dataargs, expargs, bcargs, loverwrite=False,
                   #var = computePotEvapTh(source) # simplified formula (less prerequisites)
           # ... otherwise load from source file
           if var is None and variables is None and varname in source:
-              var = source[varname].load() # load data (may not have to load all)
+              with recordPhase('load'): var = source[varname].load() # load data (may not have to load all)
           #else: raise VariableError, "Unsupported Variable '{:s}'.".format(varname)
           # for now, skip variables that are None
           if var or variables:
@@ -393,7 +475,7 @@ def performExport(dataset, mode, dataargs, expargs, bcargs, loverwrite=False,
           logger.info('\n'+str(sink)+'\n')
         
       # export new dataset to selected format
-      fileFormat.exportDataset(sink)
+      with recordPhase('write'): fileFormat.exportDataset(sink)
         
       # write results to file
       writemsg =  "\n{:s}   >>>   Export of Dataset '{:s}' to Format '{:s}' complete.".format(pidstr,expname, expformat)
@@ -417,6 +499,22 @@ if __name__ == '__main__':
     if os.environ.has_key('PYAVG_DEBUG'): 
       ldebug =  os.environ['PYAVG_DEBUG'] == 'DEBUG' 
     else: ldebug = False
+    # file for performance telemetry of each job (JSON lines)
+    if os.environ.has_key('PYAVG_TELEMETRY'): 
+      telemetry_file = os.environ['PYAVG_TELEMETRY']
+    else: telemetry_file = None
+    # memory limit for concurrent jobs (in GB)
+    if os.environ.has_key('PYAVG_MEMORY'): 
+      max_memory = float(os.environ['PYAVG_MEMORY'])*1024**3
+    else: max_memory = None
+    # memory requirements of a job as a multiple of the source file size
+    if os.environ.has_key('PYAVG_MEMFACTOR'): 
+      memory_factor = float(os.environ['PYAVG_MEMFACTOR'])
+    else: memory_factor = 3.
+    # file with recorded job runtimes (for scheduling)
+    if os.environ.has_key('PYAVG_RUNTIMES'): 
+      runtime_file = os.environ['PYAVG_RUNTIMES']
+    else: runtime_file = None
     # run script in batch or interactive mode
     if os.environ.has_key('PYAVG_BATCH'): 
       lbatch =  os.environ['PYAVG_BATCH'] == 'BATCH' 
@@ -587,6 +685,7 @@ if __name__ == '__main__':
             prefix = '{GRID}', # based on keyword arguments
             format = 'ASCII_raster', # formats to export to
             fillValue = 0, noDataValue = -9999, # in case we interpolate across a missing value...
+            lgzip = False, NP = 1, # compress ASCII raster files and number of processes for writing
             lm3 = True) # convert water flux from kg/m^2/s to m^3/m^2/s
         ## export to NetCDF (aux-file)
 #         exp_list = ['netrad','netrad_bb0','netrad_bb','vapdef','pet','pet_wrf','petrad','petwnd']
@@ -631,7 +730,7 @@ if __name__ == '__main__':
     print('Export Variable List: {:s}'.format(printList(export_arguments['exp_list'])))
     if export_arguments['lm3']: '\n Converting kg/m^2/s (mm/s) into m^3/m^2/s (m/s)'
     # check formats (will be iterated over in export function, hence not part of task list)
-    if export_arguments['format'] == 'ASCII_raster':
+    if export_arguments['format'] == 'ASCII_raster' or export_arguments['format'].lower() in ('binary','geotiff'):
       print('Export Folder: {:s}'.format(export_arguments['folder']))
       print('File Prefix: {:s}'.format(export_arguments['prefix']))
     elif export_arguments['format'].lower() in ('netcdf','netcdf4'):
@@ -717,6 +816,10 @@ if __name__ == '__main__':
     # N.B.: formats will be iterated over inside export function
     
     ## call parallel execution function
-    ec = asyncPoolEC(performExport, args, kwargs, NP=NP, ldebug=ldebug, ltrialnerror=True)
+    # estimate job costs (longest first) and memory requirements for scheduling
+    costs = getJobCosts(args, runtime_file=runtime_file); memory = getJobMemory(args, factor=memory_factor)
+    ec = asyncPoolEC(performExport, args, kwargs, NP=NP, ldebug=ldebug, ltrialnerror=True, 
+                     costs=costs, memory=memory, max_memory=max_memory, runtime_file=runtime_file, 
+                     telemetry_file=telemetry_file)
     # exit with fraction of failures (out of 10) as exit code
     exit(int(10+int(10.*ec/len(args))) if ec > 0 else 0)
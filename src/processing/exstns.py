@@ -19,9 +19,13 @@ from geodata.misc import DateError, DatasetError, printList
 from geodata.netcdf import DatasetNetCDF
 from geodata.base import Dataset
 from datasets import gridded_datasets
-from processing.multiprocess import asyncPoolEC
+from processing.multiprocess import asyncPoolEC, recordPhase, DAGJob
 from processing.process import CentralProcessingUnit
-from processing.misc import getMetaData, getTargetFile, getExperimentList, loadYAML
+from processing.misc import getMetaData, getTargetFile, getExperimentList, loadYAML, getJobCosts, getJobMemory, RunJournal,\
+  getFingerprint, isUpToDate, getDatasetFiles
+
+# version of the processing code in this module; increment to rebuild all outputs (see getFingerprint)
+code_version = 1
 
 
 # worker function that is to be passed to asyncPool for parallel execution; use of the decorator is assumed
@@ -70,16 +74,17 @@ def performExtraction(dataset, mode, stnfct, dataargs, loverwrite=False, varlist
     if lreturn: 
       tmpfilename = filename # no temporary file if dataset is passed on (can't rename the file while it is open!)
     else: 
-      if lparallel: tmppfx = 'tmp_exstns_{:s}_'.format(pidstr[1:-1])
-      else: tmppfx = 'tmp_exstns_'.format(pidstr[1:-1])
+      tmppfx = 'tmp_exstns_' # N.B.: no process ID, so that interrupted jobs can be resumed
       tmpfilename = tmppfx + filename      
     filepath = avgfolder + filename
     tmpfilepath = avgfolder + tmpfilename
+    # fingerprint of source files, parameters and code version (the output is rebuilt, if it changes)
+    srcfiles = list(dataargs.filelist) + list(getattr(stndata,'filelist',None) or []) # including station data
+    fingerprint = getFingerprint(srcfiles, params=dict(station=stndata.name, varlist=varlist), version=code_version)
     if os.path.exists(filepath): 
       if not loverwrite: 
-        age = datetime.fromtimestamp(os.path.getmtime(filepath))
-        # if source file is newer than sink file or if sink file is a stub, recompute, otherwise skip
-        if age > srcage and os.path.getsize(filepath) > 1e5: lskip = True
+        # skip, if the fingerprint is unchanged (or, for legacy files, if they are newer than the source)
+        lskip = isUpToDate(filepath, fingerprint, srcage=srcage, minsize=1e5)
         # N.B.: NetCDF files smaller than 100kB are usually incomplete header fragments from a previous crashed
 
   
@@ -92,7 +97,7 @@ def performExtraction(dataset, mode, stnfct, dataargs, loverwrite=False, varlist
   else:
           
     ## actually load datasets
-    source = loadfct() # load source 
+    with recordPhase('load'): source = loadfct() # load source 
     # check period
     if 'period' in source.atts and dataargs.periodstr != source.atts.period: # a NetCDF attribute
       raise DateError, "Specifed period is inconsistent with netcdf records: '{:s}' != '{:s}'".format(periodstr,source.atts.period)
@@ -113,15 +118,20 @@ def performExtraction(dataset, mode, stnfct, dataargs, loverwrite=False, varlist
     atts['title'] = '{:s} (Stations) from {:s} {:s}'.format(stndata.title,dataset_name,mode.title())
     # make new dataset
     if lwrite: # write to NetCDF file 
+      # journal of completed variables; the temp file of an interrupted run becomes a checkpoint
+      if lreturn: journal = None
+      else: journal = RunJournal(tmpfilepath, job=fingerprint, srcage=srcage, lresume=not loverwrite)
       if os.path.exists(tmpfilepath): os.remove(tmpfilepath) # remove old temp files 
       sink = DatasetNetCDF(folder=avgfolder, filelist=[tmpfilename], atts=atts, mode='w')
-    else: sink = Dataset(atts=atts) # ony create dataset in memory
+    else: 
+      sink = Dataset(atts=atts) # ony create dataset in memory
+      journal = None
     
     # initialize processing
-    CPU = CentralProcessingUnit(source, sink, varlist=varlist, tmp=False, feedback=ldebug)
+    CPU = CentralProcessingUnit(source, sink, varlist=varlist, tmp=False, feedback=ldebug, journal=journal)
   
     # extract data at station locations
-    CPU.Extract(template=stndata, flush=True)
+    with recordPhase('compute'): CPU.Extract(template=stndata, flush=True)
     # get results    
     CPU.sync(flush=True)
     
@@ -130,7 +140,9 @@ def performExtraction(dataset, mode, stnfct, dataargs, loverwrite=False, varlist
       logger.info('\n'+str(sink)+'\n')   
     # write results to file
     if lwrite:
-      sink.sync()
+      with recordPhase('write'): sink.sync()
+      # N.B.: the fingerprint is only recorded after all data has been written, so that partial files are rebuilt
+      sink.dataset.setncattr('fingerprint', fingerprint); sink.dataset.sync()
       writemsg =  "\n{:s}   >>>   Writing to file '{:s}' in dataset {:s}".format(pidstr,filename,dataset_name)
       writemsg += "\n{:s}   >>>   ('{:s}')\n".format(pidstr,filepath)
       logger.info(writemsg)      
@@ -140,6 +152,7 @@ def performExtraction(dataset, mode, stnfct, dataargs, loverwrite=False, varlist
         sink.unload(); sink.close(); del sink # destroy all references 
         if os.path.exists(filepath): os.remove(filepath) # remove old file
         os.rename(tmpfilepath,filepath)
+        if journal: journal.discard() # job completed
       # N.B.: there is no temporary file if the dataset is returned, because an open file can't be renamed
         
     # clean up and return
@@ -151,6 +164,19 @@ def performExtraction(dataset, mode, stnfct, dataargs, loverwrite=False, varlist
     # N.B.: garbage is collected in multi-processing wrapper
 
 
+def getExtractionJob(dataset, mode, stnfct, dataargs, station=None, **kwargs):
+  ''' return a DAGJob for performExtraction with its input and output files (for use with asyncPoolDAG); 
+      the station dataset name is taken from the 'name' argument of stnfct, if it is a partial '''
+  if station is None: station = stnfct.keywords['name']
+  grid = dataargs.get('grid',None)
+  inputs = getDatasetFiles(dataset, mode, dataargs, grid=grid)
+  outputs = getDatasetFiles(dataset, mode, dataargs, grid=grid, station=station)
+  name = dataargs['experiment'].name if 'experiment' in dataargs else dataset
+  name = "extract {:s} {:s} at '{:s}'".format(name, mode, station)
+  return DAGJob(performExtraction, args=(dataset, mode, stnfct, dataargs), kwargs=kwargs, 
+                inputs=inputs, outputs=outputs, name=name, lstrict=dataset in ('WRF','CESM'))
+
+
 if __name__ == '__main__':
   
   ## read environment variables
@@ -162,6 +188,22 @@ if __name__ == '__main__':
   if os.environ.has_key('PYAVG_DEBUG'): 
     ldebug =  os.environ['PYAVG_DEBUG'] == 'DEBUG' 
   else: ldebug = False
+  # file for performance telemetry of each job (JSON lines)
+  if os.environ.has_key('PYAVG_TELEMETRY'): 
+    telemetry_file = os.environ['PYAVG_TELEMETRY']
+  else: telemetry_file = None
+  # memory limit for concurrent jobs (in GB)
+  if os.environ.has_key('PYAVG_MEMORY'): 
+    max_memory = float(os.environ['PYAVG_MEMORY'])*1024**3
+  else: max_memory = None
+  # memory requirements of a job as a multiple of the source file size
+  if os.environ.has_key('PYAVG_MEMFACTOR'): 
+    memory_factor = float(os.environ['PYAVG_MEMFACTOR'])
+  else: memory_factor = 3.
+  # file with recorded job runtimes (for scheduling)
+  if os.environ.has_key('PYAVG_RUNTIMES'): 
+    runtime_file = os.environ['PYAVG_RUNTIMES']
+  else: runtime_file = None
   # run script in batch or interactive mode
   if os.environ.has_key('PYAVG_BATCH'): 
     lbatch =  os.environ['PYAVG_BATCH'] == 'BATCH' 
@@ -359,6 +401,10 @@ if __name__ == '__main__':
   kwargs = dict(loverwrite=loverwrite, varlist=varlist)
           
   ## call parallel execution function
-  ec = asyncPoolEC(performExtraction, args, kwargs, NP=NP, ldebug=ldebug, ltrialnerror=True)
+  # estimate job costs (longest first) and memory requirements for scheduling
+  costs = getJobCosts(args, runtime_file=runtime_file); memory = getJobMemory(args, factor=memory_factor)
+  ec = asyncPoolEC(performExtraction, args, kwargs, NP=NP, ldebug=ldebug, ltrialnerror=True, 
+                   costs=costs, memory=memory, max_memory=max_memory, runtime_file=runtime_file, 
+                   telemetry_file=telemetry_file)
   # exit with fraction of failures (out of 10) as exit code
   exit(int(10+int(10.*ec/len(args))) if ec > 0 else 0)
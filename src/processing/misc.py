@@ -10,12 +10,15 @@ Some utility functions related to processing datasets (to avoid code repetition)
 import numpy as np
 from importlib import import_module
 from functools import partial
-import yaml,os
+import yaml,os,json
+import hashlib
+import netCDF4 as nc
 from datetime import datetime
 # internal imports
 from geodata.misc import DatasetError, DateError, isInt, ArgumentError
 from utils.misc import namedTuple
 from datasets.common import getFileName
+from processing.multiprocess import getJobKey, loadRuntimes
 
 
 # load YAML configuration file
@@ -132,38 +135,233 @@ def getTargetFile(dataset=None, mode=None, dataargs=None, grid=None, shape=None,
   # return filename
   return filename
 
+def getSourceFiles(fileclasses=None, filetypes=None, exp=None, domain=None,
+                   periodstr=None, gridstr=None, lclim=None, lts=None):
+  ''' function to assemble the list of source files of a set of filetypes (WRF and CESM) '''
+  filelist = []
+  # prepare period and grid strings
+  periodstr = '_{}'.format(periodstr) if periodstr else ''
+  gridstr = '_{}'.format(gridstr) if gridstr else ''    
+  # assemble filenames from dataset arguments
+  for filetype in filetypes:
+    fileclass = fileclasses[filetype] # avoid WRF & CESM name collision
+    if domain is None:
+      if lclim: filename = fileclass.climfile.format(gridstr,periodstr) # insert grid and period
+      elif lts: filename = fileclass.tsfile.format(gridstr) # insert grid
+    else:
+      if lclim: filename = fileclass.climfile.format(domain,gridstr,periodstr) # insert domain number, grid, and period
+      elif lts: filename = fileclass.tsfile.format(domain,gridstr) # insert domain number, and grid
+    filelist.append('{:s}/{:s}'.format(exp.avgfolder,filename))
+  return filelist
+
 def getSourceAge(filelist=None, fileclasses=None, filetypes=None, exp=None, domain=None,
                  periodstr=None, gridstr=None, lclim=None, lts=None):
   ''' function to to get the latest modification date of a set of filetypes '''
   srcage = datetime.fromordinal(1) # the beginning of time (proleptic Gregorian calendar)
-  # if complete file list is given, just check each file
-  if filelist:
-    for filepath in filelist:
-      if not os.path.exists(filepath): raise IOError, "Source file '{:s}' does not exist!".format(filepath)        
-      # determine age of source file
-      fileage = datetime.fromtimestamp(os.path.getmtime(filepath))          
-      if srcage < fileage: srcage = fileage # use latest modification date
-  else:    
-    # prepare period and grid strings
-    periodstr = '_{}'.format(periodstr) if periodstr else ''
-    gridstr = '_{}'.format(gridstr) if gridstr else ''    
-    # assemble filenames from dataset arguments
-    for filetype in filetypes:
-      fileclass = fileclasses[filetype] # avoid WRF & CESM name collision
-      if domain is None:
-        if lclim: filename = fileclass.climfile.format(gridstr,periodstr) # insert grid and period
-        elif lts: filename = fileclass.tsfile.format(gridstr) # insert grid
-      else:
-        if lclim: filename = fileclass.climfile.format(domain,gridstr,periodstr) # insert domain number, grid, and period
-        elif lts: filename = fileclass.tsfile.format(domain,gridstr) # insert domain number, and grid
-      filepath = '{:s}/{:s}'.format(exp.avgfolder,filename)
-      if not os.path.exists(filepath): raise IOError, "Source file '{:s}' does not exist!".format(filepath)        
-      # determine age of source file
-      fileage = datetime.fromtimestamp(os.path.getmtime(filepath))          
-      if srcage < fileage: srcage = fileage # use latest modification date
+  # if no complete file list is given, assemble file list from dataset arguments
+  if not filelist:
+    filelist = getSourceFiles(fileclasses=fileclasses, filetypes=filetypes, exp=exp, domain=domain,
+                              periodstr=periodstr, gridstr=gridstr, lclim=lclim, lts=lts)
+  for filepath in filelist:
+    if not os.path.exists(filepath): raise IOError, "Source file '{:s}' does not exist!".format(filepath)        
+    # determine age of source file
+    fileage = datetime.fromtimestamp(os.path.getmtime(filepath))          
+    if srcage < fileage: srcage = fileage # use latest modification date
   # return latest modification date
   return srcage
 
+## content fingerprints for incremental rebuilds
+
+def getFileChecksum(filepath, nsample=8, blocksize=2**16):
+  ''' return a checksum of a file that does not depend on its location or modification time: the file size and 
+      a stored checksum (from a '.md5' or '.sha1' file next to it), or a hash of nsample evenly spaced blocks '''
+  size = os.path.getsize(filepath)
+  for ext in ('.md5','.sha1'):
+    if os.path.exists(filepath+ext):
+      with open(filepath+ext, 'r') as f: return '{:d}:{:s}'.format(size, f.read().split()[0])
+  sha1 = hashlib.sha1()
+  with open(filepath, 'rb') as f:
+    if size <= nsample*blocksize: sha1.update(f.read()) # small files are hashed entirely
+    else:
+      for offset in np.linspace(0, size-blocksize, nsample).astype(np.int64):
+        f.seek(offset); sha1.update(f.read(blocksize)) # includes first and last block
+  return '{:d}:{:s}'.format(size, sha1.hexdigest())
+
+def getFingerprint(filelist, params=None, version=None):
+  ''' return a fingerprint of an output from the checksums of its source files, the operation parameters 
+      (see getJobKey) and the code version; if the fingerprint changes, the output has to be rebuilt '''
+  sha1 = hashlib.sha1()
+  for filepath in sorted(filelist, key=os.path.basename): # N.B.: the location of source files does not matter
+    sha1.update('{:s}={:s};'.format(os.path.basename(filepath), getFileChecksum(filepath)))
+  sha1.update(getJobKey((params,version)))
+  return sha1.hexdigest()
+
+def readFingerprint(filepath):
+  ''' read the fingerprint of an output (NetCDF attribute or '.fingerprint' file in a folder); None, if absent '''
+  if os.path.isdir(filepath):
+    fpfile = '{:s}/.fingerprint'.format(filepath)
+    if not os.path.exists(fpfile): return None
+    with open(fpfile, 'r') as f: return f.read().strip()
+  try: ncfile = nc.Dataset(filepath, 'r')
+  except (IOError, RuntimeError): return None # not a (valid) NetCDF file
+  fingerprint = ncfile.getncattr('fingerprint') if 'fingerprint' in ncfile.ncattrs() else None
+  ncfile.close()
+  return fingerprint
+
+def writeFingerprint(filepath, fingerprint):
+  ''' write the fingerprint of an output (NetCDF attribute or '.fingerprint' file in a folder) '''
+  if os.path.isdir(filepath):
+    fpfile = '{:s}/.fingerprint'.format(filepath); tmpfile = '{:s}.{:d}.tmp'.format(fpfile, os.getpid())
+    with open(tmpfile, 'w') as f: f.write(fingerprint)
+    os.rename(tmpfile, fpfile)
+  else:
+    ncfile = nc.Dataset(filepath, 'a')
+    ncfile.setncattr('fingerprint', fingerprint)
+    ncfile.close()
+
+def isUpToDate(filepath, fingerprint, srcage=None, minsize=0):
+  ''' check, if an output has to be rebuilt: compare the stored fingerprint, or, for legacy outputs without 
+      fingerprint, modification time and size (stubs are incomplete); legacy outputs that pass are adopted, 
+      i.e. their fingerprint is recorded, so that in the future only content changes trigger a rebuild '''
+  if not os.path.exists(filepath): return False
+  stored = readFingerprint(filepath)
+  if stored is not None: return stored == fingerprint
+  age = datetime.fromtimestamp(os.path.getmtime(filepath))
+  lskip = ( srcage is None or age > srcage ) and ( os.path.isdir(filepath) or os.path.getsize(filepath) > minsize )
+  if lskip: writeFingerprint(filepath, fingerprint)
+  return lskip
+
+def getDatasetFiles(dataset, mode, dataargs, grid=None, shape=None, station=None):
+  ''' return the paths of the (averaged) files of a dataset on a given grid (None: native grid), or of the 
+      shape averages or station data extracted from it (see getTargetFile); unlike in getMetaData, the files 
+      do not have to exist yet, so that dependencies between jobs can be determined '''
+  if mode[-5:] == '-mean': mode = 'climatology' # seasonal means are computed from the climatology
+  period = dataargs.get('period',None)
+  if dataset in ('WRF','CESM'):
+    module = import_module('datasets.{0:s}'.format(dataset))
+    exp = dataargs['experiment']
+    periodstr, gridstr = getPeriodGridString(period, grid, exp=exp)
+    pstr = '_{}'.format(periodstr) if periodstr else ''
+    gstr = '_{}'.format(gridstr) if gridstr else ''
+    if shape and station: raise ArgumentError
+    elif shape: gstr = '_{}{}'.format(shape,gstr)
+    elif station: gstr = '_{}{}'.format(station,gstr)
+    filelist = []
+    for filetype in dataargs['filetypes']:
+      fileclass = module.fileclasses[filetype] if filetype in module.fileclasses else module.FileType(filetype)
+      fmtargs = (dataargs['domain'],gstr) if dataset == 'WRF' else (gstr,)
+      if mode == 'climatology': filename = fileclass.climfile.format(*fmtargs+(pstr,))
+      elif mode == 'time-series': filename = fileclass.tsfile.format(*fmtargs)
+      else: raise NotImplementedError, "Unrecognized Mode: '{:s}'".format(mode)
+      filelist.append('{:s}/{:s}'.format(exp.avgfolder,filename))
+  else:
+    # assume observational datasets
+    module = import_module('datasets.{0:s}'.format(dataset))
+    resolution = dataargs.get('resolution',None)
+    obs_res = '{0:s}_{1:s}'.format(module.dataset_name,resolution) if resolution else module.dataset_name
+    if grid and period is None and mode == 'climatology': period = 'LTM' # see getTargetFile
+    filename = getFileName(grid=grid, shape=shape, station=station, period=period, name=obs_res, filetype=mode)
+    filelist = ['{:s}/{:s}'.format(module.avgfolder,filename)]
+  return filelist
+
+def getSourceSize(dataset, mode, dataargs):
+  ''' return the total size (in bytes) of the existing source files of a dataset (0, if none are found) '''
+  try: filelist = getDatasetFiles(dataset, mode, dataargs, grid=dataargs.get('grid',None))
+  except (DatasetError, ImportError, KeyError, NotImplementedError): return 0
+  return sum(os.path.getsize(filepath) for filepath in filelist if os.path.exists(filepath))
+
+def getJobCosts(args, runtime_file=None):
+  ''' estimate the relative cost of jobs for scheduling (args as in asyncPoolEC, with dataset, mode and 
+      dataargs as first, second and last arguments): recorded runtimes are used, if available for any job, 
+      otherwise the size of the source files '''
+  runtimes = loadRuntimes(runtime_file)
+  keys = [getJobKey(arguments) for arguments in args]
+  known = [runtimes[key] for key in keys if key in runtimes]
+  if known: 
+    # N.B.: jobs without a record (e.g. new jobs) are assumed to take the median of the known runtimes
+    median = float(np.median(known))
+    return [runtimes.get(key, median) for key in keys]
+  else: 
+    return [getSourceSize(arguments[0], arguments[1], arguments[-1]) for arguments in args]
+
+def getJobMemory(args, factor=3.):
+  ''' estimate the memory requirements of jobs (in bytes) as a multiple of the source file size '''
+  return [factor*getSourceSize(arguments[0], arguments[1], arguments[-1]) for arguments in args]
+  # N.B.: NetCDF files are usually compressed, and intermediate results also require memory
+
+## run journal to resume interrupted jobs
+
+class RunJournal(object):
+  ''' 
+    A journal of the variables that have been completed (written to disk) in the temporary output file of 
+    a job; the journal is saved next to the temporary file and replaced atomically after every update. 
+    When an interrupted job is restarted, the temporary file of the previous run becomes a checkpoint, 
+    from which completed variables are restored (see CentralProcessingUnit), instead of recomputing them. 
+  '''
+  
+  def __init__(self, tmpfilepath, job=None, srcage=None, lresume=True):
+    ''' load journal of a previous run of the same job and prepare checkpoint, if the source is unchanged '''
+    self.tmpfilepath = tmpfilepath
+    self.filepath = tmpfilepath + '.journal'
+    self.ckptpath = tmpfilepath + '.ckpt'
+    self.job = job
+    self.units = [] # variables that are completed in the temporary file
+    self.checkpoint = [] # variables that can be restored from the checkpoint file
+    record = None
+    if lresume and os.path.exists(self.filepath):
+      try:
+        with open(self.filepath, 'r') as f: record = json.load(f)
+      except ValueError: record = None # corrupted journal
+    if record and record['job'] == job:
+      if record['units'] and not record['checkpoint'] and os.path.exists(tmpfilepath):
+        os.rename(tmpfilepath, self.ckptpath) # output of previous run becomes checkpoint
+        self.checkpoint = record['units']
+      elif os.path.exists(self.ckptpath):
+        self.checkpoint = record['checkpoint'] or record['units']
+        # N.B.: the checkpoint is still complete, if the previous run was interrupted while restoring
+    if self.checkpoint and srcage is not None: 
+      if datetime.fromtimestamp(os.path.getmtime(self.ckptpath)) < srcage: self.checkpoint = [] # outdated
+    if not self.checkpoint and os.path.exists(self.ckptpath): os.remove(self.ckptpath)
+    self.save()
+    
+  def __contains__(self, varname): return varname in self.units
+  
+  def save(self):
+    ''' save journal to disk (atomically, so that an interruption never leaves a partial journal) '''
+    tmpfile = '{:s}.{:d}.tmp'.format(self.filepath, os.getpid())
+    with open(tmpfile, 'w') as f: json.dump(dict(job=self.job, units=self.units, checkpoint=self.checkpoint), f)
+    os.rename(tmpfile, self.filepath)
+    
+  def record(self, varname):
+    ''' record a variable as completed (it has to be written to disk already) '''
+    if varname not in self.units: 
+      self.units.append(varname); self.save()
+    
+  def restore(self, dataset, varlist=None):
+    ''' copy completed variables from the checkpoint into a (NetCDF) dataset and remove the checkpoint '''
+    from geodata.netcdf import DatasetNetCDF # N.B.: import only when needed
+    folder,filename = os.path.split(self.ckptpath)
+    checkpoint = DatasetNetCDF(folder=folder+'/', filelist=[filename], mode='r')
+    try:
+      for varname in self.checkpoint:
+        if ( varlist is None or varname in varlist ) and varname not in self.units:
+          var = checkpoint.variables[varname].load()
+          dataset.addVariable(var, copy=True); var.unload()
+          dataset.sync(); self.record(varname)
+    except:
+      self.discard() # start from scratch next time
+      raise
+    finally: checkpoint.close()
+    self.checkpoint = []; self.save() # N.B.: the journal has to be updated before the checkpoint is removed
+    os.remove(self.ckptpath)
+    
+  def discard(self):
+    ''' remove journal and checkpoint (e.g. after the output file has been renamed to its final name) '''
+    for filepath in (self.filepath, self.ckptpath):
+      if os.path.exists(filepath): os.remove(filepath)
+    self.units = []; self.checkpoint = []
+
+
 ## determine dataset metadata
 def getMetaData(dataset, mode, dataargs, lone=True):
   ''' determine dataset type and meta data, as well as path to main source file '''
@@ -203,8 +401,9 @@ def getMetaData(dataset, mode, dataargs, lone=True):
       datamsgstr = "Processing WRF '{:s}'-file from Experiment '{:s}' (d{:02d})".format(filetypes[0], dataset_name, domain)
     else: datamsgstr = "Processing WRF dataset from Experiment '{:s}' (d{:02d})".format(dataset_name, domain)       
     # figure out age of source file(s)
-    srcage = getSourceAge(fileclasses=fileclasses, filetypes=filetypes, exp=exp, domain=domain,
-                          periodstr=periodstr, gridstr=gridstr, lclim=lclim, lts=lts)
+    filelist = getSourceFiles(fileclasses=fileclasses, filetypes=filetypes, exp=exp, domain=domain,
+                              periodstr=periodstr, gridstr=gridstr, lclim=lclim, lts=lts)
+    srcage = getSourceAge(filelist=filelist)
     # load source data
     if lclim:
       loadfct = partial(WRF.loadWRF, experiment=exp, name=None, domains=domain, grid=grid, varlist=varlist,
@@ -234,8 +433,9 @@ def getMetaData(dataset, mode, dataargs, lone=True):
       datamsgstr = "Processing CESM '{:s}'-file from Experiment '{:s}'".format(filetypes[0], dataset_name) 
     else: datamsgstr = "Processing CESM dataset from Experiment '{:s}'".format(dataset_name) 
     # figure out age of source file(s)
-    srcage = getSourceAge(fileclasses=fileclasses, filetypes=filetypes, exp=exp, domain=None,
-                          periodstr=periodstr, gridstr=gridstr, lclim=lclim, lts=lts)
+    filelist = getSourceFiles(fileclasses=fileclasses, filetypes=filetypes, exp=exp, domain=None,
+                              periodstr=periodstr, gridstr=gridstr, lclim=lclim, lts=lts)
+    srcage = getSourceAge(filelist=filelist)
     # load source data 
     load3D = dataargs.pop('load3D',None) # if 3D fields should be loaded (default: False)
     if lclim:
@@ -286,7 +486,7 @@ def getMetaData(dataset, mode, dataargs, lone=True):
   ## assemble and return meta data
   dataargs = namedTuple(dataset_name=dataset_name, period=period, periodstr=periodstr, avgfolder=avgfolder, 
                         filetypes=filetypes,filetype=filetypes[0], domain=domain, obs_res=obs_res, 
-                        varlist=varlist, grid=grid, gridstr=gridstr, resolution=resolution) 
+                        varlist=varlist, grid=grid, gridstr=gridstr, resolution=resolution, filelist=filelist) 
   # return meta data
   return dataargs, loadfct, srcage, datamsgstr    
 
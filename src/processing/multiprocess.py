@@ -13,9 +13,20 @@ import sys
 import gc # garbage collection
 import types
 import os
+import Queue
+import json
+import atexit
+import tempfile
+import functools
+import pickle
 import numpy as np
+from importlib import import_module
 from datetime import datetime
-from time import sleep
+from time import sleep, time
+from contextlib import contextmanager
+from collections import OrderedDict
+try: import resource
+except ImportError: resource = None # not available on Windows
 
 
 ## test functions
@@ -95,9 +106,102 @@ def test_func_dec(n, wait=1, lparallel=False, pidstr='', logger=None, ldebug=Fal
   logger.info('{:s} Current Process ID: {:d}'.format(pidstr,pid))
   assert int(pidstr[-3:-1]) == pid
   
+def test_func_dag(n, inputs=None, output=None, wait=0.1, lexit=False, lparallel=False, pidstr='', logger=None, ldebug=False):
+  ''' test function for DAG jobs: sum up the numbers in the input files and n, and write to output file '''
+  sleep(wait)
+  if lexit: os._exit(1) # simulate a worker that dies
+  with recordPhase('load'): total = n + sum(int(open(filepath).read()) for filepath in inputs or ())
+  with recordPhase('write'):
+    with open(output, 'w') as f: f.write(str(total))
+  logger.info('{:s} Job {:d}: {:d}'.format(pidstr,n,total))
+  return 1 if n < 0 else 0
+  
+def test_func_aax(n, lparallel=False, pidstr='', logger=None, ldebug=False):
+  ''' test function that calls apply_along_axis (NP=2) within a pool job; returns 0 on success '''
+  data = np.arange(n*400, dtype=np.float64).reshape((n*100,4))
+  result = apply_along_axis(np.sum, 1, data, NP=2, chunksize=10)
+  logger.info('{:s} Job {:d}: {:f}'.format(pidstr,n,result.sum()))
+  return 0 if np.all(result == data.sum(axis=1)) else 1
+  
 
 ## production functions
 
+# phases of the current task (None, if no telemetry is recorded) and stack of active phases
+_task_phases = None
+_phase_stack = []
+
+@contextmanager
+def recordPhase(name):
+  ''' context manager that records the wall time spent in a processing phase (e.g. 'load', 'compute' or 
+      'write') of the current task; time spent in nested phases is only attributed to the inner phase '''
+  if _task_phases is None: 
+    yield # no telemetry
+    return
+  now = time()
+  if _phase_stack: # pause enclosing phase
+    outer = _phase_stack[-1]; _task_phases[outer[0]] = _task_phases.get(outer[0],0.) + now - outer[1]
+  _phase_stack.append([name,now])
+  try: yield
+  finally:
+    now = time(); name,start = _phase_stack.pop()
+    _task_phases[name] = _task_phases.get(name,0.) + now - start
+    if _phase_stack: _phase_stack[-1][1] = now # resume enclosing phase
+
+def getIOCounters():
+  ''' return the number of bytes read and written by the current process (only on Linux; None otherwise) '''
+  try:
+    with open('/proc/self/io', 'r') as f: counters = dict(line.split(':') for line in f)
+    return int(counters['rchar']), int(counters['wchar'])
+  except (IOError, KeyError, ValueError): return None, None
+
+def getPeakRSS():
+  ''' return the peak resident set size of the current process in bytes (None, if not available) '''
+  if resource is None: return None
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024 # N.B.: kB on Linux
+  # N.B.: this is the peak of the worker process, which may include previous tasks
+
+def appendTelemetry(filepath, record):
+  ''' append a telemetry record to a JSON lines file (one line per task) '''
+  line = json.dumps(record) + '\n'
+  with open(filepath, 'a') as f: f.write(line)
+  # N.B.: single writes in append mode are not interleaved, so that processes can share a file
+
+def loadTelemetry(filepath, run=None):
+  ''' load telemetry records from a JSON lines file (only records from a given run, if run is not None) '''
+  records = []
+  if not os.path.exists(filepath): return records
+  with open(filepath, 'r') as f:
+    for line in f:
+      if not line.strip(): continue
+      record = json.loads(line, object_pairs_hook=OrderedDict)
+      if run is None or record['run'] == run: records.append(record)
+  return records
+
+def summarizeTelemetry(records, **kwargs):
+  ''' return a summary table of telemetry records (one row per task and totals) using utils.misc.tabulate '''
+  from utils.misc import tabulate # N.B.: import only when needed
+  phases = []
+  for record in records: 
+    phases += [phase for phase in record['phases'] if phase not in phases]
+  MB = 1024.**2
+  header = ['EC', 'Wall [s]', 'CPU [s]', 'Peak RSS [MB]', 'Read [MB]', 'Written [MB]'] + [phase.title()+' [s]' for phase in phases]
+  fmt = lambda value, scale=1.: '-' if value is None else '{:.1f}'.format(value/scale)
+  data = []; labels = []
+  for record in records:
+    row = [str(record['ec']), fmt(record['wall']), fmt(record['cpu']), fmt(record['peak_rss'],MB), 
+           fmt(record['bytes_read'],MB), fmt(record['bytes_written'],MB)]
+    data.append(row + [fmt(record['phases'].get(phase,None)) for phase in phases])
+    labels.append(record['job'])
+  total = lambda key: None if any(record[key] is None for record in records) else sum(record[key] for record in records)
+  row = [str(sum(1 for record in records if record['ec'])), fmt(total('wall')), fmt(total('cpu')), 
+         fmt(max(record['peak_rss'] for record in records) if records and total('peak_rss') is not None else None,MB), 
+         fmt(total('bytes_read'),MB), fmt(total('bytes_written'),MB)]
+  data.append(row + [fmt(sum(record['phases'].get(phase,0.) for record in records)) for phase in phases])
+  labels.append('Total')
+  kwargs.setdefault('cell_del','  '); kwargs.setdefault('line_break',''); kwargs.setdefault('lpercent',False)
+  kwargs.setdefault('lhline',False); kwargs.setdefault('lheaderhline',False)
+  return tabulate(data, header=header, labels=labels, mode='mylatex', **kwargs)
+
 # a decorator class that handles loggers and exit codes for functions inside asyncPool_EC  
 class TrialNError():
   ''' 
@@ -105,9 +209,11 @@ class TrialNError():
     also handles loggers and some multiprocessing stuff. 
   '''
   
-  def __init__(self, func):
-    ''' Save original function in decorator class. '''
+  def __init__(self, func, telemetry=None):
+    ''' Save original function in decorator class; telemetry is a tuple of a file path and run ID, if
+        wall and CPU time, peak memory, I/O and processing phases of each call are to be recorded. '''
     self.func = func
+    self.telemetry = telemetry
     
   def __call__(self, *args, **kwargs):
     ''' connect to logger, figure out process ID, execute decorated function in try-block,
@@ -123,7 +229,10 @@ class TrialNError():
     if logger is None: 
       logger = logging.getLogger() # new logger
       logger.addHandler(logging.StreamHandler())
-    else: logger = logging.getLogger(name=logger) # connect to existing one    
+    else: 
+      logger = logging.getLogger(name=logger) # connect to existing one    
+      if not logger.handlers: logger = getPoolLogger(logger.name, ldebug=kwargs.get('ldebug',False))
+      # N.B.: workers of a managed pool are started before the logger is set up in the parent process
     logger.propagate = False # suppress duplicate output
     # parallelism
     if lparallel:
@@ -132,27 +241,111 @@ class TrialNError():
     else:
       pidstr = '' # don't print process ID, sicne there is only one
 
+    # start telemetry
+    global _task_phases
+    if self.telemetry:
+      _task_phases = OrderedDict(); del _phase_stack[:]
+      wall = time(); cpu = os.times(); bytes_read, bytes_written = getIOCounters()
+
     # execute decorated function in try-block
     kwargs['logger'] = logger
     try:
       # decorated function
       ec = self.func(*args, pidstr=pidstr, **kwargs)
       gc.collect() # enforce garbage collection
-      # return exit code
-      return ec or 0 # everything OK (and ec = None is OK, too)    
+      ec = ec or 0 # everything OK (and ec = None is OK, too)    
     except Exception: # , err
       # an error occurred
       logging.exception(pidstr) # print stack trace of last exception and current process ID 
-      return 1 # indicate failure
+      ec = 1 # indicate failure
+    
+    # record telemetry
+    if self.telemetry:
+      filepath, run = self.telemetry
+      wall = time() - wall; cpu = sum(os.times()[:2]) - sum(cpu[:2])
+      read, written = getIOCounters()
+      record = OrderedDict([('run',run), ('func',self.func.__name__), ('job',getJobKey(args)), 
+                            ('pid',os.getpid()), ('ec',ec), ('wall',wall), ('cpu',cpu), ('peak_rss',getPeakRSS()), 
+                            ('bytes_read',None if read is None else read - bytes_read), 
+                            ('bytes_written',None if written is None else written - bytes_written)])
+      phases = _task_phases; _task_phases = None
+      phases['other'] = max(0., wall - sum(phases.itervalues()))
+      record['phases'] = phases
+      try: appendTelemetry(filepath, record)
+      except IOError: logging.exception(pidstr) # don't fail because of telemetry
+    # return exit code
+    return ec
+
+
+def getPoolLogger(name, ldebug=False, lparallel=False):
+  ''' set up a logger (printing to stdout) for worker pools and return it '''
+  # logging level
+  if ldebug: loglevel = logging.DEBUG
+  else: loglevel = logging.INFO
+  # set up parallel logging (multiprocessing)
+  if lparallel:
+    multiprocessing.log_to_stderr()
+    mplogger = multiprocessing.get_logger()
+    #if ldebug: mplogger.setLevel(logging.DEBUG)
+    if ldebug: mplogger.setLevel(logging.INFO)
+    else: mplogger.setLevel(logging.ERROR)
+  # set up general logging
+  logger = logging.getLogger(name) # standard logger
+  logger.setLevel(loglevel)
+  ch = logging.StreamHandler(sys.stdout) # stdout, not stderr
+  ch.setLevel(loglevel)
+  ch.setFormatter(logging.Formatter('%(message)s'))
+  logger.addHandler(ch)
+  return logger
+
+
+def getJobKey(arguments):
+  ''' return a string that identifies a job by its arguments (e.g. to record runtimes) '''
+  def argKey(arg):
+    if isinstance(arg,dict): return '{'+','.join(['{}:{}'.format(key,argKey(arg[key])) for key in sorted(arg)])+'}'
+    elif isinstance(arg,(list,tuple)): return '['+','.join([argKey(a) for a in arg])+']'
+    elif arg is None or isinstance(arg,(basestring,int,long,float,np.number)): return str(arg)
+    elif hasattr(arg,'name'): return str(arg.name) # e.g. experiments or grids
+    elif hasattr(arg,'__name__'): return arg.__name__ # e.g. functions
+    else: return arg.__class__.__name__
+  return argKey(tuple(arguments))
+
+def loadRuntimes(filepath):
+  ''' load recorded job runtimes (in seconds) from a JSON file; returns an empty dict, if there is no file '''
+  if filepath is None or not os.path.exists(filepath): return dict()
+  with open(filepath, 'r') as f: return json.load(f)
+
+def saveRuntimes(filepath, runtimes):
+  ''' save job runtimes to a JSON file (atomically, so that concurrent readers never see partial files) '''
+  tmpfile = '{:s}.{:d}.tmp'.format(filepath, os.getpid())
+  with open(tmpfile, 'w') as f: json.dump(runtimes, f, indent=0, sort_keys=True)
+  os.rename(tmpfile, filepath)
 
+def _runPoolJob(i, func, args, kwargs):
+  ''' helper function that executes a job and returns its index along with the exit code and runtime '''
+  start = datetime.today()
+  try: ec = func(*args, **kwargs)
+  except Exception:
+    logging.exception('Job {:d} failed:'.format(i)) # print stack trace 
+    ec = 1
+  return i, ec, (datetime.today() - start).total_seconds()
 
-def asyncPoolEC(func, args, kwargs, NP=1, ldebug=False, ltrialnerror=True):
+
+def asyncPoolEC(func, args, kwargs, NP=1, ldebug=False, ltrialnerror=True, costs=None, memory=None, 
+                max_memory=None, runtime_file=None, telemetry_file=None, interval=1.):
   ''' 
     A function that executes func with arguments args (len(args) times) on NP number of processors;
     args must be a list of argument tuples; kwargs are keyword arguments to func, which do not change
     between calls.
     Func is assumed to take a keyword argument lparallel to indicate parallel execution, and return 
     a common exit status (0 = no error, > 0 for an error code).
+    If cost or memory estimates are given for each job, jobs are dispatched dynamically: the most 
+    expensive jobs first, only as many as there are idle workers, and only as many as fit into 
+    max_memory (a job that exceeds max_memory by itself runs alone). If runtime_file is given, 
+    the runtimes of successful jobs are recorded there (see getJobKey). While waiting for scheduled 
+    jobs, workers are checked every interval seconds; jobs that were lost with a dead worker fail. 
+    If telemetry_file is given, performance data of each job are appended to that file (JSON lines; 
+    requires ltrialnerror) and a summary table is printed at the end. 
     This function returns the number of failures as the exit code. 
   '''
   # input checking
@@ -162,6 +355,11 @@ def asyncPoolEC(func, args, kwargs, NP=1, ldebug=False, ltrialnerror=True):
   if NP is not None and not isinstance(NP,int): raise TypeError
   if not isinstance(ldebug,(bool,np.bool)): raise TypeError
   if not isinstance(ltrialnerror,(bool,np.bool)): raise TypeError
+  if costs is not None and len(costs) != len(args): raise ValueError, costs
+  if memory is not None and len(memory) != len(args): raise ValueError, memory
+  if memory is not None and max_memory is None: memory = None # no limit
+  if telemetry_file and not ltrialnerror: raise ValueError, 'Telemetry requires the TrialNError decorator!'
+  lschedule = costs is not None or memory is not None or runtime_file is not None
   
   # figure out if running parallel
   if NP is not None and NP == 1: lparallel = False
@@ -169,23 +367,8 @@ def asyncPoolEC(func, args, kwargs, NP=1, ldebug=False, ltrialnerror=True):
   kwargs['ldebug'] = ldebug
   kwargs['lparallel'] = lparallel  
 
-  # logging level
-  if ldebug: loglevel = logging.DEBUG
-  else: loglevel = logging.INFO
-  # set up parallel logging (multiprocessing)
-  if lparallel:
-    multiprocessing.log_to_stderr()
-    mplogger = multiprocessing.get_logger()
-    #if ldebug: mplogger.setLevel(logging.DEBUG)
-    if ldebug: mplogger.setLevel(logging.INFO)
-    else: mplogger.setLevel(logging.ERROR)
-  # set up general logging
-  logger = logging.getLogger('multiprocess.asyncPoolEC') # standard logger
-  logger.setLevel(loglevel)
-  ch = logging.StreamHandler(sys.stdout) # stdout, not stderr
-  ch.setLevel(loglevel)
-  ch.setFormatter(logging.Formatter('%(message)s'))
-  logger.addHandler(ch)
+  # set up logging
+  logger = getPoolLogger(name='multiprocess.asyncPoolEC', ldebug=ldebug, lparallel=lparallel)
   kwargs['logger'] = logger.name
 #   # process sub logger
 #   sublogger = logging.getLogger('multiprocess.asyncPoolEC.func') # standard logger
@@ -199,28 +382,85 @@ def asyncPoolEC(func, args, kwargs, NP=1, ldebug=False, ltrialnerror=True):
 #   kwargs['logger'] = sublogger.name
   
   # apply decorator
-  if ltrialnerror: func = TrialNError(func)
+  run = '{:s}-{:d}'.format(datetime.today().strftime('%Y%m%d%H%M%S%f'), os.getpid()) # run ID for telemetry
+  if ltrialnerror: func = TrialNError(func, telemetry=(telemetry_file, run) if telemetry_file else None)
   
   # print first logging message
   logger.info(datetime.today())
   logger.info('\nTHREADS: {0:s}, DEBUG: {1:s}\n'.format(str(NP),str(ldebug)))
+  if max_memory is not None: logger.info('MEMORY LIMIT: {:.1f} GB\n'.format(max_memory/1024.**3))
   exitcodes = [] # list of results  
   def callbackEC(result):
     # custom callback function that appends the results to the list
     exitcodes.append(result)
+  runtimes = dict() # runtimes of successful jobs
   ## loop over and process all job sets
-  if lparallel:
-    # create pool of workers   
-    pool = multiprocessing.Pool(processes=NP) # NP=None uses all available CPUs
+  if lschedule:
+    # sort jobs by cost (most expensive first; stable sort, i.e. ties keep their order)
+    pending = range(len(args))
+    if costs is not None: pending.sort(key=lambda i: -costs[i])
+    if NP is None: NP = multiprocessing.cpu_count() # need a number to limit dispatching
+    results = Queue.Queue() # receives exit codes and runtimes (from callback)
+    if lparallel: 
+      pool, lmanaged = getPool(NP)
+      workers = list(pool._pool) # to detect dead workers
+    running = dict() # memory of running jobs
+    ndead = 0; nlost = 0 # number of dead workers and of lost jobs that were not marked as failed yet
+    try:
+      while pending or running:
+        # start jobs, as long as workers are idle and memory is available
+        while pending and len(running) < NP:
+          if memory is None: n = 0
+          else:
+            used = sum(running.itervalues())
+            n = next((n for n,i in enumerate(pending) if used + memory[i] <= max_memory), None)
+            if n is None: 
+              if running: break # wait until memory is released
+              n = 0 # job exceeds memory limit, but can run alone
+              logger.info('\n   ###   Job exceeds memory limit: {:.1f} GB   ###   \n'.format(memory[pending[0]]/1024.**3))
+          i = pending.pop(n)
+          running[i] = 0 if memory is None else memory[i]
+          if lparallel: pool.apply_async(_runPoolJob, (i, func, args[i], kwargs), callback=results.put)
+          else: results.put(_runPoolJob(i, func, args[i], kwargs))
+        # wait for a job to finish (poll, so that jobs lost with dead workers can be detected)
+        try: i, ec, runtime = results.get(timeout=interval)
+        except Queue.Empty:
+          dead = findDeadWorkers(pool, workers)
+          if len(dead) > ndead:
+            logger.info('\n   ###   {:d} worker process(es) died (exitcode {:d}) and jobs were lost!   ###   \n'.format(len(dead)-ndead,dead[-1].exitcode))
+            nlost += len(dead) - ndead; ndead = len(dead)
+          # N.B.: it is not known, which jobs were lost, but once all jobs that are still running 
+          #       have been lost, they will never finish and can be marked as failed
+          if nlost > 0 and len(running) <= nlost:
+            for i in running: logger.info("\n   ###   Job {:d} was lost: {}   ###   \n".format(i,args[i]))
+            exitcodes.extend([1]*len(running)); running.clear(); nlost = 0
+          continue
+        if i not in running: continue # job was already marked as lost
+        del running[i]; exitcodes.append(ec or 0)
+        if not ec: runtimes[i] = runtime
+    except:
+      if lparallel: releasePool(pool, lmanaged, lterminate=True)
+      raise
+    else:
+      # N.B.: lost tasks are never removed from the pool, so that joining the pool would block forever
+      if lparallel: releasePool(pool, lmanaged, lterminate=ndead > 0)
+  elif lparallel:
+    # create pool of workers (or use managed pool)
+    pool, lmanaged = getPool(NP) # NP=None uses all available CPUs
     # distribute tasks to workers
+    tasks = []
     for arguments in args:
       #exitcodes.append(pool.apply_async(func, arguments, kwargs))
       #print arguments      
-      pool.apply_async(func, arguments, kwargs, callback=callbackEC) 
-      # N.B.: we do not record result objects, since we have callback, which just extracts the exitcodes
+      tasks.append(pool.apply_async(func, arguments, kwargs, callback=callbackEC))
+      # N.B.: exit codes are extracted by the callback; results are only used to wait for a managed pool
     # wait until pool and queue finish
-    pool.close()
-    pool.join() 
+    try: 
+      for task in tasks: task.wait()
+    except:
+      releasePool(pool, lmanaged, lterminate=True)
+      raise
+    releasePool(pool, lmanaged)
     logger.debug('\n   ***   all processes joined   ***   \n')
   else:
     # don't parallelize, if there is only one process: just loop over files    
@@ -237,8 +477,160 @@ def asyncPoolEC(func, args, kwargs, NP=1, ldebug=False, ltrialnerror=True):
     exitcode += ec
   # N.B.: returnign None is interpreted as  
   nop = len(args) - exitcode
+  # record runtimes for future scheduling
+  if runtime_file and runtimes:
+    records = loadRuntimes(runtime_file)
+    for i,runtime in runtimes.iteritems(): records[getJobKey(args[i])] = runtime
+    saveRuntimes(runtime_file, records)
+  # print performance summary
+  if telemetry_file: 
+    logger.info('\n'+summarizeTelemetry(loadTelemetry(telemetry_file, run=run)))
+  
+  # print summary (to log)
+  if exitcode == 0:
+    logger.info('\n   >>>   All {:d} operations completed successfully!!!   <<<   \n'.format(nop))
+  else:
+    logger.info('\n   ===   {:2d} operations completed successfully!    ===   \n'.format(nop) +
+          '\n   ###   {:2d} operations did not complete/failed!   ###   \n'.format(exitcode))
+  logger.info(datetime.today())
+  # return with exit code
+  return exitcode
+
+class DAGJob(object):
+  ''' 
+    A job for asyncPoolDAG: a worker function with positional and keyword arguments, and the files the job 
+    reads (inputs) and writes (outputs); jobs that read the outputs of other jobs depend on these jobs. 
+    If lstrict is False, the job also runs if inputs that are not produced by any job are missing (e.g. 
+    if the worker can fall back to other sources). 
+  '''
+  
+  def __init__(self, func, args=None, kwargs=None, inputs=None, outputs=None, name=None, lstrict=True):
+    ''' save job definition; file paths are normalized, so that they can be compared '''
+    if not isinstance(func,types.FunctionType): raise TypeError, func
+    self.func = func
+    self.args = tuple(args) if args else ()
+    self.kwargs = kwargs.copy() if kwargs else dict()
+    self.inputs = [os.path.abspath(filepath) for filepath in inputs or ()]
+    self.outputs = [os.path.abspath(filepath) for filepath in outputs or ()]
+    self.name = name or func.__name__
+    self.lstrict = lstrict
+    
+  def __str__(self): return self.name
+
+
+def asyncPoolDAG(jobs, NP=1, ldebug=False, ltrialnerror=True, telemetry_file=None, interval=1.):
+  ''' 
+    A function that executes a list of DAGJob instances on one shared pool of NP processes; a job is 
+    dispatched as soon as all jobs that produce its inputs have completed successfully (other inputs 
+    have to exist already), so that jobs of different processing stages are interleaved. 
+    Among the jobs that are ready, jobs with the longest chain of dependent jobs are dispatched first, 
+    and only as many jobs as there are idle workers; jobs that depend on a failed job are skipped.
+    Worker functions have to conform to the same conventions as in asyncPoolEC (also telemetry_file). 
+    While waiting, workers are checked every interval seconds; if a worker died, a WorkerError is raised. 
+    This function returns the number of failed and skipped jobs as the exit code. 
+  '''
+  # input checking
+  if not isinstance(jobs,(list,tuple)): raise TypeError
+  if not all(isinstance(job,DAGJob) for job in jobs): raise TypeError
+  if NP is not None and not isinstance(NP,int): raise TypeError
+  if not isinstance(ldebug,(bool,np.bool)): raise TypeError
+  if not isinstance(ltrialnerror,(bool,np.bool)): raise TypeError
+  if telemetry_file and not ltrialnerror: raise ValueError, 'Telemetry requires the TrialNError decorator!'
+  njobs = len(jobs)
+  
+  # determine dependencies from input and output files
+  producers = dict()
+  for i,job in enumerate(jobs):
+    for filepath in job.outputs:
+      if filepath in producers: 
+        raise ValueError, "Jobs '{}' and '{}' write the same file:\n '{:s}'".format(jobs[producers[filepath]],job,filepath)
+      producers[filepath] = i
+  upstream = [set(producers[filepath] for filepath in job.inputs if filepath in producers) for job in jobs]
+  downstream = [[] for job in jobs]
+  for i,deps in enumerate(upstream):
+    for j in deps: downstream[j].append(i)
+  # sort topologically (and detect cycles)
+  waiting = [len(deps) for deps in upstream] # number of unfinished upstream jobs
+  order = [i for i in xrange(njobs) if waiting[i] == 0]
+  for i in order: # N.B.: order is extended in the loop
+    for j in downstream[i]:
+      waiting[j] -= 1
+      if waiting[j] == 0: order.append(j)
+  if len(order) < njobs: 
+    raise ValueError, "Cyclic job dependencies: {}".format([str(job) for i,job in enumerate(jobs) if waiting[i] > 0])
+  # rank jobs by the length of the longest chain of dependent jobs (critical path)
+  rank = [0]*njobs
+  for i in reversed(order):
+    if downstream[i]: rank[i] = 1 + max(rank[j] for j in downstream[i])
+  
+  # figure out if running parallel
+  if NP is not None and NP == 1: lparallel = False
+  else: lparallel = True
+  if NP is None: NP = multiprocessing.cpu_count() # need a number to limit dispatching
+  logger = getPoolLogger(name='multiprocess.asyncPoolDAG', ldebug=ldebug, lparallel=lparallel)
+  logger.info(datetime.today())
+  logger.info('\nTHREADS: {0:s}, DEBUG: {1:s}, JOBS: {2:d}, STAGES: {3:d}\n'.format(str(NP),str(ldebug),njobs,max(rank)+1 if njobs else 0))
+  
+  ## dispatch jobs, as they become ready
+  waiting = [len(deps) for deps in upstream]
+  ready = [i for i in xrange(njobs) if waiting[i] == 0]
+  exitcodes = [None]*njobs; nrunning = 0
+  results = Queue.Queue() # receives exit codes from callback
+  run = '{:s}-{:d}'.format(datetime.today().strftime('%Y%m%d%H%M%S%f'), os.getpid()) # run ID for telemetry
+  telemetry = (telemetry_file, run) if telemetry_file else None
+  def finishJob(i, ec):
+    ''' record exit code, release downstream jobs or skip them, if the job failed '''
+    if ec < 0: raise ValueError, 'Exit codes have to be zero or positive!' 
+    exitcodes[i] = 1 if ec > 0 else 0
+    for j in downstream[i]:
+      if exitcodes[j] is not None: continue # already skipped
+      if ec > 0: 
+        logger.info("\n   ###   Skipping job '{}', because job '{}' failed!   ###   \n".format(jobs[j],jobs[i]))
+        finishJob(j, 1) # also skips all downstream jobs
+      else:
+        waiting[j] -= 1
+        if waiting[j] == 0: ready.append(j)
+  if lparallel: 
+    pool, lmanaged = getPool(NP)
+    workers = list(pool._pool) # to detect dead workers
+  try:
+    while ready or nrunning > 0:
+      # start as many jobs as there are idle workers (most critical first)
+      while ready and nrunning < NP:
+        ready.sort(key=lambda i: (-rank[i],i))
+        i = ready.pop(0); job = jobs[i]
+        missing = [filepath for filepath in job.inputs if not os.path.exists(filepath)]
+        if missing and ( job.lstrict or any(filepath in producers for filepath in missing) ): 
+          logger.info("\n   ###   Skipping job '{}', because input files are missing:   ###   \n{}\n".format(job,'\n'.join(missing)))
+          finishJob(i, 1); continue
+        func = TrialNError(job.func, telemetry=telemetry) if ltrialnerror else job.func
+        kwargs = job.kwargs.copy(); kwargs.update(ldebug=ldebug, lparallel=lparallel, logger=logger.name)
+        if lparallel:
+          pool.apply_async(_runPoolJob, (i, func, job.args, kwargs), callback=results.put)
+          nrunning += 1
+        else: finishJob(*_runPoolJob(i, func, job.args, kwargs)[:2])
+      # wait for a job to finish
+      if nrunning > 0:
+        while True: # N.B.: without timeout, get can not be interrupted
+          try: i, ec, runtime = results.get(timeout=interval); break
+          except Queue.Empty: 
+            dead = findDeadWorkers(pool, workers)
+            if dead: raise WorkerError, "Worker process {:d} died (exitcode {:d}) and jobs were lost.".format(dead[0].pid,dead[0].exitcode)
+        nrunning -= 1
+        finishJob(i, ec or 0)
+  except:
+    if lparallel: releasePool(pool, lmanaged, lterminate=True)
+    raise
+  else:
+    if lparallel: 
+      releasePool(pool, lmanaged)
+      logger.debug('\n   ***   all processes joined   ***   \n')
+  # print performance summary
+  if telemetry_file: 
+    logger.info('\n'+summarizeTelemetry(loadTelemetry(telemetry_file, run=run)))
   
   # print summary (to log)
+  exitcode = sum(exitcodes); nop = njobs - exitcode
   if exitcode == 0:
     logger.info('\n   >>>   All {:d} operations completed successfully!!!   <<<   \n'.format(nop))
   else:
@@ -248,13 +640,302 @@ def asyncPoolEC(func, args, kwargs, NP=1, ldebug=False, ltrialnerror=True):
   # return with exit code
   return exitcode
 
-def apply_along_axis(fct, axis, data, NP=0, chunksize=200, ldebug=False, laax=True, *args, **kwargs):
+def imapPool(func, args, NP=1, chunksize=1, nreport=0, title=None):
+  ''' 
+    A generator that applies func to every element in args on NP processors and yields the results 
+    in the original order, as soon as they become available (i.e. results can be streamed to a single 
+    consumer/writer process); func has to be picklable and takes a single argument. 
+    If nreport > 0, progress and throughput are reported every nreport elements. 
+  '''
+  # input checking
+  if not isinstance(args,(list,tuple)): raise TypeError
+  if NP == 0: NP = int(os.environ['OMP_NUM_THREADS'])
+  if NP is not None and not isinstance(NP,(int,np.integer)): raise TypeError
+  if not isinstance(nreport,(int,np.integer)): raise TypeError
+  nargs = len(args)
+  # figure out if running parallel
+  if NP is not None: NP = min(NP,nargs) 
+  lparallel = NP is None or NP > 1
+  if title: print('\n   ***   {:s} ({:d} elements, NP = {:s})   ***\n'.format(title,nargs,str(NP)))
+  # process elements in parallel or in serial
+  if lparallel:
+    pool, lmanaged = getPool(NP) # NP=None uses all available CPUs
+    results = pool.imap(func, args, chunksize=chunksize) # N.B.: imap preserves order
+  else: results = (func(arg) for arg in args)
+  # yield results and report progress
+  start = datetime.today()
+  try:
+    for n,result in enumerate(results):
+      yield result
+      if nreport > 0 and ( (n+1)%nreport == 0 or n+1 == nargs ):
+        runtime = (datetime.today() - start).total_seconds()
+        print('   Progress: {:d}/{:d} ({:3.0f}%), {:5.1f} per second'.format(n+1, nargs, 100.*(n+1)/nargs, 
+                                                                           (n+1)/max(runtime,1.e-3)))
+  except: # also catches GeneratorExit, if the consumer exits early
+    if lparallel: releasePool(pool, lmanaged, lterminate=True)
+    raise
+  if lparallel: releasePool(pool, lmanaged)
+
+## managed worker pool service
+
+# modules that are imported by managed workers on start-up (missing optional dependencies are skipped)
+preload_modules = ('numpy', 'scipy.stats', 'scipy.interpolate', 'geodata.base', 'geodata.netcdf', 'geodata.gdal', 
+                   'geodata.stats', 'processing.process')
+_worker_pool = None # the managed worker pool of this process (see startWorkerPool)
+
+def getWorkerGridDef(grid, res=None):
+  ''' return a grid definition from the registry of this process (it is only unpickled on first use); 
+      managed workers preload their grid definitions, so that they are available to all tasks '''
+  from geodata.gdal import loadPickledGridDef # N.B.: GDAL is an optional dependency
+  return loadPickledGridDef(grid=grid, res=res, lcache=True)
+
+def _initWorker(modules, grids):
+  ''' initializer for managed workers: import modules and load grid definitions, so that workers are warm '''
+  global _worker_pool, _aax_pool
+  _worker_pool = None; _aax_pool = None # N.B.: forked copies of the parent's pools can not be used
+  for module in modules:
+    try: import_module(module)
+    except ImportError: pass # optional dependency (e.g. GDAL)
+  for grid in grids:
+    if isinstance(grid,basestring): grid = (grid,None)
+    try: getWorkerGridDef(*grid)
+    except Exception: logging.exception('Unable to preload grid definition {}:'.format(grid))
+
+def _pingWorker():
+  ''' trivial task for health checks '''
+  return os.getpid()
+
+class WorkerPool(object):
+  ''' 
+    A long-lived pool of warm workers (modules and grid definitions are preloaded), which can be shared by all 
+    parallel operations of a process (see startWorkerPool); tasks are submitted with submit, map or imap. 
+    The health of the pool can be checked with ping; unresponsive pools can be restarted.
+  '''
+  
+  def __init__(self, NP=None, modules=None, grids=None, maxtasksperchild=None):
+    ''' save configuration and start workers; grids are grid names or (grid, resolution) tuples, and 
+        maxtasksperchild can be used to replace workers periodically (e.g. to release leaked memory) '''
+    self.NP = NP or multiprocessing.cpu_count()
+    self.modules = preload_modules if modules is None else tuple(modules)
+    self.grids = tuple(grids or ())
+    self.maxtasksperchild = maxtasksperchild
+    self.pool = None; self.snapshot = None; self.pid = None
+    self.start()
+    
+  @property
+  def running(self):
+    ''' whether or not the pool accepts tasks '''
+    return self.pool is not None
+  
+  def start(self):
+    ''' start workers (if they are not running) '''
+    if self.pool is None:
+      self.pool = multiprocessing.Pool(processes=self.NP, initializer=_initWorker, initargs=(self.modules,self.grids), 
+                                       maxtasksperchild=self.maxtasksperchild)
+      self.snapshot = snapshotMain() # functions defined later in __main__ are not available in workers
+      self.pid = os.getpid() # only the process that started the pool can use it
+  
+  def submit(self, func, args=(), kwargs=None, callback=None):
+    ''' submit a task and return an AsyncResult '''
+    if self.pool is None: raise ValueError, 'Worker pool is not running!'
+    return self.pool.apply_async(func, args, kwargs or dict(), callback=callback)
+  
+  def map(self, func, iterable, chunksize=None):
+    ''' apply func to all elements of iterable and return the results (in order) '''
+    if self.pool is None: raise ValueError, 'Worker pool is not running!'
+    return self.pool.map(func, iterable, chunksize=chunksize)
+  
+  def imap(self, func, iterable, chunksize=1):
+    ''' apply func to all elements of iterable and return an iterator over the results (in order) '''
+    if self.pool is None: raise ValueError, 'Worker pool is not running!'
+    return self.pool.imap(func, iterable, chunksize=chunksize)
+  
+  def ping(self, timeout=10.):
+    ''' health check: all workers are alive and the pool responds to NP trivial tasks within timeout 
+        (in seconds); N.B.: a pool that is busy with long tasks will not respond in time '''
+    if self.pool is None: return False
+    if not all(process.is_alive() for process in self.pool._pool): return False
+    tasks = [self.pool.apply_async(_pingWorker) for i in xrange(self.NP)]
+    try: 
+      for task in tasks: task.get(timeout=timeout)
+    except multiprocessing.TimeoutError: return False
+    return True
+  
+  def close(self):
+    ''' shut down cleanly: wait for all submitted tasks, then stop workers '''
+    if self.pool is not None:
+      self.pool.close(); self.pool.join()
+    self.pool = None
+    
+  def terminate(self):
+    ''' stop workers immediately (submitted tasks are discarded) '''
+    if self.pool is not None:
+      self.pool.terminate(); self.pool.join()
+    self.pool = None
+    
+  def restart(self):
+    ''' replace all workers (e.g. if the pool is unresponsive) '''
+    self.terminate(); self.start()
+  
+  def __enter__(self):
+    return self
+  
+  def __exit__(self, etype, value, traceback):
+    if etype is None: self.close()
+    else: self.terminate()
+    
+def startWorkerPool(NP=None, modules=None, grids=None, maxtasksperchild=None):
+  ''' start the managed worker pool of this process (opt-in); while it is running, asyncPoolEC, asyncPoolDAG, 
+      imapPool and apply_along_axis submit their tasks to this pool, instead of starting their own '''
+  global _worker_pool
+  stopWorkerPool()
+  _worker_pool = WorkerPool(NP=NP, modules=modules, grids=grids, maxtasksperchild=maxtasksperchild)
+  return _worker_pool
+
+def getWorkerPool():
+  ''' return the managed worker pool of this process, if it is running, otherwise None '''
+  # N.B.: forked children inherit the pool object, but they can not use the parent's workers
+  if _worker_pool is None or _worker_pool.pid != os.getpid(): return None
+  return _worker_pool if _worker_pool.running else None
+
+def stopWorkerPool(lterminate=False):
+  ''' shut down the managed worker pool of this process (also called on exit) '''
+  global _worker_pool
+  if _worker_pool is not None and _worker_pool.pid == os.getpid():
+    if lterminate: _worker_pool.terminate()
+    else: _worker_pool.close()
+  _worker_pool = None
+
+def getPool(NP=None):
+  ''' return the managed worker pool, if it is running, or a new pool with NP workers, and a flag 
+      indicating, if the pool is managed (see releasePool) '''
+  managed = getWorkerPool()
+  if managed is not None: return managed.pool, True
+  else: return multiprocessing.Pool(processes=NP), False
+
+def releasePool(pool, lmanaged, lterminate=False):
+  ''' shut down a pool after use (see getPool); managed pools keep running, unless tasks have to be 
+      discarded (lterminate), in which case the workers are replaced '''
+  if lmanaged: 
+    if lterminate: _worker_pool.restart()
+  elif lterminate: pool.terminate()
+  else: pool.close(); pool.join()
+
+# persistent worker pool for apply_along_axis (started on first use, reused by subsequent calls)
+_aax_pool = None
+_aax_pool_size = 0
+_aax_pool_snapshot = None
+_aax_pool_pid = None # process that started the pool
+# folder for shared memory arrays (RAM disk, if available)
+shm_folder = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else None
+
+class WorkerError(multiprocessing.ProcessError):
+  ''' Exception indicating that a worker process died and submitted tasks were lost. '''
+  pass
+
+def snapshotMain():
+  ''' record the objects in the namespace of __main__ (by id), e.g. when workers are forked '''
+  main = sys.modules.get('__main__')
+  return dict() if main is None else {name:id(obj) for name,obj in vars(main).items()}
+
+def isForkSafe(fct, snapshot):
+  ''' check if fct (or the function wrapped by a partial) can be unpickled by workers that were forked, when 
+      __main__ was in the state of snapshot; N.B.: functions and classes are pickled by reference, so anything 
+      that is defined (or redefined) in __main__ after the fork, can not be found by the workers '''
+  while isinstance(fct, functools.partial): fct = fct.func
+  if fct is None: return True
+  if not isinstance(fct, (types.FunctionType,types.ClassType,type)): fct = fct.__class__ # callable instances
+  if getattr(fct, '__module__', None) != '__main__': return True # importable from a module
+  return snapshot is not None and snapshot.get(fct.__name__) == id(fct)
+
+def getApplyPool(NP, fct=None):
+  ''' return the persistent worker pool for apply_along_axis; a new pool is only started, if there is none, 
+      if the number of processes changed, or if fct is not available in the running workers (see isForkSafe); 
+      if the managed worker pool is running and has fct, it is used instead '''
+  global _aax_pool, _aax_pool_size, _aax_pool_snapshot, _aax_pool_pid
+  managed = getWorkerPool()
+  if managed is not None and isForkSafe(fct, managed.snapshot): return managed.pool
+  if _aax_pool is None or _aax_pool_size != NP or not isForkSafe(fct, _aax_pool_snapshot) or _aax_pool_pid != os.getpid():
+    closeApplyPool()
+    _aax_pool = multiprocessing.Pool(processes=NP); _aax_pool_size = NP
+    _aax_pool_snapshot = snapshotMain(); _aax_pool_pid = os.getpid()
+  return _aax_pool
+
+def closeApplyPool(lterminate=False):
+  ''' shut down the persistent worker pool for apply_along_axis (also called on exit) '''
+  global _aax_pool, _aax_pool_size, _aax_pool_snapshot, _aax_pool_pid
+  # N.B.: a pool that was inherited from the parent process (fork) is only discarded, not shut down
+  if _aax_pool is not None and _aax_pool_pid == os.getpid():
+    if lterminate: _aax_pool.terminate()
+    else: _aax_pool.close()
+    _aax_pool.join()
+  _aax_pool = None; _aax_pool_size = 0; _aax_pool_snapshot = None; _aax_pool_pid = None
+
+def findDeadWorkers(pool, workers):
+  ''' add replacement workers of the pool to the list of workers and return the workers that died (non-zero 
+      exit code); N.B.: if a task can not be unpickled or a worker is killed, the pool silently replaces the 
+      worker and the task is lost, so that waiting without a timeout would block forever '''
+  workers += [process for process in pool._pool if process not in workers] # replacements
+  return [process for process in workers if process.exitcode not in (None,0)]
+
+def waitForResults(results, pool, interval=1.):
+  ''' wait for async results, while checking that no worker of the pool died (see findDeadWorkers) '''
+  workers = list(pool._pool)
+  for result in results:
+    while not result.ready():
+      result.wait(interval)
+      dead = findDeadWorkers(pool, workers)
+      if dead and not result.ready(): 
+        raise WorkerError, "Worker process {:d} died (exitcode {:d}) and tasks were lost.".format(dead[0].pid,dead[0].exitcode)
+
+def _shutdownPools():
+  ''' shut down all persistent pools of this process on exit '''
+  stopWorkerPool(); closeApplyPool()
+atexit.register(_shutdownPools)
+
+def getFreeSpace(folder):
+  ''' free space (in bytes) in the file system of folder '''
+  stat = os.statvfs(folder)
+  return stat.f_bavail * stat.f_frsize
+
+def createSharedArray(shape, dtype, folder=None):
+  ''' create an array in shared memory (a memory-mapped file in a RAM disk), which can be opened by other 
+      processes using its spec (filepath, dtype, shape); the file has to be removed by the caller; if there 
+      is not enough space in the RAM disk, the array is placed in the regular temporary folder '''
+  dtype = np.dtype(dtype)
+  folder = folder or shm_folder
+  # N.B.: writing to a memory map on a full tmpfs causes a SIGBUS, so we have to check in advance
+  if folder is not None and getFreeSpace(folder) < 1.1 * dtype.itemsize * int(np.prod(shape)): 
+    folder = None # fall back to regular temporary folder (on disk)
+  fd, filepath = tempfile.mkstemp(prefix='geopy_shm_', suffix='.dat', dir=folder)
+  os.close(fd)
+  array = np.memmap(filepath, dtype=dtype, mode='w+', shape=shape)
+  return array, (filepath, dtype.str, shape)
+
+def openSharedArray(spec, mode='r'):
+  ''' open an array in shared memory from its spec (see createSharedArray) without copying '''
+  filepath, dtype, shape = spec
+  return np.asarray(np.memmap(filepath, dtype=np.dtype(dtype), mode=mode, shape=shape))
+
+def _applyShared(fct, laax, inspec, outspec, start, stop, args, kwargs):
+  ''' helper function that applies fct to a slice of a shared array and writes the result to a shared output 
+      array; if there is no output array, the result is returned (i.e. pickled) instead '''
+  data = openSharedArray(inspec, mode='r')[start:stop,:]
+  if laax: result = np.apply_along_axis(fct, 1, data, *args, **kwargs)
+  else: result = fct(data, *args, **kwargs)
+  if outspec is None: return result
+  output = openSharedArray(outspec, mode='r+')
+  output[start:stop] = result; del output # N.B.: flush to shared memory
+  return None
+
+def apply_along_axis(fct, axis, data, NP=0, chunksize=200, ldebug=False, laax=True, lshared=True, *args, **kwargs):
   ''' a parallelized version of numpy's apply_along_axis; the preferred way of passing arguments is,
       by using functools.partial, but arguments can also be passed to this function; the call-signature
       is the same as for np.apply_along_axis, except for NP=OMP_NUM_THREADS, chunksize=200, 
-      ldebug=False, and laax=True; the latter can be set to False, if fct is fully vectorized and only
-      the parallelization feature is required, otherwise Numpy's apply_along_axis will be called within
-      child processes. '''  
+      ldebug=False, laax=True, and lshared=True; laax can be set to False, if fct is fully vectorized and 
+      only the parallelization feature is required, otherwise Numpy's apply_along_axis will be called within
+      child processes; if lshared is True, input and output are placed in shared memory and only offsets
+      are passed to the (persistent) worker pool, instead of pickling the data. '''  
   if NP == 0: NP = int(os.environ['OMP_NUM_THREADS'])
   # pre-processing: move sampel axis to the back
   if not axis == data.ndim-1:
@@ -269,6 +950,7 @@ def apply_along_axis(fct, axis, data, NP=0, chunksize=200, ldebug=False, laax=Tr
   if not laax: kwargs['axis'] = 1 # for ufunc-like functions
   elif len(kwargs) > 0: raise NotImplementedError, "np.apply_along_axis doesn't take kwargs"
   if ldebug: print("Arraysize: {}, Chunksize: {}".format(arraysize,chunksize))
+  if multiprocessing.current_process().daemon: NP = 1 # daemonic pool workers can not have children
   if (NP == 1 or arraysize < 1.1*chunksize):
     # just use regular Numpy version... but always apply over last dimension
     if ldebug: print('\n   ***   Running in Serial Mode   ***')
@@ -287,26 +969,55 @@ def apply_along_axis(fct, axis, data, NP=0, chunksize=200, ldebug=False, laax=Tr
       nc = int(arraysize//chunksize) # number of chunks; use integer division
       if arraysize%chunksize != 0: nc += 1
       cs = chunksize
-    chunks = [data[i*cs:(i+1)*cs,:] for i in xrange(nc)] # views on subsets of the data
-    # initialize worker pool
-    if ldebug: print('\n   ***   firing up pool (using async results)   ***')
+    # N.B.: masked and object arrays can not be placed in shared memory and have to be pickled
+    if lshared and ( isinstance(data,np.ma.MaskedArray) or data.dtype.hasobject ): lshared = False
+    inspec = outspec = None
+    if lshared:
+      # determine shape and type of output from the first row (the output array has to be allocated first)
+      if laax: probe = np.apply_along_axis(fct, 1, data[:1,:], *args, **kwargs)
+      else: probe = np.asanyarray(fct(data[:1,:], *args, **kwargs))
+      lsharedout = not ( isinstance(probe,np.ma.MaskedArray) or probe.dtype.hasobject or probe.size == 0 )
+      # N.B.: if the output can not be placed in shared memory, results are returned (pickled) as usual
+    else:
+      chunks = [data[i*cs:(i+1)*cs,:] for i in xrange(nc)] # views on subsets of the data
+    # get persistent worker pool
+    if ldebug: print('\n   ***   using persistent pool (using async results)   ***')
     if ldebug: print('         OMP_NUM_THREADS = {:d}\n'.format(NP))
-    pool = multiprocessing.Pool(processes=NP)
+    pickle.dumps(fct, -1) # N.B.: raise pickling errors here, because the pool would lose the task 
+    pool = getApplyPool(NP, fct=fct)
     results = [] # list of resulting chunks (concatenated later    
-    for n in xrange(nc):
-      # run computation on individual subsets/chunks
-      if ldebug: print('   Starting Chunk #{:d}'.format(n+1))
-      if laax: # use Numpy's apply_along_axis
-        result = pool.apply_async(np.apply_along_axis, (fct,1,chunks[n],)+args, kwargs)
-      else: # for ufunc-like functions that can operate on multi-dimensional arrays
-        result = pool.apply_async(fct, (chunks[n],)+args, kwargs)
-      results.append(result)
-    pool.close()
-    pool.join()
-    if ldebug: print('\n   ***   joined worker pool (getting results)   ***\n')
-    # retrieve and assemble results 
-    results = tuple(result.get() for result in results)
-    results = np.concatenate(results, axis=0) 
+    try:
+      if lshared:
+        shmdata, inspec = createSharedArray(data.shape, data.dtype)
+        shmdata[:] = data; del shmdata # copy input to shared memory
+        if lsharedout: output, outspec = createSharedArray((arraysize,)+probe.shape[1:], probe.dtype)
+      for n in xrange(nc):
+        # run computation on individual subsets/chunks
+        if ldebug: print('   Starting Chunk #{:d}'.format(n+1))
+        if lshared: # only pass offsets into shared memory
+          result = pool.apply_async(_applyShared, (fct, laax, inspec, outspec, n*cs, min((n+1)*cs,arraysize), args, kwargs))
+        elif laax: # use Numpy's apply_along_axis
+          result = pool.apply_async(np.apply_along_axis, (fct,1,chunks[n],)+args, kwargs)
+        else: # for ufunc-like functions that can operate on multi-dimensional arrays
+          result = pool.apply_async(fct, (chunks[n],)+args, kwargs)
+        results.append(result)
+      # N.B.: wait for all chunks, before shared memory is removed
+      try: waitForResults(results, pool)
+      except WorkerError:
+        if getWorkerPool() is not None and pool is getWorkerPool().pool: getWorkerPool().restart()
+        else: closeApplyPool(lterminate=True)
+        raise
+      if ldebug: print('\n   ***   all chunks completed (getting results)   ***\n')
+      # retrieve and assemble results 
+      results = tuple(result.get() for result in results)
+      if lshared and outspec is not None: 
+        lram = shm_folder is not None and os.path.dirname(outspec[0]) == shm_folder
+        results = np.asarray(output) if lram else np.array(output) # only copy, if not in RAM
+      else: results = np.concatenate(results, axis=0) 
+    finally:
+      # remove shared memory files (memory is released, once the last mapping is closed)
+      for spec in (inspec,outspec):
+        if spec is not None: os.remove(spec[0])
   # check and reshape
   assert results.shape[0] == arraysize
   if results.ndim == 1: # if the second dimension was reduced to a scalar
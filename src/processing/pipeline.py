@@ -0,0 +1,158 @@
+'''
+Created on 2026-10-18
+
+A script to run the post-processing chain of WRF experiments (climatologies, regridding, station extraction
+and shape averages) as one set of jobs: asyncPoolDAG dispatches every job as soon as the jobs that produce its
+inputs have completed, so that the stages are interleaved on one pool of workers.
+
+@author: Andre R. Erler, GPL v3
+'''
+
+# external imports
+import os
+import functools
+from importlib import import_module
+from collections import OrderedDict
+# internal imports
+from geodata.misc import printList
+from datasets.common import getCommonGrid
+from processing.multiprocess import asyncPoolDAG
+from processing.misc import getExperimentList, loadYAML, getProjectVars
+from processing.wrfavg import getAveragingJob
+from processing.regrid import getRegriddingJob
+from processing.exstns import getExtractionJob
+from processing.shpavg import getShapeAverageJob
+
+# job factories of the processing stages (they return a DAGJob for the arguments of the worker function)
+stage_factories = OrderedDict()
+stage_factories['wrfavg'] = getAveragingJob
+stage_factories['regrid'] = getRegriddingJob
+stage_factories['exstns'] = getExtractionJob
+stage_factories['shpavg'] = getShapeAverageJob
+
+def getPipelineJobs(stages):
+  ''' return the jobs of all stages; stages is a list of (stage, args, kwargs) tuples, where args is a list of
+      argument tuples for the worker function of the stage and kwargs are common keyword arguments '''
+  jobs = []
+  for stage,args,kwargs in stages:
+    if stage not in stage_factories: raise NotImplementedError, "Unknown processing stage: '{:s}'".format(stage)
+    factory = stage_factories[stage]
+    jobs.extend(factory(*arguments, **kwargs) for arguments in args)
+  return jobs
+
+
+if __name__ == '__main__':
+
+  ## read environment variables
+  # number of processes NP
+  if os.environ.has_key('PYAVG_THREADS'):
+    NP = int(os.environ['PYAVG_THREADS'])
+  else: NP = None
+  # run script in debug mode
+  if os.environ.has_key('PYAVG_DEBUG'):
+    ldebug =  os.environ['PYAVG_DEBUG'] == 'DEBUG'
+  else: ldebug = False
+  # file for performance telemetry of each job (JSON lines)
+  if os.environ.has_key('PYAVG_TELEMETRY'):
+    telemetry_file = os.environ['PYAVG_TELEMETRY']
+  else: telemetry_file = None
+  # run script in batch or interactive mode
+  if os.environ.has_key('PYAVG_BATCH'):
+    lbatch =  os.environ['PYAVG_BATCH'] == 'BATCH'
+  else: lbatch = False # for debugging
+  # re-compute everything or just update
+  if os.environ.has_key('PYAVG_OVERWRITE'):
+    loverwrite =  os.environ['PYAVG_OVERWRITE'] == 'OVERWRITE'
+  else: loverwrite = ldebug # False means only update old files
+
+  ## define settings
+  if lbatch:
+    # load YAML configuration
+    config = loadYAML('pipeline.yaml', lfeedback=True)
+    # read config object
+    NP = NP or config['NP']
+    loverwrite = config['loverwrite']
+    varlist = config['varlist']
+    periods = config['periods']
+    offset = config['offset']
+    # WRF
+    WRF_project = config['WRF_project']
+    WRF_experiments = config['WRF_experiments']
+    WRF_filetypes = config['WRF_filetypes']
+    domains = config['domains']
+    # target data specs
+    grids = config['grids']
+    grid = config.get('grid',None)
+    stations = config['stations']
+    shape_name = config['shape_name']
+    shapes = config['shapes']
+  else:
+    NP = 3; ldebug = False # for quick computations
+    loverwrite = False
+    varlist = None # process all variables
+    periods = [15,] # climatology periods
+    offset = 0 # number of years from simulation start
+    WRF_project = 'GreatLakes' # only GreatLakes experiments
+    WRF_experiments = [] # use None to process all WRF experiments
+    WRF_experiments += ['erai-g','erai-t']
+    WRF_filetypes = ('hydro','srfc','xtrm','lsm') # filetypes to be processed
+    domains = None # all domains
+    grids = dict(glb1=['d02']) # grids and resolutions to regrid to
+    grid = None # grid for station extraction and shape averages (None: native WRF grid)
+    stations = dict(EC=('precip',)) # station types and datatypes
+    shape_name = 'glbshp'
+    shapes = OrderedDict()
+    shapes['basins'] = ['GLB','GRW'] # river basins from WSC module
+
+  ## process arguments
+  if isinstance(periods, (int,long)): periods = [periods]
+  if isinstance(domains, (int,long)): domains = [domains]
+  WRF_experiments = getExperimentList(WRF_experiments, WRF_project, 'WRF')
+  griddefs = [getCommonGrid(gridname, res=res, lfilepath=True) for gridname,reses in grids.iteritems() for res in reses]
+  stnfcts = []
+  for stntype,datatypes in stations.iteritems():
+    station_module = import_module('datasets.{0:s}'.format(stntype)) # load station data module
+    for datatype in datatypes:
+      stnname = stntype.lower()+datatype.lower()
+      stnfcts.append(functools.partial(station_module.loadStationTimeSeries, name=stnname, filetype=datatype))
+  shape_dict = OrderedDict()
+  if shapes:
+    proj_dict = getProjectVars(shapes.keys(), project=WRF_project, module=None)
+    for shapename in sorted(shapes.keys(), reverse=True): # for backwards compatibility
+      shapelist = shapes[shapename] or sorted(proj_dict[shapename].keys())
+      for key in shapelist: shape_dict[key] = proj_dict[shapename][key]
+
+  # print an announcement
+  print('\n Processing WRF Experiments:')
+  print([exp.name for exp in WRF_experiments])
+  print('\n Regridding to: {:s}'.format(printList([griddef.name for griddef in griddefs])))
+  print('\n Stations: {:s}'.format(printList([stnfct.keywords['name'] for stnfct in stnfcts])))
+  if shape_dict: print('\n Shapes ({:s}): {:s}'.format(shape_name,printList(shape_dict.keys())))
+  print('\nOVERWRITE: {0:s}\n'.format(str(loverwrite)))
+
+  ## assemble jobs of all stages
+  stage_args = OrderedDict((stage,[]) for stage in stage_factories.iterkeys())
+  for experiment in WRF_experiments:
+    for filetype in WRF_filetypes:
+      tmpdom = range(1,experiment.domains+1) if domains is None else domains
+      for domain in tmpdom:
+        stage_args['wrfavg'].append( (experiment, filetype, domain) )
+        beginyear = int(experiment.begindate[0:4]) + offset # same period as in computeClimatology
+        for period in periods:
+          dataargs = dict(experiment=experiment, varlist=varlist, filetypes=[filetype], domain=domain, 
+                          period=(beginyear,beginyear+period))
+          for griddef in griddefs:
+            stage_args['regrid'].append( ('WRF', 'climatology', griddef, dataargs) )
+          for stnfct in stnfcts:
+            stage_args['exstns'].append( ('WRF', 'climatology', stnfct, dict(dataargs, grid=grid)) )
+          if shape_dict:
+            stage_args['shpavg'].append( ('WRF', 'climatology', shape_name, shape_dict, dict(dataargs, grid=grid)) )
+  kwargs = dict(loverwrite=loverwrite, varlist=varlist)
+  stages = [(stage, args, dict(kwargs, periods=periods, offset=offset) if stage == 'wrfavg' else kwargs)
+            for stage,args in stage_args.iteritems()]
+  jobs = getPipelineJobs(stages)
+
+  ## call parallel execution function
+  ec = asyncPoolDAG(jobs, NP=NP, ldebug=ldebug, ltrialnerror=True, telemetry_file=telemetry_file)
+  # exit with fraction of failures (out of 10) as exit code
+  exit(int(10+int(10.*ec/len(jobs))) if ec > 0 else 0)
@@ -22,6 +22,7 @@ from geodata.base import Axis, Dataset, Variable
 from geodata.netcdf import DatasetNetCDF, asDatasetNC
 from utils.nctools import writeNetCDF
 from geodata.gdal import addGDALtoDataset, GridDefinition, gdalInterp, Shape
+from processing.multiprocess import recordPhase
 from collections import OrderedDict
 # default data types
 dtype_int = np.dtype('int16')
@@ -33,8 +34,9 @@ class ProcessError(Exception):
 
 class CentralProcessingUnit(object):
   
-  def __init__(self, source, target=None, varlist=None, ignorelist=None, tmp=True, feedback=True):
-    ''' Initialize processor and pass input and output datasets. '''
+  def __init__(self, source, target=None, varlist=None, ignorelist=None, tmp=True, feedback=True, journal=None):
+    ''' Initialize processor and pass input and output datasets; with a RunJournal, variables that are 
+        written to the output are recorded, and variables from an interrupted run are restored. '''
     # check varlist
     if varlist is None: varlist = source.variables.keys() # all source variables
     elif not isinstance(varlist,(list,tuple)): raise TypeError(varlist)
@@ -64,6 +66,8 @@ class CentralProcessingUnit(object):
     else: self.target = self.output 
     # whether or not to print status output
     self.feedback = feedback
+    # journal of completed variables (to resume interrupted runs)
+    self.journal = journal
         
   def getTmp(self, asNC=False, filename=None, deepcopy=False, **kwargs):
     ''' Get a copy of the temporary data in dataset format. '''
@@ -89,7 +93,7 @@ class CentralProcessingUnit(object):
       for varname in varlist:
         if varname in self.tmpput.variables:
           var = self.tmpput.variables[varname]
-          self.output.addVariable(var, loverwrite=True, deepcopy=copydata)
+          with recordPhase('write'): self.output.addVariable(var, loverwrite=True, deepcopy=copydata)
           # N.B.: without copydata/deepcopy, only the variable header is created but no data is written
           if flush: var.unload() # remove unnecessary references (unlink data)
       if gdal and 'gdal' in self.tmpput.__dict__: 
@@ -107,11 +111,11 @@ class CentralProcessingUnit(object):
     if self.tmp:
       if not isinstance(filename,basestring): raise TypeError(filename)
       if folder is not None: filename = folder + filename       
-      output = writeNetCDF(self.tmpput, filename, ncformat=ncformat, zlib=zlib, writeData=writeData, close=False)
+      with recordPhase('write'): output = writeNetCDF(self.tmpput, filename, ncformat=ncformat, zlib=zlib, writeData=writeData, close=False)
       if flush: self.tmpput.unload()
       if self.feedback: print('\nOutput written to {0:s}\n'.format(filename))
     else: 
-      self.output.sync()
+      with recordPhase('write'): self.output.sync()
       output = self.output.dataset # get (primary) NetCDF file
       if self.feedback: print('\nSynchronized dataset {0:s} with temporary storage.\n'.format(output.name))
     # flush?
@@ -133,8 +137,15 @@ class CentralProcessingUnit(object):
           self.output = addGDALtoDataset(self.output, griddef=self.target.griddef, lforce=True)
         self.target = self.output
         self.tmp = False # not using temporary storage anymore
+    # restore variables that were completed in a previous run (but only into the final output)
+    ljournal = self.journal is not None and self.target is self.output and isinstance(self.output,DatasetNetCDF)
+    if ljournal and self.journal.checkpoint:
+      if self.feedback: print('\n   +++   restoring completed variables: {}   +++   '.format(self.journal.checkpoint))
+      with recordPhase('write'): self.journal.restore(self.output, varlist=self.varlist)
     # loop over input variables
     for varname in self.varlist:
+      # skip variables that are already completed (or will be restored from a checkpoint)
+      if self.journal is not None and ( varname in self.journal or varname in self.journal.checkpoint ): continue
       # check agaisnt ignore list
       if varname not in self.ignorelist:
         try: 
@@ -143,7 +154,7 @@ class CentralProcessingUnit(object):
             # "in-place" operations
             srcds = self.target
             var = srcds.variables[varname]         
-            newvar = function(var) # perform actual processing
+            with recordPhase('compute'): newvar = function(var) # perform actual processing
             if newvar.ndim != var.ndim or newvar.shape != var.shape: raise VariableError('{:}\n\n{:}'.format(var,newvar))
             if newvar is not var: self.target.replaceVariable(var,newvar)
           elif self.source.hasVariable(varname):        
@@ -151,9 +162,9 @@ class CentralProcessingUnit(object):
             var = srcds.variables[varname]         
             ldata = var.data # whether data was pre-loaded 
             # perform operation from source and copy results to target
-            newvar = function(var) # perform actual processing
+            with recordPhase('compute'): newvar = function(var) # perform actual processing
             if not ldata: var.unload() # if it was already loaded, don't unload        
-            self.target.addVariable(newvar, copy=True) # copy=True allows recasting as, e.g., a NC variable
+            with recordPhase('write'): self.target.addVariable(newvar, copy=True) # copy=True allows recasting as, e.g., a NC variable
             newvar.unload() # since we already made a copy
           else:
             srcds = self.source # need to define for error message below
@@ -176,6 +187,10 @@ class CentralProcessingUnit(object):
         if flush: 
           newvar.unload() # again, free memory
           self.output.variables[varname].unload()
+        # record variable as completed, after it has been written to disk
+        if ljournal:
+          with recordPhase('write'): self.output.sync()
+          self.journal.record(varname)
         del var, newvar # free space; already added to new dataset
     # after everything is said and done:
     self.source = self.target # set target to source for next time
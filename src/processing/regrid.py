@@ -19,10 +19,13 @@ from geodata.base import Dataset
 from geodata.gdal import GDALError, GridDefinition, addGeoLocator
 from datasets import gridded_datasets
 from datasets.common import addLengthAndNamesOfMonth, getCommonGrid
-from processing.multiprocess import asyncPoolEC
+from processing.multiprocess import asyncPoolDAG, DAGJob, recordPhase
 from processing.process import CentralProcessingUnit
-from processing.misc import getMetaData, getTargetFile, getExperimentList, loadYAML
+from processing.misc import getMetaData, getTargetFile, getExperimentList, loadYAML, getDatasetFiles, RunJournal,\
+  getFingerprint, isUpToDate
 
+# version of the processing code in this module; increment to rebuild all outputs (see getFingerprint)
+code_version = 1
 
 # worker function that is to be passed to asyncPool for parallel execution; use of the decorator is assumed
 def performRegridding(dataset, mode, griddef, dataargs, loverwrite=False, varlist=None, lwrite=True, 
@@ -60,20 +63,20 @@ def performRegridding(dataset, mode, griddef, dataargs, loverwrite=False, varlis
   if lwrite:
     if lreturn: tmpfilename = filename # no temporary file if dataset is passed on (can't rename the file while it is open!)
     else: 
-      if lparallel: tmppfx = 'tmp_regrid_{:s}_'.format(pidstr[1:-1])
-      else: tmppfx = 'tmp_regrid_'.format(pidstr[1:-1])
+      tmppfx = 'tmp_regrid_' # N.B.: no process ID, so that interrupted jobs can be resumed
       tmpfilename = tmppfx + filename      
     filepath = avgfolder + filename
     tmpfilepath = avgfolder + tmpfilename
+    # fingerprint of source files, parameters and code version (the output is rebuilt, if it changes)
+    srcfiles = list(dataargs.filelist)
+    if hasattr(griddef, 'filepath') and griddef.filepath is not None: 
+      srcfiles.append(griddef.filepath)
+      srcage = max(srcage, datetime.fromtimestamp(os.path.getmtime(griddef.filepath)))
+    fingerprint = getFingerprint(srcfiles, params=dict(grid=griddef.name, varlist=varlist), version=code_version)
     if os.path.exists(filepath): 
       if not loverwrite: 
-        age = datetime.fromtimestamp(os.path.getmtime(filepath))
-        # if source file is newer than sink file or if sink file is a stub, recompute, otherwise skip
-        if age > srcage and os.path.getsize(filepath) > 1e6: 
-          lskip = True
-          if hasattr(griddef, 'filepath') and griddef.filepath is not None:
-            gridage = datetime.fromtimestamp(os.path.getmtime(griddef.filepath))
-            if age < gridage: lskip = False
+        # skip, if the fingerprint is unchanged (or, for legacy files, if they are newer than the source)
+        lskip = isUpToDate(filepath, fingerprint, srcage=srcage, minsize=1e6)
         # N.B.: NetCDF files smaller than 1MB are usually incomplete header fragments from a previous crashed
   
   # depending on last modification time of file or overwrite setting, start computation, or skip
@@ -85,7 +88,7 @@ def performRegridding(dataset, mode, griddef, dataargs, loverwrite=False, varlis
   else:
           
     ## actually load datasets
-    source = loadfct() # load source 
+    with recordPhase('load'): source = loadfct() # load source 
     # check period
     if 'period' in source.atts and dataargs.periodstr != source.atts.period: # a NetCDF attribute
       raise DateError, "Specifed period is inconsistent with netcdf records: '{:s}' != '{:s}'".format(periodstr,source.atts.period)
@@ -107,17 +110,22 @@ def performRegridding(dataset, mode, griddef, dataargs, loverwrite=False, varlis
       
     # make new dataset
     if lwrite: # write to NetCDF file 
+      # journal of completed variables; the temp file of an interrupted run becomes a checkpoint
+      if lreturn: journal = None
+      else: journal = RunJournal(tmpfilepath, job=fingerprint, srcage=srcage, lresume=not loverwrite)
       if os.path.exists(tmpfilepath): os.remove(tmpfilepath) # remove old temp files 
       sink = DatasetNetCDF(folder=avgfolder, filelist=[tmpfilename], atts=atts, mode='w')
-    else: sink = Dataset(atts=atts) # ony create dataset in memory
+    else: 
+      sink = Dataset(atts=atts) # ony create dataset in memory
+      journal = None
     
     # initialize processing
-    CPU = CentralProcessingUnit(source, sink, varlist=varlist, tmp=False, feedback=ldebug)
+    CPU = CentralProcessingUnit(source, sink, varlist=varlist, tmp=False, feedback=ldebug, journal=journal)
   
     # perform regridding (if target grid is different from native grid!)
     if griddef.name != dataset:
       # reproject and resample (regrid) dataset
-      CPU.Regrid(griddef=griddef, flush=True)
+      with recordPhase('compute'): CPU.Regrid(griddef=griddef, flush=True)
 
     # get results    
     CPU.sync(flush=True)
@@ -135,7 +143,9 @@ def performRegridding(dataset, mode, griddef, dataargs, loverwrite=False, varlis
       logger.info('\n'+str(sink)+'\n')   
     # write results to file
     if lwrite:
-      sink.sync()
+      with recordPhase('write'): sink.sync()
+      # N.B.: the fingerprint is only recorded after all data has been written, so that partial files are rebuilt
+      sink.dataset.setncattr('fingerprint', fingerprint); sink.dataset.sync()
       writemsg =  "\n{:s}   >>>   Writing to file '{:s}' in dataset {:s}".format(pidstr,filename,dataset_name)
       writemsg += "\n{:s}   >>>   ('{:s}')\n".format(pidstr,filepath)
       logger.info(writemsg)      
@@ -145,6 +155,7 @@ def performRegridding(dataset, mode, griddef, dataargs, loverwrite=False, varlis
         sink.unload(); sink.close(); del sink # destroy all references 
         if os.path.exists(filepath): os.remove(filepath) # remove old file
         os.rename(tmpfilepath,filepath) # this would also overwrite the old file...
+        if journal: journal.discard() # job completed
       # N.B.: there is no temporary file if the dataset is returned, because an open file can't be renamed
         
     # clean up and return
@@ -156,6 +167,18 @@ def performRegridding(dataset, mode, griddef, dataargs, loverwrite=False, varlis
     # N.B.: garbage is collected in multi-processing wrapper
 
 
+def getRegriddingJob(dataset, mode, griddef, dataargs, **kwargs):
+  ''' return a DAGJob for performRegridding with its input and output files (for use with asyncPoolDAG) '''
+  inputs = getDatasetFiles(dataset, mode, dataargs, grid=dataargs.get('grid',None))
+  outputs = getDatasetFiles(dataset, mode, dataargs, grid=griddef.name.lower())
+  name = dataargs['experiment'].name if 'experiment' in dataargs else dataset
+  name = "regrid {:s} {:s} to '{:s}'".format(name, mode, griddef.name)
+  # N.B.: if there is no averaged file (and no job produces it), observational datasets are loaded from the 
+  #       original source files, so that missing inputs are not an error
+  return DAGJob(performRegridding, args=(dataset, mode, griddef, dataargs), kwargs=kwargs, 
+                inputs=inputs, outputs=outputs, name=name, lstrict=dataset in ('WRF','CESM'))
+
+
 if __name__ == '__main__':
   
   ## read environment variables
@@ -167,6 +190,10 @@ if __name__ == '__main__':
   if os.environ.has_key('PYAVG_DEBUG'): 
     ldebug =  os.environ['PYAVG_DEBUG'] == 'DEBUG' 
   else: ldebug = False
+  # file for performance telemetry of each job (JSON lines)
+  if os.environ.has_key('PYAVG_TELEMETRY'): 
+    telemetry_file = os.environ['PYAVG_TELEMETRY']
+  else: telemetry_file = None
   # run script in batch or interactive mode
   if os.environ.has_key('PYAVG_BATCH'): 
     lbatch =  os.environ['PYAVG_BATCH'] == 'BATCH' 
@@ -424,8 +451,11 @@ if __name__ == '__main__':
       
   # static keyword arguments
   kwargs = dict(loverwrite=loverwrite, varlist=varlist)
+  # declare input and output files of jobs 
+  jobs = [getRegriddingJob(*arguments, **kwargs) for arguments in args]
+  # N.B.: jobs from other drivers can be added to the list, so that all stages are interleaved
   
   ## call parallel execution function
-  ec = asyncPoolEC(performRegridding, args, kwargs, NP=NP, ldebug=ldebug, ltrialnerror=True)
+  ec = asyncPoolDAG(jobs, NP=NP, ldebug=ldebug, ltrialnerror=True, telemetry_file=telemetry_file)
   # exit with fraction of failures (out of 10) as exit code
   exit(int(10+int(10.*ec/len(args))) if ec > 0 else 0)
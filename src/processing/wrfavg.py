@@ -17,11 +17,14 @@ from geodata.gdal import GridDefinition
 from geodata.misc import isInt, DateError
 from datasets.common import name_of_month, days_per_month, getCommonGrid
 from processing.process import CentralProcessingUnit
-from processing.multiprocess import asyncPoolEC
-from processing.misc import getExperimentList, loadYAML
+from processing.multiprocess import asyncPoolEC, recordPhase, DAGJob
+from processing.misc import getExperimentList, loadYAML, RunJournal, getFingerprint, isUpToDate, getDatasetFiles
 # WRF specific
 from datasets.WRF import loadWRF_TS, fileclasses, Exp
 
+# version of the processing code in this module; increment to rebuild all outputs (see getFingerprint)
+code_version = 1
+
 
 def computeClimatology(experiment, filetype, domain, periods=None, offset=0, griddef=None, varlist=None, 
                        ldebug=False, loverwrite=False, lparallel=False, pidstr='', logger=None):
@@ -65,6 +68,7 @@ def computeClimatology(experiment, filetype, domain, periods=None, offset=0, gri
     
     # determine age of source file
     if not loverwrite: sourceage = datetime.fromtimestamp(os.path.getmtime(filepath))
+    srcfilepath = filepath # N.B.: filepath is reused for the sink below
   
     # figure out start date
     filebegin = int(begintuple[0]) # first element is the year
@@ -97,18 +101,20 @@ def computeClimatology(experiment, filetype, domain, periods=None, offset=0, gri
         gridstr = '' if griddef is None or griddef.name is 'WRF' else '_'+griddef.name
         filename = fileclass.climfile.format(domain,gridstr,'_'+periodstr)
         if ldebug: filename = 'test_' + filename
-        if lparallel: tmppfx = 'tmp_wrfavg_{:s}_'.format(pidstr[1:-1])
-        else: tmppfx = 'tmp_wrfavg_'.format(pidstr[1:-1])
+        tmppfx = 'tmp_wrfavg_' # N.B.: no process ID, so that interrupted jobs can be resumed
         tmpfilename = tmppfx + filename
         assert os.path.exists(expfolder)
         filepath = expfolder+filename
         tmpfilepath = expfolder+tmpfilename
         lskip = False # else just go ahead
+        # fingerprint of source file, parameters and code version (the output is rebuilt, if it changes)
+        params = dict(period=period, offset=offset, shift=shift, varlist=varlist,
+                      grid=None if griddef is None else griddef.name)
+        fingerprint = getFingerprint([srcfilepath], params=params, version=code_version)
         if os.path.exists(filepath): 
           if not loverwrite: 
-            age = datetime.fromtimestamp(os.path.getmtime(filepath))
-            # if sink file is newer than source file, skip (do not recompute)
-            if age > sourceage and os.path.getsize(filepath) > 1e6: lskip = True
+            # skip, if the fingerprint is unchanged (or, for legacy files, if they are newer than the source)
+            lskip = isUpToDate(filepath, fingerprint, srcage=sourceage, minsize=1e6)
             # N.B.: NetCDF files smaller than 1MB are usually incomplete header fragments from a previous crash
             #print sourceage, age
           if not lskip: os.remove(filepath) 
@@ -133,27 +139,29 @@ def computeClimatology(experiment, filetype, domain, periods=None, offset=0, gri
   
           ## actually load datasets
           if source is None:
-            source = loadWRF_TS(experiment=experiment, filetypes=[filetype], domains=domain) # comes out as a tuple... 
+            with recordPhase('load'): source = loadWRF_TS(experiment=experiment, filetypes=[filetype], domains=domain) # comes out as a tuple... 
           if not lparallel and ldebug: logger.info('\n'+str(source)+'\n')
   
           # prepare sink
+          # journal of completed variables; the temp file of an interrupted run becomes a checkpoint
+          journal = RunJournal(tmpfilepath, job=fingerprint, srcage=None if loverwrite else sourceage, lresume=not loverwrite)
           if os.path.exists(tmpfilepath): os.remove(tmpfilepath) # remove old temp files
           sink = DatasetNetCDF(name='WRF Climatology', folder=expfolder, filelist=[tmpfilename], atts=source.atts.copy(), mode='w')
           sink.atts.period = periodstr 
 #           if lregrid: addGDALtoDataset(sink, griddef=griddef)
           
           # initialize processing
-          CPU = CentralProcessingUnit(source, sink, varlist=varlist, tmp=lregrid, feedback=ldebug) # no need for lat/lon
+          CPU = CentralProcessingUnit(source, sink, varlist=varlist, tmp=lregrid, feedback=ldebug, journal=journal) # no need for lat/lon
           
           # start processing climatology
           if shift != 0: 
             logger.info('{0:s}   (shifting climatology by {1:d} month, to start with January)   \n'.format(pidstr,shift))
-          CPU.Climatology(period=period, offset=offset, shift=shift, flush=False)
+          with recordPhase('compute'): CPU.Climatology(period=period, offset=offset, shift=shift, flush=False)
           # N.B.: immediate flushing should not be necessary for climatologies, since they are much smaller!
           
           # reproject and resample (regrid) dataset
           if lregrid:
-            CPU.Regrid(griddef=griddef, flush=True)
+            with recordPhase('compute'): CPU.Regrid(griddef=griddef, flush=True)
             logger.info('{:s}   ---   {:s}   ---   \n'.format(pidstr,griddef.name))              
             logger.debug('{:s}   ---   {:s}   ---   \n'.format(pidstr,str(griddef)))              
           
@@ -180,7 +188,9 @@ def computeClimatology(experiment, filetype, domain, periods=None, offset=0, gri
                           atts=dict(name='length_of_month',units='days',long_name='Length of Month'))
           
           # close... and write results to file
-          sink.sync()
+          with recordPhase('write'): sink.sync()
+          # N.B.: the fingerprint is only recorded after all data has been written, so that partial files are rebuilt
+          sink.dataset.setncattr('fingerprint', fingerprint)
           sink.close()
           writemsg =  "\n{:s}   >>>   Writing to file '{:s}' in dataset {:s}".format(pidstr,filename,dataset_name)
           writemsg += "\n{:s}   >>>   ('{:s}')\n".format(pidstr,filepath)
@@ -188,6 +198,7 @@ def computeClimatology(experiment, filetype, domain, periods=None, offset=0, gri
           # rename file to proper name
           if os.path.exists(filepath): os.remove(filepath) # remove old file
           os.rename(tmpfilepath,filepath) # this will overwrite the old file
+          journal.discard() # job completed
           
           # print dataset
           if not lparallel and ldebug:
@@ -205,6 +216,23 @@ def computeClimatology(experiment, filetype, domain, periods=None, offset=0, gri
   return 0 # so far, there is no measure of success, hence, if there is no crash...
 
 
+def getAveragingJob(experiment, filetype, domain, periods=None, offset=0, griddef=None, **kwargs):
+  ''' return a DAGJob for computeClimatology with its input and output files (for use with asyncPoolDAG); 
+      N.B.: outputs can only be declared, if periods are specified '''
+  fileclass = fileclasses[filetype]
+  inputs = ['{:s}/{:s}'.format(experiment.avgfolder, fileclass.tsfile.format(domain,''))]
+  grid = None if griddef is None or griddef.name == 'WRF' else griddef.name
+  beginyear = int(experiment.begindate[0:4]) + offset
+  outputs = []
+  for period in periods or ():
+    dataargs = dict(experiment=experiment, filetypes=[filetype], domain=domain, period=(beginyear,beginyear+period))
+    outputs += getDatasetFiles('WRF', 'climatology', dataargs, grid=grid)
+  name = "average {:s} {:s} d{:02d}".format(experiment.name, filetype, domain)
+  return DAGJob(computeClimatology, args=(experiment, filetype, domain), 
+                kwargs=dict(kwargs, periods=periods, offset=offset, griddef=griddef), 
+                inputs=inputs, outputs=outputs, name=name)
+
+
 if __name__ == '__main__':
   
   ## read environment Variables
@@ -216,6 +244,10 @@ if __name__ == '__main__':
   if os.environ.has_key('PYAVG_DEBUG'): 
     ldebug =  os.environ['PYAVG_DEBUG'] == 'DEBUG' 
   else: ldebug = False # i.e. append
+  # file for performance telemetry of each job (JSON lines)
+  if os.environ.has_key('PYAVG_TELEMETRY'): 
+    telemetry_file = os.environ['PYAVG_TELEMETRY']
+  else: telemetry_file = None
   # run script in batch or interactive mode
   if os.environ.has_key('PYAVG_BATCH'): 
     lbatch =  os.environ['PYAVG_BATCH'] == 'BATCH' 
@@ -312,6 +344,6 @@ if __name__ == '__main__':
   # static keyword arguments
   kwargs = dict(periods=periods, offset=offset, griddef=griddef, loverwrite=loverwrite, varlist=varlist)        
   # call parallel execution function
-  ec = asyncPoolEC(computeClimatology, args, kwargs, NP=NP, ldebug=ldebug, ltrialnerror=True)
+  ec = asyncPoolEC(computeClimatology, args, kwargs, NP=NP, ldebug=ldebug, ltrialnerror=True, telemetry_file=telemetry_file)
   # exit with fraction of failures (out of 10) as exit code
   exit(int(10+int(10.*ec/len(args))) if ec > 0 else 0)
@@ -11,6 +11,7 @@ import numpy as np
 import numpy.ma as ma
 import gzip, shutil, tempfile
 import os, gc
+import multiprocessing as mp
 # internal imports
 from geodata.base import Variable, Axis, Dataset
 from geodata.gdal import addGDALtoDataset, addGDALtoVar, getAxes
@@ -28,13 +29,14 @@ if ramdisk and not os.path.exists(ramdisk):
 
 def rasterDataset(name=None, title=None, vardefs=None, axdefs=None, atts=None, projection=None, griddef=None,
                   lgzip=None, lgdal=True, lmask=True, fillValue=None, lskipMissing=True, lgeolocator=True,
-                  file_pattern=None, lfeedback=True, **kwargs):
+                  file_pattern=None, lfeedback=True, NP=1, **kwargs):
     ''' function to load a set of variables that are stored in raster format in a systematic directory tree into a Dataset
         Variables and Axis are defined as follows:
           vardefs[varname] = dict(name=string, units=string, axes=tuple of strings, atts=dict, plot=dict, dtype=np.dtype, fillValue=value)
           axdefs[axname]   = dict(name=string, units=string, atts=dict, coord=array or list) or None
         The path to raster files is constructed as variable_pattern+axes_pattern, where axes_pattern is defined through the axes, 
         (as in rasterVarialbe) and variable_pattern takes the special keywords VAR, which is the variable key in vardefs.
+        Raster files of each variable are read in parallel using NP processes.
     '''
   
     ## prepare input data and axes
@@ -88,7 +90,7 @@ def rasterDataset(name=None, title=None, vardefs=None, axdefs=None, atts=None, p
         # create Variable object
         var = rasterVariable(projection=projection, griddef=griddef, file_pattern=file_pattern, lgzip=lgzip, lgdal=lgdal, 
                              lmask=lmask, lskipMissing=lskipMissing, axes=axes_list, path_params=path_params, 
-                             lfeedback=lfeedback, **vardef) 
+                             lfeedback=lfeedback, NP=NP, **vardef) 
         # vardef components: name, units, atts, plot, dtype, fillValue
         varlist.append(var)
         # check that map axes are correct
@@ -116,7 +118,7 @@ def rasterDataset(name=None, title=None, vardefs=None, axdefs=None, atts=None, p
 
 def rasterVariable(name=None, units=None, axes=None, atts=None, plot=None, dtype=None, projection=None, griddef=None,
                    file_pattern=None, lgzip=None, lgdal=True, lmask=True, fillValue=None, lskipMissing=True, 
-                   path_params=None, offset=0, scalefactor=1, transform=None, time_axis=None, lfeedback=False, **kwargs):
+                   path_params=None, offset=0, scalefactor=1, transform=None, time_axis=None, lfeedback=False, NP=1, **kwargs):
     ''' function to read multi-dimensional raster data and construct a GDAL-enabled Variable object '''
 
     # print status
@@ -140,7 +142,8 @@ def rasterVariable(name=None, units=None, axes=None, atts=None, plot=None, dtype
     if lfeedback: print("'{}'".format(file_pattern))
     data, geotransform = readRasterArray(file_pattern, lgzip=lgzip, lgdal=lgdal, dtype=dtype, lmask=lmask, 
                                          fillValue=fillValue, lgeotransform=True, axes=axes_list, lna=False, 
-                                         lskipMissing=lskipMissing, path_params=path_params, lfeedback=lfeedback, **kwargs)
+                                         lskipMissing=lskipMissing, path_params=path_params, lfeedback=lfeedback, 
+                                         NP=NP, **kwargs)
     # shift and rescale
     if offset != 0: data += offset
     if scalefactor != 1: data *= scalefactor
@@ -179,8 +182,11 @@ def rasterVariable(name=None, units=None, axes=None, atts=None, plot=None, dtype
 ## functions to load ASCII raster data
 
 def readRasterArray(file_pattern, lgzip=None, lgdal=True, dtype=np.float32, lmask=True, fillValue=None, lfeedback=False,
-                    lgeotransform=True, axes=None, lna=False, lskipMissing=False, path_params=None, **kwargs):
-    ''' function to load a multi-dimensional numpy array from several structured ASCII raster files '''
+                    lgeotransform=True, axes=None, lna=False, lskipMissing=False, path_params=None, NP=1, 
+                    max_tmpfiles=None, **kwargs):
+    ''' function to load a multi-dimensional numpy array from several structured ASCII raster files; 
+        with NP > 1 files are read in parallel into a shared array, and max_tmpfiles limits the number 
+        of temporary files that are used concurrently (to decompress files for GDAL) '''
     
     if axes is None: raise NotImplementedError
     #TODO: implement automatic detection of axes arguments and axes order
@@ -205,76 +211,92 @@ def readRasterArray(file_pattern, lgzip=None, lgdal=True, dtype=np.float32, lmas
     ## load data from raster files and assemble array
     path_params = dict() if path_params is None else path_params.copy() # will be modified
     
+    # construct file names (None, if file is missing)
+    filelist = []
+    for file_kwargs in file_kwargs_list:
+        path_params.update(file_kwargs) # update axes parameters
+        filepath = file_pattern.format(**path_params) # construct file name
+        if os.path.exists(filepath): filelist.append(filepath)
+        elif lskipMissing: filelist.append(None)
+        else: raise IOError(filepath)
+    
     # find first valid 2D raster to determine shape
-    i0 = 0 
-    path_params.update(file_kwargs_list[i0]) # update axes parameters
-    filepath = file_pattern.format(**path_params) # construct file name
-    if not os.path.exists(filepath): 
-        if lskipMissing: # find first valid
-            while not os.path.exists(filepath):
-                i0 += 1 # go to next raster file
-                if i0 >= len(file_kwargs_list): 
-                  raise IOError("No valid input raster files found!\n'{}'".format(filepath))
-                if lfeedback: print ' ',
-                path_params.update(file_kwargs_list[i0]) # update axes parameters
-                filepath = file_pattern.format(**path_params) # nest in line
-        else: # or raise error
-            raise IOError(filepath)
+    valid = [i for i,filepath in enumerate(filelist) if filepath is not None]
+    if len(valid) == 0: 
+        raise IOError("No valid input raster files found!\n'{}'".format(file_pattern.format(**path_params)))
+    i0 = valid[0]
+    if lfeedback: print ' '*(len(filelist)-len(valid)), # indicate missing rasters with spaces
       
     # read first 2D raster file
-    data2D = readASCIIraster(filepath, lgzip=lgzip, lgdal=lgdal, dtype=dtype, lna=True,
+    data2D = readASCIIraster(filelist[i0], lgzip=lgzip, lgdal=lgdal, dtype=dtype, lna=True,
                              lmask=lmask, fillValue=fillValue, lgeotransform=lgeotransform, **kwargs)
     if lgeotransform: data2D, geotransform0, na = data2D
-    else: data2D, na = data2D # we might still need na, but no need to check if it is the same
+    else: data2D, na = data2D; geotransform0 = None # we might still need na, but no need to check if it is the same
     shape2D = data2D.shape # get 2D raster shape for later use
     
-    # allocate data array
+    # allocate data and mask arrays (in shared memory, if files are read in parallel)
     list_shape = (np.prod(shape),)+shape2D # assume 3D shape to concatenate 2D rasters
-    if lmask:
-        data = ma.empty(list_shape, dtype=dtype)
-        if fillValue is None: data._fill_value = data2D._fill_value 
-        else: data._fill_value = fillValue
-        data.mask = True # initialize everything as masked 
-    else: data = np.empty(list_shape, dtype=dtype) # allocate the array
-    assert data.shape[0] == len(file_kwargs_list), (data.shape, len(file_kwargs_list))
-    # insert (up to) first raster before continuing
-    if lskipMissing and i0 > 0:
-      data[:i0,:,:] = ma.masked if lmask else fillValue # mask all invalid rasters up to first valid raster
-    data[i0,:,:] = data2D # add first (valid) raster
+    lparallel = NP > 1 and len(valid) > 2
+    if lparallel:
+        data_buffer = mp.RawArray('b', int(np.prod(list_shape))*np.dtype(dtype).itemsize)
+        values = np.frombuffer(data_buffer, dtype=dtype).reshape(list_shape)
+        mask_buffer = mp.RawArray('b', int(np.prod(list_shape))) if lmask else None
+        mask = np.frombuffer(mask_buffer, dtype=np.bool_).reshape(list_shape) if lmask else None
+    else:
+        values = np.empty(list_shape, dtype=dtype) # allocate the array
+        mask = np.empty(list_shape, dtype=np.bool_) if lmask else None
+    assert values.shape[0] == len(file_kwargs_list), (values.shape, len(file_kwargs_list))
+    # mask invalid rasters and insert first raster before continuing
+    for i,filepath in enumerate(filelist):
+        if filepath is None:
+            if lmask: mask[i,:,:] = True # mask missing raster
+            elif i < i0: values[i,:,:] = fillValue # invalid rasters up to first valid raster
+            else: values[i,:,:] = ma.masked # N.B.: this is actually zero
+    values[i0,:,:] = ma.getdata(data2D) # add first (valid) raster
+    if lmask: mask[i0,:,:] = ma.getmaskarray(data2D)
     
-    # loop over remaining 2D raster files
-    for i,file_kwargs in enumerate(file_kwargs_list[i0:]):
-        
-        path_params.update(file_kwargs) # update axes parameters
-        filepath = file_pattern.format(**path_params) # construct file name
-        if os.path.exists(filepath):
-            if lfeedback: print '.', # indicate data with bar/pipe
-            # read 2D raster file
-            data2D = readASCIIraster(filepath, lgzip=lgzip, lgdal=lgdal, dtype=dtype, lna=False,
-                                     lmask=lmask, fillValue=fillValue, lgeotransform=lgeotransform, **kwargs)
-            # check geotransform
-            if lgeotransform: 
-                data2D, geotransform = data2D
-                if not geotransform == geotransform0:
+    # read remaining 2D raster files and insert into 3D array
+    read_kwargs = dict(lgzip=lgzip, lgdal=lgdal, dtype=dtype, lmask=lmask, fillValue=fillValue, 
+                       lgeotransform=lgeotransform, **kwargs)
+    tasks = [(i,filelist[i],read_kwargs) for i in valid[1:]]
+    if lparallel:
+        # limit concurrent temporary files (only used to decompress files for GDAL)
+        semaphore = mp.BoundedSemaphore(max_tmpfiles) if lgdal and max_tmpfiles else None
+        pool = mp.Pool(processes=NP, initializer=_initRasterWorker, 
+                       initargs=(data_buffer, mask_buffer, list_shape, dtype, semaphore))
+        try: 
+            results = pool.imap_unordered(_readRasterWorker, tasks, chunksize=1)
+            for i,geotransform,rshape in results:
+                if lfeedback: print '.', # indicate data with bar/pipe
+                if lgeotransform and not geotransform == geotransform0:
                     raise AxisError(geotransform) # to make sure all geotransforms are identical!
-            else: geotransform = None
-            # size information
-            if not shape2D == data2D.shape:
-                raise AxisError(data2D.shape) # to make sure all geotransforms are identical!            
-            # insert 2D raster into 3D array
-            data[i+i0,:,:] = data2D # raster shape has to match
-        elif lskipMissing:
-            # fill with masked values
-            data[i+i0,:,:] = ma.masked # mask missing raster
-            if lfeedback: print ' ', # indicate missing with dot
-        else:
-          raise IOError(filepath)
-
+                if not shape2D == rshape:
+                    raise AxisError(rshape) # to make sure all geotransforms are identical!
+        except:
+            pool.terminate(); raise
+        else: 
+            pool.close(); pool.join()
+    else:
+        _initRasterWorker(values, mask, list_shape, dtype, None)
+        for task in tasks:
+            if lfeedback: print '.', # indicate data with bar/pipe
+            i,geotransform,rshape = _readRasterWorker(task)
+            if lgeotransform and not geotransform == geotransform0:
+                raise AxisError(geotransform) # to make sure all geotransforms are identical!
+            if not shape2D == rshape:
+                raise AxisError(rshape) # to make sure all geotransforms are identical!
+        _initRasterWorker(None, None, None, None, None) # release references
     # complete feedback with linebreak
     if lfeedback: print ''
     
+    # assemble masked array
+    if lmask:
+        data = ma.array(values, mask=mask, copy=False)
+        data._fill_value = data2D._fill_value if fillValue is None else fillValue
+    else: data = values
+    geotransform = geotransform0
+    
     # reshape and check dimensions
-    assert i+i0 == data.shape[0]-1, (i,i0)
     data = data.reshape(shape+shape2D) # now we have the full shape
     gc.collect() # remove duplicate data
     
@@ -288,14 +310,49 @@ def readRasterArray(file_pattern, lgzip=None, lgdal=True, dtype=np.float32, lmas
     return return_data
 
 
+# shared output arrays and temporary file semaphore for raster readers (set by _initRasterWorker)
+_raster_values = None
+_raster_mask = None
+_tmp_semaphore = None
+
+def _initRasterWorker(values, mask, shape, dtype, semaphore):
+    ''' initialize raster reader with output arrays (or shared buffers) and a semaphore for temporary files '''
+    global _raster_values, _raster_mask, _tmp_semaphore
+    if values is None or isinstance(values,np.ndarray): _raster_values = values
+    else: _raster_values = np.frombuffer(values, dtype=dtype).reshape(shape)
+    if mask is None or isinstance(mask,np.ndarray): _raster_mask = mask
+    else: _raster_mask = np.frombuffer(mask, dtype=np.bool_).reshape(shape)
+    _tmp_semaphore = semaphore
+
+def _readRasterWorker(args):
+    ''' read a single 2D raster file and insert it into the output array; return index, geotransform and shape '''
+    i, filepath, kwargs = args
+    if _tmp_semaphore is not None: _tmp_semaphore.acquire() # limit concurrent temporary files
+    try:
+        data2D = readASCIIraster(filepath, lna=False, **kwargs)
+    finally:
+        if _tmp_semaphore is not None: _tmp_semaphore.release()
+    if kwargs['lgeotransform']: data2D, geotransform = data2D
+    else: geotransform = None
+    # insert 2D raster into 3D array (raster shape has to match; checked by caller)
+    if data2D.shape == _raster_values.shape[1:]:
+        _raster_values[i,:,:] = ma.getdata(data2D)
+        if _raster_mask is not None: _raster_mask[i,:,:] = ma.getmaskarray(data2D)
+    return i, geotransform, data2D.shape
+
+
 def readASCIIraster(filepath, lgzip=None, lgdal=True, dtype=np.float32, lmask=True, fillValue=None, 
-                    lgeotransform=True, lna=False, **kwargs):
-    ''' load a 2D field from an ASCII raster file (can be compressed); return (masked) numpy array and geotransform '''
+                    lgeotransform=True, lna=False, lnative=None, **kwargs):
+    ''' load a 2D field from an ASCII raster file (can be compressed); return (masked) numpy array and geotransform;
+        ESRI ASCII grids are parsed natively by default (lnative), other formats require GDAL; additional 
+        keyword arguments are passed to the native parser (see readESRIgrid) '''
     
     # handle compression (currently only gzip)
     if lgzip is None: lgzip = filepath[-3:] == '.gz' # try to auto-detect
+    # N.B.: GDAL can only read compressed files via temporary files, the native parser reads the stream directly
+    if lnative is None: lnative = not lgdal or filepath.lower().endswith(('.asc','.asc.gz'))
       
-    if lgdal:
+    if not lnative:
   
         # gdal imports (allow to skip if GDAL is not installed)
         from osgeo import gdal        
@@ -348,37 +405,8 @@ def readASCIIraster(filepath, lgzip=None, lgdal=True, dtype=np.float32, lmask=Tr
   
     else:
         
-        ## parse header manually and use Numpy's genfromtxt to read array
-        
-        # handle compression on the fly (no temporary file)
-        if lgzip: Raster = gzip.open(filepath, mode='rb')
-        else: Raster = open(filepath, mode='rb')
-    
-        # open file
-        with Raster:
-        
-            # read header information
-            headers = ('NCOLS','NROWS','XLLCORNER','YLLCORNER','CELLSIZE','NODATA_VALUE')
-            hdtypes = (int,int,float,float,float,dtype)
-            hvalues = []
-            # loop over items
-            for header,hdtype in zip(headers,hdtypes):
-                name, val = Raster.readline().split()
-                if name.upper() != header: 
-                    raise IOError("Unknown header info: '{:s}' != '{:s}'".format(name,header))
-                hvalues.append(hdtype(val))
-            ie, je, xll, yll, d, na = hvalues
-            # derive geotransform
-            if lgeotransform: geotransform = (xll, d, 0., yll, 0., d)
-            
-            # read data
-            #print ie, je, xll, yll, d, na
-            # N.B.: the file cursor is already moved to the end of the header, hence skip_header=0
-            data = np.genfromtxt(Raster, skip_header=0, dtype=dtype, usemask=lmask, 
-                                 missing_values=na, filling_values=fillValue, **kwargs)
-          
-        if not data.shape == (je,ie):
-            raise IOError(data.shape, ie, je, xll, yll, d, na,)
+        ## parse ESRI ASCII grid natively (no temporary file, no genfromtxt)
+        data, geotransform, na = readESRIgrid(filepath, lgzip=lgzip, dtype=dtype, lmask=lmask, fillValue=fillValue, **kwargs)
       
     # return data and optional meta data
     if lgeotransform or lna:
@@ -388,3 +416,56 @@ def readASCIIraster(filepath, lgzip=None, lgdal=True, dtype=np.float32, lmask=Tr
     else: 
         return_data = data
     return return_data
+
+
+# ESRI ASCII grid header keywords and types
+esri_headers = dict(NCOLS=int, NROWS=int, XLLCORNER=float, YLLCORNER=float, XLLCENTER=float, YLLCENTER=float, 
+                    CELLSIZE=float, NODATA_VALUE=float)
+
+def readESRIgrid(filepath, lgzip=None, dtype=np.float32, lmask=True, fillValue=None, na=None, lflip=True, **kwargs):
+    ''' parse an ESRI ASCII grid file (can be compressed) directly from the file stream; the numeric body is 
+        converted in bulk and the y-axis is flipped (south-up); return (masked) numpy array, geotransform and 
+        no-data value (na is only used, if no no-data value is defined in the header); if additional keyword 
+        arguments are given, the body is read with np.genfromtxt instead (slower, but more flexible) '''
+    
+    # handle compression on the fly (no temporary file)
+    if lgzip is None: lgzip = filepath[-3:] == '.gz' # try to auto-detect
+    Raster = gzip.open(filepath, mode='rb') if lgzip else open(filepath, mode='rb')
+    with Raster:
+        # read header information (at most six lines that start with a known keyword)
+        # N.B.: data rows can also start with letters (e.g. 'nan'), so we can not just test for letters
+        header = dict()
+        for n in xrange(6):
+            pos = Raster.tell(); words = Raster.readline().split()
+            if len(words) < 2 or words[0].upper() not in esri_headers:
+                Raster.seek(pos); break # rewind to beginning of data
+            header[words[0].upper()] = esri_headers[words[0].upper()](words[1])
+        # read data and convert all values at once (much faster than genfromtxt)
+        if kwargs: data = np.genfromtxt(Raster, dtype=dtype, **kwargs).ravel()
+        else: data = np.fromstring(Raster.read(), dtype=dtype, sep=' ')
+    # interpret header
+    try:
+        ie, je, d = header['NCOLS'], header['NROWS'], header['CELLSIZE']
+        xll = header['XLLCORNER'] if 'XLLCORNER' in header else header['XLLCENTER'] - d/2.
+        yll = header['YLLCORNER'] if 'YLLCORNER' in header else header['YLLCENTER'] - d/2.
+    except KeyError as err: 
+        raise IOError("Incomplete header in ESRI ASCII grid: {}\n('{:s}')".format(err,filepath))
+    na = header.get('NODATA_VALUE',na)
+    if na is not None: na = np.dtype(dtype).type(na) # compare in the same precision
+    if data.size != ie*je:
+        raise IOError("Size of ESRI ASCII grid ({:d}) does not match header ({:d} x {:d}):\n'{:s}'".format(data.size,je,ie,filepath))
+    data = data.reshape((je,ie))
+    # geotransform (upper-left corner, as in GDAL)
+    geotransform = (xll, d, 0., yll+je*d, 0., -1*d)
+    if lflip:
+        data = data[::-1,:] # flip y-axis (view, no copy)
+        geotransform = geotransform[:3]+(geotransform[3]+je*geotransform[5],0,-1*geotransform[5])
+    # mask no-data values
+    if lmask:
+        if na is None: data = ma.masked_array(data, copy=False)
+        else: data = ma.masked_equal(data, value=na, copy=False)
+        if fillValue is not None: data._fill_value = fillValue
+    elif fillValue is not None and na is not None:
+        data[data == na] = fillValue # relplace original fill value 
+    # return data and meta data
+    return data, geotransform, na
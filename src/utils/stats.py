@@ -9,7 +9,7 @@ Modified statistical functions from scipy.stats
 import numpy as np
 # imports from scipy's internal stats-helper module
 from scipy.stats.stats import _chk_asarray, rankdata, distributions
-from scipy.special import betainc
+from scipy.special import betainc, gammaln, digamma, polygamma, ndtr
 
 # helper function
 def _sum_of_squares(x):
@@ -206,5 +206,423 @@ def spearmanr(a, b=None, axis=0, dof=None):
         return rs, prob
 
 
+## vectorized L-moments and maximum-likelihood fitting
+# N.B.: the functions below operate on all points of an array simultaneously; the sample axis is the
+#       last axis (or 'axis') and NaN's are treated as missing values; parameters are returned in
+#       the same order as in scipy.stats (shape, loc, scale)
+
+euler_gamma = 0.57721566490153286 # Euler-Mascheroni constant
+
+# distributions supported by the vectorized fitting engine and their number of parameters
+vectorized_dists = dict(norm=2, gumbel_r=2, genextreme=3, gamma=3, weibull_min=3)
+
+def _flatten_samples(samples, axis=-1):
+    ''' roll sample axis to the back, flatten the remaining axes and return a 2D float array and the outer shape '''
+    samples = np.asarray(samples, dtype=np.float64)
+    if axis is None: samples = samples.ravel()
+    elif axis != -1 and axis != samples.ndim-1:
+        samples = np.rollaxis(samples, axis=axis, start=samples.ndim)
+    shape = samples.shape[:-1]
+    samples = samples.reshape((int(np.prod(shape)),samples.shape[-1]))
+    return samples, shape
+
+def lmoments(samples, nmom=3, axis=-1):
+    """
+    Compute sample L-moments for all points simultaneously, using unbiased probability weighted
+    moments (Hosking, 1990). Returns an array with l1, l2, t3 (and t4, if nmom=4) along the last
+    axis; points with insufficient valid samples are set to NaN.
+    """
+    if nmom not in (2,3,4): raise ValueError(nmom)
+    x, shape = _flatten_samples(samples, axis=axis)
+    x = np.sort(x, axis=-1) # N.B.: NaN's are sorted to the end, so that ranks are not affected
+    nonans = np.invert(np.isnan(x))
+    x = np.where(nonans, x, 0.)
+    n = nonans.sum(axis=-1).astype(np.float64)
+    j = np.arange(x.shape[-1], dtype=np.float64).reshape((1,x.shape[-1])) # zero-based rank
+    olderr = np.seterr(divide='ignore', invalid='ignore')
+    try:
+        w = j / (n.reshape((len(n),1)) - 1.)
+        b0 = x.sum(axis=-1) / n
+        b1 = (w*x).sum(axis=-1) / n
+        lmom = [b0, 2.*b1 - b0]
+        if nmom > 2:
+            w *= (j - 1.) / (n.reshape((len(n),1)) - 2.)
+            b2 = (w*x).sum(axis=-1) / n
+            lmom.append( (6.*b2 - 6.*b1 + b0) / lmom[1] )
+        if nmom > 3:
+            w *= (j - 2.) / (n.reshape((len(n),1)) - 3.)
+            b3 = (w*x).sum(axis=-1) / n
+            lmom.append( (20.*b3 - 30.*b2 + 12.*b1 - b0) / lmom[1] )
+        lmom = np.stack(lmom, axis=-1)
+        lmom[n < nmom,:] = np.NaN
+    finally:
+        np.seterr(**olderr)
+    return lmom.reshape(shape+(nmom,))
+
+def _lmom_gev(l1, l2, t3):
+    ''' GEV parameters from L-moments (Hosking et al., 1985); the shape follows the scipy convention '''
+    z = 2. / (3. + t3) - np.log(2.) / np.log(3.)
+    c = 7.8590*z + 2.9554*z**2
+    c = np.clip(c, -0.95, 0.95) # keep within a range where the approximation is reasonable
+    lgumbel = np.abs(c) < 1e-6
+    c = np.where(lgumbel, 1e-6, c) # avoid division by zero
+    scale = l2 * c / ( (1. - 2.**(-c)) * np.exp(gammaln(1.+c)) )
+    loc = l1 - scale * (1. - np.exp(gammaln(1.+c))) / c
+    # Gumbel limit
+    scale = np.where(lgumbel, l2/np.log(2.), scale)
+    loc = np.where(lgumbel, l1 - euler_gamma*scale, loc)
+    c = np.where(lgumbel, 0., c)
+    return c, loc, scale
+
+def lmom_fit(samples, dist_type, axis=-1, floc=None):
+    """
+    Estimate distribution parameters for all points from sample L-moments; the estimates are
+    generally close to maximum-likelihood estimates and are used as initial guesses by mle_fit.
+    A fixed location parameter (floc) can be specified for the 'gamma' and 'weibull_min'
+    distributions; otherwise the location is inferred from the L-skewness.
+    """
+    if dist_type not in vectorized_dists: raise NotImplementedError(dist_type)
+    if floc is not None and dist_type not in ('gamma','weibull_min'): raise NotImplementedError(dist_type)
+    x, shape = _flatten_samples(samples, axis=axis)
+    lmom = lmoments(x, nmom=3, axis=-1)
+    l1, l2, t3 = lmom[:,0], lmom[:,1], lmom[:,2]
+    olderr = np.seterr(divide='ignore', invalid='ignore', over='ignore')
+    try:
+        xmin = np.where(np.isnan(x), np.inf, x).min(axis=-1) # smallest valid sample
+        if dist_type == 'norm':
+            params = (l1, l2*np.sqrt(np.pi))
+        elif dist_type == 'gumbel_r':
+            scale = l2 / np.log(2.)
+            params = (l1 - euler_gamma*scale, scale)
+        elif dist_type == 'genextreme':
+            params = _lmom_gev(l1, l2, t3)
+        elif dist_type == 'gamma':
+            if floc is None:
+                # Pearson type III approximation (Hosking & Wallis, 1997); skewness has to be positive
+                t3 = np.clip(t3, 1e-3, 0.99)
+                z = 1. - t3
+                a_hi = (0.36067*z - 0.59567*z**2 + 0.25361*z**3) / (1. - 2.78861*z + 2.56096*z**2 - 0.77045*z**3)
+                z = 3.*np.pi*t3**2
+                a_lo = (1. + 0.2906*z) / (z + 0.1882*z**2 + 0.0442*z**3)
+                a = np.where(t3 >= 1./3., a_hi, a_lo)
+                scale = l2 * np.sqrt(np.pi) * np.exp(gammaln(a) - gammaln(a+0.5))
+                # the lower bound has to be below the smallest sample
+                loc = np.minimum(l1 - a*scale, xmin - 1e-3*l2)
+                a = (l1 - loc) / scale
+            else:
+                loc = np.zeros_like(l1) + floc
+                t = l2 / (l1 - loc) # L-CV
+                z = np.pi*t**2
+                a_lo = (1. - 0.3080*z) / (z - 0.05812*z**2 + 0.01765*z**3)
+                z = 1. - t
+                a_hi = (0.7213*z - 0.5947*z**2) / (1. - 2.1817*z + 1.2113*z**2)
+                a = np.where(t < 0.5, a_lo, a_hi)
+                scale = (l1 - loc) / a
+            params = (a, loc, scale)
+        elif dist_type == 'weibull_min':
+            if floc is None:
+                # the negative of a Weibull variable follows a GEV distribution with positive shape
+                c, mloc, mscale = _lmom_gev(-1.*l1, l2, -1.*t3)
+                c = np.clip(c, 1e-2, None)
+                k = 1./c; scale = mscale/c
+                loc = np.minimum(-1.*(mloc + mscale/c), xmin - 1e-3*l2)
+            else:
+                loc = np.zeros_like(l1) + floc
+                k = -1.*np.log(2.) / np.log(l2/(l1-loc)) # from L-CV: t = 1 - 2**(-1/k)
+                scale = (l1 - loc) / np.exp(gammaln(1.+1./k))
+            params = (k, loc, scale)
+        params = np.stack(params, axis=-1)
+        params[np.invert(np.all(np.isfinite(params), axis=-1)),:] = np.NaN
+    finally:
+        np.seterr(**olderr)
+    return params.reshape(shape+(params.shape[-1],))
+
+def _gev_loglik(x, valid, theta, lgrad=False):
+    ''' GEV log-likelihood (and gradient) for each point; theta contains shape, loc and log(scale) '''
+    c = theta[:,0:1]; loc = theta[:,1:2]; lscale = theta[:,2:3]
+    c = np.where(np.abs(c) < 1e-6, np.where(c < 0, -1e-6, 1e-6), c) # Gumbel limit
+    scale = np.exp(lscale)
+    z = (x - loc) / scale
+    cz = c*z
+    lsupport = np.logical_or(cz < 1., np.invert(valid))
+    lfeasible = np.all(lsupport, axis=1)
+    valid = np.logical_and(valid, lsupport)
+    lt = np.log1p(np.where(valid, -1.*cz, 0.)) # log(t), where t = 1 - c*z
+    u = np.exp(lt/c)
+    ll = np.where(valid, -1.*lscale + (1./c - 1.)*lt - u, 0.).sum(axis=1)
+    ll[np.invert(lfeasible)] = -np.inf
+    if not lgrad: return ll
+    r = (1. - c - u) / np.exp(lt)
+    grad = (-1.*lt*(1. - u)/c**2 - r*z/c, r/scale, r*z - 1.)
+    grad = np.stack([np.where(valid, g, 0.).sum(axis=1) for g in grad], axis=-1)
+    return ll, grad
+
+def _mle_gev(x, valid, theta, free, tol=1e-6, maxiter=100):
+    ''' batched damped Newton iteration for the GEV log-likelihood; fixed parameters are not updated '''
+    npt = len(theta); npar = theta.shape[1]
+    converged = np.zeros(npt, dtype=np.bool_); niter = np.zeros(npt, dtype=np.int32)
+    active = np.all(np.isfinite(theta), axis=1)
+    # make sure initial guess is within the support (shrink shape or inflate scale)
+    for i in xrange(50):
+        lbad = np.logical_and(active, np.isinf(_gev_loglik(x, valid, theta)))
+        if not np.any(lbad): break
+        if free[0]: theta[lbad,0] *= 0.5
+        else: theta[lbad,2] += np.log(2.)
+    active = np.logical_and(active, np.invert(lbad))
+    eye = np.eye(npar).reshape((1,npar,npar))
+    for i in xrange(maxiter):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0: break
+        xa = x[idx]; va = valid[idx]; th = theta[idx]
+        ll, grad = _gev_loglik(xa, va, th, lgrad=True)
+        # Hessian from central differences of the analytical gradient
+        hess = np.zeros((len(idx),npar,npar))
+        for j in xrange(npar):
+            if not free[j]: continue
+            h = 1e-5 * (1. + np.abs(th[:,j]))
+            thp = th.copy(); thp[:,j] += h
+            thm = th.copy(); thm[:,j] -= h
+            hess[:,:,j] = ( _gev_loglik(xa, va, thp, lgrad=True)[1] - _gev_loglik(xa, va, thm, lgrad=True)[1] ) / (2.*h.reshape((len(h),1)))
+        hess = 0.5 * ( hess + hess.transpose((0,2,1)) )
+        for j in xrange(npar):
+            if not free[j]: grad[:,j] = 0.; hess[:,j,:] = 0.; hess[:,:,j] = 0.; hess[:,j,j] = -1.
+        # Levenberg-Marquardt-type damping, so that the step is always an ascent direction
+        eigmax = np.linalg.eigvalsh(hess)[:,-1]
+        lam = np.where(eigmax < 0., 0., eigmax + 1e-3*(1. + np.abs(eigmax)))
+        step = np.linalg.solve(lam.reshape((len(lam),1,1))*eye - hess, grad.reshape(grad.shape+(1,)))[:,:,0]
+        # backtracking line search (all points at once)
+        alpha = np.ones(len(idx)); laccept = np.zeros(len(idx), dtype=np.bool_)
+        for j in xrange(30):
+            todo = np.flatnonzero(np.invert(laccept))
+            if len(todo) == 0: break
+            lltrial = _gev_loglik(xa[todo], va[todo], th[todo] + alpha[todo].reshape((len(todo),1))*step[todo])
+            lok = lltrial >= ll[todo]
+            laccept[todo[lok]] = True
+            alpha[todo[np.invert(lok)]] *= 0.5
+        alpha[np.invert(laccept)] = 0.
+        dtheta = alpha.reshape((len(idx),1)) * step
+        theta[idx] = th + dtheta
+        niter[idx] += 1
+        # check convergence (points that can not be improved any further are also finished)
+        ldone = np.all(np.abs(dtheta) <= tol * (1. + np.abs(th)), axis=1)
+        converged[idx[ldone]] = True
+        active[idx[ldone]] = False
+    return theta, converged, niter
+
+def _mle_gumbel(x, valid, n, scale, tol=1e-6, maxiter=100):
+    ''' Newton iteration for the Gumbel scale (the location follows from the scale) '''
+    npt = len(x)
+    converged = np.zeros(npt, dtype=np.bool_); niter = np.zeros(npt, dtype=np.int32)
+    xm = np.where(valid, x, 0.).sum(axis=1) / n
+    xs = np.where(valid, x - xm.reshape((npt,1)), 0.) # shift samples to avoid overflow
+    scale = scale.copy()
+    active = np.logical_and(np.isfinite(scale), scale > 0)
+    def weights(xa, va, beta):
+        a = np.where(va, -1.*xa/beta.reshape((len(beta),1)), -np.inf)
+        amax = a.max(axis=1)
+        return np.exp(a - amax.reshape((len(amax),1))), amax
+    for i in xrange(maxiter):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0: break
+        xa = xs[idx]; beta = scale[idx]
+        e, amax = weights(xa, valid[idx], beta)
+        s0 = e.sum(axis=1); s1 = (xa*e).sum(axis=1); s2 = (xa**2*e).sum(axis=1)
+        g = beta + s1/s0 # N.B.: the mean of the shifted samples is zero
+        dg = 1. + (s2*s0 - s1**2) / (beta*s0)**2
+        newbeta = beta - g/dg
+        newbeta = np.where(newbeta > 0, newbeta, 0.5*beta)
+        scale[idx] = newbeta
+        niter[idx] += 1
+        ldone = np.abs(newbeta - beta) <= tol * newbeta
+        converged[idx[ldone]] = True
+        active[idx[ldone]] = False
+    e, amax = weights(xs, valid, scale)
+    loc = xm - scale * ( amax + np.log(e.sum(axis=1)/n) )
+    return loc, scale, converged, niter
+
+def _mle_gamma(x, valid, n, loc, a=None, tol=1e-6, maxiter=100):
+    ''' Newton iteration for the Gamma shape at fixed location (the scale follows from the shape) '''
+    npt = len(x)
+    converged = np.zeros(npt, dtype=np.bool_); niter = np.zeros(npt, dtype=np.int32)
+    y = x - loc.reshape((npt,1))
+    lsupport = np.all(np.logical_or(y > 0, np.invert(valid)), axis=1)
+    y = np.where(valid, y, 1.)
+    ymean = np.where(valid, y, 0.).sum(axis=1) / n
+    s = np.log(ymean) - np.where(valid, np.log(y), 0.).sum(axis=1) / n
+    if a is None: # fixed shape
+        a = (3. - s + np.sqrt((s - 3.)**2 + 24.*s)) / (12.*s) # Minka's approximation
+        active = np.logical_and(lsupport, np.isfinite(a))
+    else:
+        a = np.zeros(npt) + a
+        active = np.zeros(npt, dtype=np.bool_); converged[:] = lsupport
+    for i in xrange(maxiter):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0: break
+        aa = a[idx]
+        newa = aa - (np.log(aa) - digamma(aa) - s[idx]) / (1./aa - polygamma(1,aa))
+        newa = np.where(newa > 0, newa, 0.5*aa)
+        a[idx] = newa
+        niter[idx] += 1
+        ldone = np.abs(newa - aa) <= tol * newa
+        converged[idx[ldone]] = True
+        active[idx[ldone]] = False
+    scale = ymean / a
+    a[np.invert(lsupport)] = np.NaN
+    return a, scale, converged, niter
+
+def _mle_weibull(x, valid, n, loc, k=None, tol=1e-6, maxiter=100):
+    ''' Newton iteration for the Weibull shape at fixed location (the scale follows from the shape) '''
+    npt = len(x)
+    converged = np.zeros(npt, dtype=np.bool_); niter = np.zeros(npt, dtype=np.int32)
+    y = x - loc.reshape((npt,1))
+    lsupport = np.all(np.logical_or(y > 0, np.invert(valid)), axis=1)
+    ly = np.where(valid, np.log(np.where(valid, np.abs(y), 1.)), 0.)
+    lymean = ly.sum(axis=1) / n
+    def weights(lya, va, k):
+        a = np.where(va, lya*k.reshape((len(k),1)), -np.inf)
+        amax = a.max(axis=1)
+        return np.exp(a - amax.reshape((len(amax),1))), amax
+    if k is None:
+        lystd = np.sqrt(np.where(valid, (ly - lymean.reshape((npt,1)))**2, 0.).sum(axis=1) / n)
+        k = np.pi / ( np.sqrt(6.) * lystd ) # from the standard deviation of log(y)
+        active = np.logical_and(lsupport, np.isfinite(k))
+    else:
+        k = np.zeros(npt) + k
+        active = np.zeros(npt, dtype=np.bool_); converged[:] = lsupport
+    for i in xrange(maxiter):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0: break
+        kk = k[idx]; lya = ly[idx]
+        e, amax = weights(lya, valid[idx], kk)
+        s0 = e.sum(axis=1); s1 = (lya*e).sum(axis=1); s2 = (lya**2*e).sum(axis=1)
+        f = 1./kk + lymean[idx] - s1/s0
+        df = -1./kk**2 - (s2*s0 - s1**2) / s0**2
+        newk = kk - f/df
+        newk = np.where(newk > 0, newk, 0.5*kk)
+        k[idx] = newk
+        niter[idx] += 1
+        ldone = np.abs(newk - kk) <= tol * newk
+        converged[idx[ldone]] = True
+        active[idx[ldone]] = False
+    e, amax = weights(ly, valid, k)
+    scale = np.exp( ( amax + np.log(e.sum(axis=1)/n) ) / k )
+    k[np.invert(lsupport)] = np.NaN
+    return k, scale, converged, niter
+
+def mle_fit(samples, dist_type, axis=-1, f0=None, floc=None, lpositiveShape=False, lnegativeShape=False,
+            tol=1e-6, maxiter=100):
+    """
+    Maximum-likelihood fit of a distribution for all points simultaneously. Initial guesses are
+    obtained from L-moments and refined with batched Newton iterations; the normal distribution
+    has a closed-form solution. The shape parameter can be held fixed (f0) and for the 'gamma' and
+    'weibull_min' distributions also the location (floc); if the location of these distributions
+    is not fixed, the L-moment estimate is used and only shape and scale are fitted.
+    Analogous to the scipy-based fit, the GEV shape parameter can be constrained to be positive
+    or negative; points that violate the constraint are refitted as Gumbel distributions.
+    Returns the parameter array (parameters along the last axis), as well as the convergence
+    flag and the number of iterations for each point.
+    """
+    if dist_type not in vectorized_dists: raise NotImplementedError(dist_type)
+    if f0 is not None and dist_type not in ('genextreme','gamma','weibull_min'): raise NotImplementedError(dist_type)
+    if (lpositiveShape or lnegativeShape) and dist_type in ('gamma','weibull_min'): raise NotImplementedError(dist_type)
+    x, shape = _flatten_samples(samples, axis=axis)
+    npt = len(x); plen = vectorized_dists[dist_type]
+    valid = np.invert(np.isnan(x))
+    n = valid.sum(axis=1).astype(np.float64)
+    x = np.where(valid, x, 0.)
+    converged = np.zeros(npt, dtype=np.bool_); niter = np.zeros(npt, dtype=np.int32)
+    olderr = np.seterr(divide='ignore', invalid='ignore', over='ignore', under='ignore')
+    try:
+        ic = lmom_fit(np.where(valid, x, np.NaN), dist_type, axis=-1, floc=floc)
+        if dist_type == 'norm':
+            loc = x.sum(axis=1) / n
+            scale = np.sqrt( ( np.where(valid, x - loc.reshape((npt,1)), 0.)**2 ).sum(axis=1) / n )
+            params = np.stack((loc,scale), axis=-1)
+            converged[:] = True
+        elif dist_type == 'gumbel_r':
+            loc, scale, converged, niter = _mle_gumbel(x, valid, n, ic[:,1], tol=tol, maxiter=maxiter)
+            params = np.stack((loc,scale), axis=-1)
+        elif dist_type == 'genextreme':
+            if f0 is not None and f0 == 0: # same as Gumbel
+                params = np.zeros((npt,3))
+                params[:,1], params[:,2], converged, niter = _mle_gumbel(x, valid, n, ic[:,2], tol=tol, maxiter=maxiter)
+            else:
+                theta = ic.copy(); theta[:,2] = np.log(theta[:,2]) # fit log(scale) to ensure positivity
+                if f0 is not None: theta[:,0] = f0
+                free = (f0 is None, True, True)
+                theta, converged, niter = _mle_gev(x, valid, theta, free, tol=tol, maxiter=maxiter)
+                params = theta.copy(); params[:,2] = np.exp(theta[:,2])
+                # apply shape constraints and refit as Gumbel distribution, where necessary
+                lrefit = np.zeros(npt, dtype=np.bool_)
+                if f0 is None and lpositiveShape: lrefit = np.logical_or(lrefit, params[:,0] < 0)
+                if f0 is None and lnegativeShape: lrefit = np.logical_or(lrefit, params[:,0] > 0)
+                if np.any(lrefit):
+                    idx = np.flatnonzero(lrefit)
+                    loc, scale, lconv, nit = _mle_gumbel(x[idx], valid[idx], n[idx], params[idx,2], tol=tol, maxiter=maxiter)
+                    params[idx,0] = 0.; params[idx,1] = loc; params[idx,2] = scale
+                    converged[idx] = lconv; niter[idx] += nit
+        elif dist_type in ('gamma','weibull_min'):
+            loc = ic[:,1]
+            if dist_type == 'gamma': a, scale, converged, niter = _mle_gamma(x, valid, n, loc, a=f0, tol=tol, maxiter=maxiter)
+            else: a, scale, converged, niter = _mle_weibull(x, valid, n, loc, k=f0, tol=tol, maxiter=maxiter)
+            params = np.stack((a,loc,scale), axis=-1)
+        # invalidate points that could not be fitted
+        linvalid = np.logical_or(n < plen, np.invert(np.all(np.isfinite(params), axis=-1)))
+        params[linvalid,:] = np.NaN
+        converged[linvalid] = False
+    finally:
+        np.seterr(**olderr)
+    assert params.shape == (npt,plen)
+    return params.reshape(shape+(plen,)), converged.reshape(shape), niter.reshape(shape)
+
+## vectorized Gaussian kernel density estimation
+# N.B.: sample data for all points are passed as a 2D array (points x samples), where points with fewer
+#       samples are padded with NaN's; kernels are evaluated on a shared support for all points
+
+def _gaussian_kernel_sum(dataset, bandwidth, support, kernel, weights=None, maxsize=2**22):
+    ''' evaluate weighted sums of Gaussian kernels (or their integrals) over the support for all points;
+        points are processed in chunks, so that temporary arrays do not exceed maxsize elements '''
+    dataset = np.asarray(dataset, dtype=np.float64)
+    if dataset.ndim == 1: dataset = dataset.reshape((1,len(dataset)))
+    npt, nsmp = dataset.shape
+    bandwidth = np.asarray(bandwidth, dtype=np.float64).reshape((npt,1,1))
+    support = np.asarray(support, dtype=np.float64).reshape((1,-1,1))
+    nsup = support.shape[1]
+    valid = np.invert(np.isnan(dataset))
+    if weights is None: weights = valid.astype(np.float64)
+    else: weights = np.where(valid, weights, 0.)
+    olderr = np.seterr(divide='ignore', invalid='ignore')
+    try:
+        weights /= weights.sum(axis=1).reshape((npt,1))
+        dataset = np.where(valid, dataset, 0.)
+        results = np.zeros((npt,nsup))
+        chunksize = max(1, maxsize//max(1,nsup*nsmp))
+        for i in xrange(0,npt,chunksize):
+            z = ( support - dataset[i:i+chunksize,:].reshape((-1,1,nsmp)) ) / bandwidth[i:i+chunksize,:,:]
+            results[i:i+chunksize,:] = np.sum( kernel(z) * weights[i:i+chunksize,:].reshape((-1,1,nsmp)), axis=-1)
+    finally:
+        np.seterr(**olderr)
+    return results
+
+def gaussian_kde_pdf(dataset, bandwidth, support, weights=None, maxsize=2**22):
+    """
+    Evaluate Gaussian kernel density estimates for all points over a shared support (1D); 'dataset'
+    is a 2D array of sample data (NaN's are ignored) and 'bandwidth' contains the standard deviation
+    of the kernel for each point (i.e. the square root of the gaussian_kde covariance). Returns an
+    array with the support dimension appended.
+    """
+    pdf = _gaussian_kernel_sum(dataset, bandwidth, support, kernel=lambda z: np.exp(-0.5*z**2),
+                               weights=weights, maxsize=maxsize)
+    pdf /= np.sqrt(2.*np.pi) * np.asarray(bandwidth, dtype=np.float64).reshape((len(pdf),1))
+    return pdf
+
+def gaussian_kde_cdf(dataset, bandwidth, support, weights=None, maxsize=2**22):
+    """
+    Evaluate the cumulative distribution function of Gaussian kernel density estimates for all points
+    over a shared support (1D), using the error function; arguments are the same as for gaussian_kde_pdf.
+    """
+    return _gaussian_kernel_sum(dataset, bandwidth, support, kernel=ndtr, weights=weights, maxsize=maxsize)
+
+
 if __name__ == '__main__':
     pass